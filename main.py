@@ -5,23 +5,55 @@ import os
 import sys
 import logging
 import time
-from jinja2 import Environment, FileSystemLoader
-from mod.mzml_extract import calculate_idfree_metrics
-from mod.idbased_metrics import calculate_idbased_metrics
-from mod.general_functions import check_path, check_file, check_grouping_file, get_grouping_dict, check_samples, int_range, check_duplicates, get_overall_qc_status, groupname
+from functools import partial
+from concurrent.futures import ProcessPoolExecutor
+from mod.pca_analysis import pca_missing_value_methods, pca_solver_methods
+from mod.report_figures import get_plotlyjs, prepare_figure_dir, submit_figures, report_figure, discard_figures, large_cohort_samples, report_modes
+from mod.pipeline import stage_spec, run_pipeline, format_pipeline
+from mod.report_tuning import get_report_tuning
+from mod.qc_status import get_sample_groups, get_overall_status
+from mod.general_functions import check_path, check_file, check_grouping_file, get_grouping_dict, check_samples, int_range, check_duplicates, rollup_method
 
 import warnings
 warnings.filterwarnings("ignore")
 
-start_time = time.time()
+def build_parser():
+    """
+    Builds the command line parser of QCeltis.
+
+    Args:
+    None
+
+    Returns:
+    ArgumentParser: Parser for the command line options, also used for the defaults of run_qc.
+    """
 
-def main():
 
     parser = argparse.ArgumentParser(formatter_class=RawTextHelpFormatter)
 
     #output parameters
     parser.add_argument('-o', '--outdirectory', type=str, required=True, help='[Required] Output Directory Path')
     parser.add_argument('-r', '--reportname', type=str, required=True, help='[Required] Report Name for HTML and Excel Reports')
+    parser.add_argument('-cd', '--cache_dir', type=str, default=False, help='[Optional] Path to directory where intermediate results (parsed intensity files, missed cleavage scores for each enzyme, PCA results) are saved and reused across runs')
+    parser.add_argument('-rm', '--report_mode', type=str, choices=report_modes, default='single', help='[Optional] HTML report mode, default=single. Available modes:\n'+
+        'single\t\tone self-contained HTML file, e.g. to be sent by email\n'+
+        'lazy\t\tfigures are saved as compressed sidecars in a {reportname}_figures directory next to the HTML file and loaded when they are scrolled into view\n')
+    parser.add_argument('-fw', '--figure_workers', type=int, default=1, help='[Optional] Number of worker processes used to build the report figures while the remaining metrics and Excel reports are calculated and written, default=1')
+    parser.add_argument('-sw', '--stage_workers', type=int, default=1, help='[Optional] Number of worker processes running independent pipeline stages at the same time, e.g. 2 to calculate the ID-free and ID-based metrics concurrently, default=1')
+    parser.add_argument('-ps', '--print_stages', action='store_true', help='[Optional] Print the pipeline stages, their dependencies and timings')
+    parser.add_argument('-ms', '--metric_store', type=str, default=False, help='[Optional] Path to a SQLite metric store the metrics and QC statuses of the run are appended to, for trends across runs')
+    parser.add_argument('-in', '--instrument', type=str, default=False, help='[Optional] Instrument name saved in the metric store and used for the baseline, by default read from the mzML files')
+    parser.add_argument('-bl', '--baseline', type=str, default=False, help='[Optional] Path to a baseline file of earlier good runs. ID-free outliers are detected using the quartiles of the baseline for the instrument instead of the quartiles of the batch')
+    parser.add_argument('-ub', '--update_baseline', type=str, default=False, help='[Optional] Path to a baseline file the samples passing all ID-free QC checks are added to, created if it does not exist')
+    parser.add_argument('-sv', '--stream_verdicts', type=str, default=False, help='[Optional] Path to a JSON lines file (- for the standard output) a provisional ID-free QC verdict is written to as each mzML file is extracted, followed by the final verdicts once the whole batch is judged')
+    parser.add_argument('-sa', '--stop_after_failures', type=int, default=False, help='[Optional] Stop the run once this many mzML files have a provisional FAIL verdict, without extracting the remaining files. Requires --stream_verdicts')
+    parser.add_argument('-sb', '--save_bundle', action='store_true', help='[Optional] Save the raw metrics of the run, before any threshold is applied, to a metrics bundle ({reportname}_Metrics_Bundle in the output directory) so other thresholds can be applied later with --rethreshold')
+    parser.add_argument('-rt', '--rethreshold', type=str, default=False, help='[Optional] Path to the metrics bundle of an earlier run saved with --save_bundle ({reportname}_Metrics_Bundle in its output directory). The thresholds given are applied to the bundled metrics and the Excel and HTML reports are saved again, without extracting the mzML files or reading the intensity files. Thresholds that are not given are taken from the earlier run')
+    parser.add_argument('-sf', '--score_files', type=str, nargs='+', default=False, help='[Optional] Paths to mzML files scored one at a time against --baseline, instead of running QC on a batch')
+    parser.add_argument('-bm', '--batch_manifest', type=str, default=False, help='[Optional] Path to a JSON, YAML or TOML manifest of QC projects to run in one process. Each project takes the long parameter names (reportname is required), the other command line options are used as defaults. --reportname names the batch summary')
+    parser.add_argument('-bw', '--batch_workers', type=int, default=1, help='[Optional] Number of batch manifest projects or service jobs run at the same time, default=1')
+    parser.add_argument('-sp', '--service_port', type=int, default=False, help='[Optional] Run QCeltis as a local service on this port of 127.0.0.1 (0 for any free port), accepting QC jobs over HTTP. The other command line options are used as job defaults. --reportname names the job queue')
+    parser.add_argument('-pst', '--plot_scale_threshold', type=int, default=large_cohort_samples, help=f'[Optional] Number of samples above which per-sample plots use WebGL traces, run-order ticks with filenames in the hover text and decimated lines, 0 to always plot every filename, default={large_cohort_samples}')
 
     #id-free metrics - mzml extraction
     parser.add_argument('-m', '--mzml_directory', type=str, default=False, help='[Optional] Path to directory where mzML files are present')
@@ -36,6 +68,25 @@ def main():
     parser.add_argument('-pt', '--protein_level', type=str, default=False, help='[Optional] Path to Protein Intensity File')
     parser.add_argument('-pep', '--peptide_level', type=str, default=False, help='[Optional] Path to Peptide Intensity File')
     parser.add_argument('-pre', '--precursor_level', type=str, default=False, help='[Optional] Path to Precursor Intensity File')
+    parser.add_argument('-ru', '--level_rollup', type=rollup_method, default=False, help='[Optional] Derive Peptide and Protein Level intensities from the Precursor Intensity File instead of providing separate files. Available methods:\n'+
+        'sum\t\tsum of intensities\n'+
+        'max\t\tmaximum intensity\n'+
+        'topN\t\tmean of the N most intense precursors/peptides, e.g. top3\n')
+    parser.add_argument('-cm', '--chunk_memory', type=int, default=False, help='[Optional] Memory budget in MB for reading intensity files. When set, intensity files are streamed in row chunks that fit the budget instead of being loaded at once, and PCA is calculated incrementally from batches of samples')
+    parser.add_argument('-lw', '--level_workers', type=int, default=1, help='[Optional] Number of worker processes used to calculate the protein, peptide and precursor level metrics in parallel, default=1')
+    parser.add_argument('-mw', '--matrix_workers', type=int, default=1, help='[Optional] Number of worker processes used for the group CVs and per-sample missed cleavages of each level, sharing a memory-mapped copy of the intensities saved in the output directory, default=1')
+    parser.add_argument('-pmv', '--pca_missing_values', type=str, choices=pca_missing_value_methods, default='zero', help='[Optional] Missing value handling for PCA, default=zero. Available methods:\n'+
+        'zero\t\tfill missing values with 0\n'+
+        'mean\t\tfill missing values with the mean intensity of the feature\n'+
+        'min\t\tfill missing values with the minimum intensity of the feature\n'+
+        'drop\t\tonly use features quantified in all samples\n')
+    parser.add_argument('-pcc', '--pca_completeness', type=float, default=False, help='[Optional] Only use features quantified in at least this percentage of samples for PCA')
+    parser.add_argument('-pcv', '--pca_top_variance', type=int, default=False, help='[Optional] Only use this number of most variable features for PCA')
+    parser.add_argument('-pcs', '--pca_solver', type=str, choices=pca_solver_methods, default='auto', help='[Optional] PCA solver, default=auto. Available solvers:\n'+
+        'auto\t\tfull SVD, or randomized SVD when there are at least 1000 samples and features\n'+
+        'full\t\tfull SVD\n'+
+        'randomized\trandomized truncated SVD, for wide matrices\n'+
+        'incremental\tincremental PCA on batches of samples\n')
     parser.add_argument('-g', '--grouping_file', type=str, default=False, help='[Optional] Path to Grouping File')
     parser.add_argument('-peplt', '--peptide_list', type=str, default=False, help='[Optional] Path to file containing list of peptides to monitor intensity and RT distribution across samples')
 
@@ -64,39 +115,115 @@ def main():
     parser.add_argument('-irt', '--irtlabel', default=False, type=str, help='[Optional] If iRT peptides (Biognosys iRT Kit) are present in your peptide intensity file, please provide how the iRT proteins are labelled in your dataset')
     parser.add_argument('-v', '--coverage_threshold', type=int_range(0, 100), default=False, help='[Optional] Intensity or Retention Time Coverage %% Threshold in each sample')
 
-    args = parser.parse_args()
+    return parser
+
+def get_unknown_options(config):
+    """
+    Finds the options of a run_qc configuration that QCeltis does not have.
+
+    Args:
+    config (dict): Options named like the long command line options.
+
+    Returns:
+    list: Names of the unknown options.
+    """
+
+    options = vars(build_parser().parse_args(['--outdirectory', "out", '--reportname', "run"]))
+
+    return [option for option in config if option not in options]
+
+def run_qc(config):
+    """
+    Runs QCeltis - checks the inputs, calculates the ID-free and ID-based metrics and saves the Excel and HTML reports.
+
+    Args:
+    config (dict): Options named like the long command line options, e.g. {'outdirectory': 'out', 'reportname': 'run1', 'precursor_level': 'precursor.txt', 'grouping_file': 'groups.txt'}.
+                   'outdirectory' and 'reportname' are required, other options use the command line defaults. Unknown options exit with an error.
+
+    Returns:
+    DataFrame: Samplewise QC metrics, or "" if no metrics were calculated.
+    DataFrame: Groupwise QC metrics, or "" without a grouping file.
+    dict: HTML report parameters, with figure specifications for the figures (see report_figures.render_figure).
+
+    Note:
+    Heavy dependencies (plotly, scikit-learn, pymzml) are only imported by the code paths that use them. Invalid inputs
+    exit with an error, as on the command line. Logging is left to the caller.
+    """
+
+    options = vars(build_parser().parse_args(['--outdirectory', str(config['outdirectory']), '--reportname', str(config['reportname'])]))
+
+    unknown_options = get_unknown_options(config)
+    if unknown_options:
+        print(f"ERROR: Unknown options {', '.join(unknown_options)}. Please use the long parameter names, e.g. precursor_level")
+        logging.error(f"ERROR: Unknown options {', '.join(unknown_options)}. Please use the long parameter names, e.g. precursor_level")
+        sys.exit(1)
+
+    options.update(config)
+
+    #thresholds are applied to the metrics bundle of an earlier run, with the inputs of that run
+    if options['rethreshold']:
+        from mod.metrics_bundle import load_bundle_options, bundle_input_options
+
+        fixed_options = [option for option in config if option in bundle_input_options + ['chunk_memory', 'stream_verdicts', 'stop_after_failures', 'update_baseline', 'metric_store', 'save_bundle'] and config[option]]
+        if fixed_options:
+            print(f"ERROR: {', '.join(fixed_options)} cannot be given with --rethreshold, the metrics bundle has the inputs of the earlier run")
+            logging.error(f"ERROR: {', '.join(fixed_options)} cannot be given with --rethreshold, the metrics bundle has the inputs of the earlier run")
+            sys.exit(1)
+
+        bundle_options = load_bundle_options(options['rethreshold'])
+        options.update({option: value for option, value in bundle_options.items() if option in bundle_input_options or option not in config})
 
     # -------------------------------------------- ASSIGNING ARGUMENTS -------------------------------------------
 
-    out_dir = str(args.outdirectory)
-    reportname = str(args.reportname)
-
-    logging.basicConfig(filename=f"{reportname}_QCeltis.log", level=logging.INFO)
-
-    mzml_dir = args.mzml_directory
-    ms1_tic_threshold = float(args.ms1_tic_threshold)
-    ms2_tic_threshold = float(args.ms2_tic_threshold)
-    ms1_spectra_threshold = int(args.ms1_spectra_threshold)
-    ms2_spectra_threshold = int(args.ms2_spectra_threshold)
-    max_basepeak_intensity_threshold = float(args.max_basepeak_intensity)
-    iqr_sensitivity = float(args.iqr_sensitivity)
-
-    protein_level = args.protein_level
-    peptide_level = args.peptide_level
-    precursor_level = args.precursor_level
-    grouping_file = args.grouping_file
-    peptide_list = args.peptide_list
-
-    protein_threshold = int(args.protein_threshold)
-    peptide_threshold = int(args.peptide_threshold)
-    precursor_threshold = int(args.precursor_threshold)
-    digestion_enzyme = args.enzyme
-    miscleavage_threshold = float(args.miscleavage_threshold)
-    tic_cv_threshold = float(args.tic_cv_threshold)
-    cv_percent_threshold = float(args.cv_percent_threshold)
-    data_percent_threshold = float(args.data_percent_threshold)
-    irtlabel = args.irtlabel
-    coverage_threshold = float(args.coverage_threshold)
+    out_dir = str(options['outdirectory'])
+    reportname = str(options['reportname'])
+    cache_dir = options['cache_dir']
+
+    mzml_dir = options['mzml_directory']
+    ms1_tic_threshold = float(options['ms1_tic_threshold'])
+    ms2_tic_threshold = float(options['ms2_tic_threshold'])
+    ms1_spectra_threshold = int(options['ms1_spectra_threshold'])
+    ms2_spectra_threshold = int(options['ms2_spectra_threshold'])
+    max_basepeak_intensity_threshold = float(options['max_basepeak_intensity'])
+    iqr_sensitivity = float(options['iqr_sensitivity'])
+
+    protein_level = options['protein_level']
+    peptide_level = options['peptide_level']
+    precursor_level = options['precursor_level']
+    level_rollup = options['level_rollup']
+    chunk_memory = int(options['chunk_memory'])
+    level_workers = int(options['level_workers'])
+    matrix_workers = int(options['matrix_workers'])
+    plot_scale_threshold = int(options['plot_scale_threshold'])
+    report_mode = options['report_mode']
+    figure_workers = int(options['figure_workers'])
+    stage_workers = int(options['stage_workers'])
+    print_stages = options['print_stages']
+    metric_store = options['metric_store']
+    instrument = options['instrument']
+    baseline_file = options['baseline']
+    update_baseline_file = options['update_baseline']
+    stream_verdicts = options['stream_verdicts']
+    stop_after_failures = int(options['stop_after_failures'])
+    pca_missing_values = options['pca_missing_values']
+    pca_completeness = float(options['pca_completeness'])
+    pca_top_variance = int(options['pca_top_variance'])
+    pca_solver = options['pca_solver']
+    grouping_file = options['grouping_file']
+    peptide_list = options['peptide_list']
+
+    protein_threshold = int(options['protein_threshold'])
+    peptide_threshold = int(options['peptide_threshold'])
+    precursor_threshold = int(options['precursor_threshold'])
+    digestion_enzyme = options['enzyme']
+    miscleavage_threshold = float(options['miscleavage_threshold'])
+    tic_cv_threshold = float(options['tic_cv_threshold'])
+    cv_percent_threshold = float(options['cv_percent_threshold'])
+    data_percent_threshold = float(options['data_percent_threshold'])
+    irtlabel = options['irtlabel']
+    coverage_threshold = float(options['coverage_threshold'])
+    save_bundle = options['save_bundle']
+    rethreshold = options['rethreshold']
 
     #defaults - to check if custom thresholds have been set 
     tic_cv_threshold_default = 30
@@ -119,11 +246,101 @@ def main():
     check_path(out_dir)
     logging.info(f"All outputs will be saved to {out_dir}")
 
+    if cache_dir:
+        os.makedirs(cache_dir, exist_ok=True)
+        logging.info(f"Intermediate results will be cached in {cache_dir}")
+
+    if metric_store:
+        if not os.path.isdir(os.path.dirname(os.path.abspath(metric_store))):
+            print(f"ERROR: The directory of the metric store {metric_store} does not exist")
+            logging.error(f"ERROR: The directory of the metric store {metric_store} does not exist")
+            sys.exit(1)
+        logging.info(f"Metrics will be saved to the metric store {metric_store}")
+
+    if baseline_file or update_baseline_file:
+        if not mzml_dir:
+            print("ERROR: A mzML directory is required to detect outliers against a baseline or to update a baseline")
+            logging.error("ERROR: A mzML directory is required to detect outliers against a baseline or to update a baseline")
+            sys.exit(1)
+
+        if baseline_file:
+            from mod.baseline import load_baseline
+            load_baseline(baseline_file)
+            logging.info(f"ID-free outliers will be detected using the baseline {baseline_file}")
+
+        if update_baseline_file:
+            if not os.path.isdir(os.path.dirname(os.path.abspath(update_baseline_file))):
+                print(f"ERROR: The directory of the baseline {update_baseline_file} does not exist")
+                logging.error(f"ERROR: The directory of the baseline {update_baseline_file} does not exist")
+                sys.exit(1)
+            logging.info(f"Samples passing all ID-free QC checks will be added to the baseline {update_baseline_file}")
+
+    if stream_verdicts:
+        if not mzml_dir:
+            print("ERROR: A mzML directory is required to stream ID-free QC verdicts")
+            logging.error("ERROR: A mzML directory is required to stream ID-free QC verdicts")
+            sys.exit(1)
+        logging.info(f"Provisional ID-free QC verdicts will be written to {'the standard output' if stream_verdicts == '-' else stream_verdicts} as each mzML file is extracted")
+
+    if stop_after_failures:
+        if not stream_verdicts or stop_after_failures < 1:
+            print("ERROR: --stop_after_failures should be at least 1 and requires --stream_verdicts")
+            logging.error("ERROR: --stop_after_failures should be at least 1 and requires --stream_verdicts")
+            sys.exit(1)
+        logging.info(f"The run will be stopped once {stop_after_failures} mzML files have a provisional FAIL verdict")
+
+    if level_rollup:
+        logging.info("--------------------------------------- Checking Level Rollup ------------------------------------------\n")
+
+        if not precursor_level:
+            print("ERROR: A precursor intensity file is required to derive peptide and protein levels using --level_rollup")
+            logging.error("ERROR: A precursor intensity file is required to derive peptide and protein levels using --level_rollup")
+            sys.exit(1)
+
+        if protein_level or peptide_level:
+            print("ERROR: Protein or Peptide Intensity files cannot be provided along with --level_rollup, both levels will be derived from the precursor intensity file")
+            logging.error("ERROR: Protein or Peptide Intensity files cannot be provided along with --level_rollup, both levels will be derived from the precursor intensity file")
+            sys.exit(1)
+
+        if grouping_file and not (protein_threshold and peptide_threshold):
+            print("ERROR: Grouping File was provided. For groupwise comparison of derived levels, please provide protein and peptide threshold values using --protein_threshold and --peptide_threshold.")
+            logging.error("ERROR: Grouping File was provided. For groupwise comparison of derived levels, please provide protein and peptide threshold values using --protein_threshold and --peptide_threshold.")
+            sys.exit(1)
+
+        logging.info(f"Peptide and Protein Level intensities will be derived from {precursor_level} using the '{level_rollup}' rollup")
+
+    if chunk_memory:
+        logging.info("--------------------------------------- Checking Chunk Memory ------------------------------------------\n")
+
+        if chunk_memory < 0:
+            print("ERROR: Chunk memory should be a positive number of MB")
+            logging.error("ERROR: Chunk memory should be a positive number of MB")
+            sys.exit(1)
+
+        if level_rollup:
+            print("ERROR: --chunk_memory cannot be used along with --level_rollup, the derived levels are built from the precursor intensities held in memory")
+            logging.error("ERROR: --chunk_memory cannot be used along with --level_rollup, the derived levels are built from the precursor intensities held in memory")
+            sys.exit(1)
+
+        logging.info(f"Intensity files will be read in chunks using a memory budget of {chunk_memory} MB")
+
+    if plot_scale_threshold < 0:
+        print("ERROR: --plot_scale_threshold should not be negative")
+        logging.error("ERROR: --plot_scale_threshold should not be negative")
+        sys.exit(1)
+
+    if level_workers < 1 or matrix_workers < 1 or figure_workers < 1 or stage_workers < 1:
+        print("ERROR: The number of level, matrix, figure and stage workers should be at least 1")
+        logging.error("ERROR: The number of level, matrix, figure and stage workers should be at least 1")
+        sys.exit(1)
+
     if mzml_dir:
         logging.info("--------------------------------------- Checking mzML Directory ------------------------------------------\n")
 
         #checking if directory exists
-        if not os.path.exists(mzml_dir):
+        if rethreshold:
+            logging.info(f"ID-Free QC Metrics extracted from {mzml_dir} will be read from the metrics bundle {rethreshold}")
+        elif not os.path.exists(mzml_dir):
             print(f"ERROR: Given MzML Directory path doesn't exist = {mzml_dir}")
             logging.error(f"ERROR: Given MzML Directory path doesn't exist = {mzml_dir}")
             sys.exit(1)
@@ -146,7 +363,8 @@ def main():
     if protein_level:
         logging.info("---------------------------------------- Checking Protein Intensity File ----------------------------------------\n")
 
-        check_file(protein_level, "Protein")
+        if not rethreshold:
+            check_file(protein_level, "Protein")
 
         if protein_threshold:
             logging.info(f"Protein Threshold: {protein_threshold} will be applied")
@@ -186,8 +404,9 @@ def main():
                 print("ERROR: Grouping File was provided. For groupwise comparison, please provide data percent threshold using --data_threshold.")
                 sys.exit(1)
 
-            groups = check_grouping_file(protein_level, grouping_file)
-            logging.info(f"{grouping_file} will be used for comparing samples across the following groups: {groups}")
+            if not rethreshold:
+                groups = check_grouping_file(protein_level, grouping_file)
+                logging.info(f"{grouping_file} will be used for comparing samples across the following groups: {groups}")
 
     else:
         logging.info("Protein Level file not provided, protein level metrics will not be calculated \n")
@@ -196,7 +415,8 @@ def main():
     if peptide_level:
 
         logging.info("--------------------------------------------- Checking Peptide Intensity File --------------------------------------------- ")
-        check_file(peptide_level, "Peptide")
+        if not rethreshold:
+            check_file(peptide_level, "Peptide")
 
         if protein_threshold:
             logging.info(f"Peptide Threshold: {peptide_threshold} will be applied")
@@ -248,8 +468,9 @@ def main():
                 print("ERROR: Grouping File was provided. For groupwise comparison, please data percent threshold using --data_threshold.")
                 sys.exit(1)
 
-            groups = check_grouping_file(peptide_level, grouping_file)
-            logging.info(f"{grouping_file} will be used for comparing samples across the following groups: {groups}")
+            if not rethreshold:
+                groups = check_grouping_file(peptide_level, grouping_file)
+                logging.info(f"{grouping_file} will be used for comparing samples across the following groups: {groups}")
 
     else:
         logging.info("Peptide Level file not provided, peptide level metrics will not be calculated")
@@ -258,7 +479,8 @@ def main():
     if precursor_level:
 
         logging.info("--------------------------------------------- Checking Precursor Intensity File --------------------------------------------- ")
-        check_file(precursor_level, "precursor")
+        if not rethreshold:
+            check_file(precursor_level, "precursor")
 
         if precursor_threshold:
             logging.info(f"Precursor Threshold: {precursor_threshold} will be applied")
@@ -310,8 +532,9 @@ def main():
                 print("ERROR: Grouping File was provided. For groupwise comparison, please data percent threshold using --data_threshold.")
                 sys.exit(1)
 
-            groups = check_grouping_file(precursor_level, grouping_file)
-            logging.info(f"{grouping_file} will be used for comparing samples across the following groups: {groups}")
+            if not rethreshold:
+                groups = check_grouping_file(precursor_level, grouping_file)
+                logging.info(f"{grouping_file} will be used for comparing samples across the following groups: {groups}")
 
     else:
         logging.info("Precursor Level file not provided, precursor level metrics will not be calculated")
@@ -328,8 +551,11 @@ def main():
             check_file(peptide_list, "Peptide List")
 
     #check samples across all provided inputs
-    logging.info("--------------------------------------------- Checking Samples in Inputs --------------------------------------------- ")
-    check_samples(mzml_dir, protein_level, peptide_level, precursor_level, grouping_file)
+    if rethreshold:
+        logging.info(f"Thresholds will be applied to the metrics bundle {rethreshold}, the Excel and HTML reports will be saved to {out_dir}")
+    else:
+        logging.info("--------------------------------------------- Checking Samples in Inputs --------------------------------------------- ")
+        check_samples(mzml_dir, protein_level, peptide_level, precursor_level, grouping_file)
 
     if grouping_file:
         logging.info("--------------------------------------------- Checking for Groups -----------------------------------------------------")
@@ -339,67 +565,187 @@ def main():
         groupwise_comparison = False
         groups = ""
 
-    if mzml_dir:
-        logging.info("-------------------------------------- Calculating ID Free Metrics ------------------------------------------------ ")
-
-        mzml_threshold_dict = {}
-        mzml_threshold_dict['MS1 TIC Threshold'] = ms1_tic_threshold
-        mzml_threshold_dict['MS2 TIC Threshold'] = ms2_tic_threshold
-        mzml_threshold_dict['MS1 Spectra Threshold'] = ms1_spectra_threshold
-        mzml_threshold_dict['MS2 Spectra Threshold'] = ms2_spectra_threshold
-        mzml_threshold_dict['Max Basepeak Intensity Threshold'] = max_basepeak_intensity_threshold
-        mzml_threshold_dict['TIC CV Threshold'] = tic_cv_threshold
-        mzml_threshold_dict['IQR Sensitivity'] = iqr_sensitivity
+    #the raw metrics of the run are saved so other thresholds can be applied later with --rethreshold
+    if rethreshold:
+        metrics_bundle = rethreshold
+    elif save_bundle:
+        from mod.metrics_bundle import get_bundle_dir, save_bundle_options
+        metrics_bundle = get_bundle_dir(out_dir, reportname)
+        save_bundle_options(metrics_bundle, options)
+        logging.info(f"Raw metrics of the run will be saved to the metrics bundle {metrics_bundle}")
+    else:
+        metrics_bundle = False
+
+    mzml_threshold_dict = {}
+    mzml_threshold_dict['MS1 TIC Threshold'] = ms1_tic_threshold
+    mzml_threshold_dict['MS2 TIC Threshold'] = ms2_tic_threshold
+    mzml_threshold_dict['MS1 Spectra Threshold'] = ms1_spectra_threshold
+    mzml_threshold_dict['MS2 Spectra Threshold'] = ms2_spectra_threshold
+    mzml_threshold_dict['Max Basepeak Intensity Threshold'] = max_basepeak_intensity_threshold
+    mzml_threshold_dict['TIC CV Threshold'] = tic_cv_threshold
+    mzml_threshold_dict['IQR Sensitivity'] = iqr_sensitivity
+
+    input_dict = {}
+    input_dict['Protein Level'] = protein_level
+    input_dict['Peptide Level'] = peptide_level
+    input_dict['Precursor Level'] = precursor_level
+    input_dict['Peptide List'] = peptide_list
+    input_dict['Level Rollup'] = level_rollup
+    input_dict['Chunk Memory'] = chunk_memory
+    input_dict['Level Workers'] = level_workers
+    input_dict['Matrix Workers'] = matrix_workers
+    input_dict['Plot Scale Threshold'] = plot_scale_threshold
+    input_dict['PCA Missing Values'] = pca_missing_values
+    input_dict['PCA Completeness'] = pca_completeness
+    input_dict['PCA Top Variance'] = pca_top_variance
+    input_dict['PCA Solver'] = pca_solver
+    input_dict['Cache Directory'] = cache_dir
+    input_dict['Metrics Bundle'] = metrics_bundle
+    input_dict['Rethreshold'] = bool(rethreshold)
+
+    threshold_dict = {}
+    threshold_dict['Protein Threshold'] = protein_threshold
+    threshold_dict['Peptide Threshold'] = peptide_threshold
+    threshold_dict['Precursor Threshold'] = precursor_threshold
+    threshold_dict['Enzyme'] = digestion_enzyme
+    threshold_dict['Miscleavage Threshold'] = miscleavage_threshold
+    threshold_dict['TIC CV Threshold'] = tic_cv_threshold
+    threshold_dict['CV Percent Threshold'] = cv_percent_threshold
+    threshold_dict['Data Percent Threshold'] = data_percent_threshold
+    threshold_dict['iRT Label'] = irtlabel
+    threshold_dict['Coverage Threshold'] = coverage_threshold
+
+    # ------------------------------------------- QC PIPELINE -----------------------------------
+
+    #figures are built in a pool while the remaining metrics and excel reports are calculated and written
+    figure_executor = ProcessPoolExecutor(max_workers=figure_workers) if figure_workers > 1 else None
+    #the id-free and id-based metrics are independent and run concurrently in the stage pool
+    stage_executor = ProcessPoolExecutor(max_workers=stage_workers) if stage_workers > 1 else None
+
+    stages = {}
+    metric_stages = []
+    figure_stages = []
 
-        mzml_sample_df, mzml_group_df, idfree_report_parameters = calculate_idfree_metrics(out_dir, reportname, mzml_dir, groupwise_comparison, groups, mzml_threshold_dict)
+    if mzml_dir:
+        from mod.mzml_extract import calculate_idfree_metrics
+        #streamed verdicts are written while the files are extracted, so the stage is not restored from the cache
+        stages['ID-Free Metrics'] = stage_spec(calculate_idfree_metrics, inputs=[rethreshold or mzml_dir, grouping_file, baseline_file],
+                                               outputs=[f"{out_dir}/{reportname}_ID-Free_QC_Report.xlsx"] + ([f"{metrics_bundle}/ID-Free.pkl"] if save_bundle and not rethreshold else []),
+                                               ignore=['out_dir', 'groups', 'metrics_bundle'], cache=not stream_verdicts, process=True,
+                                               out_dir=out_dir, reportname=reportname, mzml_dir=mzml_dir, groupwise_comparison=groupwise_comparison,
+                                               groups=groups, mzml_threshold_dict=mzml_threshold_dict, scale_threshold=plot_scale_threshold,
+                                               baseline_file=baseline_file, instrument=instrument, stream_verdicts=stream_verdicts,
+                                               stop_after_failures=stop_after_failures, metrics_bundle=metrics_bundle, rethreshold=bool(rethreshold))
+        stages['ID-Free Figures'] = stage_spec(submit_metric_figures, depends=['ID-Free Metrics'], executor=figure_executor, share_dir=out_dir)
+        metric_stages.append('ID-Free Metrics')
+        figure_stages.append('ID-Free Figures')
 
     if protein_level or peptide_level or precursor_level:
-        logging.info("-------------------------------------- Calculating ID Based Metrics ------------------------------------------------ ")
-
-        input_dict = {}
-        input_dict['Protein Level'] = protein_level
-        input_dict['Peptide Level'] = peptide_level
-        input_dict['Precursor Level'] = precursor_level
-        input_dict['Peptide List'] = peptide_list
-
-        threshold_dict = {}
-        threshold_dict['Protein Threshold'] = protein_threshold
-        threshold_dict['Peptide Threshold'] = peptide_threshold
-        threshold_dict['Precursor Threshold'] = precursor_threshold
-        threshold_dict['Enzyme'] = digestion_enzyme
-        threshold_dict['Miscleavage Threshold'] = miscleavage_threshold
-        threshold_dict['TIC CV Threshold'] = tic_cv_threshold
-        threshold_dict['CV Percent Threshold'] = cv_percent_threshold
-        threshold_dict['Data Percent Threshold'] = data_percent_threshold
-        threshold_dict['iRT Label'] = irtlabel
-        threshold_dict['Coverage Threshold'] = coverage_threshold
-
-        #calculating_idbased_metrics()
-        idbased_sample_df, idbased_group_df, idbased_report_parameters = calculate_idbased_metrics(out_dir, reportname, input_dict, threshold_dict, groups, groupwise_comparison)
-
-    if mzml_dir:
-        if protein_level or peptide_level or precursor_level:
-            sample_df = pd.merge(mzml_sample_df, idbased_sample_df, on="Filename")
-            if groupwise_comparison:
-                grouped_df = pd.merge(mzml_group_df, idbased_group_df, on="Group")
-        else:
-            sample_df = mzml_sample_df
-            if groupwise_comparison:
-                grouped_df = mzml_group_df
-    elif protein_level or peptide_level or precursor_level:
-        sample_df = idbased_sample_df
+        from mod.idbased_metrics import calculate_idbased_metrics
+        levels = [level for level, level_file in [('Protein', protein_level or level_rollup), ('Peptide', peptide_level or level_rollup), ('Precursor', precursor_level)] if level_file]
+        level_inputs = [rethreshold] if rethreshold else [protein_level, peptide_level, precursor_level]
+        stages['ID-Based Metrics'] = stage_spec(calculate_idbased_metrics, inputs=level_inputs + [peptide_list, grouping_file],
+                                                outputs=[f"{out_dir}/{reportname}_{level}Level_QC_Report.xlsx" for level in levels] +
+                                                        ([f"{metrics_bundle}/{level}.pkl" for level in levels] if save_bundle and not rethreshold else []),
+                                                ignore=['out_dir', 'groups'], cache=True, process=True,
+                                                out_dir=out_dir, reportname=reportname, input_dict=input_dict, threshold_dict=threshold_dict,
+                                                groups=groups, groupwise_comparison=groupwise_comparison)
+        stages['ID-Based Figures'] = stage_spec(submit_metric_figures, depends=['ID-Based Metrics'], executor=figure_executor, share_dir=out_dir)
+        metric_stages.append('ID-Based Metrics')
+        figure_stages.append('ID-Based Figures')
+
+    stages['QC Status'] = stage_spec(get_qc_status, depends=metric_stages, groupwise_comparison=groupwise_comparison, groups=groups)
+    stages['Excel Report'] = stage_spec(save_qc_status_report, depends=['QC Status'], out_dir=out_dir, reportname=reportname, groupwise_comparison=groupwise_comparison)
+    if metric_store:
+        from mod.metric_store import save_run_metrics
+        stages['Metric Store'] = stage_spec(save_run_metrics, depends=['QC Status'], store_file=metric_store, out_dir=out_dir, reportname=reportname,
+                                            mzml_dir=mzml_dir, instrument=instrument)
+    if update_baseline_file:
+        from mod.baseline import update_baseline
+        stages['Baseline'] = stage_spec(update_baseline, depends=['ID-Free Metrics'], baseline_file=update_baseline_file, out_dir=out_dir,
+                                        reportname=reportname, mzml_dir=mzml_dir, instrument=instrument)
+    stages['HTML Report'] = stage_spec(save_html_report, depends=metric_stages + figure_stages, out_dir=out_dir, reportname=reportname,
+                                       groupwise_comparison=groupwise_comparison, groups=groups, mzml_dir=mzml_dir, report_mode=report_mode)
+
+    try:
+        results, timings = run_pipeline(stages, stage_executor, cache_dir)
+    finally:
+        for executor in [stage_executor, figure_executor]:
+            if executor:
+                executor.shutdown()
+
+    logging.info("QC pipeline stages:\n" + format_pipeline(stages, timings))
+    if print_stages:
+        print(format_pipeline(stages, timings))
+
+    sample_df, grouped_df = results['QC Status']
+
+    return sample_df, grouped_df, results['HTML Report']
+
+def submit_metric_figures(metric_results, executor=None, share_dir=None):
+    """
+    Starts rendering the figures of an ID-free or ID-based metrics stage (see report_figures.submit_figures).
+
+    Args:
+    metric_results (tuple): Samplewise QC metrics, groupwise QC metrics and report parameters of the stage.
+    executor (ProcessPoolExecutor): [Optional] Pool the figures are rendered in.
+    share_dir (str): [Optional] Directory where the rendered figures are saved until the report is written.
+
+    Returns:
+    dict: Report parameters with futures of the rendered figures, or the figure specifications without a pool.
+    """
+
+    return submit_figures(metric_results[2], executor, share_dir)
+
+def get_qc_status(*metric_results, groupwise_comparison=False, groups=""):
+    """
+    Merges the samplewise and groupwise QC metrics of the ID-free and ID-based metrics and calculates the overall groupwise QC status.
+
+    Args:
+    *metric_results (tuple): Samplewise QC metrics, groupwise QC metrics and report parameters of each metrics stage.
+    groupwise_comparison (bool): [Optional] Whether a grouping file was provided.
+    groups (dict): [Optional] Groups and their filenames.
+
+    Returns:
+    DataFrame: Samplewise QC metrics, or "" if no metrics were calculated.
+    DataFrame: Groupwise QC metrics, or "" without a grouping file.
+    """
+
+    sample_df = ""
+    grouped_df = ""
+
+    for metric_sample_df, metric_group_df, _ in metric_results:
+        sample_df = pd.merge(sample_df, metric_sample_df, on="Filename") if isinstance(sample_df, pd.DataFrame) else metric_sample_df
         if groupwise_comparison:
-            grouped_df = idbased_group_df
+            grouped_df = pd.merge(grouped_df, metric_group_df, on="Group") if isinstance(grouped_df, pd.DataFrame) else metric_group_df
 
     if groupwise_comparison:
         if not 'Group' in sample_df.columns.tolist():
-            sample_df['Group'] = sample_df['Filename'].apply(groupname, args=[groups,])
+            sample_df['Group'] = get_sample_groups(sample_df['Filename'].tolist(), groups)
         other_sample_cols = [col for col in sample_df.columns.tolist() if col not in ['Filename','Group']]
         sample_df = sample_df[['Filename','Group'] + other_sample_cols]
         sample_df = sample_df.sort_values('Group')
 
         status_cols = [col for col in grouped_df.columns.tolist() if col != 'Group']
-        grouped_df[['Overall QC Status','QC Fail Score']] = grouped_df[status_cols].apply(get_overall_qc_status, args=[len(status_cols)], axis=1)
+        grouped_df['Overall QC Status'], grouped_df['QC Fail Score'] = get_overall_status(grouped_df, status_cols)
+
+    return sample_df, grouped_df
+
+def save_qc_status_report(qc_status, out_dir, reportname, groupwise_comparison):
+    """
+    Saves the overall QC status report.
+
+    Args:
+    qc_status (tuple): Samplewise and groupwise QC metrics from get_qc_status.
+    out_dir (str): Output directory.
+    reportname (str): Report name.
+    groupwise_comparison (bool): Whether a grouping file was provided.
+
+    Returns:
+    None
+    """
+
+    sample_df, grouped_df = qc_status
 
     if isinstance(sample_df, pd.DataFrame):
         logging.info(f"Saving Overall QC Report to {out_dir}/{reportname}_QC_Status_Report.xlsx")
@@ -412,33 +758,203 @@ def main():
     else:
         logging.info(f"Overall QC Report not generated since thresholds were not provided.")
 
+    return None
+
+def save_html_report(*stage_results, out_dir, reportname, groupwise_comparison, groups, mzml_dir, report_mode):
+    """
+    Saves the HTML QC report.
+
+    Args:
+    *stage_results: Results of the metrics stages followed by the report parameters of their figure stages.
+    out_dir (str): Output directory.
+    reportname (str): Report name.
+    groupwise_comparison (bool): Whether a grouping file was provided.
+    groups (dict): Groups and their filenames.
+    mzml_dir (str): mzML directory, False without ID-free metrics.
+    report_mode (str): HTML report mode, one of report_figures.report_modes.
+
+    Returns:
+    dict: HTML report parameters, with figure specifications for the figures.
+    """
+
+    metric_results = stage_results[:len(stage_results)//2]
+    report_figures = {}
+    for figure_params in stage_results[len(stage_results)//2:]:
+        report_figures.update(figure_params)
+
     #creating report
     all_report_params = {}
-
-    if mzml_dir:
-        if protein_level or peptide_level or precursor_level:
-            all_report_params = dict(tuple(idfree_report_parameters.items()) + tuple(idbased_report_parameters.items()))
-        else:
-            all_report_params = idfree_report_parameters
-    elif protein_level or peptide_level or precursor_level:
-        all_report_params = idbased_report_parameters
+    for _, _, report_parameters in metric_results:
+        all_report_params.update(report_parameters)
 
     all_report_params['groupwise_comparison'] = groupwise_comparison
     all_report_params['mzml_dir'] = mzml_dir
-    
+    #metrics and status rules the report applies when other thresholds are tried in the browser
+    all_report_params['tuning_data'] = get_report_tuning(metric_results, groupwise_comparison, groups)
+
+    figure_dir = False
+    if report_mode == 'lazy':
+        figure_dir = f"{out_dir}/{reportname}_figures"
+        logging.info(f"Saving HTML QC Report figures to {figure_dir}")
+        prepare_figure_dir(figure_dir)
+        all_report_params['figure_dir'] = f"{reportname}_figures"
+    else:
+        all_report_params['plotlyjs'] = get_plotlyjs()
+
     logging.info(f"Saving HTML QC Report to {out_dir}/{reportname}.html")
     if all_report_params:
-        env = Environment(loader=FileSystemLoader(str("./templates")))
+        from jinja2 import Environment, FileSystemLoader
+        env = Environment(loader=FileSystemLoader(os.path.join(os.path.dirname(os.path.abspath(__file__)), "templates")))
+        #figures are rendered when the template reaches them and the report is streamed to the file
+        env.filters['figure'] = partial(report_figure, figure_dir=figure_dir)
         template = env.get_template(str("report_template.html"))
 
-        output_from_parsed_template = template.render(all_report_params)
-
         with open(f'{out_dir}/{reportname}.html', 'w',encoding="utf-8") as f:
-            f.write(output_from_parsed_template)
+            for chunk in template.generate(dict(all_report_params, **report_figures)):
+                f.write(chunk)
+
+    discard_figures(report_figures)
+
+    return all_report_params
+
+def run_qc_batch(config):
+    """
+    Runs the QC projects of a batch manifest in one warm process or a small worker pool and saves a status summary of the projects.
+
+    Args:
+    config (dict): Options named like the long command line options, with 'batch_manifest'. The other options are the defaults of the projects.
+
+    Returns:
+    list: Status of each project (see batch_runner.run_project).
+
+    Note:
+    Unless a cache directory is given, projects share cached intensity files and missed cleavage scores in {outdirectory}/{reportname}_cache.
+    """
+
+    from mod.batch_runner import read_manifest, get_batch_projects, run_batch, save_batch_summary
+
+    out_dir = str(config['outdirectory'])
+    reportname = str(config['reportname'])
+    check_path(out_dir)
+
+    if int(config['batch_workers']) < 1:
+        print("ERROR: The number of batch workers should be at least 1")
+        logging.error("ERROR: The number of batch workers should be at least 1")
+        sys.exit(1)
+
+    manifest = read_manifest(config['batch_manifest'])
+
+    defaults = {key: value for key, value in config.items() if key not in ['batch_manifest', 'batch_workers']}
+    if not defaults['cache_dir']:
+        defaults['cache_dir'] = f"{out_dir}/{reportname}_cache"
+
+    projects = get_batch_projects(manifest, defaults)
+    logging.info(f"Running {len(projects)} projects from {config['batch_manifest']} with {config['batch_workers']} batch workers")
+
+    statuses = run_batch(run_qc, projects, int(config['batch_workers']))
+
+    summary_file = save_batch_summary(statuses, out_dir, reportname)
+    completed = len([status for status in statuses if status['Status'] == 'Completed'])
+    print(f"{completed} out of {len(statuses)} projects completed, see {summary_file}")
+    logging.info(f"{completed} out of {len(statuses)} projects completed, see {summary_file}")
+
+    return statuses
+
+def run_qc_service(config):
+    """
+    Runs QCeltis as a local service - QC jobs are submitted over HTTP, queued in SQLite and run on a pool of warm worker processes.
 
+    Args:
+    config (dict): Options named like the long command line options, with 'service_port'. The other options are the defaults of the jobs.
+
+    Returns:
+    None
+
+    Note:
+    Unless a cache directory is given, jobs share cached intensity files and missed cleavage scores in {outdirectory}/{reportname}_cache.
+    """
+
+    from mod.qc_service import run_service
+
+    out_dir = str(config['outdirectory'])
+    reportname = str(config['reportname'])
+    check_path(out_dir)
+
+    if int(config['batch_workers']) < 1:
+        print("ERROR: The number of batch workers should be at least 1")
+        logging.error("ERROR: The number of batch workers should be at least 1")
+        sys.exit(1)
+
+    if not 0 <= int(config['service_port']) <= 65535:
+        print("ERROR: --service_port should be between 0 and 65535")
+        logging.error("ERROR: --service_port should be between 0 and 65535")
+        sys.exit(1)
+
+    defaults = {key: value for key, value in config.items() if key not in ['outdirectory', 'reportname', 'batch_manifest', 'batch_workers', 'service_port']}
+    if not defaults['cache_dir']:
+        defaults['cache_dir'] = f"{out_dir}/{reportname}_cache"
+
+    run_service(run_qc, get_unknown_options, defaults, out_dir, reportname, int(config['service_port']), int(config['batch_workers']))
+
+    return None
+
+def run_baseline_scoring(config):
+    """
+    Scores mzML files one at a time against a baseline of earlier good runs, without waiting for the rest of the batch.
+
+    Args:
+    config (dict): Options named like the long command line options, with 'score_files' and 'baseline'.
+
+    Returns:
+    DataFrame: Scores of each file and ID-free metric (see baseline.score_mzml_file).
+    """
+
+    from mod.baseline import score_mzml_files
+
+    out_dir = str(config['outdirectory'])
+    reportname = str(config['reportname'])
+    check_path(out_dir)
+
+    if not config['baseline']:
+        print("ERROR: A baseline file is required to score mzML files, please provide --baseline")
+        logging.error("ERROR: A baseline file is required to score mzML files, please provide --baseline")
+        sys.exit(1)
+
+    missing_files = [mzml_file for mzml_file in config['score_files'] if not os.path.exists(mzml_file)]
+    if missing_files:
+        print(f"ERROR: mzML files to score do not exist: {', '.join(missing_files)}")
+        logging.error(f"ERROR: mzML files to score do not exist: {', '.join(missing_files)}")
+        sys.exit(1)
+
+    scores = score_mzml_files(config['score_files'], config['baseline'], out_dir, reportname, config['instrument'], float(config['iqr_sensitivity']))
+    logging.info(f"Baseline scores saved to {out_dir}/{reportname}_Baseline_Scores.txt")
+
+    return scores
+
+def main():
+
+    start_time = time.time()
+
+    args = build_parser().parse_args()
+    logging.basicConfig(filename=f"{args.reportname}_QCeltis.log", level=logging.INFO)
+
+    if args.service_port is not False:
+        run_qc_service(vars(args))
+    elif args.batch_manifest:
+        run_qc_batch(vars(args))
+    elif args.score_files:
+        run_baseline_scoring(vars(args))
+    elif args.rethreshold:
+        #only the options given on the command line replace the thresholds of the earlier run
+        parser = build_parser()
+        not_given = object()
+        parser.set_defaults(**{option: not_given for option in vars(args)})
+        run_qc({option: value for option, value in vars(parser.parse_args()).items() if value is not not_given})
+    else:
+        run_qc(vars(args))
+
+    print("--- Runtime: %s seconds ---" % (time.time() - start_time))
+    logging.info("--- Runtime: %s seconds ---" % (time.time() - start_time))
 
 if __name__ == '__main__':
     main()
-
-print("--- Runtime: %s seconds ---" % (time.time() - start_time))
-logging.info("--- Runtime: %s seconds ---" % (time.time() - start_time))
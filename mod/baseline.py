@@ -0,0 +1,485 @@
+"""
+Reference baselines for outlier detection - mergeable t-digest quantile sketches of the ID-free metrics of good runs, per instrument
+"""
+
+import pandas as pd
+import numpy as np
+import os
+import sys
+import json
+import math
+import time
+import logging
+
+from mod.mzml_extract import idfree_metrics, get_mzml_run_info, mzml_extract
+
+#-------------------------------------------------------------------------- VARIABLES --------------------------------------------------------------------------
+
+#t-digest compression - about this many centroids are kept per metric, more centroids give more accurate quartiles
+default_compression = 100
+
+#metrics with fewer baseline samples are compared within the batch instead
+min_baseline_samples = 5
+
+baseline_format = "QCeltis Baseline"
+baseline_version = 1
+
+#seconds to wait for another run updating the same baseline
+baseline_lock_timeout = 60
+
+#-------------------------------------------------------------------------- FUNCTIONS ---------------------------------------------------------------------------
+
+def new_baseline(compression=default_compression):
+    """
+    Creates an empty baseline.
+
+    Args:
+    compression (int): [Optional] t-digest compression of the metric sketches.
+
+    Returns:
+    dict: Baseline with the keys 'Format', 'Version', 'Compression' and 'Instruments' (sketches by instrument and metric).
+    """
+
+    return {'Format': baseline_format, 'Version': baseline_version, 'Compression': compression, 'Instruments': {}}
+
+def scale_index(q, compression):
+    """
+    t-digest scale function k1, which keeps centroids small at the tails of the distribution.
+
+    Args:
+    q (float): Quantile between 0 and 1.
+    compression (int): t-digest compression.
+
+    Returns:
+    float: Scale index of the quantile - neighbouring centroids are only merged while they span at most 1.
+    """
+
+    return compression / (2 * math.pi) * math.asin(2 * min(max(q, 0.0), 1.0) - 1)
+
+def compress_digest(means, weights, compression):
+    """
+    Merges centroids of a t-digest until they fit the compression.
+
+    Args:
+    means (array): Centroid means.
+    weights (array): Centroid weights (number of values).
+    compression (int): t-digest compression.
+
+    Returns:
+    list: Merged centroid means, in increasing order.
+    list: Merged centroid weights.
+    """
+
+    order = np.argsort(means, kind='stable')
+    means = np.asarray(means, dtype=float)[order]
+    weights = np.asarray(weights, dtype=float)[order]
+    total = weights.sum()
+
+    merged_means = [means[0]]
+    merged_weights = [weights[0]]
+    weight_before = 0.0
+    k_lower = scale_index(0.0, compression)
+
+    for mean, weight in zip(means[1:], weights[1:]):
+        if scale_index((weight_before + merged_weights[-1] + weight) / total, compression) - k_lower <= 1:
+            merged_weights[-1] += weight
+            merged_means[-1] += (mean - merged_means[-1]) * weight / merged_weights[-1]
+        else:
+            weight_before += merged_weights[-1]
+            k_lower = scale_index(weight_before / total, compression)
+            merged_means.append(mean)
+            merged_weights.append(weight)
+
+    return [float(mean) for mean in merged_means], [float(weight) for weight in merged_weights]
+
+def merge_digests(digests, compression=default_compression):
+    """
+    Merges t-digest sketches, e.g. the sketch of a baseline and the sketch of new runs.
+
+    Args:
+    digests (list): Sketches with the keys 'Count', 'Min', 'Max', 'Means' and 'Weights'.
+    compression (int): [Optional] t-digest compression of the merged sketch.
+
+    Returns:
+    dict: Merged sketch.
+    """
+
+    digests = [digest for digest in digests if digest['Count']]
+    if not digests:
+        return {'Count': 0, 'Min': None, 'Max': None, 'Means': [], 'Weights': []}
+
+    means, weights = compress_digest(np.concatenate([digest['Means'] for digest in digests]),
+                                     np.concatenate([digest['Weights'] for digest in digests]), compression)
+
+    return {'Count': int(sum(digest['Count'] for digest in digests)), 'Min': min(digest['Min'] for digest in digests),
+            'Max': max(digest['Max'] for digest in digests), 'Means': means, 'Weights': weights}
+
+def create_digest(values, compression=default_compression):
+    """
+    Creates a t-digest sketch of metric values.
+
+    Args:
+    values (list): Metric values, missing values are left out.
+    compression (int): [Optional] t-digest compression.
+
+    Returns:
+    dict: Sketch with the keys 'Count', 'Min', 'Max', 'Means' and 'Weights'.
+    """
+
+    values = np.asarray(values, dtype=float)
+    values = values[~np.isnan(values)]
+
+    if len(values) == 0:
+        return merge_digests([])
+
+    means, weights = compress_digest(values, np.ones(len(values)), compression)
+
+    return {'Count': int(len(values)), 'Min': float(values.min()), 'Max': float(values.max()), 'Means': means, 'Weights': weights}
+
+def digest_quantile(digest, quantiles):
+    """
+    Estimates quantiles of the values summarised by a t-digest sketch.
+
+    Args:
+    digest (dict): Sketch from create_digest or merge_digests.
+    quantiles (list): Quantiles between 0 and 1.
+
+    Returns:
+    array: Estimated value at each quantile.
+    """
+
+    weights = np.asarray(digest['Weights'])
+
+    #small baselines keep each value as a centroid, their quartiles are calculated exactly as for the batch
+    if (weights == 1).all():
+        return np.quantile(digest['Means'], quantiles)
+
+    #centroids are taken to sit at the middle of their weight, between the minimum and maximum value
+    centers = np.cumsum(weights) - weights / 2
+    positions = np.concatenate([[0], centers, [weights.sum()]])
+    values = np.concatenate([[digest['Min']], digest['Means'], [digest['Max']]])
+
+    return np.interp(np.asarray(quantiles) * weights.sum(), positions, values)
+
+def digest_percentile(digest, value):
+    """
+    Estimates the percentile of a value within the values summarised by a t-digest sketch.
+
+    Args:
+    digest (dict): Sketch from create_digest or merge_digests.
+    value (float): Metric value.
+
+    Returns:
+    float: Percentage of baseline values below the value.
+    """
+
+    weights = np.asarray(digest['Weights'])
+    centers = np.cumsum(weights) - weights / 2
+    positions = np.concatenate([[0], centers, [weights.sum()]])
+    values = np.concatenate([[digest['Min']], digest['Means'], [digest['Max']]])
+
+    #values equal to baseline values are placed in the middle of them
+    upper = np.interp(value, values, positions)
+    lower = np.interp(-value, -values[::-1], positions[::-1])
+
+    return float((lower + upper) / 2 / weights.sum() * 100)
+
+def load_baseline(baseline_file):
+    """
+    Reads a baseline file.
+
+    Args:
+    baseline_file (str): Path to a baseline saved by save_baseline.
+
+    Returns:
+    dict: Baseline (see new_baseline).
+
+    Raises:
+    SystemExit: If the file does not exist or is not a QCeltis baseline.
+    """
+
+    if not os.path.exists(baseline_file):
+        print(f"ERROR: Baseline file {baseline_file} does not exist")
+        logging.error(f"ERROR: Baseline file {baseline_file} does not exist")
+        sys.exit(1)
+
+    try:
+        with open(baseline_file, encoding='utf-8') as f:
+            baseline = json.load(f)
+    except ValueError as e:
+        print(f"ERROR: Baseline file {baseline_file} could not be read: {e}")
+        logging.error(f"ERROR: Baseline file {baseline_file} could not be read: {e}")
+        sys.exit(1)
+
+    if not isinstance(baseline, dict) or baseline.get('Format') != baseline_format or baseline.get('Version') != baseline_version:
+        print(f"ERROR: {baseline_file} is not a QCeltis baseline file (version {baseline_version})")
+        logging.error(f"ERROR: {baseline_file} is not a QCeltis baseline file (version {baseline_version})")
+        sys.exit(1)
+
+    return baseline
+
+def save_baseline(baseline, baseline_file):
+    """
+    Saves a baseline as JSON.
+
+    Args:
+    baseline (dict): Baseline (see new_baseline).
+    baseline_file (str): Path to the baseline file.
+
+    Returns:
+    None
+    """
+
+    #written to a temporary file first, so runs reading the baseline never see a partial file
+    with open(f"{baseline_file}.tmp", 'w', encoding='utf-8') as f:
+        json.dump(baseline, f)
+    os.replace(f"{baseline_file}.tmp", baseline_file)
+
+    return None
+
+def merge_baselines(baselines):
+    """
+    Merges baselines, e.g. baselines built separately for different periods or sites.
+
+    Args:
+    baselines (list): Baselines (see new_baseline).
+
+    Returns:
+    dict: Baseline with the merged sketches of each instrument and metric.
+    """
+
+    merged = new_baseline(max([baseline['Compression'] for baseline in baselines] + [default_compression]))
+
+    for baseline in baselines:
+        for instrument, digests in baseline['Instruments'].items():
+            merged_digests = merged['Instruments'].setdefault(instrument, {})
+            for metric, digest in digests.items():
+                merged_digests[metric] = merge_digests([merged_digests[metric], digest], merged['Compression']) if metric in merged_digests else digest
+
+    return merged
+
+def merge_baseline_files(baseline_files, out_file):
+    """
+    Merges baseline files into one baseline file.
+
+    Args:
+    baseline_files (list): Paths to baseline files.
+    out_file (str): Path to the merged baseline file, may be one of the baseline files.
+
+    Returns:
+    dict: Merged baseline.
+    """
+
+    merged = merge_baselines([load_baseline(baseline_file) for baseline_file in baseline_files])
+    save_baseline(merged, out_file)
+
+    return merged
+
+def add_samples_to_baseline(baseline, metrics_df, instruments):
+    """
+    Adds the ID-free metrics of samples to a baseline.
+
+    Args:
+    baseline (dict): Baseline (see new_baseline), updated in place.
+    metrics_df (DataFrame): ID-free metrics with a 'Filename' column, e.g. the ID-Free Metrics Summary of a run.
+    instruments (dict): Instrument of each filename.
+
+    Returns:
+    dict: Updated baseline.
+    """
+
+    metrics_df = metrics_df.assign(Instrument=metrics_df['Filename'].map(instruments))
+
+    for instrument, instrument_df in metrics_df.groupby('Instrument'):
+        digests = baseline['Instruments'].setdefault(instrument, {})
+        for metric in [metric for metric in idfree_metrics if metric in instrument_df.columns.tolist()]:
+            digest = create_digest(instrument_df[metric].tolist(), baseline['Compression'])
+            digests[metric] = merge_digests([digests[metric], digest], baseline['Compression']) if metric in digests else digest
+
+    return baseline
+
+def get_file_instrument(mzml_path, instrument=False):
+    """
+    Gets the instrument a mzML file was acquired on, as used for the baseline.
+
+    Args:
+    mzml_path (str): Path to the mzML file.
+    instrument (str): [Optional] Instrument name given for the run, used instead of the mzML instrument if set.
+
+    Returns:
+    str: Instrument name, or "Unknown" if not given and not present in the mzML file.
+    """
+
+    if instrument:
+        return instrument
+
+    return get_mzml_run_info(mzml_path)[0] or "Unknown"
+
+def get_baseline_range(baseline, instrument, metric, iqr_sensitivity):
+    """
+    Calculates the outlier detection range of a metric from the baseline quartiles.
+
+    Args:
+    baseline (dict): Baseline (see new_baseline).
+    instrument (str): Instrument name.
+    metric (str): ID-free metric.
+    iqr_sensitivity (float): Sensitivity value for determining IQR decision range for outlier detection.
+
+    Returns:
+    tuple: (lower, upper) range, or False if the baseline has fewer than min_baseline_samples values of the metric for the instrument.
+    """
+
+    digest = baseline['Instruments'].get(instrument, {}).get(metric)
+    if not digest or digest['Count'] < min_baseline_samples:
+        return False
+
+    q1, q3 = digest_quantile(digest, [0.25, 0.75])
+    IQR = q3 - q1
+
+    return (float(q1 - (iqr_sensitivity * IQR)), float(q3 + (iqr_sensitivity * IQR)))
+
+def get_baseline_ranges(baseline, instruments, iqr_sensitivity):
+    """
+    Calculates the baseline outlier detection ranges of the ID-free metrics for the instruments of a run.
+
+    Args:
+    baseline (dict): Baseline (see new_baseline).
+    instruments (dict): Instrument of each filename.
+    iqr_sensitivity (float): Sensitivity value for determining IQR decision range for outlier detection.
+
+    Returns:
+    dict: Ranges by metric and instrument. Metrics the baseline does not cover for every instrument of the run are left out,
+          their outliers are detected within the batch.
+    """
+
+    baseline_ranges = {}
+
+    for metric in idfree_metrics:
+        metric_ranges = {instrument: get_baseline_range(baseline, instrument, metric, iqr_sensitivity) for instrument in set(instruments.values())}
+        missing = sorted([instrument for instrument, metric_range in metric_ranges.items() if not metric_range])
+        if missing:
+            logging.warning(f"WARNING: The baseline has fewer than {min_baseline_samples} samples of {metric} for {', '.join(missing)}, outliers will be detected within the batch")
+        else:
+            baseline_ranges[metric] = metric_ranges
+
+    return baseline_ranges
+
+def update_baseline(idfree_results, baseline_file, out_dir, reportname, mzml_dir, instrument=False):
+    """
+    Adds the samples of a run that passed all ID-free QC checks to a baseline file, creating it if needed.
+
+    Args:
+    idfree_results (tuple): Samplewise QC metrics, groupwise QC metrics and report parameters of the ID-free metrics.
+    baseline_file (str): Path to the baseline file.
+    out_dir (str): Output directory of the run.
+    reportname (str): Report name of the run.
+    mzml_dir (str): mzML directory of the run.
+    instrument (str): [Optional] Instrument name given for the run, used instead of the mzML instrument if set.
+
+    Returns:
+    int: Number of samples added to the baseline.
+
+    Note:
+    Metric values are read from the ID-Free Metrics Summary of the ID-Free Excel report. Runs updating the same baseline
+    wait for each other through a {baseline_file}.lock file.
+    """
+
+    sample_df = idfree_results[0]
+    status_cols = [col for col in sample_df.columns.tolist() if col not in ['Filename', 'Group']]
+    passed = sample_df[(sample_df[status_cols] == 'PASS').all(axis=1)]['Filename'].tolist()
+
+    metrics_df = pd.read_excel(f"{out_dir}/{reportname}_ID-Free_QC_Report.xlsx", sheet_name="ID-Free Metrics Summary")
+    metrics_df = metrics_df[metrics_df['Filename'].isin(passed)]
+    instruments = {filename: get_file_instrument(f"{mzml_dir}/{filename}", instrument) for filename in metrics_df['Filename'].tolist()}
+
+    lock_file = f"{baseline_file}.lock"
+    lock_start = time.time()
+    while True:
+        try:
+            os.close(os.open(lock_file, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+            break
+        except FileExistsError:
+            if time.time() - lock_start > baseline_lock_timeout:
+                logging.warning(f"WARNING: {lock_file} was not released after {baseline_lock_timeout} seconds, updating the baseline anyway")
+                break
+            time.sleep(0.1)
+
+    try:
+        baseline = load_baseline(baseline_file) if os.path.exists(baseline_file) else new_baseline()
+        save_baseline(add_samples_to_baseline(baseline, metrics_df, instruments), baseline_file)
+    finally:
+        if os.path.exists(lock_file):
+            os.remove(lock_file)
+
+    logging.info(f"{len(metrics_df)} out of {len(sample_df)} samples passing all ID-free QC checks were added to the baseline {baseline_file}")
+
+    return len(metrics_df)
+
+def score_mzml_file(mzml_path, baseline, instrument=False, iqr_sensitivity=1.5):
+    """
+    Scores the ID-free metrics of one mzML file against a baseline, without waiting for the rest of the batch.
+
+    Args:
+    mzml_path (str): Path to the mzML file.
+    baseline (dict): Baseline (see new_baseline).
+    instrument (str): [Optional] Instrument name, by default read from the mzML file.
+    iqr_sensitivity (float): [Optional] Sensitivity value for determining IQR decision range for outlier detection.
+
+    Returns:
+    DataFrame: One row per ID-free metric with the Filename, Instrument, Metric, Value, Baseline Samples, Lower Range,
+               Upper Range, Baseline Percentile and QC Status (PASS, FAIL, or No Baseline if the baseline does not cover the metric).
+    """
+
+    file_instrument = get_file_instrument(mzml_path, instrument)
+    metrics = mzml_extract(mzml_path, [])[0]
+
+    rows = []
+    for metric in [metric for metric in idfree_metrics if metric in metrics]:
+        value = float(metrics[metric])
+        digest = baseline['Instruments'].get(file_instrument, {}).get(metric)
+        metric_range = get_baseline_range(baseline, file_instrument, metric, iqr_sensitivity)
+
+        if metric_range:
+            status = 'PASS' if metric_range[0] <= value <= metric_range[1] else 'FAIL'
+        else:
+            status = 'No Baseline'
+
+        rows.append({'Filename': metrics['Filename'], 'Instrument': file_instrument, 'Metric': metric, 'Value': value,
+                     'Baseline Samples': digest['Count'] if digest else 0,
+                     'Lower Range': metric_range[0] if metric_range else np.nan, 'Upper Range': metric_range[1] if metric_range else np.nan,
+                     'Baseline Percentile': round(digest_percentile(digest, value), 2) if digest and digest['Count'] else np.nan,
+                     'QC Status': status})
+
+    return pd.DataFrame(rows)
+
+def score_mzml_files(mzml_files, baseline_file, out_dir, reportname, instrument=False, iqr_sensitivity=1.5):
+    """
+    Scores mzML files against a baseline one at a time, printing and saving the result of each file as soon as it is scored.
+
+    Args:
+    mzml_files (list): Paths to mzML files.
+    baseline_file (str): Path to the baseline file.
+    out_dir (str): Output directory.
+    reportname (str): Report name, the scores are saved to {reportname}_Baseline_Scores.txt.
+    instrument (str): [Optional] Instrument name, by default read from each mzML file.
+    iqr_sensitivity (float): [Optional] Sensitivity value for determining IQR decision range for outlier detection.
+
+    Returns:
+    DataFrame: Scores of all files (see score_mzml_file).
+    """
+
+    baseline = load_baseline(baseline_file)
+    scores_file = f"{out_dir}/{reportname}_Baseline_Scores.txt"
+    scores = []
+
+    for number, mzml_path in enumerate(mzml_files):
+        file_scores = score_mzml_file(mzml_path, baseline, instrument, iqr_sensitivity)
+        file_scores.to_csv(scores_file, sep="\t", index=False, mode='w' if number == 0 else 'a', header=number == 0)
+        scores.append(file_scores)
+
+        failed = file_scores[file_scores['QC Status'] == 'FAIL']['Metric'].tolist()
+        verdict = f"FAIL ({', '.join(failed)})" if failed else ('PASS' if (file_scores['QC Status'] == 'PASS').any() else 'No Baseline')
+        print(f"{os.path.basename(mzml_path)}: {verdict}")
+        logging.info(f"Baseline score of {mzml_path}: {verdict}")
+
+    return pd.concat(scores, ignore_index=True)
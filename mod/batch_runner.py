@@ -0,0 +1,239 @@
+"""
+Batch mode - runs the QC projects of a manifest in one warm process or a small worker pool and summarises their status
+"""
+
+import pandas as pd
+import os
+import sys
+import json
+import time
+import logging
+from concurrent.futures import ProcessPoolExecutor
+
+#-------------------------------------------------------------------------- VARIABLES --------------------------------------------------------------------------
+
+#manifest formats by file extension
+manifest_formats = {'.json': 'json', '.yaml': 'yaml', '.yml': 'yaml', '.toml': 'toml'}
+
+#-------------------------------------------------------------------------- FUNCTIONS ---------------------------------------------------------------------------
+
+def read_manifest(manifest_file):
+    """
+    Reads a batch manifest.
+
+    Args:
+    manifest_file (str): Path to a JSON, YAML or TOML manifest with a 'projects' list and optional 'defaults'.
+
+    Returns:
+    dict: Manifest contents.
+
+    Raises:
+    SystemExit: If the manifest cannot be read or has no projects.
+
+    Note:
+    Reading YAML manifests requires PyYAML.
+    """
+
+    extension = os.path.splitext(manifest_file)[1].lower()
+
+    if not os.path.exists(manifest_file):
+        print(f"ERROR: Batch manifest {manifest_file} does not exist")
+        logging.error(f"ERROR: Batch manifest {manifest_file} does not exist")
+        sys.exit(1)
+
+    if extension not in manifest_formats:
+        print(f"ERROR: Batch manifest should be a {', '.join(manifest_formats)} file")
+        logging.error(f"ERROR: Batch manifest should be a {', '.join(manifest_formats)} file")
+        sys.exit(1)
+
+    manifest_format = manifest_formats[extension]
+
+    try:
+        if manifest_format == 'json':
+            with open(manifest_file, encoding='utf-8') as f:
+                manifest = json.load(f)
+        elif manifest_format == 'yaml':
+            import yaml
+            with open(manifest_file, encoding='utf-8') as f:
+                manifest = yaml.safe_load(f)
+        else:
+            import tomllib
+            with open(manifest_file, 'rb') as f:
+                manifest = tomllib.load(f)
+    except ImportError as e:
+        print(f"ERROR: Reading {manifest_format.upper()} manifests requires the {e.name} package")
+        logging.error(f"ERROR: Reading {manifest_format.upper()} manifests requires the {e.name} package")
+        sys.exit(1)
+    except ValueError as e:
+        print(f"ERROR: Batch manifest {manifest_file} could not be read: {e}")
+        logging.error(f"ERROR: Batch manifest {manifest_file} could not be read: {e}")
+        sys.exit(1)
+
+    if not isinstance(manifest, dict) or not isinstance(manifest.get('projects'), list) or not manifest['projects']:
+        print(f"ERROR: Batch manifest {manifest_file} should contain a list of projects")
+        logging.error(f"ERROR: Batch manifest {manifest_file} should contain a list of projects")
+        sys.exit(1)
+
+    return manifest
+
+def get_batch_projects(manifest, defaults):
+    """
+    Builds the run_qc configuration of each project of a manifest.
+
+    Args:
+    manifest (dict): Manifest from read_manifest.
+    defaults (dict): Options applied to all projects, e.g. the command line options of the batch run.
+
+    Returns:
+    list: run_qc configurations, in manifest order.
+
+    Raises:
+    SystemExit: If a project has no report name or report names are repeated.
+
+    Note:
+    Options of a project override the manifest 'defaults', which override the given defaults.
+    """
+
+    projects = []
+
+    for project in manifest['projects']:
+        if not isinstance(project, dict) or not project.get('reportname'):
+            print("ERROR: Each project of the batch manifest should have a reportname")
+            logging.error("ERROR: Each project of the batch manifest should have a reportname")
+            sys.exit(1)
+
+        config = dict(defaults)
+        config.update(manifest.get('defaults', {}))
+        config.update(project)
+        projects.append(config)
+
+    reportnames = [(config['outdirectory'], config['reportname']) for config in projects]
+    if len(set(reportnames)) != len(reportnames):
+        print("ERROR: Projects of the batch manifest writing to the same output directory should have different reportnames")
+        logging.error("ERROR: Projects of the batch manifest writing to the same output directory should have different reportnames")
+        sys.exit(1)
+
+    return projects
+
+def warm_imports():
+    """
+    Imports the metric, figure and report dependencies once, so the projects of a batch do not pay for them again.
+
+    Args:
+    None
+
+    Returns:
+    None
+    """
+
+    import mod.mzml_extract
+    import mod.idbased_metrics
+    import plotly.express
+    import plotly.io
+    import sklearn.decomposition
+    import jinja2
+
+    return None
+
+def run_project(run_qc, config, log_dir=""):
+    """
+    Runs one project of a batch and records its status, also logging it to {reportname}_QCeltis.log.
+
+    Args:
+    run_qc (function): QC run function (main.run_qc).
+    config (dict): run_qc configuration of the project.
+    log_dir (str): [Optional] Directory of the project log, by default the working directory.
+
+    Returns:
+    dict: Project status with the keys 'Project', 'Output Directory', 'Status' (Completed or Failed), 'Samples', 'Failed Samples',
+          'Groups', 'Failed Groups', 'Runtime (s)' and 'Error'.
+    """
+
+    start_time = time.time()
+
+    status = {'Project': config['reportname'], 'Output Directory': config['outdirectory'], 'Status': 'Failed',
+              'Samples': 0, 'Failed Samples': 0, 'Groups': 0, 'Failed Groups': 0, 'Runtime (s)': 0, 'Error': ""}
+
+    log_file = os.path.join(log_dir, f"{config['reportname']}_QCeltis.log")
+    log_handler = logging.FileHandler(log_file)
+    root_logger = logging.getLogger()
+    root_logger.addHandler(log_handler)
+    if root_logger.level > logging.INFO:
+        root_logger.setLevel(logging.INFO)
+
+    try:
+        sample_df, grouped_df, _ = run_qc(config)
+        status['Status'] = 'Completed'
+    except SystemExit:
+        status['Error'] = f"Invalid inputs, see {log_file}"
+    except Exception as e:
+        logging.exception(f"Project {config['reportname']} failed")
+        status['Error'] = f"{type(e).__name__}: {e}"
+    finally:
+        root_logger.removeHandler(log_handler)
+        log_handler.close()
+
+    if status['Status'] == 'Completed':
+        if isinstance(sample_df, pd.DataFrame):
+            status_cols = [col for col in sample_df.columns.tolist() if col not in ['Filename','Group']]
+            status['Samples'] = len(sample_df)
+            status['Failed Samples'] = int((sample_df[status_cols] == 'FAIL').any(axis=1).sum())
+        if isinstance(grouped_df, pd.DataFrame):
+            status['Groups'] = len(grouped_df)
+            status['Failed Groups'] = int((grouped_df['Overall QC Status'] == 'FAIL').sum())
+
+    status['Runtime (s)'] = round(time.time() - start_time, 2)
+
+    return status
+
+def run_batch(run_qc, projects, batch_workers=1):
+    """
+    Runs the projects of a batch, in this process or in a pool of worker processes.
+
+    Args:
+    run_qc (function): QC run function (main.run_qc).
+    projects (list): run_qc configurations from get_batch_projects.
+    batch_workers (int): [Optional] Number of projects run at the same time.
+
+    Returns:
+    list: Project statuses from run_project, in manifest order.
+
+    Note:
+    Dependencies are imported once per process and grouping files are read once per process, cached intensity files
+    are shared through the cache directory of the projects.
+    """
+
+    if batch_workers > 1:
+        with ProcessPoolExecutor(max_workers=batch_workers, initializer=warm_imports) as executor:
+            futures = [executor.submit(run_project, run_qc, config) for config in projects]
+            statuses = [future.result() for future in futures]
+    else:
+        warm_imports()
+        statuses = [run_project(run_qc, config) for config in projects]
+
+    for status in statuses:
+        logging.info(f"Project {status['Project']}: {status['Status']} in {status['Runtime (s)']} seconds {status['Error']}")
+
+    return statuses
+
+def save_batch_summary(statuses, out_dir, reportname):
+    """
+    Saves the status summary of a batch as JSON and tab-delimited text.
+
+    Args:
+    statuses (list): Project statuses from run_batch.
+    out_dir (str): Output directory.
+    reportname (str): Name of the batch run.
+
+    Returns:
+    str: Path to the JSON summary.
+    """
+
+    summary_file = f"{out_dir}/{reportname}_Batch_Summary.json"
+
+    with open(summary_file, 'w', encoding='utf-8') as f:
+        json.dump(statuses, f, indent=2)
+
+    pd.DataFrame(statuses).to_csv(f"{out_dir}/{reportname}_Batch_Summary.txt", sep="\t", index=False)
+
+    return summary_file
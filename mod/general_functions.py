@@ -21,6 +21,9 @@ color_list = [
     "#e7969c", "#fddbc7", "#c7eae5", "#9edae5", "#fdae6b", "#fdd0a2", "#636363", "#989898", "#bdbdbd", "#f7f7f7"
 ]
 
+#grouping files read in this process, keyed by path, size and modification time - shared by the projects of a batch
+grouping_file_cache = {}
+
 #-------------------------------------------------------------------------- FUNCTIONS ---------------------------------------------------------------------------
 
 # This function checks if a given file path exists in the file system.
@@ -65,7 +68,8 @@ def check_file(txtfile, level):
         logging.error(f"The {txtfile} is not tab delimited, Please check the input")
         sys.exit(1)
 
-    df = pd.read_csv(txtfile, sep="\t")
+    #only the header is needed to check the columns
+    df = pd.read_csv(txtfile, sep="\t", nrows=0)
 
     if level == "Protein":
         if "Protein" not in df.columns.tolist():
@@ -149,10 +153,10 @@ def check_grouping_file(txtfile, grouping_file):
         logging.error(f"The {grouping_file} is not tab delimited, Please check the input")
         sys.exit(1)
 
-    df = pd.read_csv(txtfile, sep="\t")
+    df = pd.read_csv(txtfile, sep="\t", nrows=0)
 
     #add error check for group df
-    group_df = pd.read_csv(grouping_file, sep="\t")
+    group_df = read_grouping_file(grouping_file)
 
     if not all(ele in group_df.columns.tolist() for ele in ['Filename','Group']):
         print(f"'Filename' or 'Group' column not present in {grouping_file}")
@@ -225,14 +229,14 @@ def check_samples(mzml_dir, protein_level, peptide_level, precursor_level, group
 
     #getting filenames from protein file
     if protein_level:
-        pt_level = pd.read_csv(protein_level, sep="\t")
+        pt_level = pd.read_csv(protein_level, sep="\t", nrows=0)
         pt_filenames = pt_level.columns.tolist()
         pt_filenames.remove('Protein')
         filename_lists.append(pt_filenames)
 
     #getting filenames from peptide file
     if peptide_level:
-        pep_level = pd.read_csv(peptide_level, sep="\t")
+        pep_level = pd.read_csv(peptide_level, sep="\t", nrows=0)
         pep_filenames = pep_level.columns.tolist()
         pep_filenames.remove('Protein')
         pep_filenames.remove('Peptide')
@@ -240,7 +244,7 @@ def check_samples(mzml_dir, protein_level, peptide_level, precursor_level, group
 
     #getting filenames from precursor file
     if precursor_level:
-        pre_level = pd.read_csv(precursor_level, sep="\t")
+        pre_level = pd.read_csv(precursor_level, sep="\t", nrows=0)
         pre_filenames = pre_level.columns.tolist()
         pre_filenames.remove('Protein')
         pre_filenames.remove('Peptide')
@@ -249,7 +253,7 @@ def check_samples(mzml_dir, protein_level, peptide_level, precursor_level, group
 
     #getting filenames from grouping file
     if grouping_file:
-        groupdf = pd.read_csv(grouping_file, sep="\t")
+        groupdf = read_grouping_file(grouping_file)
         group_filenames = groupdf['Filename'].tolist()
         filename_lists.append(group_filenames)
 
@@ -264,6 +268,25 @@ def check_samples(mzml_dir, protein_level, peptide_level, precursor_level, group
 
     return None
 
+def read_grouping_file(grouping_file):
+    """
+    Reads the grouping file, once per process as long as the file is unchanged.
+
+    Args:
+    grouping_file (str): Path to the grouping file.
+
+    Returns:
+    DataFrame: Copy of the grouping file contents.
+    """
+
+    stat = os.stat(grouping_file)
+    key = (os.path.abspath(grouping_file), stat.st_size, stat.st_mtime_ns)
+
+    if key not in grouping_file_cache:
+        grouping_file_cache[key] = pd.read_csv(grouping_file, sep="\t")
+
+    return grouping_file_cache[key].copy()
+
 def get_grouping_dict(grouping_file):
     """
     Creates a dictionary mapping groups to their corresponding filenames.
@@ -275,7 +298,7 @@ def get_grouping_dict(grouping_file):
     dict: A dictionary where keys are group names and values are lists of filenames belonging to each group.
     """
 
-    df = pd.read_csv(grouping_file, sep="\t")
+    df = read_grouping_file(grouping_file)
 
     groups = list(set(df['Group'].tolist()))
 
@@ -290,39 +313,6 @@ def get_grouping_dict(grouping_file):
 
 cv = lambda x: np.std(x, ddof=1) / np.mean(x) * 100
 
-def cv_status(row, thres):
-    """
-    Determines the pass/fail status based on the coefficient of variation.
-
-    Args:
-    row (float): The calculated CV value.
-    thres (float): Threshold for the CV.
-
-    Returns:
-    str: "PASS" if CV is below the threshold, otherwise "FAIL".
-    """
-
-    if row > thres:
-        return "FAIL"
-    else:
-        return "PASS"
-
-def check_threshold(row, threshold):
-    """
-    Evaluates if a given value meets a specified threshold.
-
-    Args:
-    row (float): The value to be checked.
-    threshold (float): The threshold to compare against.
-
-    Returns:
-    str: "FAIL" if the value is below the threshold, otherwise "PASS".
-    """
-    if threshold > float(row):
-        return "FAIL"
-    else:
-        return "PASS"
-
 def groupname(filename, groups):
     """
     Finds the group name for a given filename.
@@ -338,21 +328,29 @@ def groupname(filename, groups):
         if filename in groups[group]:
             return group
 
-def quant_status(number, threshold):
+def get_group_codes(filenames, groups):
     """
-    Determines if a numeric value meets a specified quantitative threshold.
+    Maps each filename to the code of its group - the first group listing it, as with groupname.
 
     Args:
-    number (float): The numeric value to be checked.
-    threshold (float): The threshold to compare against.
+    filenames (list): List of filenames.
+    groups (dict): Dictionary mapping groups to filenames.
 
     Returns:
-    str: "PASS" if the number is equal to or greater than the threshold, otherwise "FAIL".
+    tuple: Array with the group code of each filename (-1 if the file is not in a group) and the list of group names in code order, sorted by name.
     """
-    if number >= threshold:
-        return "PASS"
-    else:
-        return "FAIL"
+
+    group_names = sorted(groups)
+    name_codes = {group: code for code, group in enumerate(group_names)}
+
+    file_codes = {}
+    for group in groups:
+        for filename in groups[group]:
+            file_codes.setdefault(filename, name_codes[group])
+
+    group_codes = np.array([file_codes.get(filename, -1) for filename in filenames], dtype=np.int64)
+
+    return (group_codes, group_names)
 
 def transpose_DF(input_DF):
     """
@@ -369,111 +367,6 @@ def transpose_DF(input_DF):
     input_DF_T.reset_index(inplace=True)
     return (input_DF_T)
 
-def perc_qc(row, perc_thres):
-    """
-    Evaluates if a percentage value meets a specific threshold.
-
-    Args:
-    row (float): The percentage value to be evaluated.
-    perc_thres (float): The threshold percentage.
-
-    Returns:
-    str: "FAIL" if the value is below the threshold, otherwise "PASS".
-    """
-    if float(row) < perc_thres:
-        return "FAIL"
-    else:
-        return "PASS"
-
-def label_outlier(value, outliers):
-    """
-    Labels a value as an outlier.
-
-    Args:
-    value: The value to be checked.
-    outliers (list): A list of outlier values.
-
-    Returns:
-    int: 1 if the value is an outlier, otherwise 0.
-    """
-    if value in outliers:
-        return 1
-    else:
-        return 0
-
-def get_outlier_and_cv_status(series):
-    """
-    Determines the status based on outlier and CV threshold values.
-
-    Args:
-    series (iterable): Contains the outlier flag and CV status.
-
-    Returns:
-    str: "FAIL" if any condition fails, otherwise "PASS".
-    """
-    outlier = series[0]
-    threshold = series[1]
-
-    if outlier == 1:
-        return "FAIL"
-    elif threshold == "FAIL":
-        return "FAIL"
-    else:
-        return "PASS"
-
-def only_outlier_status(outlier_value):
-    """
-    Determines if a value is an outlier.
-
-    Args:
-    outlier_value (int): The outlier flag value.
-
-    Returns:
-    str: "FAIL" if the value is an outlier, otherwise "PASS".
-    """
-    if outlier_value == 1:
-        return "FAIL"
-    else:
-        return "PASS"
-
-def get_series_status(series):
-    """
-    Determines the overall status from a series of pass/fail conditions.
-
-    Args:
-    series (iterable): Contains multiple status values.
-
-    Returns:
-    str: "FAIL" if any status is "FAIL", otherwise "PASS".
-    """
-    if series[0] == "FAIL":
-        return "FAIL"
-    elif series[1] == "FAIL":
-        return "FAIL"
-    else:
-        return "PASS"
-
-def get_overall_qc_status(series, cols_len):
-    """
-    Computes the overall QC status based on multiple metrics.
-
-    Args:
-    series (iterable): Series of individual status values.
-    cols_len (int): Total number of metrics.
-
-    Returns:
-    pd.Series: A series containing the overall status and the failure count.
-    """
-    status_list = []
-    for i in range(cols_len):
-        status_list.append(series[i])
-
-    if list(set(status_list)) == ['PASS']:
-        return pd.Series(['PASS',f'0 out of {cols_len} metrics'])
-    else:
-        failed = status_list.count('FAIL')
-        return pd.Series(['FAIL',f'{failed} out of {cols_len} metrics'])
-
 #adding a function to help check the range of the input values
 def int_range(min_value, max_value):
     """
@@ -493,6 +386,24 @@ def int_range(min_value, max_value):
         return ivalue
     return _type_checker
 
+#adding a function to help check the level rollup method
+def rollup_method(value):
+    """
+    Type checker for argparse that validates the method used to derive peptide and protein levels from precursors.
+
+    Args:
+    value (str): The rollup method given by the user - 'sum', 'max' or 'topN' (e.g. 'top3').
+
+    Returns:
+    str: The validated rollup method in lowercase.
+    """
+    method = str(value).lower()
+    if method in ['sum', 'max']:
+        return method
+    if method.startswith('top') and method[3:].isdigit() and int(method[3:]) > 0:
+        return method
+    raise argparse.ArgumentTypeError("Rollup method must be one of: sum, max or topN (e.g. top3)")
+
 #adding a function to help check if the file is tab delimited or not.
 def is_tab_delimited(filename):
     """
@@ -5,22 +5,26 @@ import pandas as pd
 import sys
 import os
 import numpy as np
-import pymzml
 import statistics
 import pandas as pd
 import os
 import re
+import json
+import hashlib
 import threading
 import logging
-import xlsxwriter
 import collections
 from collections import defaultdict
-import plotly
-import plotly.express as px
-from sklearn.preprocessing import StandardScaler
-from sklearn.decomposition import PCA
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
 
-from mod.general_functions import cv, groupname, quant_status, check_threshold, transpose_DF, perc_qc, cv_status, color_list
+from mod.general_functions import cv, groupname, get_group_codes, transpose_DF, color_list
+from mod.qc_status import check_status, get_group_status, get_group_values
+from mod.pca_analysis import get_pca_options, level_pca, streamed_level_pca
+from mod.intensity_matrix import build_intensity_matrix, subset_intensity_matrix, sample_counts, feature_completeness, common_feature_sums, share_array, attach_array
+from mod.report_figures import figure_spec, update_figure, scale_figure_spec, large_cohort_samples
+from mod.metrics_bundle import save_bundle_part, load_bundle_part
+from mod.report_tuning import get_level_tuning
 
 enzyme_info =  {'asp-n':{'terminus' : 'N' , 'cleave' : ['D'], 'exceptions' : []},
                 'lys-c' : {'terminus' : 'C' , 'cleave' : ['K'], 'exceptions' : ['KP']},
@@ -39,6 +43,16 @@ enzyme_info =  {'asp-n':{'terminus' : 'N' , 'cleave' : ['D'], 'exceptions' : []}
 
 combined_pat = r'|'.join(('\[.*?\]', '\(.*?\)','\{.*?\}'))
 
+#iRT kit
+irt_peptides = ["LGGNEQVTR","GAGSSEPVTGLDAK","VEATFGVDESNAK","YILAGVENSK","TPVISGGPYEYR","TPVITGAPYEYR","DGLDAASYYAPVR","ADVTPADFSEWSK","GTFIIDPGGVIR","GTFIIDPAAVIR","LFLQFGAQGSPFLK"]
+irt_precursors = ["LGGNEQVTR2","GAGSSEPVTGLDAK2","VEATFGVDESNAK2","YILAGVENSK2","TPVISGGPYEYR2","TPVITGAPYEYR2","DGLDAASYYAPVR2","ADVTPADFSEWSK2","GTFIIDPGGVIR2","GTFIIDPAAVIR2","LFLQFGAQGSPFLK2"]
+
+digestion_labels = ["No end cleavage site found","0 missed cleavage","1 missed cleavage","2 missed cleavage",
+                    "3 missed cleavage","4 missed cleavage",">=5 missed cleavage"]
+
+#missed cleavage scores of peptides seen so far, for each enzyme - {enzyme: Series(score, index=peptide)}
+miscleavage_cache = {}
+
 #------------------------------------------------------------------------- FUNCTIONS ---------------------------------------------------------------------------------
 ''' Calculate miscleavages for a peptide sequence, based on enzyme selected by user. Considerations to exclude exceptions to the cleavage sites are made. If no end cleavage site found, add 1000 to the original MC_score as punishment'''
 
@@ -101,13 +115,334 @@ def calc_miscleavage(each_peptide, enzyme):
 
     return(cleavage_score)
 
-def get_quant(df, filenames, threshold, level, groupwise_comparison, groups):
+def score_peptides(peptides, enzyme):
+    """
+    Calculates the miscleavage scores of many peptide sequences at once, giving the same scores as calc_miscleavage.
+
+    Args:
+    peptides (list): Unique peptide sequences to be analyzed.
+    enzyme (str): The enzyme used for determining the miscleavage sites.
+
+    Returns:
+    Series: Miscleavage score of each peptide, indexed by the peptide sequence.
+
+    Note:
+    Cleavage sites and exceptions are counted with regular expressions over all sequences, exceptions are matched with a lookahead so overlapping pairs are counted.
+    """
+
+    info = enzyme_info[enzyme.lower()]
+    cleave_site = "[" + "".join(info['cleave']) + "]"
+
+    sequences = pd.Series(peptides, index=peptides, dtype=str).str.replace(combined_pat, '', regex=True)
+
+    sites = sequences.str.count(cleave_site)
+
+    #exceptions are only checked at cleavage sites - first residue of the pair for C terminus, second for N terminus
+    site_position = 0 if info['terminus'] == "C" else 1
+    exceptions = [exception for exception in info['exceptions'] if exception[site_position] in info['cleave']]
+    if exceptions:
+        excepted_sites = sequences.str.count("(?=" + "|".join(exceptions) + ")")
+    else:
+        excepted_sites = 0
+
+    end_residue = sequences.str[-1] if info['terminus'] == "C" else sequences.str[0]
+    end_cleaved = end_residue.isin(info['cleave'])
+
+    scores = sites - excepted_sites + np.where(end_cleaved, -1, 1000)
+    scores[sites == 0] = 1000
+
+    return scores.astype(int)
+
+def get_miscleavage_scores(peptides, enzyme, cache_dir=False):
+    """
+    Gets the miscleavage scores of peptide sequences, scoring only the peptides that have not been seen before with the enzyme.
+
+    Args:
+    peptides (list): Unique peptide sequences to be analyzed.
+    enzyme (str): The enzyme used for determining the miscleavage sites.
+    cache_dir (str): [Optional] Directory where the scores of each enzyme are saved and reused across runs.
+
+    Returns:
+    Series: Miscleavage score of each peptide, indexed by the peptide sequence.
+    """
+
+    enzyme = enzyme.lower()
+
+    if enzyme not in miscleavage_cache:
+        cache_file = f"{cache_dir}/miscleavage_scores_{enzyme}.tsv" if cache_dir else ""
+        if cache_file and os.path.exists(cache_file):
+            cached = pd.read_csv(cache_file, sep="\t", keep_default_na=False)
+            miscleavage_cache[enzyme] = pd.Series(cached['Score'].values, index=cached['Peptide'].values)
+            logging.info(f"Loaded {len(cached)} miscleavage scores from {cache_file}")
+        else:
+            miscleavage_cache[enzyme] = pd.Series(dtype=int)
+
+    cached_scores = miscleavage_cache[enzyme]
+    new_peptides = pd.Index(peptides).difference(cached_scores.index)
+
+    if len(new_peptides) > 0:
+        cached_scores = pd.concat([cached_scores, score_peptides(new_peptides.tolist(), enzyme)])
+        miscleavage_cache[enzyme] = cached_scores
+
+        if cache_dir:
+            #written to a temporary file first, so other processes sharing the cache never read a partial file
+            cache_file = f"{cache_dir}/miscleavage_scores_{enzyme}.tsv"
+            cached_scores.rename_axis('Peptide').reset_index(name='Score').to_csv(f"{cache_file}.{os.getpid()}.tmp", sep="\t", index=False)
+            os.replace(f"{cache_file}.{os.getpid()}.tmp", cache_file)
+
+    return cached_scores.reindex(peptides)
+
+def read_level_file(level_file, cache_dir=False):
+    """
+    Reads a protein, peptide or precursor level intensity file, treating 0 intensities as missing values.
+
+    Args:
+    level_file (str): Path to the tab delimited intensity file.
+    cache_dir (str): [Optional] Directory where parsed intensity files are cached as binary matrices for later runs.
+
+    Returns:
+    DataFrame: The intensity DataFrame with 0 intensities replaced by NaN.
+    """
+
+    if cache_dir:
+        df_level = load_cached_level(level_file, cache_dir)
+        if df_level is not None:
+            return df_level
+
+    df_level = pd.read_csv(level_file, sep="\t")
+    df_level = df_level[df_level.columns.tolist()].replace({'0':np.nan, 0:np.nan})
+
+    if cache_dir:
+        save_cached_level(df_level, level_file, cache_dir)
+
+    return df_level
+
+def get_file_hash(path):
+    """
+    Calculates the SHA-1 hash of a file's contents, reading it in blocks.
+
+    Args:
+    path (str): Path to the file.
+
+    Returns:
+    str: Hex digest of the file contents.
+    """
+
+    file_hash = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            file_hash.update(block)
+
+    return file_hash.hexdigest()
+
+def get_level_cache_paths(level_file, cache_dir):
+    """
+    Gets the paths of the cached intensity matrix, identifiers and sidecar of an intensity file.
+
+    Args:
+    level_file (str): Path to the tab delimited intensity file.
+    cache_dir (str): Directory where parsed intensity files are cached.
+
+    Returns:
+    tuple: Paths to the intensity matrix (.npy), the identifier columns (.pkl) and the sidecar (.json).
+    """
+
+    key = hashlib.sha1(os.path.abspath(level_file).encode()).hexdigest()
+    prefix = f"{cache_dir}/level_{key}"
+
+    return (f"{prefix}.npy", f"{prefix}_ids.pkl", f"{prefix}.json")
+
+def load_cached_level(level_file, cache_dir):
+    """
+    Loads an intensity file from its cached binary matrix, if the file has not changed since it was cached.
+
+    Args:
+    level_file (str): Path to the tab delimited intensity file.
+    cache_dir (str): Directory where parsed intensity files are cached.
+
+    Returns:
+    DataFrame: The intensity DataFrame, or None if there is no valid cache for the file.
+
+    Note:
+    The cache is used if the file size and modification time match. If only the modification time changed,
+    the contents hash is compared so a touched or copied file still uses the cache. The intensities of the returned
+    DataFrame stay memory-mapped from the cached matrix until they are modified.
+    """
+
+    values_path, ids_path, sidecar_path = get_level_cache_paths(level_file, cache_dir)
+    if not all(os.path.exists(path) for path in [values_path, ids_path, sidecar_path]):
+        return None
+
+    #the sidecar is removed while another process replaces the cached files
+    try:
+        with open(sidecar_path) as f:
+            sidecar = json.load(f)
+    except (OSError, ValueError):
+        return None
+
+    file_stat = os.stat(level_file)
+    if sidecar['Size'] != file_stat.st_size:
+        logging.info(f"{level_file} has changed since it was cached, reading it again")
+        return None
+
+    if sidecar['Mtime'] != file_stat.st_mtime_ns:
+        if sidecar['Hash'] != get_file_hash(level_file):
+            logging.info(f"{level_file} has changed since it was cached, reading it again")
+            return None
+        sidecar['Mtime'] = file_stat.st_mtime_ns
+        with open(f"{sidecar_path}.{os.getpid()}.tmp", 'w') as f:
+            json.dump(sidecar, f)
+        os.replace(f"{sidecar_path}.{os.getpid()}.tmp", sidecar_path)
+
+    #copy-on-write memory map, the cached matrix is never modified
+    values = np.load(values_path, mmap_mode='c')
+    ids = pd.read_pickle(ids_path)
+
+    #identifier columns are inserted at their positions, so the intensities are not copied out of the memory map
+    df_level = pd.DataFrame(values, columns=sidecar['Samples'], copy=False)
+    for position, col in enumerate(sidecar['Columns']):
+        if col in ids.columns:
+            df_level.insert(position, col, ids[col].to_numpy())
+    logging.info(f"Loaded {level_file} from the cached matrix {values_path}")
+
+    return df_level
+
+def save_cached_level(df_level, level_file, cache_dir):
+    """
+    Caches a parsed intensity file as a binary matrix with a sidecar for the identifiers and sample names.
+
+    Args:
+    df_level (DataFrame): The intensity DataFrame from read_level_file.
+    level_file (str): Path to the tab delimited intensity file.
+    cache_dir (str): Directory where parsed intensity files are cached.
+
+    Returns:
+    None
+    """
+
+    id_cols = [col for col in ['Protein', 'Peptide', 'Precursor'] if col in df_level.columns]
+    filenames = [col for col in df_level.columns if col not in id_cols]
+
+    try:
+        values = df_level[filenames].to_numpy(dtype=np.float64)
+    except (ValueError, TypeError):
+        logging.info(f"{level_file} has non-numeric intensities and will not be cached")
+        return None
+
+    values_path, ids_path, sidecar_path = get_level_cache_paths(level_file, cache_dir)
+    file_stat = os.stat(level_file)
+
+    #the sidecar marks the cached files valid, so it is removed while they are replaced and written last.
+    #each file is written to a temporary file first, so other processes sharing the cache never read a partial file
+    tmp_suffix = f".{os.getpid()}.tmp"
+    if os.path.exists(sidecar_path):
+        os.remove(sidecar_path)
+
+    with open(values_path + tmp_suffix, 'wb') as f:
+        np.save(f, values)
+    os.replace(values_path + tmp_suffix, values_path)
+
+    #pickled so the identifiers keep the dtypes and missing values of the parsed file
+    df_level[id_cols].reset_index(drop=True).to_pickle(ids_path + tmp_suffix)
+    os.replace(ids_path + tmp_suffix, ids_path)
+
+    sidecar = {'Source': os.path.abspath(level_file),
+               'Size': file_stat.st_size,
+               'Mtime': file_stat.st_mtime_ns,
+               'Hash': get_file_hash(level_file),
+               'Columns': df_level.columns.tolist(),
+               'Samples': filenames}
+    with open(sidecar_path + tmp_suffix, 'w') as f:
+        json.dump(sidecar, f)
+    os.replace(sidecar_path + tmp_suffix, sidecar_path)
+
+    logging.info(f"Cached {level_file} as {values_path}")
+
+    return None
+
+def rollup_level(df_level, id_cols, filenames, method):
+    """
+    Aggregates intensities of rows sharing the same identifiers into a single row for each identifier.
+
+    Args:
+    df_level (DataFrame): DataFrame containing the intensities to be aggregated.
+    id_cols (list): Identifier columns defining the aggregated level (e.g. ['Protein', 'Peptide']).
+    filenames (list): List of sample columns to aggregate.
+    method (str): Rollup method - 'sum', 'max' or 'topN' (mean of the N most intense rows in each sample).
+
+    Returns:
+    DataFrame: The aggregated DataFrame with the identifier columns followed by the sample columns.
+
+    Note:
+    The reductions are vectorized over all samples at once. Missing values are ignored and an identifier
+    with no intensity in a sample stays missing in that sample.
+    """
+
+    grouped = df_level.groupby(id_cols, sort=True)[filenames]
+
+    if method == "sum":
+        rolled_level = grouped.sum(min_count=1)
+    elif method == "max":
+        rolled_level = grouped.max()
+    else:
+        top_n = int(method[3:])
+        ranks = grouped.rank(ascending=False, method='first')
+        top_intensities = df_level[filenames].where(ranks <= top_n)
+        rolled_level = top_intensities.groupby([df_level[col] for col in id_cols], sort=True).mean()
+
+    rolled_level = rolled_level.reset_index()
+
+    return rolled_level
+
+def derive_levels(pre_level, filenames, method):
+    """
+    Derives peptide and protein level intensities from a precursor level DataFrame.
+
+    Args:
+    pre_level (DataFrame): Precursor level DataFrame with 'Protein', 'Peptide' and 'Precursor' columns.
+    filenames (list): List of sample columns.
+    method (str): Rollup method - 'sum', 'max' or 'topN'.
+
+    Returns:
+    tuple: Peptide level and protein level DataFrames in the same layout as the peptide and protein input files.
+
+    Note:
+    Peptides are derived from their precursors and proteins from the derived peptides, so a topN rollup
+    uses the N most intense peptides of each protein.
+    """
+
+    logging.info(f"Deriving peptide and protein level intensities from precursor intensities using the '{method}' rollup")
+
+    pep_level = rollup_level(pre_level, ['Protein', 'Peptide'], filenames, method)
+    pt_level = rollup_level(pep_level, ['Protein'], filenames, method)
+
+    logging.info(f"{len(pep_level)} peptides and {len(pt_level)} proteins were derived from {len(pre_level)} precursors")
+
+    return (pep_level, pt_level)
+
+def get_quant(level_matrix, threshold, level, groupwise_comparison, groups):
     """
     Generates quantitative data and group status based on a threshold.
 
     Args:
-    df (DataFrame): The DataFrame containing the data.
-    filenames (list): List of filenames to be considered.
+    level_matrix (dict): Intensity matrix of the level, from build_intensity_matrix.
+    threshold (int/float): The threshold for quantitative analysis.
+    level (str): The analysis level (e.g., Protein, Peptide).
+    groupwise_comparison (bool): Flag to perform group-wise comparison.
+    groups (dict): A dictionary mapping groups to filenames.
+
+    Returns:
+    tuple: A tuple containing the quant DataFrame and group status DataFrame.
+    """
+
+    return get_quant_from_counts(sample_counts(level_matrix), threshold, level, groupwise_comparison, groups)
+
+def get_quant_from_counts(counts, threshold, level, groupwise_comparison, groups):
+    """
+    Generates quantitative data and group status from the number of identifications in each sample.
+
+    Args:
+    counts (Series): Number of identified features indexed by filename.
     threshold (int/float): The threshold for quantitative analysis.
     level (str): The analysis level (e.g., Protein, Peptide).
     groupwise_comparison (bool): Flag to perform group-wise comparison.
@@ -116,35 +451,21 @@ def get_quant(df, filenames, threshold, level, groupwise_comparison, groups):
     Returns:
     tuple: A tuple containing the quant DataFrame and group status DataFrame.
     """
+
     #getting quant df
-    quant = pd.DataFrame(df[filenames].count())
+    quant = pd.DataFrame(counts)
     quant = quant.reset_index()
     quant.columns = ['Filename', f'{level} Number']
     quant = quant.sort_values('Filename')
 
     if threshold:
         threshold_col = f'{level} Threshold = {threshold}'
-        quant[threshold_col] = quant[f'{level} Number'].apply(check_threshold, args=[threshold,])
+        quant[threshold_col] = check_status(quant[f'{level} Number'].to_numpy(), 'Below Threshold', threshold)
 
         if groupwise_comparison:
             #get group based PASS or FAIL
-            group_status_dict = {}
-            group_quant = quant[['Filename', threshold_col]]
-            group_quant['Group'] = group_quant['Filename'].apply(groupname, args=[groups,])
-            group_quant = group_quant[['Group',threshold_col]]
-
-            for group in list(set(group_quant['Group'].tolist())):
-                subset_quant = group_quant[group_quant['Group'] == group]
-                group_status = list(set(subset_quant[threshold_col].tolist()))
-
-                if group_status == ['PASS']:
-                    group_status_dict[group] = "PASS"
-                else:
-                    group_status_dict[group] = "FAIL"
-
-
-            group_status_df = pd.DataFrame(list(group_status_dict.items()), columns=['Group',f'{level} Threshold QC Status'])
-            group_status_df = group_status_df.sort_values('Group')
+            group_status_df = get_group_status(quant, [threshold_col], groups)
+            group_status_df.columns = ['Group', f'{level} Threshold QC Status']
 
         else:
             group_status_df = ""
@@ -153,7 +474,89 @@ def get_quant(df, filenames, threshold, level, groupwise_comparison, groups):
 
     return (quant, group_status_df)
 
-def intensity_cvs(df, intensity_cv_threshold, data_percent_threshold, filenames, level, groupwise_comparison, groups):
+def groupwise_cv(values, group_codes, num_groups):
+    """
+    Calculates the mean, standard deviation and CV% of every feature within every group in one pass over the intensity matrix.
+
+    Args:
+    values (ndarray): Intensity matrix (features x samples) with NaN for missing values.
+    group_codes (ndarray): Integer group code of each sample column, -1 for samples that are not in a group.
+    num_groups (int): Number of groups.
+
+    Returns:
+    tuple: Mean, standard deviation and CV% matrices (features x groups) as float64 arrays.
+
+    Note:
+    Missing values are skipped and the standard deviation uses one degree of freedom like pandas, so a feature needs 2 values in a group to get a CV.
+    """
+
+    #sample to group indicator matrix, samples without a group are left out
+    indicator = np.zeros((len(group_codes), num_groups))
+    grouped = group_codes >= 0
+    indicator[np.flatnonzero(grouped), group_codes[grouped]] = 1
+
+    present = ~np.isnan(values)
+    counts = present.astype(np.float64) @ indicator
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        means = (np.where(present, values, 0) @ indicator)/counts
+
+        #second pass on the deviations from the group means for a stable variance
+        deviations = values - np.where(grouped, means[:, np.maximum(group_codes, 0)], np.nan)
+        sq_dev = np.where(present & grouped, deviations**2, 0) @ indicator
+        stds = np.sqrt(sq_dev/(counts - 1))
+        stds[counts < 2] = np.nan
+
+        cvs = (stds/means)*100
+
+    return (means, stds, cvs)
+
+def group_cv_worker(values_file, columns):
+    """
+    Calculates the mean, standard deviation and CV% of every feature within one group, from a shared intensity matrix.
+
+    Args:
+    values_file (str): Path to the shared intensity matrix (features x samples), from share_array.
+    columns (ndarray): Sample columns of the group.
+
+    Returns:
+    tuple: Mean, standard deviation and CV% of each feature within the group.
+    """
+
+    values = attach_array(values_file)
+    means, stds, cvs = groupwise_cv(values[:, columns], np.zeros(len(columns), dtype=np.int64), 1)
+
+    return (means[:, 0], stds[:, 0], cvs[:, 0])
+
+def parallel_groupwise_cv(values, group_codes, num_groups, workers, share_dir):
+    """
+    Calculates groupwise_cv with one task per group in worker processes, which memory-map a single shared copy of the intensity matrix.
+
+    Args:
+    values (ndarray): Intensity matrix (features x samples) with NaN for missing values.
+    group_codes (ndarray): Integer group code of each sample column, -1 for samples that are not in a group.
+    num_groups (int): Number of groups.
+    workers (int): Number of worker processes.
+    share_dir (str): Directory where the shared matrix is saved while the workers run.
+
+    Returns:
+    tuple: Mean, standard deviation and CV% matrices (features x groups) as float64 arrays.
+    """
+
+    values_file = share_array(values, share_dir)
+    group_columns = [np.flatnonzero(group_codes == code) for code in range(num_groups)]
+
+    try:
+        with ProcessPoolExecutor(max_workers=min(workers, num_groups)) as executor:
+            group_results = list(executor.map(group_cv_worker, repeat(values_file), group_columns))
+    finally:
+        os.remove(values_file)
+
+    means, stds, cvs = [np.column_stack(stat) for stat in zip(*group_results)]
+
+    return (means, stds, cvs)
+
+def intensity_cvs(df, intensity_cv_threshold, data_percent_threshold, filenames, level, groupwise_comparison, groups, workers=1, share_dir=False):
 
     """
     Analyzes the coefficient of variation (CV) for intensity data and performs group-wise comparisons.
@@ -166,66 +569,161 @@ def intensity_cvs(df, intensity_cv_threshold, data_percent_threshold, filenames,
     level (str): The analysis level (e.g., Protein, Peptide).
     groupwise_comparison (bool): Flag to perform group-wise CV analysis.
     groups (dict): A dictionary mapping groups to filenames.
+    workers (int): [Optional] Number of worker processes for the group statistics.
+    share_dir (str): [Optional] Directory where the intensity matrix is shared with the worker processes.
 
     Returns:
     tuple: A tuple containing the overall CV DataFrame, CV summary, and group-wise CV DataFrame.
+
+    Note:
+    The given DataFrame is not modified. The overall CV DataFrame only has the features with a valid overall CV,
+    with the index of the given DataFrame so the same features can be selected from it.
     """
 
-    overall_cv_df = df
-    overall_cv_df['Overall Average'] = overall_cv_df[filenames].mean(axis=1)
-    overall_cv_df['Overall Standard Deviation'] = overall_cv_df[filenames].std(axis=1)
-    overall_cv_df['Overall CV %'] = (overall_cv_df['Overall Standard Deviation']/overall_cv_df['Overall Average'])*100
+    values = df[filenames].to_numpy(dtype=np.float64)
 
-    cv_bins = [10,20,30,40,50,60,70,80,90,100]
+    #overall statistics - all samples in a single group
+    overall_mean, overall_std, overall_cv = groupwise_cv(values, np.zeros(len(filenames), dtype=np.int64), 1)
+    valid = ~np.isnan(overall_cv[:, 0])
 
-    cumfeq_dict = {}
-    cv_level = overall_cv_df
-    cv_level.dropna(subset=['Overall CV %'], inplace=True)
+    id_cols = [col for col in ['Protein', 'Peptide', 'Precursor'] if col in df.columns]
+    cv_level = df.loc[valid, id_cols + filenames].copy()
+    cv_level['Overall Average'] = overall_mean[valid, 0]
+    cv_level['Overall Standard Deviation'] = overall_std[valid, 0]
+    cv_level['Overall CV %'] = overall_cv[valid, 0]
 
-    for num in cv_bins:
-        feature_count = len(cv_level[cv_level['Overall CV %'] <= num]['Overall CV %'].tolist())
-        cumfeq_dict[num] = {f"{level} Cumulative Frequency %" :(feature_count/len(cv_level['Overall CV %'].tolist()))*100}
+    cv_sum = get_cv_cumulative_frequency(cv_level['Overall CV %'], level)
 
-    cv_sum = pd.DataFrame.from_dict(cumfeq_dict, orient="index")
-    cv_sum.reset_index(drop=False, inplace=True)
-    cv_sum.rename({"index":"CV%"}, axis=1, inplace=True)
+    grouped_df = ""
 
     if groupwise_comparison:
+        group_cv_matrix = get_group_cv_matrix(cv_level, values[valid], filenames, groups, workers, share_dir)
+
         if intensity_cv_threshold and data_percent_threshold:
+            group_cv_counts = get_group_cv_counts(cv_level[level].values, values[valid], group_cv_matrix, filenames, groups, intensity_cv_threshold)
+            grouped_df = get_grouped_cv_df(group_cv_counts, intensity_cv_threshold, data_percent_threshold, level)
 
-            grouped_cv_dict = {}
+    return (cv_level, cv_sum, grouped_df)
 
-            for group in groups:
-                df[f'{group}-Average'] = df[groups[group]].mean(axis=1)
-                df[f'{group}-Standard Deviation'] = df[groups[group]].std(axis=1)
-                df[f'{group}-CV%'] = (df[f'{group}-Standard Deviation']/df[f'{group}-Average'])*100
-
-                group_subset_cols = [level] + groups[group] + [f'{group}-CV%']
-                group_subset = df[group_subset_cols].dropna(subset=groups[group], how='all')
-                total = len(list(group_subset[level].tolist()))
-                total_under_cv = len(list(set(group_subset[group_subset[f'{group}-CV%'] <= intensity_cv_threshold][level].tolist())))
-                total_perc_under_cv = round((total_under_cv/total)*100, 2)
-
-                if total_perc_under_cv >= data_percent_threshold:
-                    group_cv_status = "PASS"
-                else:
-                    group_cv_status = "FAIL"
+def get_group_cv_matrix(cv_level, values, filenames, groups, workers=1, share_dir=False):
+    """
+    Adds the average, standard deviation and CV% of each group to the level CV DataFrame.
 
-                grouped_cv_dict[group] = {f"{level} Number": total,
-                                         f"{level} CV% < {intensity_cv_threshold}":total_under_cv,
-                                         f"{data_percent_threshold}% {level}s <= {intensity_cv_threshold}% CV": group_cv_status,}
+    Args:
+    cv_level (DataFrame): Level CV DataFrame, modified in place.
+    values (ndarray): Intensity matrix (features x samples) of the rows in cv_level.
+    filenames (list): List of filenames, in the column order of values.
+    groups (dict): A dictionary mapping groups to filenames.
+    workers (int): [Optional] Number of worker processes, groups are calculated in parallel when more than 1.
+    share_dir (str): [Optional] Directory where the intensity matrix is shared with the worker processes.
+
+    Returns:
+    ndarray: CV% of each feature (rows) within each group (columns, in group name order) as a float32 array.
+    """
 
-                grouped_df = pd.DataFrame.from_dict(grouped_cv_dict, orient="index")
-                grouped_df.reset_index(drop=False, inplace=True)
-                grouped_df.rename(columns = {"index":"Group"}, inplace=True)
-                grouped_df = grouped_df.sort_values('Group')
+    group_codes, group_names = get_group_codes(filenames, groups)
 
+    if workers > 1 and share_dir:
+        group_means, group_stds, group_cvs = parallel_groupwise_cv(values, group_codes, len(group_names), workers, share_dir)
     else:
-        grouped_df = ""
+        group_means, group_stds, group_cvs = groupwise_cv(values, group_codes, len(group_names))
 
-    return (overall_cv_df, cv_sum, grouped_df)
+    for group in groups:
+        code = group_names.index(group)
+        cv_level[f'{group}-Average'] = group_means[:, code]
+        cv_level[f'{group}-Standard Deviation'] = group_stds[:, code]
+        cv_level[f'{group}-CV%'] = group_cvs[:, code]
 
-def miscleavage(pep_level, enzyme, miscleavage_threshold, filenames, groups, groupwise_comparison):
+    return group_cvs.astype(np.float32)
+
+def get_group_cv_counts(feature_ids, values, group_cv_matrix, filenames, groups, intensity_cv_threshold):
+    """
+    Counts the features identified in each group and the unique features under the CV threshold within each group.
+
+    Args:
+    feature_ids (ndarray): Identifier of each feature (row).
+    values (ndarray): Intensity matrix (features x samples) with NaN for missing values.
+    group_cv_matrix (ndarray): CV% of each feature within each group, as returned by get_group_cv_matrix.
+    filenames (list): List of filenames, in the column order of values.
+    groups (dict): A dictionary mapping groups to filenames.
+    intensity_cv_threshold (float): The threshold for CV.
+
+    Returns:
+    dict: Maps each group to a tuple of (number of features, number of features under the CV threshold).
+    """
+
+    group_codes, group_names = get_group_codes(filenames, groups)
+    present = ~np.isnan(values)
+
+    group_cv_counts = {}
+    for code, group in enumerate(group_names):
+        total = int(present[:, group_codes == code].any(axis=1).sum())
+        total_under_cv = len(pd.unique(feature_ids[group_cv_matrix[:, code] <= intensity_cv_threshold]))
+        group_cv_counts[group] = (total, total_under_cv)
+
+    return group_cv_counts
+
+def get_cv_cumulative_frequency(cv_values, level, cv_bins=(10,20,30,40,50,60,70,80,90,100)):
+    """
+    Calculates the cumulative frequency of features under each CV% bin.
+
+    Args:
+    cv_values (Series): Overall CV% of each feature, without missing values.
+    level (str): The analysis level (e.g., Protein, Peptide).
+    cv_bins (tuple): [Optional] Upper CV% limit of each bin.
+
+    Returns:
+    DataFrame: CV summary DataFrame with the 'CV%' bins and the cumulative frequency % of the level.
+
+    Note:
+    The CV values are sorted once and the number of features under each bin is found with a binary search.
+    """
+
+    sorted_cvs = np.sort(np.asarray(cv_values, dtype=np.float64))
+    feature_counts = np.searchsorted(sorted_cvs, cv_bins, side='right')
+
+    cv_sum = pd.DataFrame({"CV%": list(cv_bins),
+                           f"{level} Cumulative Frequency %": (feature_counts/len(sorted_cvs))*100})
+
+    return cv_sum
+
+def get_grouped_cv_df(group_cv_counts, intensity_cv_threshold, data_percent_threshold, level):
+    """
+    Applies the CV and data percent thresholds to the number of features under the CV threshold within each group.
+
+    Args:
+    group_cv_counts (dict): Maps each group to a tuple of (number of features, number of features under the CV threshold).
+    intensity_cv_threshold (float): The threshold for CV.
+    data_percent_threshold (float): The data percentage threshold for CV analysis.
+    level (str): The analysis level (e.g., Protein, Peptide).
+
+    Returns:
+    DataFrame: Group-wise CV DataFrame with the QC status of each group.
+    """
+
+    grouped_cv_dict = {}
+
+    for group in group_cv_counts:
+        total, total_under_cv = group_cv_counts[group]
+        total_perc_under_cv = round((total_under_cv/total)*100, 2)
+
+        if total_perc_under_cv >= data_percent_threshold:
+            group_cv_status = "PASS"
+        else:
+            group_cv_status = "FAIL"
+
+        grouped_cv_dict[group] = {f"{level} Number": total,
+                                 f"{level} CV% < {intensity_cv_threshold}":total_under_cv,
+                                 f"{data_percent_threshold}% {level}s <= {intensity_cv_threshold}% CV": group_cv_status,}
+
+    grouped_df = pd.DataFrame.from_dict(grouped_cv_dict, orient="index")
+    grouped_df.reset_index(drop=False, inplace=True)
+    grouped_df.rename(columns = {"index":"Group"}, inplace=True)
+    grouped_df = grouped_df.sort_values('Group')
+
+    return grouped_df
+
+def miscleavage(pep_level, enzyme, miscleavage_threshold, filenames, groups, groupwise_comparison, cache_dir=False, workers=1, share_dir=False):
     """
     Analyzes miscleavage in peptides based on enzyme specificity and calculates their distribution.
 
@@ -236,77 +734,114 @@ def miscleavage(pep_level, enzyme, miscleavage_threshold, filenames, groups, gro
     filenames (list): List of filenames to consider in the analysis.
     groups (dict): Dictionary mapping groups to filenames for group-wise analysis.
     groupwise_comparison (bool): Flag indicating if group-wise comparison should be performed.
+    cache_dir (str): [Optional] Directory where miscleavage scores are reused across runs.
+    workers (int): [Optional] Number of worker processes for the per-sample histograms.
+    share_dir (str): [Optional] Directory where the presence matrix is shared with the worker processes.
 
     Returns:
     tuple: Returns two DataFrames - one with miscleavage information and another with group-wise miscleavage QC status.
     """
 
     peptide_level = pep_level[['Peptide'] + filenames]
-    peptide_level.fillna(0, inplace=True)
     peptide_level.drop_duplicates(subset=['Peptide'], inplace=True)
-    peptide_level.index = peptide_level['Peptide']
-    peptide_level.drop(['Peptide'], axis=1, inplace=True)
-
-    digestion_info = peptide_level.to_dict()
-    filesNames = sorted(digestion_info.keys())
-
-    digestionDF = pd.DataFrame()
-    digestionDF["Digestion"] = ["No end cleavage site found","0 missed cleavage","1 missed cleavage","2 missed cleavage",
-                           "3 missed cleavage","4 missed cleavage",">=5 missed cleavage","Total Peptides"]
-
-    cleavageScore_dict = {}
-    for file in filesNames:
-        mcScoreCount_list = []
-        for pepSeqs in digestion_info[file]:
-            if not int(digestion_info[file][pepSeqs]) == 0:
-                mcScore = calc_miscleavage(pepSeqs,enzyme)
-                cleavageScore_dict[pepSeqs] = mcScore
-                mcScoreCount_list.append(mcScore)
-
-        mcScore_Counter = collections.Counter(mcScoreCount_list)
-        ms_list = [0]*(len(digestionDF["Digestion"])-1)
-
-        for mcScore in mcScore_Counter:
-            if mcScore >= 1000:
-                ms_list[0]+= mcScore_Counter[mcScore]
-            elif mcScore >= 0 and mcScore <=4:
-                ms_list[mcScore+1] = mcScore_Counter[mcScore]
-            elif mcScore >=5 and mcScore < 1000:
-                ms_list[-1] += mcScore_Counter[mcScore]
-            else:
-                print ("Error in digestion")
 
-        fileSum = sum(ms_list)
+    digestion_counts = miscleavage_counts(peptide_level, enzyme, filenames, cache_dir, workers, share_dir)
+
+    return get_miscleavage_summary(digestion_counts, miscleavage_threshold, groups, groupwise_comparison)
+
+def digestion_histogram_worker(presence_file, bins_file, columns):
+    """
+    Counts the peptides in each missed cleavage category for a batch of samples, from a shared presence matrix.
+
+    Args:
+    presence_file (str): Path to the shared presence matrix (peptides x samples), from share_array.
+    bins_file (str): Path to the shared missed cleavage category of each peptide.
+    columns (ndarray): Sample columns of the batch.
+
+    Returns:
+    ndarray: Number of peptides in each category (rows) for each sample of the batch (columns).
+    """
+
+    presence = attach_array(presence_file)
+    score_bins = attach_array(bins_file)
+
+    histograms = [np.bincount(score_bins[presence[:, column]], minlength=len(digestion_labels)) for column in columns]
+
+    return np.column_stack(histograms)
+
+def miscleavage_counts(peptide_level, enzyme, filenames, cache_dir=False, workers=1, share_dir=False):
+    """
+    Counts the number of peptides identified in each sample for each number of missed cleavages.
+
+    Args:
+    peptide_level (DataFrame): DataFrame with a 'Peptide' column (one row per peptide) and sample intensities.
+    enzyme (str): The enzyme used for digestion.
+    filenames (list): List of filenames to consider in the analysis.
+    cache_dir (str): [Optional] Directory where miscleavage scores are reused across runs.
+    workers (int): [Optional] Number of worker processes, batches of samples are counted in parallel when more than 1.
+    share_dir (str): [Optional] Directory where the presence matrix is shared with the worker processes.
+
+    Returns:
+    DataFrame: Number of peptides in each missed cleavage category (rows) for each sample (columns).
+    """
 
-        ms_list.append(fileSum)
-        digestionDF[file] = ms_list
+    filesNames = sorted(filenames)
+    peptides = peptide_level['Peptide'].tolist()
 
-    dig_df = transpose_DF(digestionDF)
-    headers = dig_df.iloc[0].values
-    dig_df.columns = headers
-    dig_df.drop(index=0, axis=0, inplace=True)
+    #each unique peptide is scored once, instead of once for every sample it is identified in
+    scores = get_miscleavage_scores(peptides, enzyme, cache_dir).values
+
+    #score bins - no end cleavage site found, 0-4 missed cleavages and >=5 missed cleavages
+    score_bins = np.where(scores >= 1000, 0, np.clip(scores, 0, 5) + 1)
+
+    #a peptide is counted in a sample if its intensity is non-zero
+    presence = (peptide_level[filesNames].fillna(0).astype(np.int64) != 0).values
+
+    if workers > 1 and share_dir:
+        presence_file = share_array(presence, share_dir)
+        bins_file = share_array(score_bins, share_dir)
+        try:
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                batches = np.array_split(np.arange(len(filesNames)), min(workers, len(filesNames)))
+                histograms = np.column_stack(list(executor.map(digestion_histogram_worker, repeat(presence_file), repeat(bins_file), batches)))
+        finally:
+            os.remove(presence_file)
+            os.remove(bins_file)
+    else:
+        bin_matrix = np.zeros((len(peptides), len(digestion_labels)), dtype=np.int64)
+        bin_matrix[np.arange(len(peptides)), score_bins] = 1
+        histograms = bin_matrix.T @ presence.astype(np.int64)
+
+    digestion_counts = pd.DataFrame(histograms, index=digestion_labels, columns=filesNames)
+
+    return digestion_counts
+
+def get_miscleavage_summary(digestion_counts, miscleavage_threshold, groups, groupwise_comparison):
+    """
+    Calculates the 0 missed cleavage percentage of each sample and applies the miscleavage threshold.
+
+    Args:
+    digestion_counts (DataFrame): Number of peptides in each missed cleavage category (rows) for each sample (columns).
+    miscleavage_threshold (float): Threshold for miscleavage analysis.
+    groups (dict): Dictionary mapping groups to filenames for group-wise analysis.
+    groupwise_comparison (bool): Flag indicating if group-wise comparison should be performed.
+
+    Returns:
+    tuple: Returns two DataFrames - one with miscleavage information and another with group-wise miscleavage QC status.
+    """
+
+    dig_df = digestion_counts.T
+    dig_df['Total Peptides'] = dig_df[digestion_labels].sum(axis=1)
+    dig_df.insert(0, 'Digestion', dig_df.index)
+    dig_df.reset_index(drop=True, inplace=True)
     dig_df['0 missed cleavage percentage'] = (dig_df['0 missed cleavage']/dig_df['Total Peptides'])*100
 
     if miscleavage_threshold:
-        dig_df['0 missed cleavage QC Status'] = dig_df['0 missed cleavage percentage'].apply(perc_qc, args=[int(miscleavage_threshold),])
+        dig_df['0 missed cleavage QC Status'] = check_status(dig_df['0 missed cleavage percentage'].to_numpy(), 'Below Threshold', int(miscleavage_threshold))
 
         if groupwise_comparison and miscleavage_threshold:
-            group_dig_df = dig_df[['Digestion','0 missed cleavage QC Status']]
-            group_dig_df['Group'] = group_dig_df['Digestion'].apply(groupname, args=[groups,])
-            group_dig_df = group_dig_df[['Group','0 missed cleavage QC Status']]
-
-            group_level = {}
-            for group in list(set(group_dig_df['Group'].tolist())):
-                group_subset = group_dig_df[group_dig_df['Group'] == group]
-                status = list(set(group_subset['0 missed cleavage QC Status'].tolist()))
-                if status == ['PASS']:
-                    group_level[group] = "PASS"
-                else:
-                    group_level[group] = "FAIL"
-
-            group_df = pd.DataFrame(list(group_level.items()), columns=['Group','0 Miscleaved Peptides QC Status'])
-            group_df['0 Miscleaved Peptides QC Status'] = group_df['0 Miscleaved Peptides QC Status'].astype(str)
-            group_df = group_df.sort_values('Group')
+            group_df = get_group_status(dig_df, ['0 missed cleavage QC Status'], groups, filename_col='Digestion')
+            group_df.columns = ['Group', '0 Miscleaved Peptides QC Status']
 
         else:
             group_df = ""
@@ -319,16 +854,15 @@ def miscleavage(pep_level, enzyme, miscleavage_threshold, filenames, groups, gro
 
     return (dig_df, group_df)
 
-def common_tic(df_level, level, tic_cv_threshold, filenames, groups, groupwise_comparison):
+def common_tic(level_matrix, level, tic_cv_threshold, groups, groupwise_comparison):
 
     """
     Analyzes Total Ion Chromatogram (TIC) across multiple files and performs group-wise comparison if specified.
 
     Args:
-    df_level (DataFrame): DataFrame containing either peptide or precursor level information.
+    level_matrix (dict): Intensity matrix of the peptide or precursor level, from build_intensity_matrix.
     level (str): Analysis level ('Peptide' or 'Precursor').
     tic_cv_threshold (float): Threshold for coefficient of variation (CV) in TIC analysis.
-    filenames (list): List of filenames to consider in the analysis.
     groups (dict): Dictionary mapping groups to filenames for group-wise analysis.
     groupwise_comparison (bool): Flag indicating if group-wise comparison should be performed.
 
@@ -336,45 +870,114 @@ def common_tic(df_level, level, tic_cv_threshold, filenames, groups, groupwise_c
     tuple: Returns two DataFrames - one with TIC information and another with group-wise TIC QC status.
     """
 
-    if level == "Peptide":
-        df = df_level[['Peptide'] + filenames]
-    elif level == "Precursor":
-        df = df_level[['Precursor'] + filenames]
-
-    df.replace({0.0:np.nan,0:np.nan}, inplace=True)
-    df.dropna(inplace=True)
-
-    #calculating TIC
-    df.loc['TIC'] = df.sum(numeric_only=True, axis=0)
-    df_tic = df.T.reset_index(drop=False)[['index','TIC']]
-    df_tic.rename({'index':'Filename'}, axis=1, inplace=True)
-    df_tic = df_tic[df_tic['Filename'] != level]
-    df_tic = df_tic.sort_values('Filename')
+    #calculating TIC from the features identified in all samples
+    tic_sums = common_feature_sums(level_matrix, level)
+    df_tic = pd.DataFrame({'Filename': tic_sums.index.tolist(), 'TIC': tic_sums.tolist()})
 
-    if groupwise_comparison and tic_cv_threshold:
-        #getting group level information
-        df_tic['Group'] = df_tic['Filename'].apply(groupname, args=[groups, ])
+    return get_tic_summary(df_tic, level, tic_cv_threshold, groups, groupwise_comparison)
 
-        #calculating cv across plates
-        group_level = {}
-        for group in list(set(df_tic['Group'].tolist())):
-            group_subset = df_tic[df_tic['Group'] == group]
-            tic_list = group_subset['TIC'].tolist()
-            group_level[group] = round(cv(tic_list),2)
+def get_tic_summary(df_tic, level, tic_cv_threshold, groups, groupwise_comparison):
+    """
+    Calculates the common TIC CV% within each group and applies the TIC CV threshold.
+
+    Args:
+    df_tic (DataFrame): DataFrame with the 'Filename' and common 'TIC' of each sample.
+    level (str): Analysis level ('Peptide' or 'Precursor').
+    tic_cv_threshold (float): Threshold for coefficient of variation (CV) in TIC analysis.
+    groups (dict): Dictionary mapping groups to filenames for group-wise analysis.
+    groupwise_comparison (bool): Flag indicating if group-wise comparison should be performed.
+
+    Returns:
+    tuple: Returns two DataFrames - one with TIC information and another with group-wise TIC QC status.
+    """
 
-        group_df = pd.DataFrame(list(group_level.items()), columns=['Group','CV %'])
-        group_df[f'Common {level} TIC QC Status'] = group_df['CV %'].apply(cv_status, args=[float(tic_cv_threshold),])
+    df_tic = df_tic.sort_values('Filename')
 
-        df_tic.drop(['Group'], axis=1, inplace=True)
-        group_df[f'Common {level} TIC QC Status'] = group_df[f'Common {level} TIC QC Status'].astype(str)
-        group_df = group_df.sort_values('Group')
+    if groupwise_comparison and tic_cv_threshold:
+        #calculating cv across plates
+        group_tics = get_group_values(df_tic, 'TIC', groups)
+        group_df = pd.DataFrame({'Group': list(group_tics), 'CV %': [round(cv(tic_values),2) for tic_values in group_tics.values()]})
+        group_df[f'Common {level} TIC QC Status'] = check_status(group_df['CV %'].to_numpy(), 'Above Threshold', float(tic_cv_threshold))
 
     else:
         group_df = ""
 
     return (df_tic, group_df)
 
-def selected_peps(df_level, level, coverage_threshold, filenames, irtlabel, peptide_list, peptide_list_df):
+def build_feature_index(df_level):
+    """
+    Builds hashed indexes of the rows of each peptide, precursor and protein name token of a level.
+
+    Args:
+    df_level (DataFrame): DataFrame containing protein, peptide or precursor level information.
+
+    Returns:
+    dict: Maps 'Peptide', 'Precursor', 'Protein' and 'Protein Token' to dictionaries of {key: array of row positions}, for the columns present in df_level.
+
+    Note:
+    Protein names are split into tokens on non-alphanumeric characters, e.g. 'Biognosys|iRT-Kit_WR_fusion' gives 'Biognosys', 'iRT', 'Kit', 'WR' and 'fusion'.
+    """
+
+    feature_index = {}
+
+    for col in ['Protein', 'Peptide', 'Precursor']:
+        if col in df_level.columns:
+            feature_index[col] = df_level.groupby(df_level[col].astype(str), sort=False).indices
+
+    if 'Protein' in feature_index:
+        token_rows = defaultdict(list)
+        for protein, rows in feature_index['Protein'].items():
+            for token in set(re.split(r'[^A-Za-z0-9]+', protein)):
+                if token:
+                    token_rows[token].append(rows)
+        feature_index['Protein Token'] = {token: np.concatenate(rows) for token, rows in token_rows.items()}
+
+    return feature_index
+
+def lookup_rows(feature_index, col, keys):
+    """
+    Gets the row positions of the given keys from a feature index, in row order.
+
+    Args:
+    feature_index (dict): Feature index from build_feature_index.
+    col (str): Indexed column ('Protein', 'Peptide', 'Precursor' or 'Protein Token').
+    keys (list): Keys to look up, keys that are not in the index are skipped.
+
+    Returns:
+    ndarray: Sorted row positions.
+    """
+
+    index = feature_index.get(col, {})
+    rows = [index[key] for key in keys if key in index]
+
+    if not rows:
+        return np.array([], dtype=np.int64)
+
+    return np.unique(np.concatenate(rows))
+
+def find_protein_rows(feature_index, label):
+    """
+    Gets the row positions of the proteins whose name contains a label, e.g. the iRT label.
+
+    Args:
+    feature_index (dict): Feature index from build_feature_index.
+    label (str): Label to search for in protein names.
+
+    Returns:
+    ndarray: Sorted row positions.
+
+    Note:
+    Labels made of a single token are found in the protein token index. Other labels are searched in the unique protein names, not in every row.
+    """
+
+    if re.fullmatch(r'[A-Za-z0-9]+', label) and label in feature_index.get('Protein Token', {}):
+        return lookup_rows(feature_index, 'Protein Token', [label])
+
+    proteins = [protein for protein in feature_index.get('Protein', {}) if label in protein]
+
+    return lookup_rows(feature_index, 'Protein', proteins)
+
+def selected_peps(df_level, level, coverage_threshold, filenames, irtlabel, peptide_list, peptide_list_df, feature_index=None, level_matrix=None):
 
     """
     Analyzes selected peptides for coverage and iRT QC, considering provided peptide list.
@@ -387,14 +990,19 @@ def selected_peps(df_level, level, coverage_threshold, filenames, irtlabel, pept
     irtlabel (str): Label for iRT peptides.
     peptide_list (list): List of specific peptides for analysis.
     peptide_list_df (DataFrame): DataFrame containing the list of specific peptides.
+    feature_index (dict): [Optional] Feature index of df_level from build_feature_index, built if not given.
+    level_matrix (dict): [Optional] Intensity matrix of df_level from build_intensity_matrix, used for the coverage of each feature.
 
     Returns:
     tuple: Returns DataFrames for iRT analysis, iRT plots flag, and selected peptide analysis.
     """
 
-    #iRT kit
-    irt_peptides = ["LGGNEQVTR","GAGSSEPVTGLDAK","VEATFGVDESNAK","YILAGVENSK","TPVISGGPYEYR","TPVITGAPYEYR","DGLDAASYYAPVR","ADVTPADFSEWSK","GTFIIDPGGVIR","GTFIIDPAAVIR","LFLQFGAQGSPFLK"]
-    irt_precursors = ["LGGNEQVTR2","GAGSSEPVTGLDAK2","VEATFGVDESNAK2","YILAGVENSK2","TPVISGGPYEYR2","TPVITGAPYEYR2","DGLDAASYYAPVR2","ADVTPADFSEWSK2","GTFIIDPGGVIR2","GTFIIDPAAVIR2","LFLQFGAQGSPFLK2"]
+    if feature_index is None:
+        feature_index = build_feature_index(df_level)
+
+    if level_matrix is None:
+        level_matrix = build_intensity_matrix(df_level, filenames)
+    coverage = np.round(feature_completeness(level_matrix), 2)
 
     if not irtlabel:
         irt_plots = False
@@ -404,11 +1012,7 @@ def selected_peps(df_level, level, coverage_threshold, filenames, irtlabel, pept
     if irtlabel:
         irt_plots = True
 
-        irt_present = False
-        for protein in list(set(df_level['Protein'].tolist())):
-            if irtlabel in protein:
-                irt_present = True
-                break
+        irt_present = len(find_protein_rows(feature_index, irtlabel)) > 0
 
         if not irt_present:
             irt_plots = False
@@ -417,133 +1021,446 @@ def selected_peps(df_level, level, coverage_threshold, filenames, irtlabel, pept
 
         if irt_present:
             if level == "Peptide":
-                irt_level = df_level[df_level['Peptide'].isin(irt_peptides)]
+                irt_rows = lookup_rows(feature_index, 'Peptide', irt_peptides)
             if level == "Precursor":
-                irt_level = df_level[df_level['Precursor'].isin(irt_precursors)]
+                irt_rows = lookup_rows(feature_index, 'Precursor', irt_precursors)
 
-            irt_level['Coverage %'] = round((irt_level[filenames].count(axis=1)/len(filenames))*100,2)
+            irt_level = df_level.iloc[irt_rows]
+            irt_level['Coverage %'] = coverage[irt_rows]
 
             if coverage_threshold:
-                irt_level[f'Coverage Threshold = {coverage_threshold}'] = irt_level['Coverage %'].apply(check_threshold,  args=[coverage_threshold,])
+                irt_level[f'Coverage Threshold = {coverage_threshold}'] = check_status(irt_level['Coverage %'].to_numpy(), 'Below Threshold', coverage_threshold)
 
     #selected peptide list
     if peptide_list:
         peptide_list = list(set(peptide_list_df['Peptide'].tolist()))
 
-        peptides_not_found = []
-        for peptide in peptide_list:
-            if peptide not in list(set(df_level['Peptide'].tolist())):
-                peptides_not_found.append(peptide)
+        peptides_not_found = [peptide for peptide in peptide_list if peptide not in feature_index['Peptide']]
+
+        if len(peptides_not_found) > 0:
+            #logging.info(f"The following peptides provided in the peptide list were not found in the input files: {", ".join(peptides_not_found)}")
+            print(f"The following peptides provided in the peptide list were not found in the input files: {', '.join(peptides_not_found)}")
+
+        selected_rows = lookup_rows(feature_index, 'Peptide', peptide_list)
+        selected_pep_df = df_level.iloc[selected_rows]
+        selected_pep_df['Coverage %'] = coverage[selected_rows]
+
+        if coverage_threshold:
+            selected_pep_df[f'Coverage Threshold = {coverage_threshold}'] = check_status(selected_pep_df['Coverage %'].to_numpy(), 'Below Threshold', coverage_threshold)
+
+    else:
+        selected_pep_df = ""
+
+    return (irt_level, irt_plots, selected_pep_df)
+
+def get_sample_df(protein_level, peptide_level, precursor_level, pt_sample_df, pep_sample_df, pre_sample_df, threshold_dict, groupwise_comparison, groups):
+
+    """
+    Creates a combined sample DataFrame based on the available data levels and thresholds.
+
+    Args:
+    protein_level, peptide_level, precursor_level (bool): Flags indicating the presence of each data level.
+    pt_sample_df, pep_sample_df, pre_sample_df (DataFrame): DataFrames for protein, peptide, and precursor levels.
+    threshold_dict (dict): Dictionary containing threshold values for each level.
+    groupwise_comparison (bool): Flag for group-wise comparison.
+    groups (dict): Dictionary mapping groups to filenames.
+
+    Returns:
+    DataFrame: A combined DataFrame based on the specified data levels and thresholds.
+    """
+
+    if protein_level and peptide_level and precursor_level and threshold_dict['Protein Threshold'] and threshold_dict['Peptide Threshold'] and threshold_dict['Precursor Threshold']:
+        overall_sample_df = pd.merge(pt_sample_df, pep_sample_df, on="Filename")
+        overall_sample_df = pd.merge(overall_sample_df, pre_sample_df, on="Filename")
+        overall_sample_df = overall_sample_df.sort_values('Filename')
+        return overall_sample_df
+
+    elif protein_level and peptide_level and threshold_dict['Protein Threshold'] and threshold_dict['Peptide Threshold']:
+        overall_sample_df = pd.merge(pt_sample_df, pep_sample_df, on="Filename")
+        overall_sample_df = overall_sample_df.sort_values('Filename')
+        return overall_sample_df
+
+    elif protein_level and precursor_level and threshold_dict['Protein Threshold'] and threshold_dict['Precursor Threshold']:
+        overall_sample_df = pd.merge(pt_sample_df, pre_sample_df, on="Filename")
+        overall_sample_df = overall_sample_df.sort_values('Filename')
+        return overall_sample_df
+
+    elif peptide_level and precursor_level and threshold_dict['Peptide Threshold'] and threshold_dict['Precursor Threshold']:
+        overall_sample_df = pd.merge(pep_sample_df, pre_sample_df, on="Filename")
+        overall_sample_df = overall_sample_df.sort_values('Filename')
+        return overall_sample_df
+
+    elif protein_level and threshold_dict['Protein Threshold']:
+        pt_sample_df = pt_sample_df.sort_values('Filename')
+        return pt_sample_df
+
+    elif peptide_level and threshold_dict['Peptide Threshold']:
+        pep_sample_df = pep_sample_df.sort_values('Filename')
+        return pep_sample_df
+
+    elif precursor_level and threshold_dict['Precursor Threshold']:
+        pre_sample_df = pre_sample_df.sort_values('Filename')
+        return pre_sample_df
+
+def get_overall_df(protein_level, peptide_level, precursor_level, pt_group_df, pep_group_df, pre_group_df):
+
+    """
+    Combines group DataFrames for different levels (protein, peptide, precursor) based on availability.
+
+    Args:
+    protein_level, peptide_level, precursor_level (bool): Flags indicating the presence of each data level.
+    pt_group_df, pep_group_df, pre_group_df (DataFrame): Group DataFrames for each level.
+
+    Returns:
+    DataFrame: A combined group DataFrame based on the specified data levels.
+    """
+
+    if protein_level and peptide_level and precursor_level:
+        overall_group_df = pd.merge(pt_group_df, pep_group_df, on="Group")
+        overall_group_df = pd.merge(overall_group_df, pre_group_df, on="Group")
+
+    elif protein_level and peptide_level:
+        overall_group_df = pd.merge(pt_group_df, pep_group_df, on="Group")
+
+    elif protein_level and precursor_level:
+        overall_group_df = pd.merge(pt_group_df, pre_group_df, on="Group")
+
+    elif peptide_level and precursor_level:
+        overall_group_df = pd.merge(pep_group_df, pre_group_df, on="Group")
+
+    elif protein_level:
+        pt_group_df = pt_group_df.sort_values('Group')
+        return pt_group_df
+
+    elif peptide_level:
+        pep_group_df = pep_group_df.sort_values('Group')
+        return pep_group_df
+
+    elif precursor_level:
+        pre_group_df = pre_group_df.sort_values('Group')
+        return pre_group_df
+
+    overall_group_df = overall_group_df.sort_values('Group')
+
+    return overall_group_df
+
+#------------------------------------------------------------------- OUT-OF-CORE FUNCTIONS ---------------------------------------------------------------------------
+
+#number of working copies of a chunk held at once (zero replacement, row statistics and masks)
+chunk_overhead = 4
+
+def get_chunksize(level_file, chunk_memory):
+    """
+    Estimates the number of rows that can be read from an intensity file at once within a memory budget.
+
+    Args:
+    level_file (str): Path to the tab delimited intensity file.
+    chunk_memory (int): Memory budget in MB for each chunk of rows.
+
+    Returns:
+    int: Number of rows to read in each chunk.
+    """
+
+    sample = pd.read_csv(level_file, sep="\t", nrows=1000)
+    row_bytes = sample.memory_usage(deep=True, index=False).sum() / max(len(sample), 1)
+    chunksize = int((chunk_memory * 1024 * 1024) / (row_bytes * chunk_overhead))
+
+    return max(chunksize, 1)
+
+def get_sample_batch_size(num_features, chunk_memory):
+    """
+    Estimates the number of sample columns that can be read from an intensity file at once within a memory budget.
+
+    Args:
+    num_features (int): Number of rows (features) in the intensity file.
+    chunk_memory (int): Memory budget in MB for each batch of samples.
+
+    Returns:
+    int: Number of samples to read in each batch.
+    """
+
+    #float32 intensities
+    batch_size = int((chunk_memory * 1024 * 1024) / (max(num_features, 1) * 4 * chunk_overhead))
+
+    return max(batch_size, 1)
+
+def read_level_chunks(level_file, chunksize):
+    """
+    Reads an intensity file in blocks of rows, treating 0 intensities as missing values.
+
+    Args:
+    level_file (str): Path to the tab delimited intensity file.
+    chunksize (int): Number of rows in each block.
+
+    Yields:
+    DataFrame: The next block of rows with 0 intensities replaced by NaN.
+    """
+
+    for chunk in pd.read_csv(level_file, sep="\t", chunksize=chunksize):
+        yield chunk[chunk.columns.tolist()].replace({'0':np.nan, 0:np.nan})
+
+def chunked_level_metrics(level_file, level, input_dict, threshold_dict, groupwise_comparison, groups):
+    """
+    Calculates the ID-Based metrics of an intensity file that does not fit in memory by streaming blocks of rows.
+
+    Args:
+    level_file (str): Path to the tab delimited intensity file.
+    level (str): The analysis level ('Protein', 'Peptide' or 'Precursor').
+    input_dict (dict): Dictionary containing the input files and the chunk memory budget.
+    threshold_dict (dict): Dictionary containing threshold values.
+    groupwise_comparison (bool): Flag indicating if group-wise comparison should be performed.
+    groups (dict): Dictionary mapping groups to filenames for group-wise analysis.
+
+    Returns:
+    dict: Results with the same outputs as the in-memory functions - 'Quant' (get_quant), 'Intensity CVs' (intensity_cvs),
+    'Common TIC' (common_tic), 'Miscleavage' (miscleavage), the 'Targeted Level' rows needed by selected_peps and the 'Filenames'.
+
+    Note:
+    Per-sample counts, common TIC sums, per-group feature counts and missed cleavage histograms are merged across chunks.
+    Only the per-feature CV statistics are kept for the cumulative frequency, so the level CV table does not include intensities.
+    """
+
+    columns = pd.read_csv(level_file, sep="\t", nrows=0).columns.tolist()
+    id_cols = [col for col in ['Protein', 'Peptide', 'Precursor'] if col in columns]
+    filenames = [col for col in columns if col not in id_cols]
+
+    chunksize = get_chunksize(level_file, input_dict['Chunk Memory'])
+    logging.info(f"Streaming {level} intensities from {level_file} in chunks of {chunksize} rows")
+
+    intensity_cv_threshold = threshold_dict['CV Percent Threshold']
+    group_cvs = groupwise_comparison and intensity_cv_threshold and threshold_dict['Data Percent Threshold']
+    common_tic_level = level in ['Peptide', 'Precursor']
+    digestion = threshold_dict['Enzyme'] and (level == "Peptide" or (level == "Precursor" and not input_dict['Peptide Level']))
+    targeted = level != "Protein" and (threshold_dict['iRT Label'] or input_dict['Peptide List'])
+
+    if input_dict['Peptide List']:
+        targeted_peptides = set(pd.read_csv(input_dict['Peptide List'], sep="\t")['Peptide'].tolist())
+    else:
+        targeted_peptides = set()
+
+    if group_cvs:
+        group_codes, group_names = get_group_codes(filenames, groups)
+
+    #accumulators
+    counts = pd.Series(0, index=filenames)
+    tic_sums = pd.Series(0.0, index=filenames)
+    group_totals = {group: 0 for group in groups} if group_cvs else {}
+    digestion_counts = pd.DataFrame(0, index=digestion_labels, columns=sorted(filenames))
+    seen_peptides = set()
+    feature_cvs = []
+    targeted_rows = []
+    num_chunks = 0
+    num_features = 0
+
+    for chunk in read_level_chunks(level_file, chunksize):
+        num_chunks += 1
+        num_features += len(chunk)
+        values = chunk[filenames].to_numpy(dtype=np.float64)
+        chunk_matrix = build_intensity_matrix(chunk, filenames)
+
+        counts += sample_counts(chunk_matrix)
+
+        #per-feature statistics, rows are complete within a chunk
+        overall_mean, overall_std, overall_cv = groupwise_cv(values, np.zeros(len(filenames), dtype=np.int64), 1)
+        valid = ~np.isnan(overall_cv[:, 0])
+
+        features = chunk.loc[valid, id_cols].copy()
+        features['Overall Average'] = overall_mean[valid, 0]
+        features['Overall Standard Deviation'] = overall_std[valid, 0]
+        features['Overall CV %'] = overall_cv[valid, 0]
+
+        if group_cvs:
+            group_cv_matrix = groupwise_cv(values[valid], group_codes, len(group_names))[2]
+            present = ~np.isnan(values[valid])
+            for group in groups:
+                code = group_names.index(group)
+                features[f'{group}-CV%'] = group_cv_matrix[:, code]
+                group_totals[group] += int(present[:, group_codes == code].any(axis=1).sum())
+
+        feature_cvs.append(features)
+
+        if common_tic_level:
+            tic_sums += common_feature_sums(chunk_matrix, level)
+
+        if digestion:
+            peptide_chunk = chunk[valid][['Peptide'] + filenames].drop_duplicates(subset=['Peptide'])
+            peptide_chunk = peptide_chunk[~peptide_chunk['Peptide'].isin(seen_peptides)]
+            seen_peptides.update(peptide_chunk['Peptide'].tolist())
+            digestion_counts += miscleavage_counts(peptide_chunk, threshold_dict['Enzyme'], filenames, input_dict.get('Cache Directory'))
+
+        if targeted:
+            targeted_rows.append(get_targeted_rows(chunk, level, threshold_dict['iRT Label'], targeted_peptides))
+
+    logging.info(f"{num_chunks} chunks of {level} intensities were processed")
+
+    level_bundle = get_level_bundle(level, filenames, counts, pd.concat(feature_cvs, ignore_index=True), groups, group_totals,
+                                    pd.DataFrame({'Filename': filenames, 'TIC': tic_sums.tolist()}) if common_tic_level else None,
+                                    digestion_counts if digestion else None,
+                                    pd.concat(targeted_rows, ignore_index=True) if targeted else None)
+
+    level_results = get_level_results(level_bundle, level, threshold_dict, groupwise_comparison, groups)
+    level_results['PCA Batch Size'] = get_sample_batch_size(num_features, input_dict['Chunk Memory'])
+    level_results['Bundle'] = level_bundle
+
+    return level_results
+
+def get_targeted_rows(df_level, level, irtlabel, targeted_peptides):
+    """
+    Selects the rows of a peptide or precursor level needed for iRT and selected peptide analysis.
+
+    Args:
+    df_level (DataFrame): Peptide or precursor level intensities.
+    level (str): The analysis level ('Peptide' or 'Precursor').
+    irtlabel (str): Label of the iRT proteins, or False.
+    targeted_peptides (set): Peptides of the peptide list.
+
+    Returns:
+    DataFrame: Rows of the iRT peptides and precursors, the iRT proteins and the peptide list.
+    """
+
+    targeted_mask = df_level['Peptide'].isin(targeted_peptides) | df_level['Peptide'].isin(irt_peptides)
+    if level == "Precursor":
+        targeted_mask = targeted_mask | df_level['Precursor'].isin(irt_precursors)
+    if irtlabel:
+        targeted_mask = targeted_mask | df_level['Protein'].astype(str).str.contains(irtlabel, regex=False)
+
+    return df_level[targeted_mask]
+
+def get_level_bundle(level, filenames, counts, level_cv, groups, group_totals=False, df_tic=None, digestion_counts=None, targeted_level=None):
+    """
+    Gets the raw metrics of a level before any threshold is applied, as saved to the metrics bundle.
+
+    Args:
+    level (str): The analysis level ('Protein', 'Peptide' or 'Precursor').
+    filenames (list): List of filenames.
+    counts (Series): Number of identified features indexed by filename.
+    level_cv (DataFrame): Level CV DataFrame, from intensity_cvs or chunked_level_metrics.
+    groups (dict): Dictionary mapping groups to filenames for group-wise analysis.
+    group_totals (dict): [Optional] Number of features identified in each group, counted from the intensities in level_cv if not given.
+    df_tic (DataFrame): [Optional] 'Filename' and common 'TIC' of each sample.
+    digestion_counts (DataFrame): [Optional] Number of peptides in each missed cleavage category (rows) for each sample (columns).
+    targeted_level (DataFrame): [Optional] Rows needed for iRT and selected peptide analysis, from get_targeted_rows.
 
-        if len(peptides_not_found) > 0:
-            #logging.info(f"The following peptides provided in the peptide list were not found in the input files: {", ".join(peptides_not_found)}")
-            print(f"The following peptides provided in the peptide list were not found in the input files: {', '.join(peptides_not_found)}")
+    Returns:
+    dict: Raw metrics of the level, for get_level_results.
 
-        selected_pep_df = df_level[df_level['Peptide'].isin(peptide_list)]
-        selected_pep_df['Coverage %'] = round((selected_pep_df[filenames].count(axis=1)/len(filenames))*100,2)
+    Note:
+    Only the per-feature CV statistics of the level CV DataFrame are kept, as with chunked_level_metrics.
+    """
 
-        if coverage_threshold:
-            selected_pep_df[f'Coverage Threshold = {coverage_threshold}'] = selected_pep_df['Coverage %'].apply(check_threshold,  args=[coverage_threshold,])
+    id_cols = [col for col in ['Protein', 'Peptide', 'Precursor'] if col in level_cv.columns]
+    group_cv_cols = [f'{group}-CV%' for group in groups if f'{group}-CV%' in level_cv.columns]
 
-    else:
-        selected_pep_df = ""
+    if group_totals is False and group_cv_cols:
+        #features identified in any sample of each group, counted from the intensities of the level CV DataFrame
+        group_codes, group_names = get_group_codes(filenames, groups)
+        present = ~np.isnan(level_cv[filenames].to_numpy(dtype=np.float64))
+        group_totals = {group: int(present[:, group_codes == group_names.index(group)].any(axis=1).sum()) for group in groups}
 
-    return (irt_level, irt_plots, selected_pep_df)
+    level_bundle = {'Filenames': filenames,
+                    'Counts': counts,
+                    'Level CV': level_cv[id_cols + ['Overall Average', 'Overall Standard Deviation', 'Overall CV %'] + group_cv_cols].reset_index(drop=True),
+                    'Group Totals': group_totals or {},
+                    'Common TIC': df_tic,
+                    'Digestion Counts': digestion_counts,
+                    'Targeted Level': targeted_level}
 
-def get_sample_df(protein_level, peptide_level, precursor_level, pt_sample_df, pep_sample_df, pre_sample_df, threshold_dict, groupwise_comparison, groups):
+    return level_bundle
 
+def get_level_results(level_bundle, level, threshold_dict, groupwise_comparison, groups):
     """
-    Creates a combined sample DataFrame based on the available data levels and thresholds.
+    Applies the thresholds to the raw metrics of a level.
 
     Args:
-    protein_level, peptide_level, precursor_level (bool): Flags indicating the presence of each data level.
-    pt_sample_df, pep_sample_df, pre_sample_df (DataFrame): DataFrames for protein, peptide, and precursor levels.
-    threshold_dict (dict): Dictionary containing threshold values for each level.
-    groupwise_comparison (bool): Flag for group-wise comparison.
-    groups (dict): Dictionary mapping groups to filenames.
+    level_bundle (dict): Raw metrics of the level, from get_level_bundle.
+    level (str): The analysis level ('Protein', 'Peptide' or 'Precursor').
+    threshold_dict (dict): Dictionary containing threshold values.
+    groupwise_comparison (bool): Flag indicating if group-wise comparison should be performed.
+    groups (dict): Dictionary mapping groups to filenames for group-wise analysis.
 
     Returns:
-    DataFrame: A combined DataFrame based on the specified data levels and thresholds.
+    dict: Results with the same outputs as the in-memory functions - 'Quant' (get_quant), 'Intensity CVs' (intensity_cvs),
+    'Common TIC' (common_tic), 'Miscleavage' (miscleavage), the 'Targeted Level' rows needed by selected_peps, the 'Filenames'
+    and the 'PCA' report parameters if saved with the level.
     """
 
-    if protein_level and peptide_level and precursor_level and threshold_dict['Protein Threshold'] and threshold_dict['Peptide Threshold'] and threshold_dict['Precursor Threshold']:
-        overall_sample_df = pd.merge(pt_sample_df, pep_sample_df, on="Filename")
-        overall_sample_df = pd.merge(overall_sample_df, pre_sample_df, on="Filename")
-        overall_sample_df = overall_sample_df.sort_values('Filename')
-        return overall_sample_df
+    intensity_cv_threshold = threshold_dict['CV Percent Threshold']
 
-    elif protein_level and peptide_level and threshold_dict['Protein Threshold'] and threshold_dict['Peptide Threshold']:
-        overall_sample_df = pd.merge(pt_sample_df, pep_sample_df, on="Filename")
-        overall_sample_df = overall_sample_df.sort_values('Filename')
-        return overall_sample_df
+    level_results = {'Filenames': level_bundle['Filenames'],
+                     'PCA': level_bundle.get('PCA', {})}
 
-    elif protein_level and precursor_level and threshold_dict['Protein Threshold'] and threshold_dict['Precursor Threshold']:
-        overall_sample_df = pd.merge(pt_sample_df, pre_sample_df, on="Filename")
-        overall_sample_df = overall_sample_df.sort_values('Filename')
-        return overall_sample_df
+    level_results['Quant'] = get_quant_from_counts(level_bundle['Counts'], threshold_dict[f'{level} Threshold'], level, groupwise_comparison, groups)
 
-    elif peptide_level and precursor_level and threshold_dict['Peptide Threshold'] and threshold_dict['Precursor Threshold']:
-        overall_sample_df = pd.merge(pep_sample_df, pre_sample_df, on="Filename")
-        overall_sample_df = overall_sample_df.sort_values('Filename')
-        return overall_sample_df
+    level_cv = level_bundle['Level CV']
+    cv_sum = get_cv_cumulative_frequency(level_cv['Overall CV %'], level)
 
-    elif protein_level and threshold_dict['Protein Threshold']:
-        pt_sample_df = pt_sample_df.sort_values('Filename')
-        return pt_sample_df
+    if groupwise_comparison and intensity_cv_threshold and threshold_dict['Data Percent Threshold'] and level_bundle['Group Totals']:
+        group_cv_counts = {}
+        for group in groups:
+            total_under_cv = level_cv[level_cv[f'{group}-CV%'] <= intensity_cv_threshold][level].nunique()
+            group_cv_counts[group] = (level_bundle['Group Totals'][group], total_under_cv)
+        grouped_cv = get_grouped_cv_df(group_cv_counts, intensity_cv_threshold, threshold_dict['Data Percent Threshold'], level)
+    else:
+        grouped_cv = ""
 
-    elif peptide_level and threshold_dict['Peptide Threshold']:
-        pep_sample_df = pep_sample_df.sort_values('Filename')
-        return pep_sample_df
+    level_results['Intensity CVs'] = (level_cv, cv_sum, grouped_cv)
 
-    elif precursor_level and threshold_dict['Precursor Threshold']:
-        pre_sample_df = pre_sample_df.sort_values('Filename')
-        return pre_sample_df
+    if level_bundle['Common TIC'] is not None:
+        level_results['Common TIC'] = get_tic_summary(level_bundle['Common TIC'], level, threshold_dict['TIC CV Threshold'], groups, groupwise_comparison)
 
-def get_overall_df(protein_level, peptide_level, precursor_level, pt_group_df, pep_group_df, pre_group_df):
+    if level_bundle['Digestion Counts'] is not None:
+        level_results['Miscleavage'] = get_miscleavage_summary(level_bundle['Digestion Counts'], threshold_dict['Miscleavage Threshold'], groups, groupwise_comparison)
+
+    if level_bundle['Targeted Level'] is not None:
+        level_results['Targeted Level'] = level_bundle['Targeted Level']
+
+    return level_results
 
+def save_level_bundle(level, level_results, level_df, filenames, quant, level_cv, groups, input_dict, threshold_dict, pca_report_params, df_tic=None, dig_df=None, targeted=False):
     """
-    Combines group DataFrames for different levels (protein, peptide, precursor) based on availability.
+    Saves the raw metrics of a level to the metrics bundle of the run.
 
     Args:
-    protein_level, peptide_level, precursor_level (bool): Flags indicating the presence of each data level.
-    pt_group_df, pep_group_df, pre_group_df (DataFrame): Group DataFrames for each level.
+    level (str): The analysis level ('Protein', 'Peptide' or 'Precursor').
+    level_results (dict): Results of chunked_level_metrics, or False for a level held in memory.
+    level_df (DataFrame): Level intensities with a valid overall CV, for a level held in memory.
+    filenames (list): List of filenames.
+    quant (DataFrame): Quant DataFrame from get_quant.
+    level_cv (DataFrame): Level CV DataFrame from intensity_cvs.
+    groups (dict): Dictionary mapping groups to filenames for group-wise analysis.
+    input_dict (dict): Dictionary containing the input files and the metrics bundle directory.
+    threshold_dict (dict): Dictionary containing threshold values.
+    pca_report_params (dict): PCA report parameters, reused as they do not depend on the thresholds.
+    df_tic (DataFrame): [Optional] Common TIC DataFrame from common_tic.
+    dig_df (DataFrame): [Optional] Miscleavage DataFrame from miscleavage.
+    targeted (bool): [Optional] Whether the rows needed for iRT and selected peptide analysis are saved.
 
     Returns:
-    DataFrame: A combined group DataFrame based on the specified data levels.
+    None
     """
 
-    if protein_level and peptide_level and precursor_level:
-        overall_group_df = pd.merge(pt_group_df, pep_group_df, on="Group")
-        overall_group_df = pd.merge(overall_group_df, pre_group_df, on="Group")
-
-    elif protein_level and peptide_level:
-        overall_group_df = pd.merge(pt_group_df, pep_group_df, on="Group")
-
-    elif protein_level and precursor_level:
-        overall_group_df = pd.merge(pt_group_df, pre_group_df, on="Group")
-
-    elif peptide_level and precursor_level:
-        overall_group_df = pd.merge(pep_group_df, pre_group_df, on="Group")
-
-    elif protein_level:
-        pt_group_df = pt_group_df.sort_values('Group')
-        return pt_group_df
-
-    elif peptide_level:
-        pep_group_df = pep_group_df.sort_values('Group')
-        return pep_group_df
+    if level_results:
+        level_bundle = level_results['Bundle']
+    else:
+        if targeted:
+            targeted_peptides = set(pd.read_csv(input_dict['Peptide List'], sep="\t")['Peptide'].tolist()) if input_dict['Peptide List'] else set()
+            targeted_level = get_targeted_rows(level_df, level, threshold_dict['iRT Label'], targeted_peptides)
+        else:
+            targeted_level = None
 
-    elif precursor_level:
-        pre_group_df = pre_group_df.sort_values('Group')
-        return pre_group_df
+        level_bundle = get_level_bundle(level, filenames, quant.set_index('Filename')[f'{level} Number'], level_cv, groups,
+                                        df_tic=df_tic[['Filename', 'TIC']] if df_tic is not None else None,
+                                        digestion_counts=dig_df.set_index('Filename')[digestion_labels].T if dig_df is not None else None,
+                                        targeted_level=targeted_level)
 
-    overall_group_df = overall_group_df.sort_values('Group')
+    level_bundle['PCA'] = pca_report_params
+    save_bundle_part(input_dict['Metrics Bundle'], level, level_bundle)
 
-    return overall_group_df
+    return None
 
 #---------------------------------------------------------------------- GRAPH FUNCTIONS -----------------------------------------------------------------------------
 
-def get_quant_plot(quant_df, threshold, level, groupwise_comparison, groups, color_list):
+def get_quant_plot(quant_df, threshold, level, groupwise_comparison, groups, color_list, scale_threshold=large_cohort_samples):
 
     """
     Generates a plot for quantitative analysis of identified levels (protein/peptide/precursor).
@@ -555,6 +1472,7 @@ def get_quant_plot(quant_df, threshold, level, groupwise_comparison, groups, col
     groupwise_comparison (bool): Flag for performing group-wise comparison.
     groups (dict): Dictionary mapping groups for comparison.
     color_list (list): List of colors for plotting.
+    scale_threshold (int): [Optional] Number of samples above which the plot is drawn with run-order ticks and WebGL traces, 0 to never scale it.
 
     Returns:
     dict: A dictionary with parameters for reporting and plotting the quantitative analysis.
@@ -564,18 +1482,18 @@ def get_quant_plot(quant_df, threshold, level, groupwise_comparison, groups, col
     if groupwise_comparison:
         quant_df['Group'] = quant_df['Filename'].apply(groupname, args=[groups,])
         quant_df = quant_df.sort_values('Group')
-        quant_plot = px.bar(quant_df, x='Filename', y=f'{level} Number', title=f"Number of {level}s Identified", color="Group", color_discrete_sequence=color_list)
+        quant_plot = figure_spec('bar', quant_df, x='Filename', y=f'{level} Number', title=f"Number of {level}s Identified", color="Group", color_discrete_sequence=color_list)
     else:
-        quant_plot = px.bar(quant_df, x='Filename', y=f'{level} Number', title=f"Number of {level}s Identified")
+        quant_plot = figure_spec('bar', quant_df, x='Filename', y=f'{level} Number', title=f"Number of {level}s Identified")
 
     if threshold:
-        quant_plot.add_hline(y=threshold, line_dash="dot", annotation_text=f"{level} Threshold = {threshold}")
+        update_figure(quant_plot, 'add_hline', y=threshold, line_dash="dot", annotation_text=f"{level} Threshold = {threshold}")
 
-    quant_plot.update_xaxes(tickfont_size=6)
-    quant_plot.update_layout(margin=dict(l=20, r=20, t=20, b=20))
-    quant_plot.update_layout(title={'font': {'size': 9}})
+    update_figure(quant_plot, 'update_xaxes', tickfont_size=6)
+    update_figure(quant_plot, 'update_layout', margin=dict(l=20, r=20, t=20, b=20))
+    update_figure(quant_plot, 'update_layout', title={'font': {'size': 9}})
 
-    quant_div = plotly.io.to_html(quant_plot, include_plotlyjs=True, full_html=False, default_width='900px', default_height='450px')
+    quant_div = scale_figure_spec(quant_plot, scale_threshold)
 
     if level == "Protein":
         quant_report_params = {'protein_file': True,
@@ -628,14 +1546,12 @@ def intensity_cv_graphs(cv_sum, grouped_cv, level, groupwise_comparison, cv_perc
 
     grouped_cv[feature_column] = (grouped_cv[feature_col_name]/grouped_cv[f'{level} Number'])*100
 
-    grouped_cv_graph = px.bar(grouped_cv, x='Group', y=feature_column, title=f"Percentage of {level}s Identified under {cv_percent_threshold}% CV", color='Group', color_discrete_sequence=color_list)
-    grouped_cv_graph.add_hline(y=data_percent_threshold, line_dash="dot", annotation_text=f"Data Percent Threshold = {data_percent_threshold}")
-    grouped_cv_graph.update_xaxes(tickfont_size=6)
-    grouped_cv_graph.update_layout(
-            margin=dict(l=20, r=20, t=20, b=20),
-        )
-    grouped_cv_graph.update_layout(title={'font': {'size': 9}})
-    grouped_cv_plot = plotly.io.to_html(grouped_cv_graph, include_plotlyjs=False, full_html=False, default_width='900px', default_height='450px')
+    grouped_cv_graph = figure_spec('bar', grouped_cv, x='Group', y=feature_column, title=f"Percentage of {level}s Identified under {cv_percent_threshold}% CV", color='Group', color_discrete_sequence=color_list)
+    update_figure(grouped_cv_graph, 'add_hline', y=data_percent_threshold, line_dash="dot", annotation_text=f"Data Percent Threshold = {data_percent_threshold}")
+    update_figure(grouped_cv_graph, 'update_xaxes', tickfont_size=6)
+    update_figure(grouped_cv_graph, 'update_layout', margin=dict(l=20, r=20, t=20, b=20))
+    update_figure(grouped_cv_graph, 'update_layout', title={'font': {'size': 9}})
+    grouped_cv_plot = grouped_cv_graph
 
     if level == "Protein":
         intensity_cv_report_params = {'protein_file': True,
@@ -654,7 +1570,7 @@ def intensity_cv_graphs(cv_sum, grouped_cv, level, groupwise_comparison, cv_perc
 
     return intensity_cv_report_params
 
-def pca_plot(df_level, level,filenames, groups, color_list): #call it only if groupwise is given
+def pca_plot(df_level, level,filenames, groups, color_list, pca_options, level_file=False, batch_size=0): #call it only if groupwise is given
     """
     Generates a PCA plot for different levels of data.
 
@@ -664,39 +1580,34 @@ def pca_plot(df_level, level,filenames, groups, color_list): #call it only if gr
     filenames (list): List of filenames used in the analysis.
     groups (dict): Dictionary mapping groups for the analysis.
     color_list (list): List of colors for plotting.
+    pca_options (dict): PCA options - missing value handling, feature filters, solver and cache directory.
+    level_file (str): [Optional] Path to the intensity file, used when the intensities are streamed instead of given in df_level.
+    batch_size (int): [Optional] Number of samples read at once from level_file.
 
     Returns:
     dict: Dictionary containing PCA plot and description for reporting.
     """
 
-    #keeping only required columns and filling NAs with 0
-    df = df_level[[level]+filenames]
-    df.fillna(0, inplace=True)
+    #samples ordered by group for the plot legend
+    samples = sorted(filenames, key=lambda filename: groupname(filename, groups))
+    sample_groups = [groupname(filename, groups) for filename in samples]
 
-    samples = df.drop(level, axis=1).columns.tolist()
-    df.set_index(level, inplace=True)
-    df = df.T
-    df['Samples'] = df.index
-    df.reset_index(inplace=True, drop=True)
-
-    df['Group'] = df['Samples'].apply(groupname, args=[groups, ])
-    df.sort_values(by=['Group'], inplace=True)
-    samples = df.drop(['Samples', 'Group'], axis=1).columns.tolist()
-    features = df.loc[:, samples]
-    features = StandardScaler().fit_transform(features)
+    if level_file:
+        pca_results = streamed_level_pca(level_file, samples, level, pca_options, batch_size)
+    else:
+        pca_results = level_pca(df_level, samples, level, pca_options)
 
-    pca3 = PCA(n_components=3)
-    pC3 = pca3.fit_transform(features)
-    total_var = pca3.explained_variance_ratio_.sum() * 100
+    pC3 = pca_results['Scores']
+    total_var = pca_results['Explained Variance Ratio'].sum() * 100
 
-    pca_fig3 = px.scatter_3d(
-        pC3, x=0, y=1, z=2, color=df['Group'],
+    pca_fig3 = figure_spec('scatter_3d',
+        pC3, x=0, y=1, z=2, color=sample_groups,
         color_discrete_sequence=color_list,
         title=f'Total Explained Variance: {total_var:.2f}%',
         labels={'0': 'PC 1', '1': 'PC 2', '2': 'PC 3'}
     )
 
-    pca3_graph = plotly.io.to_html(pca_fig3, include_plotlyjs=False, full_html=False, default_width='900px', default_height='450px')
+    pca3_graph = pca_fig3
 
     if level == "Protein":
         pca_report_params = {'protein_pca_plot':pca3_graph,
@@ -712,7 +1623,7 @@ def pca_plot(df_level, level,filenames, groups, color_list): #call it only if gr
 
     return pca_report_params
 
-def common_tic_plot(df_tic, group_tic, level, tic_cv_threshold, groupwise_comparison, groups, color_list):
+def common_tic_plot(df_tic, group_tic, level, tic_cv_threshold, groupwise_comparison, groups, color_list, scale_threshold=large_cohort_samples):
 
     """
     Creates a Total Ion Current (TIC) plot for the specified analysis level.
@@ -725,6 +1636,7 @@ def common_tic_plot(df_tic, group_tic, level, tic_cv_threshold, groupwise_compar
     groupwise_comparison (bool): Indicates if group-wise comparison is to be done.
     groups (dict): Dictionary mapping groups for analysis.
     color_list (list): List of colors for plotting.
+    scale_threshold (int): [Optional] Number of samples above which the plot is drawn with run-order ticks and WebGL traces, 0 to never scale it.
 
     Returns:
     dict: Dictionary containing TIC plot and description for reporting.
@@ -733,16 +1645,14 @@ def common_tic_plot(df_tic, group_tic, level, tic_cv_threshold, groupwise_compar
     if groupwise_comparison:
         df_tic['Group'] = df_tic['Filename'].apply(groupname, args=[groups, ])
         df_tic = df_tic.sort_values('Group')
-        tic_bar = px.bar(df_tic, x='Filename', y='TIC', title=f"Common {level} TIC", color=df_tic['Group'].tolist(), color_discrete_sequence=color_list)
+        tic_bar = figure_spec('bar', df_tic, x='Filename', y='TIC', title=f"Common {level} TIC", color=df_tic['Group'].tolist(), color_discrete_sequence=color_list)
     else:
-        tic_bar = px.bar(df_tic, x='Filename', y='TIC', title=f"Common {level} TIC")
+        tic_bar = figure_spec('bar', df_tic, x='Filename', y='TIC', title=f"Common {level} TIC")
 
-    tic_bar.update_xaxes(tickfont_size=6)
-    tic_bar.update_layout(
-        margin=dict(l=20, r=20, t=20, b=20),
-    )
-    tic_bar.update_layout(title={'font': {'size': 9}})
-    tic_bar_graph = plotly.io.to_html(tic_bar, include_plotlyjs=True, full_html=False, default_width='900px', default_height='450px')
+    update_figure(tic_bar, 'update_xaxes', tickfont_size=6)
+    update_figure(tic_bar, 'update_layout', margin=dict(l=20, r=20, t=20, b=20))
+    update_figure(tic_bar, 'update_layout', title={'font': {'size': 9}})
+    tic_bar_graph = scale_figure_spec(tic_bar, scale_threshold)
 
     if level == "Peptide":
         common_tic_report_params = {'common_peptide_tic_plot': tic_bar_graph,
@@ -754,17 +1664,15 @@ def common_tic_plot(df_tic, group_tic, level, tic_cv_threshold, groupwise_compar
 
     if groupwise_comparison:
 
-        cv_bar = px.bar(group_tic, x='Group', y='CV %', title=f'Common {level} TIC Group CV%', color=group_tic['Group'].tolist(), color_discrete_sequence=color_list)
+        cv_bar = figure_spec('bar', group_tic, x='Group', y='CV %', title=f'Common {level} TIC Group CV%', color=group_tic['Group'].tolist(), color_discrete_sequence=color_list)
 
         if tic_cv_threshold:
-            cv_bar.add_hline(y=tic_cv_threshold, line_dash="dot", annotation_text=f"TIC CV Threshold = {tic_cv_threshold}")
+            update_figure(cv_bar, 'add_hline', y=tic_cv_threshold, line_dash="dot", annotation_text=f"TIC CV Threshold = {tic_cv_threshold}")
 
-        cv_bar.update_xaxes(tickfont_size=6)
-        cv_bar.update_layout(
-            margin=dict(l=20, r=20, t=20, b=20),
-        )
-        cv_bar.update_layout(title={'font': {'size': 9}})
-        cv_bar_graph = plotly.io.to_html(cv_bar, include_plotlyjs=True, full_html=False, default_width='900px', default_height='450px')
+        update_figure(cv_bar, 'update_xaxes', tickfont_size=6)
+        update_figure(cv_bar, 'update_layout', margin=dict(l=20, r=20, t=20, b=20))
+        update_figure(cv_bar, 'update_layout', title={'font': {'size': 9}})
+        cv_bar_graph = cv_bar
 
         if level == "Peptide":
             common_tic_report_params['common_peptide_tic_group_cv'] = cv_bar_graph
@@ -776,7 +1684,7 @@ def common_tic_plot(df_tic, group_tic, level, tic_cv_threshold, groupwise_compar
 
     return common_tic_report_params
 
-def miscleavage_plot(dig_df, miscleavage_threshold, groupwise_comparison, groups, color_list):
+def miscleavage_plot(dig_df, miscleavage_threshold, groupwise_comparison, groups, color_list, scale_threshold=large_cohort_samples):
 
     """
     Generates a plot showing the percentage of no missed cleavages.
@@ -787,6 +1695,7 @@ def miscleavage_plot(dig_df, miscleavage_threshold, groupwise_comparison, groups
     groupwise_comparison (bool): Indicates if group-wise comparison is to be done.
     groups (dict): Dictionary mapping groups for analysis.
     color_list (list): List of colors for plotting.
+    scale_threshold (int): [Optional] Number of samples above which the plot is drawn with run-order ticks and WebGL traces, 0 to never scale it.
 
     Returns:
     dict: Dictionary containing miscleavage plot and description for reporting.
@@ -795,53 +1704,51 @@ def miscleavage_plot(dig_df, miscleavage_threshold, groupwise_comparison, groups
     if groupwise_comparison:
         dig_df['Group'] = dig_df['Filename'].apply(groupname, args=[groups, ])
         dig_df = dig_df.sort_values('Group')
-        dig = px.bar(dig_df, x='Filename', y='0 missed cleavage percentage', title="Percentage of No Missed Cleavages", color=dig_df['Group'].tolist(), color_discrete_sequence=color_list)
+        dig = figure_spec('bar', dig_df, x='Filename', y='0 missed cleavage percentage', title="Percentage of No Missed Cleavages", color=dig_df['Group'].tolist(), color_discrete_sequence=color_list)
     else:
-        dig = px.bar(dig_df, x='Filename', y='0 missed cleavage percentage', title="Percentage of No Missed Cleavages")
+        dig = figure_spec('bar', dig_df, x='Filename', y='0 missed cleavage percentage', title="Percentage of No Missed Cleavages")
 
     if miscleavage_threshold:
-        dig.add_hline(y=miscleavage_threshold, line_dash="dot", annotation_text=f"No Missed Cleavage Percentage Threshold = {miscleavage_threshold}")
+        update_figure(dig, 'add_hline', y=miscleavage_threshold, line_dash="dot", annotation_text=f"No Missed Cleavage Percentage Threshold = {miscleavage_threshold}")
 
-    dig.update_xaxes(tickfont_size=6)
-    dig.update_layout(margin=dict(l=20, r=20, t=20, b=20))
-    dig.update_layout(title={'font': {'size': 9}})
+    update_figure(dig, 'update_xaxes', tickfont_size=6)
+    update_figure(dig, 'update_layout', margin=dict(l=20, r=20, t=20, b=20))
+    update_figure(dig, 'update_layout', title={'font': {'size': 9}})
 
-    dig_graph = plotly.io.to_html(dig, include_plotlyjs=True, full_html=False, default_width='900px', default_height='450px')
+    dig_graph = scale_figure_spec(dig, scale_threshold)
 
     miscleavage_report_params = {'percent_miscleavage_plot': dig_graph,
                                 'percent_miscleavage_description': f"Total Number of 0 miscleaved peptides found in each sample. If the percentage of 0 miscleaved peptides is under the miscleavage threshold value of {miscleavage_threshold}%, this could indicate issues with sample preparation and digestion protocols."}
 
     return miscleavage_report_params
 
-def selected_peptide_plots(df_level, filenames, level, level2, coverage_threshold, color_list):
+def selected_peptide_plots(df_level, filenames, level, level2, coverage_threshold, color_list, scale_threshold=large_cohort_samples):
 
     #Intensity Distribution Plot
     int_level = df_level[[level] + filenames]
     df_int = pd.melt(int_level, id_vars=[level], var_name="Filename", value_name="Intensity")
 
     if level2 == "iRT":
-        int_plot = px.line(df_int, x='Filename', y="Intensity", title=f"Intensity Distribution Across iRT {level}s", color=level, color_discrete_sequence=color_list)
+        int_plot = figure_spec('line', df_int, x='Filename', y="Intensity", title=f"Intensity Distribution Across iRT {level}s", color=level, color_discrete_sequence=color_list)
     else:
-        int_plot = px.line(df_int, x='Filename', y="Intensity", title=f"Intensity Distribution Across {level}s", color=level, color_discrete_sequence=color_list)
+        int_plot = figure_spec('line', df_int, x='Filename', y="Intensity", title=f"Intensity Distribution Across {level}s", color=level, color_discrete_sequence=color_list)
 
-    int_plot.update_xaxes(tickfont_size=6)
-    int_plot.update_layout(margin=dict(l=20, r=20, t=20, b=20))
-    int_plot.update_layout(title={'font': {'size': 9}})
-    int_dist = plotly.io.to_html(int_plot, include_plotlyjs=True, full_html=False, default_width='900px', default_height='450px')
+    update_figure(int_plot, 'update_xaxes', tickfont_size=6)
+    update_figure(int_plot, 'update_layout', margin=dict(l=20, r=20, t=20, b=20))
+    update_figure(int_plot, 'update_layout', title={'font': {'size': 9}})
+    int_dist = scale_figure_spec(int_plot, scale_threshold)
 
     #Peptide/Precursor Coverage Across Samples
     int_cov = df_level[[level, 'Coverage %']]
     if level2 == "iRT":
-        cov = px.bar(int_cov, x=level, y="Coverage %", title=f"Coverage Percentage of iRT {level}s", color=int_cov[level].tolist(), color_discrete_sequence=color_list)
+        cov = figure_spec('bar', int_cov, x=level, y="Coverage %", title=f"Coverage Percentage of iRT {level}s", color=int_cov[level].tolist(), color_discrete_sequence=color_list)
     else:
-        cov = px.bar(int_cov, x=level, y="Coverage %", title=f"Coverage Percentage of {level}s", color=int_cov[level].tolist(), color_discrete_sequence=color_list)
-    cov.add_hline(y=coverage_threshold)
-    cov.update_xaxes(tickfont_size=6)
-    cov.update_layout(title={'font': {'size': 9}})
-    cov.update_layout(
-        margin=dict(l=20, r=20, t=20, b=20),
-    )
-    cov_plot = plotly.io.to_html(cov, include_plotlyjs=True, full_html=False, default_width='900px', default_height='450px')
+        cov = figure_spec('bar', int_cov, x=level, y="Coverage %", title=f"Coverage Percentage of {level}s", color=int_cov[level].tolist(), color_discrete_sequence=color_list)
+    update_figure(cov, 'add_hline', y=coverage_threshold)
+    update_figure(cov, 'update_xaxes', tickfont_size=6)
+    update_figure(cov, 'update_layout', title={'font': {'size': 9}})
+    update_figure(cov, 'update_layout', margin=dict(l=20, r=20, t=20, b=20))
+    cov_plot = cov
 
     if level2 == "iRT":
         selected_peptide_report_params = {'irt_intensity_plot': int_dist,
@@ -878,11 +1785,9 @@ def cumulative_freq_graph(protein_level, peptide_level, precursor_level, pt_cv_s
                     var_name="Label",
                     value_name="Cumulative Frequency %")
 
-        cv_line = px.line(cv_sum, x='CV%', y="Cumulative Frequency %", title="Number of Proteins, Peptides and Precursors under CV% (Across all Samples)", color="Label", line_shape="spline", markers=True)
-        cv_line.update_xaxes(tickfont_size=6)
-        cv_line.update_layout(
-                margin=dict(l=20, r=20, t=20, b=20)
-        )
+        cv_line = figure_spec('line', cv_sum, x='CV%', y="Cumulative Frequency %", title="Number of Proteins, Peptides and Precursors under CV% (Across all Samples)", color="Label", line_shape="spline", markers=True)
+        update_figure(cv_line, 'update_xaxes', tickfont_size=6)
+        update_figure(cv_line, 'update_layout', margin=dict(l=20, r=20, t=20, b=20))
 
     elif protein_level and peptide_level:
         df = pd.merge(pt_cv_sum, pep_cv_sum, on="CV%")
@@ -891,11 +1796,9 @@ def cumulative_freq_graph(protein_level, peptide_level, precursor_level, pt_cv_s
                     var_name="Label",
                     value_name="Cumulative Frequency %")
 
-        cv_line = px.line(cv_sum, x='CV%', y="Cumulative Frequency %", title="Number of Proteins and Peptides under CV% (Across all Samples)", color="Label", line_shape="spline", markers=True)
-        cv_line.update_xaxes(tickfont_size=6)
-        cv_line.update_layout(
-                margin=dict(l=20, r=20, t=20, b=20)
-        )
+        cv_line = figure_spec('line', cv_sum, x='CV%', y="Cumulative Frequency %", title="Number of Proteins and Peptides under CV% (Across all Samples)", color="Label", line_shape="spline", markers=True)
+        update_figure(cv_line, 'update_xaxes', tickfont_size=6)
+        update_figure(cv_line, 'update_layout', margin=dict(l=20, r=20, t=20, b=20))
 
     elif protein_level and precursor_level:
         df = pd.merge(pt_cv_sum, pre_cv_sum, on="CV%")
@@ -904,11 +1807,9 @@ def cumulative_freq_graph(protein_level, peptide_level, precursor_level, pt_cv_s
                     var_name="Label",
                     value_name="Cumulative Frequency %")
 
-        cv_line = px.line(cv_sum, x='CV%', y="Cumulative Frequency %", title="Number of Proteins and Precursors under CV% (Across all Samples)", color="Label", line_shape="spline", markers=True)
-        cv_line.update_xaxes(tickfont_size=6)
-        cv_line.update_layout(
-                margin=dict(l=20, r=20, t=20, b=20)
-        )
+        cv_line = figure_spec('line', cv_sum, x='CV%', y="Cumulative Frequency %", title="Number of Proteins and Precursors under CV% (Across all Samples)", color="Label", line_shape="spline", markers=True)
+        update_figure(cv_line, 'update_xaxes', tickfont_size=6)
+        update_figure(cv_line, 'update_layout', margin=dict(l=20, r=20, t=20, b=20))
 
     elif peptide_level and precursor_level:
         df = pd.merge(pep_cv_sum, pre_cv_sum, on="CV%")
@@ -917,35 +1818,27 @@ def cumulative_freq_graph(protein_level, peptide_level, precursor_level, pt_cv_s
                     var_name="Label",
                     value_name="Cumulative Frequency %")
 
-        cv_line = px.line(cv_sum, x='CV%', y="Cumulative Frequency %", title="Number of Peptides and Precursors under CV% (Across all Samples)", color="Label", line_shape="spline", markers=True)
-        cv_line.update_xaxes(tickfont_size=6)
-        cv_line.update_layout(
-                margin=dict(l=20, r=20, t=20, b=20)
-        )
+        cv_line = figure_spec('line', cv_sum, x='CV%', y="Cumulative Frequency %", title="Number of Peptides and Precursors under CV% (Across all Samples)", color="Label", line_shape="spline", markers=True)
+        update_figure(cv_line, 'update_xaxes', tickfont_size=6)
+        update_figure(cv_line, 'update_layout', margin=dict(l=20, r=20, t=20, b=20))
 
     elif protein_level:
-        cv_line = px.line(pt_cv_sum, x='CV%', y="Protein Cumulative Frequency %", title="Number of Proteins under CV% (Across all Samples)", line_shape="spline", markers=True)
-        cv_line.update_xaxes(tickfont_size=6)
-        cv_line.update_layout(
-                margin=dict(l=20, r=20, t=20, b=20)
-        )
+        cv_line = figure_spec('line', pt_cv_sum, x='CV%', y="Protein Cumulative Frequency %", title="Number of Proteins under CV% (Across all Samples)", line_shape="spline", markers=True)
+        update_figure(cv_line, 'update_xaxes', tickfont_size=6)
+        update_figure(cv_line, 'update_layout', margin=dict(l=20, r=20, t=20, b=20))
 
     elif peptide_level:
-        cv_line = px.line(cv_sum, x='CV%', y="Peptide Cumulative Frequency %", title="Number of Peptides under CV% (Across all Samples)", line_shape="spline", markers=True)
-        cv_line.update_xaxes(tickfont_size=6)
-        cv_line.update_layout(
-                margin=dict(l=20, r=20, t=20, b=20)
-        )
+        cv_line = figure_spec('line', cv_sum, x='CV%', y="Peptide Cumulative Frequency %", title="Number of Peptides under CV% (Across all Samples)", line_shape="spline", markers=True)
+        update_figure(cv_line, 'update_xaxes', tickfont_size=6)
+        update_figure(cv_line, 'update_layout', margin=dict(l=20, r=20, t=20, b=20))
 
     elif precursor_level:
-        cv_line = px.line(cv_sum, x='CV%', y="Precursor Cumulative Frequency %", title="Number of Precursors under CV% (Across all Samples)", line_shape="spline", markers=True)
-        cv_line.update_xaxes(tickfont_size=6)
-        cv_line.update_layout(
-                margin=dict(l=20, r=20, t=20, b=20)
-        )
+        cv_line = figure_spec('line', cv_sum, x='CV%', y="Precursor Cumulative Frequency %", title="Number of Precursors under CV% (Across all Samples)", line_shape="spline", markers=True)
+        update_figure(cv_line, 'update_xaxes', tickfont_size=6)
+        update_figure(cv_line, 'update_layout', margin=dict(l=20, r=20, t=20, b=20))
 
-    cv_line.update_layout(title={'font': {'size': 9}})
-    cumfreq_cv_line = plotly.io.to_html(cv_line, include_plotlyjs=True, full_html=False, default_width='900px', default_height='450px')
+    update_figure(cv_line, 'update_layout', title={'font': {'size': 9}})
+    cumfreq_cv_line = cv_line
 
     cumfreq_report_params = {'cumulative_frequency_plot': cumfreq_cv_line,
                              'cumulative_frequency_description': "Cumulative Frequency % of calculated CV% of intensity values across all samples. This reveals the degree of variability across the dataset, higher CVs indicate greater variation that could be stemming from sample preparation, data acquisition or instrument performance. Lower CVs indicate higher reproducibility of protein, peptide or precursor intensities across replicate samples."}
@@ -954,306 +1847,538 @@ def cumulative_freq_graph(protein_level, peptide_level, precursor_level, pt_cv_s
 
 #-------------------------------------------------------------------- MAIN FUNCTION --------------------------------------------------------------------------------
 
-def calculate_idbased_metrics(out_dir, reportname, input_dict, threshold_dict, groups, groupwise_comparison):
+def protein_level_metrics(out_dir, reportname, input_dict, threshold_dict, groups, groupwise_comparison, pca_options, level_df=None):
+    """
+    Calculates the protein level metrics (quant and intensity CVs), saves the Protein Level Excel report and gets the report parameters.
+
+    Args:
+    out_dir (str): Output directory.
+    reportname (str): Report name used for the output files.
+    input_dict (dict): Dictionary containing the input files and options.
+    threshold_dict (dict): Dictionary containing threshold values.
+    groups (dict): Dictionary mapping groups to filenames for group-wise analysis.
+    groupwise_comparison (bool): Flag indicating if group-wise comparison should be performed.
+    pca_options (dict): PCA options, from get_pca_options.
+    level_df (DataFrame): [Optional] Protein level intensities, read from the protein file if not given.
+
+    Returns:
+    tuple: Protein sample DataFrame, group DataFrame, CV cumulative frequency DataFrame and report parameters.
+    """
+
+    pt_group_df = ""
+    matrix_workers = input_dict.get('Matrix Workers') or 1
+    scale_threshold = input_dict.get('Plot Scale Threshold', large_cohort_samples)
+
+
+    logging.info("Getting Protein Level QC Metrics")
 
-    protein_report_params = {}
-    peptide_report_params = {}
-    precursor_report_params = {}
+    if input_dict.get('Rethreshold'):
+        level_results = get_level_results(load_bundle_part(input_dict['Metrics Bundle'], "Protein"), "Protein", threshold_dict, groupwise_comparison, groups)
+    elif input_dict.get('Chunk Memory'):
+        level_results = chunked_level_metrics(input_dict['Protein Level'], "Protein", input_dict, threshold_dict, groupwise_comparison, groups)
+    else:
+        level_results = False
 
-    if input_dict['Protein Level']:
+    if level_results:
+        filenames = level_results['Filenames']
 
-        logging.info("Getting Protein Level QC Metrics")
+        pt_quant, pt_grouped_quant = level_results['Quant']
+        pt_level_cv, pt_cv_sum, pt_grouped_cv = level_results['Intensity CVs']
 
-        pt_level = pd.read_csv(input_dict['Protein Level'], sep="\t")
-        pt_level = pt_level[pt_level.columns.tolist()].replace({'0':np.nan, 0:np.nan})
+    else:
+        if level_df is not None:
+            pt_level = level_df
+        else:
+            pt_level = read_level_file(input_dict['Protein Level'], input_dict.get('Cache Directory'))
 
         filenames = pt_level.columns.tolist()
         filenames.remove("Protein")
 
         #protein quant and intensity CVs
-        pt_quant, pt_grouped_quant = get_quant(pt_level, filenames, threshold_dict['Protein Threshold'], "Protein", groupwise_comparison, groups)
-        pt_level_cv, pt_cv_sum, pt_grouped_cv = intensity_cvs(pt_level, threshold_dict['CV Percent Threshold'], threshold_dict['Data Percent Threshold'], filenames, "Protein", groupwise_comparison, groups)
+        pt_matrix = build_intensity_matrix(pt_level, filenames)
+        pt_quant, pt_grouped_quant = get_quant(pt_matrix, threshold_dict['Protein Threshold'], "Protein", groupwise_comparison, groups)
+        pt_level_cv, pt_cv_sum, pt_grouped_cv = intensity_cvs(pt_level, threshold_dict['CV Percent Threshold'], threshold_dict['Data Percent Threshold'], filenames, "Protein", groupwise_comparison, groups, matrix_workers, out_dir)
 
-        #getting protein level report parameters - plots + descriptions
-        pt_quant_report_params = get_quant_plot(pt_quant, threshold_dict['Protein Threshold'], "Protein", groupwise_comparison, groups, color_list)
-        if groupwise_comparison:
-            pt_intensity_cv_report_params = intensity_cv_graphs(pt_cv_sum, pt_grouped_cv, "Protein", groupwise_comparison, threshold_dict['CV Percent Threshold'], threshold_dict['Data Percent Threshold'], color_list)
-            protein_pca_report_params = pca_plot(pt_level,"Protein",filenames, groups, color_list)
+        #the remaining protein metrics use the features with a valid overall CV
+        pt_level = pt_level.loc[pt_level_cv.index]
+
+    #getting protein level report parameters - plots + descriptions
+    pt_quant_report_params = get_quant_plot(pt_quant, threshold_dict['Protein Threshold'], "Protein", groupwise_comparison, groups, color_list, scale_threshold)
+    if groupwise_comparison:
+        pt_intensity_cv_report_params = intensity_cv_graphs(pt_cv_sum, pt_grouped_cv, "Protein", groupwise_comparison, threshold_dict['CV Percent Threshold'], threshold_dict['Data Percent Threshold'], color_list)
+        if input_dict.get('Rethreshold'):
+            protein_pca_report_params = level_results['PCA']
+        elif input_dict.get('Chunk Memory'):
+            protein_pca_report_params = pca_plot("", "Protein", filenames, groups, color_list, pca_options, input_dict['Protein Level'], level_results['PCA Batch Size'])
         else:
-            pt_intensity_cv_report_params = {}
-            protein_pca_report_params = {}
+            protein_pca_report_params = pca_plot(pt_level, "Protein", filenames, groups, color_list, pca_options)
+    else:
+        pt_intensity_cv_report_params = {}
+        protein_pca_report_params = {}
 
-        protein_report_params = dict(tuple(pt_quant_report_params.items()) + tuple(pt_intensity_cv_report_params.items()) + tuple(protein_pca_report_params.items()))
+    protein_report_params = dict(tuple(pt_quant_report_params.items()) + tuple(pt_intensity_cv_report_params.items()) + tuple(protein_pca_report_params.items()))
+    protein_report_params['protein_tuning'] = get_level_tuning("Protein", pt_quant, pt_level_cv, pt_grouped_cv, threshold_dict)
 
-        logging.info(f"Saving Protein Level QC Report to {out_dir}/{reportname}_ProteinLevel_QC_Report.xlsx")
+    logging.info(f"Saving Protein Level QC Report to {out_dir}/{reportname}_ProteinLevel_QC_Report.xlsx")
 
-        #saving dataframes to excel document
-        protein_report_writer = pd.ExcelWriter(f"{out_dir}/{reportname}_ProteinLevel_QC_Report.xlsx", engine='xlsxwriter')
-        pt_quant.to_excel(protein_report_writer, index=False, sheet_name='Protein Quant Summary')
-        if groupwise_comparison and threshold_dict['Protein Threshold']:
-            pt_grouped_quant.to_excel(protein_report_writer, index=False, sheet_name='Groupwise Protein Quant')
-        pt_level_cv.to_excel(protein_report_writer, index=False, sheet_name='Protein Level CV')
-        if groupwise_comparison:
-            pt_grouped_cv.to_excel(protein_report_writer, index=False, sheet_name='Protein CV Group Summary')
-        protein_report_writer.close()
+    #saving dataframes to excel document
+    protein_report_writer = pd.ExcelWriter(f"{out_dir}/{reportname}_ProteinLevel_QC_Report.xlsx", engine='xlsxwriter')
+    pt_quant.to_excel(protein_report_writer, index=False, sheet_name='Protein Quant Summary')
+    if groupwise_comparison and threshold_dict['Protein Threshold']:
+        pt_grouped_quant.to_excel(protein_report_writer, index=False, sheet_name='Groupwise Protein Quant')
+    pt_level_cv.to_excel(protein_report_writer, index=False, sheet_name='Protein Level CV')
+    if groupwise_comparison:
+        pt_grouped_cv.to_excel(protein_report_writer, index=False, sheet_name='Protein CV Group Summary')
+    protein_report_writer.close()
 
-        #getting protein overall sample dataframe
-        if threshold_dict["Protein Threshold"]:
-            pt_sample_df = pt_quant[['Filename', f'Protein Threshold = {threshold_dict["Protein Threshold"]}']]
-        else:
-            pt_sample_df = ""
+    #raw metrics of the level, saved so other thresholds can be applied without reading the intensities again
+    if input_dict.get('Metrics Bundle') and not input_dict.get('Rethreshold'):
+        save_level_bundle("Protein", level_results, None, filenames, pt_quant, pt_level_cv, groups, input_dict, threshold_dict, protein_pca_report_params)
 
-        #getting protein group overall dataframe
-        if groupwise_comparison:
-            pt_group_df = pd.merge(pt_grouped_quant, pt_grouped_cv, on="Group")
-            pt_group_df = pt_group_df[["Group",
-                               "Protein Threshold QC Status",
-                               f"{threshold_dict['Data Percent Threshold']}% Proteins <= {threshold_dict['CV Percent Threshold']}% CV"]]
+    #getting protein overall sample dataframe
+    if threshold_dict["Protein Threshold"]:
+        pt_sample_df = pt_quant[['Filename', f'Protein Threshold = {threshold_dict["Protein Threshold"]}']]
+    else:
+        pt_sample_df = ""
+
+    #getting protein group overall dataframe
+    if groupwise_comparison:
+        pt_group_df = pd.merge(pt_grouped_quant, pt_grouped_cv, on="Group")
+        pt_group_df = pt_group_df[["Group",
+                           "Protein Threshold QC Status",
+                           f"{threshold_dict['Data Percent Threshold']}% Proteins <= {threshold_dict['CV Percent Threshold']}% CV"]]
+
+    return (pt_sample_df, pt_group_df, pt_cv_sum, protein_report_params)
+
+def peptide_level_metrics(out_dir, reportname, input_dict, threshold_dict, groups, groupwise_comparison, pca_options, level_df=None):
+    """
+    Calculates the peptide level metrics (quant, intensity CVs, common TIC, missed cleavages, PCA, iRT and selected peptides), saves the Peptide Level Excel report and gets the report parameters.
+
+    Args:
+    out_dir (str): Output directory.
+    reportname (str): Report name used for the output files.
+    input_dict (dict): Dictionary containing the input files and options.
+    threshold_dict (dict): Dictionary containing threshold values.
+    groups (dict): Dictionary mapping groups to filenames for group-wise analysis.
+    groupwise_comparison (bool): Flag indicating if group-wise comparison should be performed.
+    pca_options (dict): PCA options, from get_pca_options.
+    level_df (DataFrame): [Optional] Peptide level intensities, read from the peptide file if not given.
+
+    Returns:
+    tuple: Peptide sample DataFrame, group DataFrame, CV cumulative frequency DataFrame and report parameters.
+    """
+
+    pep_group_df = ""
+    matrix_workers = input_dict.get('Matrix Workers') or 1
+    scale_threshold = input_dict.get('Plot Scale Threshold', large_cohort_samples)
+
+
+    logging.info("Getting Peptide Level QC Metrics")
 
-    if input_dict['Peptide Level']:
+    if input_dict.get('Rethreshold'):
+        level_results = get_level_results(load_bundle_part(input_dict['Metrics Bundle'], "Peptide"), "Peptide", threshold_dict, groupwise_comparison, groups)
+    elif input_dict.get('Chunk Memory'):
+        level_results = chunked_level_metrics(input_dict['Peptide Level'], "Peptide", input_dict, threshold_dict, groupwise_comparison, groups)
+    else:
+        level_results = False
+
+    if level_results:
+        filenames = level_results['Filenames']
 
-        logging.info("Getting Peptide Level QC Metrics")
+        #only the rows needed for iRT and selected peptide analysis are kept in memory
+        pep_level = level_results.get('Targeted Level')
+        if pep_level is not None:
+            pep_matrix = build_intensity_matrix(pep_level, filenames)
+        pep_quant, pep_grouped_quant = level_results['Quant']
+        pep_level_cv, pep_cv_sum, pep_grouped_cv = level_results['Intensity CVs']
+        pep_tic, pep_grouped_tic = level_results['Common TIC']
 
-        pep_level = pd.read_csv(input_dict['Peptide Level'], sep="\t")
-        pep_level = pep_level[pep_level.columns.tolist()].replace({'0':np.nan, 0:np.nan})
+    else:
+        if level_df is not None:
+            pep_level = level_df
+        else:
+            pep_level = read_level_file(input_dict['Peptide Level'], input_dict.get('Cache Directory'))
 
         filenames = pep_level.columns.tolist()
         filenames.remove("Protein")
         filenames.remove("Peptide")
 
         #peptide quant, intensity_cvs, tic, missed cleavage percentage, peptide intensity distribution
-        pep_quant, pep_grouped_quant = get_quant(pep_level, filenames, threshold_dict['Peptide Threshold'], "Peptide", groupwise_comparison, groups)
-        pep_level_cv, pep_cv_sum, pep_grouped_cv = intensity_cvs(pep_level, threshold_dict['CV Percent Threshold'], threshold_dict['Data Percent Threshold'], filenames, "Peptide", groupwise_comparison, groups)
-        pep_tic, pep_grouped_tic = common_tic(pep_level, "Peptide", threshold_dict['TIC CV Threshold'], filenames, groups, groupwise_comparison)
+        pep_matrix = build_intensity_matrix(pep_level, filenames)
+        pep_quant, pep_grouped_quant = get_quant(pep_matrix, threshold_dict['Peptide Threshold'], "Peptide", groupwise_comparison, groups)
+        pep_level_cv, pep_cv_sum, pep_grouped_cv = intensity_cvs(pep_level, threshold_dict['CV Percent Threshold'], threshold_dict['Data Percent Threshold'], filenames, "Peptide", groupwise_comparison, groups, matrix_workers, out_dir)
+
+        #the remaining peptide metrics use the features with a valid overall CV
+        valid_rows = pep_level.index.get_indexer(pep_level_cv.index)
+        pep_level = pep_level.iloc[valid_rows]
+        pep_matrix = subset_intensity_matrix(pep_matrix, valid_rows)
+        pep_tic, pep_grouped_tic = common_tic(pep_matrix, "Peptide", threshold_dict['TIC CV Threshold'], groups, groupwise_comparison)
+
+    if groupwise_comparison:
+        pep_group_df = pd.merge(pep_grouped_quant, pep_grouped_cv, on="Group")
+        pep_group_df = pd.merge(pep_group_df, pep_grouped_tic, on="Group")
+
+    if threshold_dict['Enzyme']:
+        if level_results:
+            dig_df, dig_grouped = level_results['Miscleavage']
+        else:
+            dig_df, dig_grouped = miscleavage(pep_level, threshold_dict['Enzyme'], threshold_dict['Miscleavage Threshold'], filenames, groups, groupwise_comparison, input_dict.get('Cache Directory'), matrix_workers, out_dir)
+        if groupwise_comparison:
+            pep_group_df = pd.merge(pep_group_df, dig_grouped, on="Group")
+    else:
+        dig_df, dig_grouped = "", ""
+
+    if threshold_dict['iRT Label'] or input_dict['Peptide List']:
+        if input_dict['Peptide List']:
+            peptide_list_df = pd.read_csv(input_dict['Peptide List'], sep="\t")
+        else:
+            peptide_list_df = ""
+        pep_index = build_feature_index(pep_level)
+        irt_level, irt_plots, selected_pep_df = selected_peps(pep_level, "Peptide", threshold_dict['Coverage Threshold'], filenames, threshold_dict['iRT Label'], input_dict['Peptide List'], peptide_list_df, pep_index, pep_matrix)
+
+    #peptide sample dataframe
+    if threshold_dict['Peptide Threshold'] and threshold_dict['Enzyme'] and threshold_dict['Miscleavage Threshold']:
+        pep_sample_df = pd.merge(pep_quant, dig_df, on="Filename")
+        pep_sample_df = pep_sample_df[['Filename', f'Peptide Threshold = {threshold_dict["Peptide Threshold"]}', '0 missed cleavage QC Status']]
+    elif threshold_dict['Peptide Threshold']:
+        pep_sample_df = pep_quant[['Filename', f'Peptide Threshold = {threshold_dict["Peptide Threshold"]}']]
+    else:
+        pep_sample_df = ""
+
+    #getting peptide level report parameters - plots + descriptions
+    pep_quant_report_params = get_quant_plot(pep_quant, threshold_dict['Peptide Threshold'], "Peptide", groupwise_comparison, groups, color_list, scale_threshold)
+    if groupwise_comparison:
+        pep_intensity_cv_report_params = intensity_cv_graphs(pep_cv_sum, pep_grouped_cv, "Peptide", groupwise_comparison, threshold_dict['CV Percent Threshold'], threshold_dict['Data Percent Threshold'], color_list)
+        if input_dict.get('Rethreshold'):
+            peptide_pca_report_params = level_results['PCA']
+        elif input_dict.get('Chunk Memory'):
+            peptide_pca_report_params = pca_plot("", "Peptide", filenames, groups, color_list, pca_options, input_dict['Peptide Level'], level_results['PCA Batch Size'])
+        else:
+            peptide_pca_report_params = pca_plot(pep_level, "Peptide", filenames, groups, color_list, pca_options)
+    else:
+        pep_intensity_cv_report_params = {}
+        peptide_pca_report_params = {}
+
+    pep_common_tic_report_params = common_tic_plot(pep_tic, pep_grouped_tic, "Peptide", threshold_dict['TIC CV Threshold'], groupwise_comparison, groups, color_list, scale_threshold)
+    if threshold_dict['Enzyme']:
+        miscleavage_report_params = miscleavage_plot(dig_df, threshold_dict['Miscleavage Threshold'], groupwise_comparison, groups, color_list, scale_threshold)
+    else:
+        miscleavage_report_params = {}
+
+    if threshold_dict['iRT Label'] and irt_plots:
+        irt_report_params = selected_peptide_plots(irt_level, filenames, "Peptide", "iRT", threshold_dict['Coverage Threshold'], color_list, scale_threshold)
+    else:
+        irt_report_params = {}
+
+    if input_dict['Peptide List']:
+        selected_peptide_report_params = selected_peptide_plots(selected_pep_df, filenames, "Peptide", "Peptide List", threshold_dict['Coverage Threshold'], color_list, scale_threshold)
+    else:
+        selected_peptide_report_params = {}
+
+    peptide_report_params = dict(tuple(pep_quant_report_params.items()) +
+                            tuple(pep_intensity_cv_report_params.items()) +
+                            tuple(peptide_pca_report_params.items()) +
+                            tuple(pep_common_tic_report_params.items()) +
+                            tuple(miscleavage_report_params.items()) +
+                            tuple(irt_report_params.items()) +
+                            tuple(selected_peptide_report_params.items()))
+    peptide_report_params['peptide_tuning'] = get_level_tuning("Peptide", pep_quant, pep_level_cv, pep_grouped_cv, threshold_dict, pep_tic,
+                                                               dig_df if threshold_dict['Enzyme'] else None)
+
+    logging.info(f"Saving Peptide Level QC Report to {out_dir}/{reportname}_PeptideLevel_QC_Report.xlsx")
+
+    #saving dataframes to excel document
+    peptide_report_writer = pd.ExcelWriter(f"{out_dir}/{reportname}_PeptideLevel_QC_Report.xlsx", engine='xlsxwriter')
+    pep_quant.to_excel(peptide_report_writer, index=False, sheet_name='Peptide Quant Summary')
+    if groupwise_comparison and threshold_dict['Peptide Threshold']:
+        pep_grouped_quant.to_excel(peptide_report_writer, index=False, sheet_name='Groupwise Peptide Quant')
+    pep_level_cv.to_excel(peptide_report_writer, index=False, sheet_name='Peptide Level CV')
+    if groupwise_comparison:
+        pep_grouped_cv.to_excel(peptide_report_writer, index=False, sheet_name='Peptide CV Group Summary')
+    pep_tic.to_excel(peptide_report_writer, index=False, sheet_name='Common Peptide TIC')
+    if groupwise_comparison:
+        pep_grouped_tic.to_excel(peptide_report_writer, index=False, sheet_name='Common Peptide TIC Group CV')
+    if threshold_dict['Enzyme']:
+        dig_df.to_excel(peptide_report_writer, index=False, sheet_name='Miscleavage Threshold')
+    if threshold_dict['iRT Label'] and irt_plots:
+        irt_level.to_excel(peptide_report_writer, index=False, sheet_name='iRT Peptide Intensity')
+    if input_dict['Peptide List']:
+        selected_pep_df.to_excel(peptide_report_writer, index=False, sheet_name='Selected Peptide Intensity')
+    peptide_report_writer.close()
+
+    #raw metrics of the level, saved so other thresholds can be applied without reading the intensities again
+    if input_dict.get('Metrics Bundle') and not input_dict.get('Rethreshold'):
+        save_level_bundle("Peptide", level_results, pep_level, filenames, pep_quant, pep_level_cv, groups, input_dict, threshold_dict, peptide_pca_report_params,
+                          pep_tic, dig_df if threshold_dict['Enzyme'] else None, bool(threshold_dict['iRT Label'] or input_dict['Peptide List']))
+
+    #getting peptide group overall dataframe
+    if groupwise_comparison:
+        if threshold_dict['Enzyme']:
+            pep_group_df = pep_group_df[["Group", "Peptide Threshold QC Status",
+                        f"{threshold_dict['Data Percent Threshold']}% Peptides <= {threshold_dict['CV Percent Threshold']}% CV",
+                        "Common Peptide TIC QC Status", "0 Miscleaved Peptides QC Status"]]
+        else:
+            pep_group_df = pep_group_df[["Group", "Peptide Threshold QC Status",
+                        f"{threshold_dict['Data Percent Threshold']}% Peptides <= {threshold_dict['CV Percent Threshold']}% CV",
+                        "Common Peptide TIC QC Status"]]
+
+    return (pep_sample_df, pep_group_df, pep_cv_sum, peptide_report_params)
 
+def precursor_level_metrics(out_dir, reportname, input_dict, threshold_dict, groups, groupwise_comparison, pca_options, level_df=None):
+    """
+    Calculates the precursor level metrics (quant, intensity CVs, common TIC, PCA and, without a peptide level, missed cleavages, iRT and selected peptides), saves the Precursor Level Excel report and gets the report parameters.
+
+    Args:
+    out_dir (str): Output directory.
+    reportname (str): Report name used for the output files.
+    input_dict (dict): Dictionary containing the input files and options.
+    threshold_dict (dict): Dictionary containing threshold values.
+    groups (dict): Dictionary mapping groups to filenames for group-wise analysis.
+    groupwise_comparison (bool): Flag indicating if group-wise comparison should be performed.
+    pca_options (dict): PCA options, from get_pca_options.
+    level_df (DataFrame): [Optional] Precursor level intensities, read from the precursor file if not given.
+
+    Returns:
+    tuple: Precursor sample DataFrame, group DataFrame, CV cumulative frequency DataFrame and report parameters.
+    """
+
+    pre_group_df = ""
+    matrix_workers = input_dict.get('Matrix Workers') or 1
+    scale_threshold = input_dict.get('Plot Scale Threshold', large_cohort_samples)
+
+
+    logging.info("Getting Precursor Level QC Metrics")
+
+    if input_dict.get('Rethreshold'):
+        level_results = get_level_results(load_bundle_part(input_dict['Metrics Bundle'], "Precursor"), "Precursor", threshold_dict, groupwise_comparison, groups)
+    elif input_dict.get('Chunk Memory'):
+        level_results = chunked_level_metrics(input_dict['Precursor Level'], "Precursor", input_dict, threshold_dict, groupwise_comparison, groups)
+    else:
+        level_results = False
+
+    if level_results:
+        filenames = level_results['Filenames']
+
+        #only the rows needed for iRT and selected peptide analysis are kept in memory
+        pre_level = level_results.get('Targeted Level')
+        if pre_level is not None:
+            pre_matrix = build_intensity_matrix(pre_level, filenames)
+        pre_quant, pre_grouped_quant = level_results['Quant']
+        pre_level_cv, pre_cv_sum, pre_grouped_cv = level_results['Intensity CVs']
+        pre_tic, pre_grouped_tic = level_results['Common TIC']
+
+    else:
+        if level_df is not None:
+            pre_level = level_df
+        else:
+            pre_level = read_level_file(input_dict['Precursor Level'], input_dict.get('Cache Directory'))
+
+        filenames = pre_level.columns.tolist()
+        filenames.remove("Protein")
+        filenames.remove("Peptide")
+        filenames.remove("Precursor")
+
+        #precursor quant, intensity_cvs, tic, missed cleavage percentage, precursor intensity distribution
+        pre_matrix = build_intensity_matrix(pre_level, filenames)
+        pre_quant, pre_grouped_quant = get_quant(pre_matrix, threshold_dict['Precursor Threshold'], "Precursor", groupwise_comparison, groups)
+        pre_level_cv, pre_cv_sum, pre_grouped_cv = intensity_cvs(pre_level, threshold_dict['CV Percent Threshold'], threshold_dict['Data Percent Threshold'], filenames, "Precursor", groupwise_comparison, groups, matrix_workers, out_dir)
+
+        #the remaining precursor metrics use the features with a valid overall CV
+        valid_rows = pre_level.index.get_indexer(pre_level_cv.index)
+        pre_level = pre_level.iloc[valid_rows]
+        pre_matrix = subset_intensity_matrix(pre_matrix, valid_rows)
+        pre_tic, pre_grouped_tic = common_tic(pre_matrix, "Precursor", threshold_dict['TIC CV Threshold'], groups, groupwise_comparison)
+
+    if groupwise_comparison:
+        pre_group_df = pd.merge(pre_grouped_quant, pre_grouped_cv, on="Group")
+
+    if not input_dict['Peptide Level']:
         if groupwise_comparison:
-            pep_group_df = pd.merge(pep_grouped_quant, pep_grouped_cv, on="Group")
-            pep_group_df = pd.merge(pep_group_df, pep_grouped_tic, on="Group")
+            pre_group_df = pd.merge(pre_group_df, pre_grouped_tic, on="Group")
 
         if threshold_dict['Enzyme']:
-            dig_df, dig_grouped = miscleavage(pep_level, threshold_dict['Enzyme'], threshold_dict['Miscleavage Threshold'], filenames, groups, groupwise_comparison)
+            if level_results:
+                dig_df, dig_grouped = level_results['Miscleavage']
+            else:
+                dig_df, dig_grouped = miscleavage(pre_level, threshold_dict['Enzyme'], threshold_dict['Miscleavage Threshold'], filenames, groups, groupwise_comparison, input_dict.get('Cache Directory'), matrix_workers, out_dir)
             if groupwise_comparison:
-                pep_group_df = pd.merge(pep_group_df, dig_grouped, on="Group")
+                pre_group_df = pd.merge(pre_group_df, dig_grouped, on="Group")
         else:
-            dig_df, dig_grouped = ""
+            dig_df, dig_grouped = "", ""
 
         if threshold_dict['iRT Label'] or input_dict['Peptide List']:
+
             if input_dict['Peptide List']:
                 peptide_list_df = pd.read_csv(input_dict['Peptide List'], sep="\t")
             else:
                 peptide_list_df = ""
-            irt_level, irt_plots, selected_pep_df = selected_peps(pep_level, "Peptide", threshold_dict['Coverage Threshold'], filenames, threshold_dict['iRT Label'], input_dict['Peptide List'], peptide_list_df)
 
-        #peptide sample dataframe
-        if threshold_dict['Peptide Threshold'] and threshold_dict['Enzyme'] and threshold_dict['Miscleavage Threshold']:
-            pep_sample_df = pd.merge(pep_quant, dig_df, on="Filename")
-            pep_sample_df = pep_sample_df[['Filename', f'Peptide Threshold = {threshold_dict["Peptide Threshold"]}', '0 missed cleavage QC Status']]
-        else:
-            pep_sample_df = ""
+            pre_index = build_feature_index(pre_level)
+            irt_level, irt_plots, selected_pep_df = selected_peps(pre_level, "Precursor", threshold_dict['Coverage Threshold'], filenames, threshold_dict['iRT Label'], input_dict['Peptide List'], peptide_list_df, pre_index, pre_matrix)
 
-        #getting peptide level report parameters - plots + descriptions
-        pep_quant_report_params = get_quant_plot(pep_quant, threshold_dict['Peptide Threshold'], "Peptide", groupwise_comparison, groups, color_list)
-        if groupwise_comparison:
-            pep_intensity_cv_report_params = intensity_cv_graphs(pep_cv_sum, pep_grouped_cv, "Peptide", groupwise_comparison, threshold_dict['CV Percent Threshold'], threshold_dict['Data Percent Threshold'], color_list)
-            peptide_pca_report_params = pca_plot(pep_level, "Peptide", filenames, groups, color_list)
+    #peptide sample dataframe
+    if threshold_dict['Precursor Threshold']:
+        pre_sample_df = pre_quant[['Filename', f'Precursor Threshold = {threshold_dict["Precursor Threshold"]}']]
+        if not input_dict['Peptide Level']:
+            if threshold_dict['Enzyme'] and threshold_dict['Miscleavage Threshold']:
+                pre_sample_df = pd.merge(pre_sample_df, dig_df, on="Filename")
+                pre_sample_df = pre_sample_df[['Filename', f'Precursor Threshold = {threshold_dict["Precursor Threshold"]}', '0 missed cleavage QC Status']]
+    else:
+        pre_sample_df = ""
+
+    #getting precursor level report parameters - plots + descriptions
+    precursor_quant_report_params = get_quant_plot(pre_quant, threshold_dict['Precursor Threshold'], "Precursor", groupwise_comparison, groups, color_list, scale_threshold)
+    if groupwise_comparison:
+        precursor_intensity_cv_report_params = intensity_cv_graphs(pre_cv_sum, pre_grouped_cv, "Precursor", groupwise_comparison, threshold_dict['CV Percent Threshold'], threshold_dict['Data Percent Threshold'], color_list)
+        if input_dict.get('Rethreshold'):
+            precursor_pca_report_params = level_results['PCA']
+        elif input_dict.get('Chunk Memory'):
+            precursor_pca_report_params = pca_plot("", "Precursor", filenames, groups, color_list, pca_options, input_dict['Precursor Level'], level_results['PCA Batch Size'])
         else:
-            pep_intensity_cv_report_params = {}
-            peptide_pca_report_params = {}
+            precursor_pca_report_params = pca_plot(pre_level, "Precursor", filenames, groups, color_list, pca_options)
+    else:
+        precursor_intensity_cv_report_params = {}
+        precursor_pca_report_params = {}
+
+    if not input_dict['Peptide Level']:
+
+        pre_common_tic_report_params = common_tic_plot(pre_tic, pre_grouped_tic, "Precursor", threshold_dict['TIC CV Threshold'], groupwise_comparison, groups, color_list, scale_threshold)
 
-        pep_common_tic_report_params = common_tic_plot(pep_tic, pep_grouped_tic, "Peptide", threshold_dict['TIC CV Threshold'], groupwise_comparison, groups, color_list)
         if threshold_dict['Enzyme']:
-            miscleavage_report_params = miscleavage_plot(dig_df, threshold_dict['Miscleavage Threshold'], groupwise_comparison, groups, color_list)
+            miscleavage_report_params = miscleavage_plot(dig_df, threshold_dict['Miscleavage Threshold'], groupwise_comparison, groups, color_list, scale_threshold)
         else:
             miscleavage_report_params = {}
 
         if threshold_dict['iRT Label'] and irt_plots:
-            irt_report_params = selected_peptide_plots(irt_level, filenames, "Peptide", "iRT", threshold_dict['Coverage Threshold'], color_list)
+            irt_report_params = selected_peptide_plots(irt_level, filenames, "Precursor", "iRT", threshold_dict['Coverage Threshold'], color_list, scale_threshold)
         else:
             irt_report_params = {}
 
         if input_dict['Peptide List']:
-            selected_peptide_report_params = selected_peptide_plots(selected_peptide_df, filenames, "Peptide", "Peptide List", threshold_dict['Coverage Threshold'], color_list)
+            selected_peptide_report_params = selected_peptide_plots(selected_pep_df, filenames, "Precursor", "Peptide List", threshold_dict['Coverage Threshold'], color_list, scale_threshold)
         else:
             selected_peptide_report_params = {}
 
-        peptide_report_params = dict(tuple(pep_quant_report_params.items()) +
-                                tuple(pep_intensity_cv_report_params.items()) +
-                                tuple(peptide_pca_report_params.items()) +
-                                tuple(pep_common_tic_report_params.items()) +
-                                tuple(miscleavage_report_params.items()) +
-                                tuple(irt_report_params.items()) +
-                                tuple(selected_peptide_report_params.items()))
-
-        logging.info(f"Saving Peptide Level QC Report to {out_dir}/{reportname}_PeptideLevel_QC_Report.xlsx")
-
-        #saving dataframes to excel document
-        peptide_report_writer = pd.ExcelWriter(f"{out_dir}/{reportname}_PeptideLevel_QC_Report.xlsx", engine='xlsxwriter')
-        pep_quant.to_excel(peptide_report_writer, index=False, sheet_name='Peptide Quant Summary')
-        if groupwise_comparison and threshold_dict['Peptide Threshold']:
-            pep_grouped_quant.to_excel(peptide_report_writer, index=False, sheet_name='Groupwise Peptide Quant')
-        pep_level_cv.to_excel(peptide_report_writer, index=False, sheet_name='Peptide Level CV')
-        if groupwise_comparison:
-            pep_grouped_cv.to_excel(peptide_report_writer, index=False, sheet_name='Peptide CV Group Summary')
-        pep_tic.to_excel(peptide_report_writer, index=False, sheet_name='Common Peptide TIC')
-        if groupwise_comparison:
-            pep_grouped_tic.to_excel(peptide_report_writer, index=False, sheet_name='Common Peptide TIC Group CV')
+    else:
+        #only common peptide tic, miscleavage, irt and peptide list plots are reported when the peptide level is present
+        pre_common_tic_report_params = {}
+        miscleavage_report_params = {}
+        irt_report_params = {}
+        selected_peptide_report_params = {}
+
+    precursor_report_params = dict(tuple(precursor_quant_report_params.items()) +
+                            tuple(precursor_intensity_cv_report_params.items()) +
+                            tuple(precursor_pca_report_params.items()) +
+                            tuple(pre_common_tic_report_params.items()) +
+                            tuple(miscleavage_report_params.items()) +
+                            tuple(irt_report_params.items()) +
+                            tuple(selected_peptide_report_params.items()))
+    precursor_report_params['precursor_tuning'] = get_level_tuning("Precursor", pre_quant, pre_level_cv, pre_grouped_cv, threshold_dict, pre_tic,
+                                                                   dig_df if not input_dict['Peptide Level'] and threshold_dict['Enzyme'] else None)
+
+    logging.info(f"Saving Precursor Level QC Report to {out_dir}/{reportname}_PrecursorLevel_QC_Report.xlsx")
+
+    #saving dataframes to excel document
+    precursor_report_writer = pd.ExcelWriter(f"{out_dir}/{reportname}_PrecursorLevel_QC_Report.xlsx", engine='xlsxwriter')
+    pre_quant.to_excel(precursor_report_writer, index=False, sheet_name='Precursor Quant Summary')
+    if groupwise_comparison and threshold_dict['Precursor Threshold']:
+        pre_grouped_quant.to_excel(precursor_report_writer, index=False, sheet_name='Groupwise Precursor Quant')
+    pre_level_cv.to_excel(precursor_report_writer, index=False, sheet_name='Precursor Level CV')
+    if groupwise_comparison:
+        pre_grouped_cv.to_excel(precursor_report_writer, index=False, sheet_name='Precursor CV Group Summary')
+    pre_tic.to_excel(precursor_report_writer, index=False, sheet_name='Common Precursor TIC')
+    if groupwise_comparison:
+        pre_grouped_tic.to_excel(precursor_report_writer, index=False, sheet_name='Common Precursor TIC Group CV')
+
+    if not input_dict['Peptide Level']:
         if threshold_dict['Enzyme']:
-            dig_df.to_excel(peptide_report_writer, index=False, sheet_name='Miscleavage Threshold')
+            dig_df.to_excel(precursor_report_writer, index=False, sheet_name='Miscleavage Threshold')
         if threshold_dict['iRT Label'] and irt_plots:
-            irt_level.to_excel(peptide_report_writer, index=False, sheet_name='iRT Peptide Intensity')
+            irt_level.to_excel(precursor_report_writer, index=False, sheet_name='iRT Precursor Intensity')
         if input_dict['Peptide List']:
-            selected_pep_df.to_excel(peptide_threshold_dict, index=False, sheet_name='Selected Peptide Intensity')
-        peptide_report_writer.close()
-
-        #getting peptide group overall dataframe
-        if groupwise_comparison:
-            if threshold_dict['Enzyme']:
-                pep_group_df = pep_group_df[["Group", "Peptide Threshold QC Status",
-                            f"{threshold_dict['Data Percent Threshold']}% Peptides <= {threshold_dict['CV Percent Threshold']}% CV",
-                            "Common Peptide TIC QC Status", "0 Miscleaved Peptides QC Status"]]
-            else:
-                pep_group_df = pep_group_df[["Group", "Peptide Threshold QC Status",
-                            f"{threshold_dict['Data Percent Threshold']}% Peptides <= {threshold_dict['CV Percent Threshold']}% CV",
-                            "Common Peptide TIC QC Status"]]
-
-    if input_dict['Precursor Level']:
-
-        logging.info("Getting Precursor Level QC Metrics")
+            selected_pep_df.to_excel(precursor_report_writer, index=False, sheet_name='Selected Precursor Intensity')
 
-        pre_level = pd.read_csv(input_dict['Precursor Level'], sep="\t")
-        pre_level = pre_level[pre_level.columns.tolist()].replace({'0':np.nan, 0:np.nan})
+    precursor_report_writer.close()
 
-        filenames = pre_level.columns.tolist()
-        filenames.remove("Protein")
-        filenames.remove("Peptide")
-        filenames.remove("Precursor")
-
-        #precursor quant, intensity_cvs, tic, missed cleavage percentage, precursor intensity distribution
-        pre_quant, pre_grouped_quant = get_quant(pre_level, filenames, threshold_dict['Precursor Threshold'], "Precursor", groupwise_comparison, groups)
-        pre_level_cv, pre_cv_sum, pre_grouped_cv = intensity_cvs(pre_level, threshold_dict['CV Percent Threshold'], threshold_dict['Data Percent Threshold'], filenames, "Precursor", groupwise_comparison, groups)
-        pre_tic, pre_grouped_tic = common_tic(pre_level, "Precursor", threshold_dict['TIC CV Threshold'], filenames, groups, groupwise_comparison)
-
-        if groupwise_comparison:
-            pre_group_df = pd.merge(pre_grouped_quant, pre_grouped_cv, on="Group")
+    #raw metrics of the level, saved so other thresholds can be applied without reading the intensities again
+    if input_dict.get('Metrics Bundle') and not input_dict.get('Rethreshold'):
+        without_peptide_level = not input_dict['Peptide Level']
+        save_level_bundle("Precursor", level_results, pre_level, filenames, pre_quant, pre_level_cv, groups, input_dict, threshold_dict, precursor_pca_report_params,
+                          pre_tic, dig_df if without_peptide_level and threshold_dict['Enzyme'] else None,
+                          bool(without_peptide_level and (threshold_dict['iRT Label'] or input_dict['Peptide List'])))
 
+    if groupwise_comparison:
         if not input_dict['Peptide Level']:
-            if groupwise_comparison:
-                pre_group_df = pd.merge(pre_group_df, pre_grouped_tic, on="Group")
-
             if threshold_dict['Enzyme']:
-                dig_df, dig_grouped = miscleavage(pre_level, threshold_dict['Enzyme'], threshold_dict['Miscleavage Threshold'], filenames, groups, groupwise_comparison)
-                if groupwise_comparison:
-                    pre_group_df = pd.merge(pre_group_df, dig_grouped, on="Group")
+                pre_group_df = pre_group_df[["Group", "Precursor Threshold QC Status",f"{threshold_dict['Data Percent Threshold']}% Precursors <= {threshold_dict['CV Percent Threshold']}% CV",
+                "Common Precursor TIC QC Status", "0 Miscleaved Peptides QC Status"]]
             else:
-                dig_df, dig_grouped = ""
+                pre_group_df = pre_group_df[["Group", "Precursor Threshold QC Status",f"{threshold_dict['Data Percent Threshold']}% Precursors <= {threshold_dict['CV Percent Threshold']}% CV",
+                "Common Precursor TIC QC Status"]]
 
-            if threshold_dict['iRT Label'] or input_dict['Peptide List']:
+        else:
+            pre_group_df = pre_group_df[["Group", "Precursor Threshold QC Status",f"{threshold_dict['Data Percent Threshold']}% Precursors <= {threshold_dict['CV Percent Threshold']}% CV"]]
 
-                if input_dict['Peptide List']:
-                    peptide_list_df = pd.read_csv(input_dict['Peptide List'], sep="\t")
-                else:
-                    peptide_list_df = ""
+    return (pre_sample_df, pre_group_df, pre_cv_sum, precursor_report_params)
 
-                irt_level, irt_plots, selected_pep_df = selected_peps(pre_level, "Precursor", threshold_dict['Coverage Threshold'], filenames, threshold_dict['iRT Label'], input_dict['Peptide List'], peptide_list_df)
+def init_level_worker(log_file):
+    """
+    Sets up logging in a worker process, so level metrics calculated in parallel are logged to the same file.
 
-        #peptide sample dataframe
-        if threshold_dict['Precursor Threshold']:
-            pre_sample_df = pre_quant[['Filename', f'Precursor Threshold = {threshold_dict["Precursor Threshold"]}']]
-            if not input_dict['Peptide Level']:
-                if threshold_dict['Enzyme'] and threshold_dict['Miscleavage Threshold']:
-                    pre_sample_df = pd.merge(pre_sample_df, dig_df, on="Filename")
-                    pre_sample_df = pre_sample_df[['Filename', f'Precursor Threshold = {threshold_dict["Precursor Threshold"]}', '0 missed cleavage QC Status']]
-        else:
-            pre_sample_df = ""
+    Args:
+    log_file (str): Path to the log file of the main process, or None.
 
-        #getting precursor level report parameters - plots + descriptions
-        precursor_quant_report_params = get_quant_plot(pre_quant, threshold_dict['Precursor Threshold'], "Precursor", groupwise_comparison, groups, color_list)
-        if groupwise_comparison:
-            precursor_intensity_cv_report_params = intensity_cv_graphs(pre_cv_sum, pre_grouped_cv, "Precursor", groupwise_comparison, threshold_dict['CV Percent Threshold'], threshold_dict['Data Percent Threshold'], color_list)
-            precursor_pca_report_params = pca_plot(pre_level, "Precursor", filenames, groups, color_list)
-        else:
-            precursor_intensity_cv_report_params = {}
-            precursor_pca_report_params = {}
+    Returns:
+    None
+    """
 
-        if not input_dict['Peptide Level']:
+    if log_file and not logging.getLogger().handlers:
+        logging.basicConfig(filename=log_file, level=logging.INFO)
 
-            pre_common_tic_report_params = common_tic_plot(pre_tic, pre_grouped_tic, "Precursor", threshold_dict['TIC CV Threshold'], groupwise_comparison, groups, color_list)
+    return None
 
-            if threshold_dict['Enzyme']:
-                miscleavage_report_params = miscleavage_plot(dig_df, threshold_dict['Miscleavage Threshold'], groupwise_comparison, groups, color_list)
-            else:
-                miscleavage_report_params = {}
+def calculate_idbased_metrics(out_dir, reportname, input_dict, threshold_dict, groups, groupwise_comparison):
 
-            if threshold_dict['iRT Label'] and irt_plots:
-                irt_report_params = selected_peptide_plots(irt_level, filenames, "Precursor", "iRT", threshold_dict['Coverage Threshold'], color_list)
-            else:
-                irt_report_params = {}
+    pca_options = get_pca_options(input_dict)
 
-            if input_dict['Peptide List']:
-                selected_peptide_report_params = selected_peptide_plots(selected_peptide_df, filenames, "Precursor", "Peptide List", threshold_dict['Coverage Threshold'], color_list)
-            else:
-                selected_peptide_report_params = {}
-
-        precursor_report_params = dict(tuple(precursor_quant_report_params.items()) +
-                                tuple(precursor_intensity_cv_report_params.items()) +
-                                tuple(precursor_pca_report_params.items()) +
-                                tuple(pre_common_tic_report_params.items()) +
-                                tuple(miscleavage_report_params.items()) +
-                                tuple(irt_report_params.items()) +
-                                tuple(selected_peptide_report_params.items()))
-
-        logging.info(f"Saving Precursor Level QC Report to {out_dir}/{reportname}_PrecursorLevel_QC_Report.xlsx")
-
-        #saving dataframes to excel document
-        precursor_report_writer = pd.ExcelWriter(f"{out_dir}/{reportname}_PrecursorLevel_QC_Report.xlsx", engine='xlsxwriter')
-        pre_quant.to_excel(precursor_report_writer, index=False, sheet_name='Precursor Quant Summary')
-        if groupwise_comparison and threshold_dict['Precursor Threshold']:
-            pre_grouped_quant.to_excel(precursor_report_writer, index=False, sheet_name='Groupwise Precursor Quant')
-        pre_level_cv.to_excel(precursor_report_writer, index=False, sheet_name='Precursor Level CV')
-        if groupwise_comparison:
-            pre_grouped_cv.to_excel(precursor_report_writer, index=False, sheet_name='Precursor CV Group Summary')
-        pre_tic.to_excel(precursor_report_writer, index=False, sheet_name='Common Precursor TIC')
-        if groupwise_comparison:
-            pre_grouped_tic.to_excel(precursor_report_writer, index=False, sheet_name='Common Precursor TIC Group CV')
+    #deriving peptide and protein levels from the precursor level, the precursor file is only parsed once
+    input_dict = dict(input_dict)
+    level_dfs = {}
 
-        if not input_dict['Peptide Level']:
-            if threshold_dict['Enzyme']:
-                dig_df.to_excel(precursor_report_writer, index=False, sheet_name='Miscleavage Threshold')
-            if threshold_dict['iRT Label'] and irt_plots:
-                irt_level.to_excel(precursor_report_writer, index=False, sheet_name='iRT Precursor Intensity')
-            if input_dict['Peptide List']:
-                selected_pep_df.to_excel(precursor_report_writer, index=False, sheet_name='Selected Precursor Intensity')
+    if input_dict.get('Level Rollup'):
+        #reapplied thresholds use the derived levels saved in the metrics bundle
+        if not input_dict.get('Rethreshold'):
+            pre_level = read_level_file(input_dict['Precursor Level'], input_dict.get('Cache Directory'))
+            filenames = [col for col in pre_level.columns.tolist() if col not in ['Protein', 'Peptide', 'Precursor']]
 
-        precursor_report_writer.close()
+            level_dfs['Peptide Level'], level_dfs['Protein Level'] = derive_levels(pre_level, filenames, input_dict['Level Rollup'])
+            level_dfs['Precursor Level'] = pre_level
 
-        if groupwise_comparison:
-            if not input_dict['Peptide Level']:
-                if threshold_dict['Enzyme']:
-                    pre_group_df = pre_group_df[["Group", "Precursor Threshold QC Status",f"{threshold_dict['Data Percent Threshold']}% Precursors <= {threshold_dict['CV Percent Threshold']}% CV",
-                    "Common Precursor TIC QC Status", "0 Miscleaved Peptides QC Status"]]
-                else:
-                    pre_group_df = pre_group_df[["Group", "Precursor Threshold QC Status",f"{threshold_dict['Data Percent Threshold']}% Precursors <= {threshold_dict['CV Percent Threshold']}% CV",
-                    "Common Precursor TIC QC Status"]]
+        input_dict['Protein Level'] = f"{input_dict['Precursor Level']} ({input_dict['Level Rollup']} rollup)"
+        input_dict['Peptide Level'] = f"{input_dict['Precursor Level']} ({input_dict['Level Rollup']} rollup)"
 
-            else:
-                pre_group_df = pre_group_df[["Group", "Precursor Threshold QC Status",f"{threshold_dict['Data Percent Threshold']}% Precursors <= {threshold_dict['CV Percent Threshold']}% CV"]]
+    level_functions = {'Protein Level': protein_level_metrics,
+                       'Peptide Level': peptide_level_metrics,
+                       'Precursor Level': precursor_level_metrics}
+    levels = [level for level in level_functions if input_dict[level]]
+    level_args = (out_dir, reportname, input_dict, threshold_dict, groups, groupwise_comparison, pca_options)
 
-    #adding cumulative frequency graph
-    if not input_dict['Protein Level']:
-        pt_group_df = ""
-        pt_sample_df = ""
-        pt_cv_sum = ""
+    level_workers = min(input_dict.get('Level Workers') or 1, len(levels))
 
-    if not input_dict['Peptide Level']:
-        pep_group_df = ""
-        pep_sample_df = ""
-        pep_cv_sum = ""
+    if level_workers > 1:
+        #each level is independent until the final merge, so the levels are calculated in separate processes
+        logging.info(f"Calculating {', '.join(levels)} metrics in {level_workers} worker processes")
 
-    if not input_dict['Precursor Level']:
-        pre_group_df = ""
-        pre_sample_df = ""
-        pre_cv_sum = ""
+        log_file = next((handler.baseFilename for handler in logging.getLogger().handlers if isinstance(handler, logging.FileHandler)), None)
+        with ProcessPoolExecutor(max_workers=level_workers, initializer=init_level_worker, initargs=(log_file,)) as executor:
+            futures = {level: executor.submit(level_functions[level], *level_args, level_dfs.pop(level, None)) for level in levels}
+            level_outputs = {level: futures[level].result() for level in levels}
+    else:
+        level_outputs = {level: level_functions[level](*level_args, level_dfs.pop(level, None)) for level in levels}
 
+    pt_sample_df, pt_group_df, pt_cv_sum, protein_report_params = level_outputs.get('Protein Level', ("", "", "", {}))
+    pep_sample_df, pep_group_df, pep_cv_sum, peptide_report_params = level_outputs.get('Peptide Level', ("", "", "", {}))
+    pre_sample_df, pre_group_df, pre_cv_sum, precursor_report_params = level_outputs.get('Precursor Level', ("", "", "", {}))
 
     #overall sample dataframe
     overall_sample_df = get_sample_df(input_dict['Protein Level'], input_dict['Peptide Level'], input_dict['Precursor Level'], pt_sample_df, pep_sample_df, pre_sample_df, threshold_dict, groupwise_comparison, groups)
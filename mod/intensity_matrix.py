@@ -0,0 +1,157 @@
+"""
+Compact intensity matrix used by the ID-based metrics - float32 intensities, packed presence bitmask, categorical identifiers and sample names
+"""
+
+import pandas as pd
+import numpy as np
+import os
+import tempfile
+
+#-------------------------------------------------------------------------- VARIABLES --------------------------------------------------------------------------
+
+#number of set bits in each byte value, to count the packed presence bits without unpacking them
+popcount_table = np.array([bin(byte).count('1') for byte in range(256)], dtype=np.uint8)
+
+#-------------------------------------------------------------------------- FUNCTIONS ---------------------------------------------------------------------------
+
+def build_intensity_matrix(df_level, filenames):
+    """
+    Builds the compact intensity matrix of a level.
+
+    Args:
+    df_level (DataFrame): DataFrame with the identifier columns and one intensity column per sample, NaN for missing values.
+    filenames (list): List of filenames (sample columns).
+
+    Returns:
+    dict: Intensity matrix with the keys:
+        'Values' (ndarray): float32 intensities (features x samples), 0 for missing values.
+        'Presence' (ndarray): Presence bitmask packed along the features axis (ceil(features/8) x samples).
+        'Features' (int): Number of features (rows).
+        'Ids' (dict): Categorical identifiers of each identifier column ('Protein', 'Peptide', 'Precursor').
+        'Samples' (Index): Sample names, in column order.
+    """
+
+    values = df_level[filenames].to_numpy(dtype=np.float32)
+    present = ~np.isnan(values)
+    values[~present] = 0
+
+    id_cols = [col for col in ['Protein', 'Peptide', 'Precursor'] if col in df_level.columns]
+
+    level_matrix = {'Values': values,
+                    'Presence': np.packbits(present, axis=0),
+                    'Features': len(df_level),
+                    'Ids': {col: pd.Categorical(df_level[col]) for col in id_cols},
+                    'Samples': pd.Index(filenames)}
+
+    return level_matrix
+
+def subset_intensity_matrix(level_matrix, rows):
+    """
+    Selects features (rows) of an intensity matrix.
+
+    Args:
+    level_matrix (dict): Intensity matrix from build_intensity_matrix.
+    rows (ndarray): Positions of the features to keep.
+
+    Returns:
+    dict: Intensity matrix of the selected features.
+    """
+
+    present = presence_mask(level_matrix)[rows]
+
+    subset = {'Values': level_matrix['Values'][rows],
+              'Presence': np.packbits(present, axis=0),
+              'Features': len(rows),
+              'Ids': {col: ids[rows] for col, ids in level_matrix['Ids'].items()},
+              'Samples': level_matrix['Samples']}
+
+    return subset
+
+def presence_mask(level_matrix):
+    """
+    Unpacks the presence bitmask of an intensity matrix.
+
+    Args:
+    level_matrix (dict): Intensity matrix from build_intensity_matrix.
+
+    Returns:
+    ndarray: Boolean matrix (features x samples), True where the intensity is present.
+    """
+
+    return np.unpackbits(level_matrix['Presence'], axis=0, count=level_matrix['Features']).astype(bool)
+
+def sample_counts(level_matrix):
+    """
+    Counts the features identified in each sample.
+
+    Args:
+    level_matrix (dict): Intensity matrix from build_intensity_matrix.
+
+    Returns:
+    Series: Number of features in each sample, indexed by sample name.
+    """
+
+    counts = popcount_table[level_matrix['Presence']].sum(axis=0, dtype=np.int64)
+
+    return pd.Series(counts, index=level_matrix['Samples'])
+
+def feature_completeness(level_matrix):
+    """
+    Calculates the percentage of samples each feature is identified in.
+
+    Args:
+    level_matrix (dict): Intensity matrix from build_intensity_matrix.
+
+    Returns:
+    ndarray: Completeness % of each feature.
+    """
+
+    return (presence_mask(level_matrix).sum(axis=1)/len(level_matrix['Samples']))*100
+
+def common_feature_sums(level_matrix, level):
+    """
+    Sums the intensities of the features identified in all samples, e.g. the common TIC.
+
+    Args:
+    level_matrix (dict): Intensity matrix from build_intensity_matrix.
+    level (str): Identifier column, features without an identifier are left out.
+
+    Returns:
+    Series: Summed intensity of the common features in each sample, indexed by sample name.
+    """
+
+    common = presence_mask(level_matrix).all(axis=1) & (level_matrix['Ids'][level].codes >= 0)
+    sums = level_matrix['Values'][common].sum(axis=0, dtype=np.float64)
+
+    return pd.Series(sums, index=level_matrix['Samples'])
+
+def share_array(array, share_dir):
+    """
+    Saves an array as a .npy file that worker processes can memory-map, instead of each worker receiving a pickled copy.
+
+    Args:
+    array (ndarray): Array to be shared.
+    share_dir (str): Directory where the .npy file is saved, e.g. the output directory.
+
+    Returns:
+    str: Path to the .npy file, to be removed by the caller once the workers are done.
+    """
+
+    handle, path = tempfile.mkstemp(prefix="qceltis_", suffix=".npy", dir=share_dir)
+    os.close(handle)
+    np.save(path, array)
+
+    return path
+
+def attach_array(path):
+    """
+    Memory-maps an array saved by share_array, read-only and without copying it.
+
+    Args:
+    path (str): Path to the .npy file.
+
+    Returns:
+    memmap: The shared array.
+    """
+
+    return np.load(path, mmap_mode='r')
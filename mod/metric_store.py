@@ -0,0 +1,355 @@
+"""
+Longitudinal QC metric store - appends the metrics and QC statuses of every run to a SQLite database, with query helpers for trends per instrument
+"""
+
+import pandas as pd
+import os
+import sqlite3
+import logging
+from datetime import datetime, timedelta, timezone
+
+#-------------------------------------------------------------------------- VARIABLES --------------------------------------------------------------------------
+
+#excel report sheets with one row per sample or per group, numeric columns are stored as metrics
+sample_metric_sheets = ['ID-Free Metrics Summary', 'Protein Quant Summary', 'Peptide Quant Summary', 'Precursor Quant Summary',
+                        'Common Peptide TIC', 'Common Precursor TIC', 'Miscleavage Threshold']
+group_metric_sheets = ['Group TIC CV', 'Protein CV Group Summary', 'Peptide CV Group Summary', 'Precursor CV Group Summary',
+                       'Common Peptide TIC Group CV', 'Common Precursor TIC Group CV']
+
+#generic column names, stored under the sheet name instead
+sheet_named_columns = ['TIC', 'CV %']
+
+#excel reports of a run, by report name
+report_files = ["{reportname}_ID-Free_QC_Report.xlsx", "{reportname}_ProteinLevel_QC_Report.xlsx",
+                "{reportname}_PeptideLevel_QC_Report.xlsx", "{reportname}_PrecursorLevel_QC_Report.xlsx"]
+
+#timestamps are stored as UTC ISO 8601 text, which sorts in time order
+timestamp_format = "%Y-%m-%dT%H:%M:%SZ"
+
+#-------------------------------------------------------------------------- FUNCTIONS ---------------------------------------------------------------------------
+
+def open_metric_store(store_file):
+    """
+    Opens the metric store, creating its tables and indexes if needed.
+
+    Args:
+    store_file (str): Path to the SQLite database.
+
+    Returns:
+    Connection: Database connection, to be closed by the caller.
+
+    Note:
+    Tables:
+        runs - one row per QC run (id, reportname, outdirectory, run_time).
+        sample_metrics - one row per run, sample and metric (filename, sample_group, instrument, timestamp, timestamp_source, metric, value, status).
+        group_metrics - one row per run, group and metric (sample_group, instrument, timestamp, metric, value, status).
+    timestamp is the mzML startTimeStamp of the sample (earliest of the group) when known (timestamp_source 'mzML'), otherwise the run time ('Run').
+    Metrics are stored as rows so new metrics need no schema change, indexed by instrument, metric and timestamp.
+    """
+
+    connection = sqlite3.connect(store_file, timeout=30)
+    connection.executescript("""
+        CREATE TABLE IF NOT EXISTS runs (id INTEGER PRIMARY KEY AUTOINCREMENT, reportname TEXT, outdirectory TEXT, run_time TEXT);
+        CREATE TABLE IF NOT EXISTS sample_metrics (run_id INTEGER REFERENCES runs(id), filename TEXT, sample_group TEXT, instrument TEXT,
+                                                   timestamp TEXT, timestamp_source TEXT, metric TEXT, value REAL, status TEXT);
+        CREATE TABLE IF NOT EXISTS group_metrics (run_id INTEGER REFERENCES runs(id), sample_group TEXT, instrument TEXT, timestamp TEXT,
+                                                  metric TEXT, value REAL, status TEXT);
+        CREATE INDEX IF NOT EXISTS sample_metrics_trend ON sample_metrics (instrument, metric, timestamp);
+        CREATE INDEX IF NOT EXISTS sample_metrics_metric ON sample_metrics (metric, timestamp);
+        CREATE INDEX IF NOT EXISTS sample_metrics_filename ON sample_metrics (filename);
+        CREATE INDEX IF NOT EXISTS group_metrics_trend ON group_metrics (instrument, metric, timestamp);
+        CREATE INDEX IF NOT EXISTS group_metrics_metric ON group_metrics (metric, timestamp);
+    """)
+
+    return connection
+
+def format_timestamp(value):
+    """
+    Converts a timestamp to the UTC ISO 8601 text stored in the metric store.
+
+    Args:
+    value (str or datetime): Timestamp, e.g. a mzML startTimeStamp. Timestamps without a time zone are taken as UTC.
+
+    Returns:
+    str: Timestamp as YYYY-MM-DDTHH:MM:SSZ.
+    """
+
+    timestamp = pd.Timestamp(value)
+    timestamp = timestamp.tz_localize('UTC') if timestamp.tzinfo is None else timestamp.tz_convert('UTC')
+
+    return timestamp.strftime(timestamp_format)
+
+def get_sample_info(mzml_dir, filenames, instrument, run_time):
+    """
+    Gets the instrument and acquisition time of each sample, from the mzML headers where available.
+
+    Args:
+    mzml_dir (str): mzML directory, False without ID-free metrics.
+    filenames (list): Sample filenames.
+    instrument (str): Instrument name given for the run, used instead of the mzML instrument if set.
+    run_time (str): Time of the run, used for samples without a mzML startTimeStamp.
+
+    Returns:
+    DataFrame: Filename, instrument, timestamp and timestamp_source of each sample.
+    """
+
+    rows = []
+
+    for filename in filenames:
+        mzml_instrument, start_time = "", ""
+        if mzml_dir and os.path.exists(f"{mzml_dir}/{filename}"):
+            from mod.mzml_extract import get_mzml_run_info
+            mzml_instrument, start_time = get_mzml_run_info(f"{mzml_dir}/{filename}")
+
+        rows.append({'filename': filename,
+                     'instrument': instrument or mzml_instrument or "Unknown",
+                     'timestamp': format_timestamp(start_time) if start_time else run_time,
+                     'timestamp_source': 'mzML' if start_time else 'Run'})
+
+    return pd.DataFrame(rows, columns=['filename', 'instrument', 'timestamp', 'timestamp_source'])
+
+def get_report_metrics(out_dir, reportname):
+    """
+    Reads the per-sample and per-group metrics from the Excel reports of a run.
+
+    Args:
+    out_dir (str): Output directory of the run.
+    reportname (str): Report name of the run.
+
+    Returns:
+    DataFrame: Sample metrics with the columns filename, metric and value.
+    DataFrame: Group metrics with the columns sample_group, metric and value.
+    """
+
+    sample_metrics = []
+    group_metrics = []
+
+    for report_file in report_files:
+        path = f"{out_dir}/{report_file.format(reportname=reportname)}"
+        if not os.path.exists(path):
+            continue
+
+        #only the summary sheets are parsed, not the per-feature CV sheets
+        with pd.ExcelFile(path) as excel_file:
+            for sheet_name in excel_file.sheet_names:
+                if sheet_name in sample_metric_sheets:
+                    id_col, metrics = 'Filename', sample_metrics
+                elif sheet_name in group_metric_sheets:
+                    id_col, metrics = 'Group', group_metrics
+                else:
+                    continue
+
+                df = excel_file.parse(sheet_name)
+                value_cols = [col for col in df.select_dtypes('number').columns.tolist() if col not in ['Filename', 'Group']]
+                long_df = df.melt(id_vars=[id_col], value_vars=value_cols, var_name='metric', value_name='value')
+                long_df['metric'] = long_df['metric'].apply(lambda col: sheet_name if col in sheet_named_columns else col)
+                metrics.append(long_df.rename(columns={'Filename': 'filename', 'Group': 'sample_group'}))
+
+    sample_df = pd.concat(sample_metrics, ignore_index=True) if sample_metrics else pd.DataFrame(columns=['filename', 'metric', 'value'])
+    group_df = pd.concat(group_metrics, ignore_index=True) if group_metrics else pd.DataFrame(columns=['sample_group', 'metric', 'value'])
+
+    return sample_df, group_df
+
+def get_status_metrics(df, id_col):
+    """
+    Converts the QC status columns of the overall QC status report to rows.
+
+    Args:
+    df (DataFrame): Samplewise or groupwise QC metrics, "" if not calculated.
+    id_col (str): 'Filename' or 'Group'.
+
+    Returns:
+    DataFrame: id_col, metric and status of each QC status.
+    """
+
+    if not isinstance(df, pd.DataFrame):
+        return pd.DataFrame(columns=[id_col, 'metric', 'status'])
+
+    status_cols = [col for col in df.columns.tolist() if col not in ['Filename', 'Group']]
+
+    return df.melt(id_vars=[id_col], value_vars=status_cols, var_name='metric', value_name='status').astype({'status': str})
+
+def save_run_metrics(qc_status, store_file, out_dir, reportname, mzml_dir=False, instrument=False):
+    """
+    Appends the metrics and QC statuses of a run to the metric store.
+
+    Args:
+    qc_status (tuple): Samplewise and groupwise QC metrics of the run.
+    store_file (str): Path to the SQLite metric store.
+    out_dir (str): Output directory of the run, where its Excel reports were saved.
+    reportname (str): Report name of the run.
+    mzml_dir (str): [Optional] mzML directory, to read the instrument and startTimeStamp of each sample.
+    instrument (str): [Optional] Instrument name of the run, instead of the instrument in the mzML files.
+
+    Returns:
+    int: Run id in the metric store.
+    """
+
+    sample_df, grouped_df = qc_status
+    run_time = datetime.now(timezone.utc).strftime(timestamp_format)
+
+    sample_metrics, group_metrics = get_report_metrics(out_dir, reportname)
+
+    sample_status = get_status_metrics(sample_df, 'Filename').rename(columns={'Filename': 'filename'})
+    group_status = get_status_metrics(grouped_df, 'Group').rename(columns={'Group': 'sample_group'})
+    sample_rows = pd.concat([sample_metrics, sample_status], ignore_index=True)
+    group_rows = pd.concat([group_metrics, group_status], ignore_index=True)
+
+    sample_info = get_sample_info(mzml_dir, sorted(sample_rows['filename'].unique()), instrument, run_time)
+    sample_rows = sample_rows.merge(sample_info, on='filename', how='left')
+
+    if isinstance(sample_df, pd.DataFrame) and 'Group' in sample_df.columns:
+        sample_groups = pd.DataFrame({'filename': sample_df['Filename'], 'sample_group': sample_df['Group'].astype(str)})
+        sample_rows = sample_rows.merge(sample_groups, on='filename', how='left')
+
+        #groups take the most common instrument and the earliest acquisition of their samples
+        group_info = sample_groups.merge(sample_info, on='filename')
+        group_info = group_info.groupby('sample_group').agg(instrument=('instrument', lambda x: x.mode()[0]), timestamp=('timestamp', 'min')).reset_index()
+        group_rows['sample_group'] = group_rows['sample_group'].astype(str)
+        group_rows = group_rows.merge(group_info, on='sample_group', how='left')
+    else:
+        group_rows['instrument'] = instrument or "Unknown"
+        group_rows['timestamp'] = run_time
+
+    sample_rows = sample_rows.reindex(columns=['filename', 'sample_group', 'instrument', 'timestamp', 'timestamp_source', 'metric', 'value', 'status'])
+    group_rows = group_rows.reindex(columns=['sample_group', 'instrument', 'timestamp', 'metric', 'value', 'status'])
+    sample_rows = sample_rows.astype(object).where(sample_rows.notna(), None)
+    group_rows = group_rows.astype(object).where(group_rows.notna(), None)
+
+    connection = open_metric_store(store_file)
+    with connection:
+        run_id = connection.execute("INSERT INTO runs (reportname, outdirectory, run_time) VALUES (?, ?, ?)",
+                                    (reportname, os.path.abspath(out_dir), run_time)).lastrowid
+        connection.executemany("INSERT INTO sample_metrics VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                               [(run_id,) + tuple(row) for row in sample_rows.itertuples(index=False)])
+        connection.executemany("INSERT INTO group_metrics VALUES (?, ?, ?, ?, ?, ?, ?)",
+                               [(run_id,) + tuple(row) for row in group_rows.itertuples(index=False)])
+    connection.close()
+
+    logging.info(f"Saved {len(sample_rows)} sample and {len(group_rows)} group metrics of run {run_id} to the metric store {store_file}")
+
+    return run_id
+
+def get_time_range(days=None, start=None, end=None):
+    """
+    Gets the timestamp range of a query.
+
+    Args:
+    days (int): [Optional] Number of days up to now.
+    start (str or datetime): [Optional] Start of the range.
+    end (str or datetime): [Optional] End of the range.
+
+    Returns:
+    tuple: Start and end timestamps, "" for open ends.
+    """
+
+    if days is not None:
+        start = datetime.now(timezone.utc) - timedelta(days=days)
+
+    return (format_timestamp(start) if start is not None else "", format_timestamp(end) if end is not None else "")
+
+def query_metrics(store_file, table, metric, instrument=None, days=None, start=None, end=None, group=None):
+    """
+    Queries one metric of the metric store over time, using the instrument/metric/timestamp indexes.
+
+    Args:
+    store_file (str): Path to the SQLite metric store.
+    table (str): 'sample_metrics' or 'group_metrics'.
+    metric (str): Metric name, e.g. 'Log MS1 TIC', 'Precursor Number' or 'Overall QC Status'.
+    instrument (str): [Optional] Instrument name.
+    days (int): [Optional] Only the last number of days.
+    start (str or datetime): [Optional] Earliest timestamp.
+    end (str or datetime): [Optional] Latest timestamp.
+    group (str): [Optional] Sample group.
+
+    Returns:
+    DataFrame: Matching rows with their run report name, in time order.
+    """
+
+    if table not in ['sample_metrics', 'group_metrics']:
+        raise ValueError(f"Unknown metric store table {table}")
+
+    range_start, range_end = get_time_range(days, start, end)
+
+    query = f"SELECT m.*, r.reportname FROM {table} m JOIN runs r ON r.id = m.run_id WHERE m.metric = ?"
+    params = [metric]
+    if instrument is not None:
+        query += " AND m.instrument = ?"
+        params.append(instrument)
+    if range_start:
+        query += " AND m.timestamp >= ?"
+        params.append(range_start)
+    if range_end:
+        query += " AND m.timestamp <= ?"
+        params.append(range_end)
+    if group is not None:
+        query += " AND m.sample_group = ?"
+        params.append(str(group))
+    query += " ORDER BY m.timestamp"
+
+    connection = open_metric_store(store_file)
+    result = pd.read_sql_query(query, connection, params=params)
+    connection.close()
+
+    return result
+
+def query_sample_metric(store_file, metric, instrument=None, days=None, start=None, end=None, group=None):
+    """
+    Queries a per-sample metric over time, e.g. query_sample_metric(store, 'Log MS1 TIC', instrument='Q Exactive HF (SN03748)', days=90).
+
+    Args:
+    store_file (str): Path to the SQLite metric store.
+    metric (str): Metric name.
+    instrument (str): [Optional] Instrument name.
+    days (int): [Optional] Only the last number of days.
+    start (str or datetime): [Optional] Earliest timestamp.
+    end (str or datetime): [Optional] Latest timestamp.
+    group (str): [Optional] Sample group.
+
+    Returns:
+    DataFrame: Samples with the metric value or status, in time order.
+    """
+
+    return query_metrics(store_file, 'sample_metrics', metric, instrument, days, start, end, group)
+
+def query_group_metric(store_file, metric, instrument=None, days=None, start=None, end=None, group=None):
+    """
+    Queries a per-group metric or QC status over time, e.g. query_group_metric(store, 'Overall QC Status', days=30).
+
+    Args:
+    store_file (str): Path to the SQLite metric store.
+    metric (str): Metric name.
+    instrument (str): [Optional] Instrument name.
+    days (int): [Optional] Only the last number of days.
+    start (str or datetime): [Optional] Earliest timestamp.
+    end (str or datetime): [Optional] Latest timestamp.
+    group (str): [Optional] Sample group.
+
+    Returns:
+    DataFrame: Groups with the metric value or status, in time order.
+    """
+
+    return query_metrics(store_file, 'group_metrics', metric, instrument, days, start, end, group)
+
+def list_store_metrics(store_file):
+    """
+    Lists the metrics and instruments in the metric store.
+
+    Args:
+    store_file (str): Path to the SQLite metric store.
+
+    Returns:
+    DataFrame: Table (sample_metrics or group_metrics), instrument, metric, number of rows and time range of each metric.
+    """
+
+    connection = open_metric_store(store_file)
+    result = pd.read_sql_query("""
+        SELECT 'sample_metrics' AS table_name, instrument, metric, COUNT(*) AS rows, MIN(timestamp) AS first, MAX(timestamp) AS last
+        FROM sample_metrics GROUP BY instrument, metric
+        UNION ALL
+        SELECT 'group_metrics', instrument, metric, COUNT(*), MIN(timestamp), MAX(timestamp)
+        FROM group_metrics GROUP BY instrument, metric
+    """, connection)
+    connection.close()
+
+    return result
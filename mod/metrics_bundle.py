@@ -0,0 +1,163 @@
+"""
+Metrics bundles - the raw metrics of a run before any threshold is applied, so other thresholds can be applied without
+extracting the mzML files or reading the intensity files again
+"""
+
+import os
+import sys
+import glob
+import json
+import pickle
+import shutil
+import logging
+
+#-------------------------------------------------------------------------- VARIABLES --------------------------------------------------------------------------
+
+bundle_format = "QCeltis Metrics Bundle"
+bundle_version = 1
+
+#options describing the inputs of the bundled run, these cannot be changed when the thresholds are reapplied
+bundle_input_options = ['mzml_directory', 'protein_level', 'peptide_level', 'precursor_level', 'level_rollup', 'grouping_file',
+                        'peptide_list', 'enzyme', 'irtlabel', 'instrument']
+
+#options of the bundled run used when the thresholds are reapplied, unless given again
+bundle_threshold_options = ['ms1_tic_threshold', 'ms2_tic_threshold', 'ms1_spectra_threshold', 'ms2_spectra_threshold', 'max_basepeak_intensity',
+                            'iqr_sensitivity', 'baseline', 'protein_threshold', 'peptide_threshold', 'precursor_threshold', 'miscleavage_threshold',
+                            'tic_cv_threshold', 'cv_percent_threshold', 'data_percent_threshold', 'coverage_threshold']
+
+#small input files copied into the bundle, so the bundle does not depend on them
+bundle_input_files = {'grouping_file': "Grouping.txt", 'peptide_list': "Peptide_List.txt"}
+
+#-------------------------------------------------------------------------- FUNCTIONS ---------------------------------------------------------------------------
+
+def get_bundle_dir(out_dir, reportname):
+    """
+    Gets the metrics bundle directory of a run.
+
+    Args:
+    out_dir (str): Output directory.
+    reportname (str): Report name.
+
+    Returns:
+    str: Path to the metrics bundle directory.
+    """
+
+    return f"{out_dir}/{reportname}_Metrics_Bundle"
+
+def save_bundle_options(bundle_dir, options):
+    """
+    Starts a metrics bundle - saves the input and threshold options of the run along with copies of the grouping file and peptide list.
+    Parts of an earlier run in the same directory are removed.
+
+    Args:
+    bundle_dir (str): Metrics bundle directory, created if it does not exist.
+    options (dict): Options of the run, named like the long command line options.
+
+    Returns:
+    None
+    """
+
+    os.makedirs(bundle_dir, exist_ok=True)
+    for path in glob.glob(f"{bundle_dir}/*.pkl"):
+        os.remove(path)
+
+    for option, filename in bundle_input_files.items():
+        if options[option]:
+            shutil.copyfile(options[option], f"{bundle_dir}/{filename}")
+
+    bundle = {'Format': bundle_format, 'Version': bundle_version,
+              'Options': {option: options[option] for option in bundle_input_options + bundle_threshold_options}}
+
+    with open(f"{bundle_dir}/Run.json.tmp", 'w', encoding='utf-8') as f:
+        json.dump(bundle, f, indent=2)
+    os.replace(f"{bundle_dir}/Run.json.tmp", f"{bundle_dir}/Run.json")
+
+    return None
+
+def load_bundle_options(bundle_dir):
+    """
+    Reads the options of a bundled run.
+
+    Args:
+    bundle_dir (str): Metrics bundle directory.
+
+    Returns:
+    dict: Input and threshold options of the run, with the grouping file and peptide list pointing to their copies in the bundle.
+
+    Raises:
+    SystemExit: If the directory is not a QCeltis metrics bundle.
+    """
+
+    bundle_file = f"{bundle_dir}/Run.json"
+
+    if not os.path.exists(bundle_file):
+        print(f"ERROR: {bundle_dir} is not a metrics bundle, {bundle_file} does not exist")
+        logging.error(f"ERROR: {bundle_dir} is not a metrics bundle, {bundle_file} does not exist")
+        sys.exit(1)
+
+    try:
+        with open(bundle_file, encoding='utf-8') as f:
+            bundle = json.load(f)
+    except ValueError as e:
+        print(f"ERROR: Metrics bundle {bundle_file} could not be read: {e}")
+        logging.error(f"ERROR: Metrics bundle {bundle_file} could not be read: {e}")
+        sys.exit(1)
+
+    if not isinstance(bundle, dict) or bundle.get('Format') != bundle_format or bundle.get('Version') != bundle_version:
+        print(f"ERROR: {bundle_dir} is not a QCeltis metrics bundle (version {bundle_version})")
+        logging.error(f"ERROR: {bundle_dir} is not a QCeltis metrics bundle (version {bundle_version})")
+        sys.exit(1)
+
+    options = bundle['Options']
+    for option, filename in bundle_input_files.items():
+        if options[option]:
+            options[option] = f"{bundle_dir}/{filename}"
+
+    return options
+
+def save_bundle_part(bundle_dir, part, metrics):
+    """
+    Saves the raw metrics of part of a run to the metrics bundle.
+
+    Args:
+    bundle_dir (str): Metrics bundle directory.
+    part (str): Part of the run - 'ID-Free', 'Protein', 'Peptide' or 'Precursor'.
+    metrics (dict): Raw metrics of the part.
+
+    Returns:
+    None
+    """
+
+    logging.info(f"Saving {part} metrics to the metrics bundle {bundle_dir}")
+
+    #written to a temporary file first, so an interrupted run does not leave a partial bundle
+    with open(f"{bundle_dir}/{part}.pkl.tmp", 'wb') as f:
+        pickle.dump(metrics, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(f"{bundle_dir}/{part}.pkl.tmp", f"{bundle_dir}/{part}.pkl")
+
+    return None
+
+def load_bundle_part(bundle_dir, part):
+    """
+    Reads the raw metrics of part of a run from the metrics bundle.
+
+    Args:
+    bundle_dir (str): Metrics bundle directory.
+    part (str): Part of the run - 'ID-Free', 'Protein', 'Peptide' or 'Precursor'.
+
+    Returns:
+    dict: Raw metrics of the part, as saved by save_bundle_part.
+
+    Raises:
+    SystemExit: If the bundle does not have the part.
+    """
+
+    part_file = f"{bundle_dir}/{part}.pkl"
+
+    if not os.path.exists(part_file):
+        print(f"ERROR: The metrics bundle {bundle_dir} does not have {part} metrics, the run may not have completed")
+        logging.error(f"ERROR: The metrics bundle {bundle_dir} does not have {part} metrics, the run may not have completed")
+        sys.exit(1)
+
+    with open(part_file, 'rb') as f:
+        return pickle.load(f)
@@ -1,20 +1,39 @@
-import pymzml
 import statistics
 import pandas as pd
 import numpy as np
 import os
 import threading
 import logging
-import xlsxwriter
-import plotly.express as px
-import plotly
-import plotly.graph_objects as go
-import plotly.offline as offline
-from jinja2 import Environment, FileSystemLoader
-from scipy.stats import shapiro
 import time
-
-from mod.general_functions import cv, cv_status, check_threshold, groupname, label_outlier, get_outlier_and_cv_status, only_outlier_status, get_series_status, color_list
+import xml.etree.ElementTree as ET
+
+from mod.general_functions import cv, groupname, color_list
+from mod.qc_status import check_status, get_rule_status, get_sample_groups, get_group_status
+from mod.report_figures import figure_spec, update_figure, scale_figure_spec, large_cohort_samples
+from mod.metrics_bundle import save_bundle_part, load_bundle_part
+from mod.report_tuning import get_idfree_tuning
+
+#-------------------------------------------------------------------------- VARIABLES --------------------------------------------------------------------------
+
+#id-free metrics checked for outliers
+idfree_metrics = ['Log MS1 TIC', 'Log MS2 TIC', 'MS2/MS1 Spectra', 'Log Max Basepeak Intensity']
+
+#sample QC statuses of the id-free metrics - FAIL if the sample is an outlier for 'Outliers' or its 'Metric' is below the 'Threshold',
+#calculated when the 'Requires' column is present
+idfree_status_rules = {'MS1 TIC Sample QC Status': {'Requires': 'Log MS1 TIC', 'Metric': 'Log MS1 TIC', 'Outliers': 'Log MS1 TIC Outliers',
+                                                    'Threshold': 'MS1 TIC Threshold', 'Threshold Column': "MS1TIC QC Threshold = {}"},
+                       'MS2 TIC Sample QC Status': {'Requires': 'Log MS2 TIC', 'Metric': 'Log MS2 TIC', 'Outliers': 'Log MS2 TIC Outliers',
+                                                    'Threshold': 'MS2 TIC Threshold', 'Threshold Column': "MS2TIC QC Threshold = {}"},
+                       'MS1 Spectra QC Status': {'Requires': 'MS2/MS1 Spectra', 'Metric': 'MS1 Spectra', 'Outliers': 'MS2/MS1 Spectra Outliers',
+                                                 'Threshold': 'MS1 Spectra Threshold', 'Threshold Column': "MS1Spectra QC Threshold = {}"},
+                       'MS2 Spectra QC Status': {'Requires': 'MS2/MS1 Spectra', 'Metric': 'MS2 Spectra', 'Outliers': 'MS2/MS1 Spectra Outliers',
+                                                 'Threshold': 'MS2 Spectra Threshold', 'Threshold Column': "MS2Spectra QC Threshold = {}"},
+                       'Max Basepeak Intensity QC Status': {'Requires': 'Max Basepeak Intensity', 'Metric': 'Log Max Basepeak Intensity',
+                                                            'Outliers': 'Log Max Basepeak Intensity Outliers', 'Threshold': 'Max Basepeak Intensity Threshold',
+                                                            'Threshold Column': "Max Basepeak Intensity QC Threshold = {}"}}
+
+#groupwise id-free statuses that also fail when the TIC CV% of the group is above the TIC CV threshold
+idfree_tic_cv_columns = {'MS1 TIC Group QC Status': "MS1 TIC CV% Threshold = {}", 'MS2 TIC Group QC Status': "MS2 TIC CV% Threshold = {}"}
 
 #-------------------------------------------------------------------------- FUNCTIONS ---------------------------------------------------------------------------
 
@@ -45,6 +64,52 @@ def get_mzml_list(mzml_dir):
 
     return final_mzml_list
 
+def get_mzml_run_info(mzml_path):
+    """
+    Reads the instrument and acquisition start time from the header of a mzML file, without reading its spectra.
+
+    Args:
+    mzml_path (str): Path to the mzML file.
+
+    Returns:
+    str: Instrument model, followed by the serial number in brackets if present, or "" if not found.
+    str: startTimeStamp of the run, or "" if not present.
+    """
+
+    instrument_params = []
+    start_time = ""
+    section = ""
+    in_components = False
+
+    for event, element in ET.iterparse(mzml_path, events=('start', 'end')):
+        tag = element.tag.rsplit('}', 1)[-1]
+        if event == 'start':
+            if tag in ['referenceableParamGroupList', 'instrumentConfigurationList']:
+                section = tag
+            elif tag == 'componentList':
+                in_components = True
+            elif tag == 'run':
+                start_time = element.get('startTimeStamp', "")
+                break
+        else:
+            if tag in ['referenceableParamGroupList', 'instrumentConfigurationList']:
+                section = ""
+            elif tag == 'componentList':
+                in_components = False
+            #source, analyzer and detector parameters are left out, the remaining instrument parameters are the model and serial number
+            elif tag == 'cvParam' and section and not in_components:
+                instrument_params.append((element.get('accession'), element.get('name', ""), element.get('value', "")))
+
+    #MS:1000529 - instrument serial number
+    serial_numbers = [value for accession, name, value in instrument_params if accession == 'MS:1000529' and value]
+    models = [name for accession, name, value in instrument_params if accession != 'MS:1000529']
+
+    instrument = models[0] if models else ""
+    if serial_numbers:
+        instrument = f"{instrument} ({serial_numbers[0]})".strip()
+
+    return instrument, start_time
+
 def mzml_extract(mzml_path, mzml_data):
 
     """
@@ -67,6 +132,9 @@ def mzml_extract(mzml_path, mzml_data):
     ms1_tic = 0
     ms2_tic = 0
 
+    #pymzml is only imported when mzml files are extracted
+    import pymzml
+
     msrun = pymzml.run.Reader(mzml_path)
 
     for spectrum in msrun:
@@ -160,20 +228,10 @@ def apply_idfree_thresholds(mzml_df, mzml_threshold_dict):
     DataFrame: Updated mzML DataFrame with added columns for QC status based on thresholds.
     """
 
-    if mzml_threshold_dict['MS1 TIC Threshold'] and 'Log MS1 TIC' in mzml_df.columns.tolist():
-        mzml_df[f"MS1TIC QC Threshold = {mzml_threshold_dict['MS1 TIC Threshold']}"] = mzml_df['Log MS1 TIC'].apply(check_threshold, args=[mzml_threshold_dict['MS1 TIC Threshold'],])
-
-    if mzml_threshold_dict['MS2 TIC Threshold'] and 'Log MS2 TIC' in mzml_df.columns.tolist():
-        mzml_df[f"MS2TIC QC Threshold = {mzml_threshold_dict['MS2 TIC Threshold']}"] = mzml_df['Log MS2 TIC'].apply(check_threshold, args=[mzml_threshold_dict['MS2 TIC Threshold'],])
-
-    if mzml_threshold_dict['MS1 Spectra Threshold']:
-        mzml_df[f"MS1Spectra QC Threshold = {mzml_threshold_dict['MS1 Spectra Threshold']}"] = mzml_df['MS1 Spectra'].apply(check_threshold, args=[mzml_threshold_dict['MS1 Spectra Threshold'],])
-
-    if mzml_threshold_dict['MS2 Spectra Threshold']:
-        mzml_df[f"MS2Spectra QC Threshold = {mzml_threshold_dict['MS2 Spectra Threshold']}"] = mzml_df['MS2 Spectra'].apply(check_threshold, args=[mzml_threshold_dict['MS2 Spectra Threshold'],])
-
-    if mzml_threshold_dict['Max Basepeak Intensity Threshold'] and 'Log Max Basepeak Intensity' in mzml_df.columns.tolist():
-        mzml_df[f"Max Basepeak Intensity QC Threshold = {mzml_threshold_dict['Max Basepeak Intensity Threshold']}"] = mzml_df['Log Max Basepeak Intensity'].apply(check_threshold, args=[mzml_threshold_dict['Max Basepeak Intensity Threshold'],])
+    for rule in idfree_status_rules.values():
+        threshold = mzml_threshold_dict[rule['Threshold']]
+        if threshold and rule['Metric'] in mzml_df.columns.tolist():
+            mzml_df[rule['Threshold Column'].format(threshold)] = check_status(mzml_df[rule['Metric']].to_numpy(), 'Below Threshold', threshold)
 
     return mzml_df
 
@@ -198,15 +256,40 @@ def iqr_outliers(df, colname, iqr_sensitivity):
     #iqr
     IQR=q3-q1
 
-    outliers = df[((df[colname]<(q1-(iqr_sensitivity*IQR))) | (df[colname]>(q3+(iqr_sensitivity*IQR))))][colname].tolist()
+    outliers = (df[colname]<(q1-(iqr_sensitivity*IQR))) | (df[colname]>(q3+(iqr_sensitivity*IQR)))
 
-    df[f"{colname} Outliers"] = df[colname].apply(label_outlier, args=[outliers, ])
+    df[f"{colname} Outliers"] = outliers.astype(int)
 
     col_iqr_range = (q1-(iqr_sensitivity*IQR), q3+(iqr_sensitivity*IQR))
 
-    return (df, len(outliers), col_iqr_range)
+    return (df, int(outliers.sum()), col_iqr_range)
+
+def baseline_outliers(df, colname, instruments, instrument_ranges):
+
+    """
+    Identifies outliers in a DataFrame column based on the IQR range of a reference baseline of earlier runs.
 
-def outlier_detection(mzml_df, iqr_sensitivity):
+    Args:
+    df (DataFrame): DataFrame containing the data.
+    colname (str): Name of the column to check for outliers.
+    instruments (dict): Instrument of each filename.
+    instrument_ranges (dict): Baseline outlier detection range of each instrument (see baseline.get_baseline_ranges).
+
+    Returns:
+    tuple: Updated DataFrame with outliers marked, the number of outliers found and the range of the most common instrument.
+    """
+
+    file_instruments = df['Filename'].map(instruments)
+    lower = file_instruments.map(lambda instrument: instrument_ranges[instrument][0])
+    upper = file_instruments.map(lambda instrument: instrument_ranges[instrument][1])
+
+    df[f"{colname} Outliers"] = ((df[colname] < lower) | (df[colname] > upper)).astype(int)
+
+    col_iqr_range = instrument_ranges[file_instruments.mode()[0]]
+
+    return (df, int(df[f"{colname} Outliers"].sum()), col_iqr_range)
+
+def outlier_detection(mzml_df, iqr_sensitivity, baseline_ranges=False, instruments=False):
 
     """
     Detects outliers in mzML data using either z-score or IQR methods based on data distribution.
@@ -214,12 +297,13 @@ def outlier_detection(mzml_df, iqr_sensitivity):
     Args:
     mzml_df (DataFrame): DataFrame containing mzML data.
     iqr_sensitivity (float): Sensitivity value for determining IQR decision range for outlier detection. Default is 1.5
+    baseline_ranges (dict): [Optional] Baseline outlier detection ranges by metric and instrument, used instead of the quartiles of the batch.
+    instruments (dict): [Optional] Instrument of each filename, required with baseline_ranges.
 
     Returns:
     DataFrame: mzML DataFrame updated with outlier detection results.
     """
 
-    idfree_metrics = ['Log MS1 TIC', 'Log MS2 TIC', 'MS2/MS1 Spectra', 'Log Max Basepeak Intensity']
     iqr_ranges = {}
 
     for colname in mzml_df.columns.tolist():
@@ -227,7 +311,11 @@ def outlier_detection(mzml_df, iqr_sensitivity):
 
             logging.info(f"Checking outliers for {colname}")
 
-            mzml_df, num_outliers, col_iqr_range = iqr_outliers(mzml_df, colname, iqr_sensitivity)
+            if baseline_ranges and colname in baseline_ranges:
+                logging.info(f"Outliers for {colname} are detected using the baseline")
+                mzml_df, num_outliers, col_iqr_range = baseline_outliers(mzml_df, colname, instruments, baseline_ranges[colname])
+            else:
+                mzml_df, num_outliers, col_iqr_range = iqr_outliers(mzml_df, colname, iqr_sensitivity)
 
             if num_outliers == 0:
                 logging.info(f"No outliers found for {colname}")
@@ -267,8 +355,8 @@ def calculate_tic_cv(mzml_df, groups, tic_cv_threshold):
     tic_cv.reset_index(drop=False, inplace=True)
     tic_cv = tic_cv.sort_values('Group')
 
-    tic_cv[f'MS1 TIC CV% Threshold = {int(tic_cv_threshold)}'] = tic_cv['Log MS1 TIC CV%'].apply(cv_status, args=[tic_cv_threshold,])
-    tic_cv[f'MS2 TIC CV% Threshold = {int(tic_cv_threshold)}'] = tic_cv['Log MS2 TIC CV%'].apply(cv_status, args=[tic_cv_threshold,])
+    tic_cv[f'MS1 TIC CV% Threshold = {int(tic_cv_threshold)}'] = check_status(tic_cv['Log MS1 TIC CV%'].to_numpy(), 'Above Threshold', tic_cv_threshold)
+    tic_cv[f'MS2 TIC CV% Threshold = {int(tic_cv_threshold)}'] = check_status(tic_cv['Log MS2 TIC CV%'].to_numpy(), 'Above Threshold', tic_cv_threshold)
 
     return tic_cv
 
@@ -287,39 +375,14 @@ def get_sample_qc(mzml_df, mzml_threshold_dict, groupwise_comparison, groups):
     DataFrame: Updated mzML DataFrame with sample QC status.
     """
 
-    if 'Log MS1 TIC' in mzml_df.columns.tolist():
-        if mzml_threshold_dict['MS1 TIC Threshold']:
-            mzml_df['MS1 TIC Sample QC Status'] = mzml_df[['Log MS1 TIC Outliers',f"MS1TIC QC Threshold = {mzml_threshold_dict['MS1 TIC Threshold']}"]].apply(get_outlier_and_cv_status, axis=1)
-        else:
-            mzml_df['MS1 TIC Sample QC Status'] =  mzml_df['Log MS1 TIC Outliers'].apply(only_outlier_status)
-
-    if 'Log MS2 TIC' in mzml_df.columns.tolist():
-        if mzml_threshold_dict['MS2 TIC Threshold']:
-            mzml_df['MS2 TIC Sample QC Status'] = mzml_df[['Log MS2 TIC Outliers',f"MS2TIC QC Threshold = {mzml_threshold_dict['MS2 TIC Threshold']}"]].apply(get_outlier_and_cv_status, axis=1)
-        else:
-            mzml_df['MS2 TIC Sample QC Status'] = mzml_df['Log MS2 TIC Outliers'].apply(only_outlier_status)
-
-    if mzml_threshold_dict['MS1 Spectra Threshold']:
-        mzml_df['MS1 Spectra QC Status'] = mzml_df[['MS2/MS1 Spectra Outliers',f"MS1Spectra QC Threshold = {mzml_threshold_dict['MS1 Spectra Threshold']}"]].apply(get_outlier_and_cv_status, axis=1)
-    else:
-        mzml_df['MS1 Spectra QC Status'] = mzml_df['MS2/MS1 Spectra Outliers'].apply(only_outlier_status)
+    for status_col, rule in idfree_status_rules.items():
+        if rule['Requires'] in mzml_df.columns.tolist():
+            checks = [('Outlier', rule['Outliers'], None)]
+            if mzml_threshold_dict[rule['Threshold']]:
+                checks.append(('Below Threshold', rule['Metric'], mzml_threshold_dict[rule['Threshold']]))
+            mzml_df[status_col] = get_rule_status(mzml_df, checks)
 
-    if mzml_threshold_dict['MS2 Spectra Threshold']:
-        mzml_df['MS2 Spectra QC Status'] = mzml_df[['MS2/MS1 Spectra Outliers',f"MS2Spectra QC Threshold = {mzml_threshold_dict['MS2 Spectra Threshold']}"]].apply(get_outlier_and_cv_status, axis=1)
-    else:
-        mzml_df['MS2 Spectra QC Status'] = mzml_df['MS2/MS1 Spectra Outliers'].apply(only_outlier_status)
-
-    if 'Max Basepeak Intensity' in mzml_df.columns.tolist():
-        if mzml_threshold_dict['Max Basepeak Intensity Threshold']:
-            mzml_df['Max Basepeak Intensity QC Status'] = mzml_df[['Log Max Basepeak Intensity Outliers', f"Max Basepeak Intensity QC Threshold = {mzml_threshold_dict['Max Basepeak Intensity Threshold']}"]].apply(get_outlier_and_cv_status, axis=1)
-        else:
-            mzml_df['Max Basepeak Intensity QC Status'] = mzml_df['Log Max Basepeak Intensity Outliers'].apply(only_outlier_status)
-
-    sample_qc_cols = ['MS1 TIC Sample QC Status', 'MS2 TIC Sample QC Status', 'MS1 Spectra QC Status', 'MS2 Spectra QC Status', 'Max Basepeak Intensity QC Status']
-    matched_sample_qc_cols = []
-    for colname in mzml_df.columns.tolist():
-        if colname in sample_qc_cols:
-            matched_sample_qc_cols.append(colname)
+    matched_sample_qc_cols = [colname for colname in mzml_df.columns.tolist() if colname in idfree_status_rules]
 
     mzml_df = mzml_df[['Filename'] + matched_sample_qc_cols]
     mzml_df = mzml_df.sort_values('Filename')
@@ -340,40 +403,20 @@ def get_idfree_grouped_df(mzml_sample_df, tic_cv, tic_cv_threshold, groups):
     DataFrame: Compiled DataFrame with grouped QC status for ID-free data.
     """
 
-    tic_group_df = tic_cv[['Group',f'MS1 TIC CV% Threshold = {int(tic_cv_threshold)}', f'MS2 TIC CV% Threshold = {int(tic_cv_threshold)}']]
-    idfree_status_params = ['MS1 TIC Sample QC Status', 'MS2 TIC Sample QC Status', 'MS1 Spectra QC Status', 'MS2 Spectra QC Status', 'Max Basepeak Intensity QC Status']
-    mzml_sample_df['Group'] = mzml_sample_df['Filename'].apply(groupname, args=[groups, ])
-
-    group_status_dict = {}
-
-    for group in list(set(mzml_sample_df['Group'].tolist())):
-        group_subset = mzml_sample_df[mzml_sample_df['Group'] == group]
-        col_dict = {}
+    cv_cols = {status_col: cv_col.format(int(tic_cv_threshold)) for status_col, cv_col in idfree_tic_cv_columns.items()}
+    tic_group_df = tic_cv[['Group'] + list(cv_cols.values())]
+    mzml_sample_df['Group'] = get_sample_groups(mzml_sample_df['Filename'].tolist(), groups)
 
-        for colname in ['MS1 TIC Sample QC Status', 'MS2 TIC Sample QC Status', 'MS1 Spectra QC Status', 'MS2 Spectra QC Status', 'Max Basepeak Intensity QC Status']:
-            if colname in group_subset.columns.tolist():
-                group_colname = colname.replace("Sample", "Group")
-                if list(set(group_subset[colname].tolist())) == ["PASS"]:
-                    col_dict[group_colname] = "PASS"
-                else:
-                    col_dict[group_colname] = "FAIL"
-
-        group_status_dict[group] = col_dict
-
-    grouped_df = pd.DataFrame.from_dict(group_status_dict, orient="columns")
-    grouped_df = grouped_df.T
-    grouped_df.reset_index(drop=False, inplace=True)
-    grouped_df.rename(columns={'index':'Group'}, inplace=True)
+    status_cols = [colname for colname in idfree_status_rules if colname in mzml_sample_df.columns.tolist()]
+    grouped_df = get_group_status(mzml_sample_df, status_cols, groups)
+    grouped_df.columns = ['Group'] + [colname.replace("Sample", "Group") for colname in status_cols]
 
     grouped_df = pd.merge(grouped_df, tic_group_df, on='Group')
 
-    if 'MS1 TIC Group QC Status' in grouped_df.columns.tolist():
-        grouped_df['MS1 TIC Group QC Status'] = grouped_df[['MS1 TIC Group QC Status', f'MS1 TIC CV% Threshold = {int(tic_cv_threshold)}']].apply(get_series_status, axis=1)
-        grouped_df = grouped_df.drop(f'MS1 TIC CV% Threshold = {int(tic_cv_threshold)}', axis=1)
-
-    if 'MS2 TIC Group QC Status' in grouped_df.columns.tolist():
-        grouped_df['MS2 TIC Group QC Status'] = grouped_df[['MS2 TIC Group QC Status', f'MS2 TIC CV% Threshold = {int(tic_cv_threshold)}']].apply(get_series_status, axis=1)
-        grouped_df = grouped_df.drop(f'MS2 TIC CV% Threshold = {int(tic_cv_threshold)}', axis=1)
+    for status_col, cv_col in cv_cols.items():
+        if status_col in grouped_df.columns.tolist():
+            grouped_df[status_col] = get_rule_status(grouped_df, [('Failed', status_col, None), ('Failed', cv_col, None)])
+            grouped_df = grouped_df.drop(cv_col, axis=1)
 
     grouped_df = grouped_df.sort_values('Group')
 
@@ -381,7 +424,7 @@ def get_idfree_grouped_df(mzml_sample_df, tic_cv, tic_cv_threshold, groups):
 
 #------------------------------------------------------------------------ PLOT FUNCTIONS ----------------------------------------------------------------------------
 
-def tic_plots(mzml_df, tic_cv, ms1_tic_threshold, ms2_tic_threshold, tic_cv_threshold, groupwise_comparison, color_list, iqr_ranges):
+def tic_plots(mzml_df, tic_cv, ms1_tic_threshold, ms2_tic_threshold, tic_cv_threshold, groupwise_comparison, color_list, iqr_ranges, scale_threshold=large_cohort_samples):
 
     df = mzml_df[['Filename','Log MS1 TIC','Log MS2 TIC']]
 
@@ -389,20 +432,18 @@ def tic_plots(mzml_df, tic_cv, ms1_tic_threshold, ms2_tic_threshold, tic_cv_thre
         var_name="Label",
         value_name="TIC")
 
-    tic_line = px.line(df, x='Filename', y="TIC", title="Total Ion Current", color="Label", line_shape="spline", markers=True)
-    tic_line.update_xaxes(tickfont_size=6)
-    tic_line.update_layout(title={'font': {'size': 9}})
-    tic_line.update_layout(
-            margin=dict(l=20, r=20, t=20, b=20)
-    )
+    tic_line = figure_spec('line', df, x='Filename', y="TIC", title="Total Ion Current", color="Label", line_shape="spline", markers=True)
+    update_figure(tic_line, 'update_xaxes', tickfont_size=6)
+    update_figure(tic_line, 'update_layout', title={'font': {'size': 9}})
+    update_figure(tic_line, 'update_layout', margin=dict(l=20, r=20, t=20, b=20))
 
     if ms1_tic_threshold:
-        tic_line.add_hline(y=ms1_tic_threshold, line_dash="dot", annotation_text=f"MS1 TIC Threshold = {ms1_tic_threshold}")
+        update_figure(tic_line, 'add_hline', y=ms1_tic_threshold, line_dash="dot", annotation_text=f"MS1 TIC Threshold = {ms1_tic_threshold}")
 
     if ms2_tic_threshold:
-        tic_line.add_hline(y=ms2_tic_threshold, line_dash="dot", annotation_text=f"MS2 TIC Threshold = {ms2_tic_threshold}")
+        update_figure(tic_line, 'add_hline', y=ms2_tic_threshold, line_dash="dot", annotation_text=f"MS2 TIC Threshold = {ms2_tic_threshold}")
 
-    tic_plot = plotly.io.to_html(tic_line, include_plotlyjs=False, full_html=False, default_width='900px', default_height='450px')
+    tic_plot = scale_figure_spec(tic_line, scale_threshold)
     #tic_plot = offline.plot(tic_line, output_type='div', include_plotlyjs=False)
 
     tic_report_params = {'total_ion_current': True,
@@ -414,17 +455,15 @@ def tic_plots(mzml_df, tic_cv, ms1_tic_threshold, ms2_tic_threshold, tic_cv_thre
         ms1_outliers_filenames = ", ".join(ms1_outliers)
         tic_report_params['tic_ms1_outlier_description'] = f"{mzml_df['Log MS1 TIC Outliers'].tolist().count(1)} outliers were found. The following files have been detected as outliers: {ms1_outliers_filenames}"
 
-        tic_ms1_outlier = px.scatter(mzml_df, x='Filename', y='Log MS1 TIC', title="Log MS1 TIC Outliers", color='Log MS1 TIC Outliers')
-        tic_ms1_outlier.update_layout(title={'font': {'size': 9}})
-        tic_ms1_outlier.add_hline(y=iqr_ranges['Log MS1 TIC'][1], line_width=1.5, line_dash='dash', line_color="red")
-        tic_ms1_outlier.add_hline(y=iqr_ranges['Log MS1 TIC'][0], line_width=1.5, line_dash='dash', line_color="red")
-        tic_ms1_outlier.update_xaxes(tickfont_size=6)
-        tic_ms1_outlier.update_layout(
-                margin=dict(l=20, r=20, t=20, b=20)
-        )
-        tic_ms1_outlier.update_traces(marker=dict(line=dict(color='black', width=1)))
+        tic_ms1_outlier = figure_spec('scatter', mzml_df, x='Filename', y='Log MS1 TIC', title="Log MS1 TIC Outliers", color='Log MS1 TIC Outliers')
+        update_figure(tic_ms1_outlier, 'update_layout', title={'font': {'size': 9}})
+        update_figure(tic_ms1_outlier, 'add_hline', y=iqr_ranges['Log MS1 TIC'][1], line_width=1.5, line_dash='dash', line_color="red")
+        update_figure(tic_ms1_outlier, 'add_hline', y=iqr_ranges['Log MS1 TIC'][0], line_width=1.5, line_dash='dash', line_color="red")
+        update_figure(tic_ms1_outlier, 'update_xaxes', tickfont_size=6)
+        update_figure(tic_ms1_outlier, 'update_layout', margin=dict(l=20, r=20, t=20, b=20))
+        update_figure(tic_ms1_outlier, 'update_traces', marker=dict(line=dict(color='black', width=1)))
 
-        tic_ms1_outlier_plot = plotly.io.to_html(tic_ms1_outlier, include_plotlyjs=False, full_html=False, default_width='900px', default_height='450px')
+        tic_ms1_outlier_plot = scale_figure_spec(tic_ms1_outlier, scale_threshold)
 
         tic_report_params['tic_ms1_outlier_plot'] = tic_ms1_outlier_plot
 
@@ -433,32 +472,28 @@ def tic_plots(mzml_df, tic_cv, ms1_tic_threshold, ms2_tic_threshold, tic_cv_thre
         ms2_outliers_filenames = ", ".join(ms2_outliers)
         tic_report_params['tic_ms2_outlier_description'] = f"{mzml_df['Log MS2 TIC Outliers'].tolist().count(1)} outliers were found. The following files have been detected as outliers: {ms2_outliers_filenames}"
 
-        tic_ms2_outlier = px.scatter(mzml_df, x='Filename', y='Log MS2 TIC', title="Log MS2 TIC Outliers", color='Log MS2 TIC Outliers')
-        tic_ms2_outlier.update_layout(title={'font': {'size': 9}})
-        tic_ms2_outlier.add_hline(y=iqr_ranges['Log MS2 TIC'][1], line_width=1.5, line_dash='dash', line_color="red")
-        tic_ms2_outlier.add_hline(y=iqr_ranges['Log MS2 TIC'][0], line_width=1.5, line_dash='dash', line_color="red")
-        tic_ms2_outlier.update_xaxes(tickfont_size=6)
-        tic_ms2_outlier.update_layout(
-                margin=dict(l=20, r=20, t=20, b=20)
-        )
-        tic_ms2_outlier.update_traces(marker=dict(line=dict(color='black', width=1)))
+        tic_ms2_outlier = figure_spec('scatter', mzml_df, x='Filename', y='Log MS2 TIC', title="Log MS2 TIC Outliers", color='Log MS2 TIC Outliers')
+        update_figure(tic_ms2_outlier, 'update_layout', title={'font': {'size': 9}})
+        update_figure(tic_ms2_outlier, 'add_hline', y=iqr_ranges['Log MS2 TIC'][1], line_width=1.5, line_dash='dash', line_color="red")
+        update_figure(tic_ms2_outlier, 'add_hline', y=iqr_ranges['Log MS2 TIC'][0], line_width=1.5, line_dash='dash', line_color="red")
+        update_figure(tic_ms2_outlier, 'update_xaxes', tickfont_size=6)
+        update_figure(tic_ms2_outlier, 'update_layout', margin=dict(l=20, r=20, t=20, b=20))
+        update_figure(tic_ms2_outlier, 'update_traces', marker=dict(line=dict(color='black', width=1)))
 
-        tic_ms2_outlier_plot = plotly.io.to_html(tic_ms2_outlier, include_plotlyjs=False, full_html=False, default_width='900px', default_height='450px')
+        tic_ms2_outlier_plot = scale_figure_spec(tic_ms2_outlier, scale_threshold)
 
         tic_report_params['tic_ms2_outlier_plot'] = tic_ms2_outlier_plot
 
     if groupwise_comparison:
         tic_report_params['tic_ms_cv_description'] = "When a grouping file is provided, CV% for TIC values across samples in each group is calculated. This provides an insignt into how consistent the samples are within each group."
 
-        ms1tic_bar = px.bar(tic_cv, x='Group', y="Log MS1 TIC CV%", title="MS1 Total Ion Current - CV%", color="Group", color_discrete_sequence=color_list)
-        ms1tic_bar.update_xaxes(tickfont_size=6)
-        ms1tic_bar.update_layout(title={'font': {'size': 9}})
-        ms1tic_bar.add_hline(y=tic_cv_threshold, line_dash="dot", annotation_text=f"TIC CV Threshold = {tic_cv_threshold}")
-        ms1tic_bar.update_layout(
-            margin=dict(l=20, r=20, t=20, b=20),
-        )
+        ms1tic_bar = figure_spec('bar', tic_cv, x='Group', y="Log MS1 TIC CV%", title="MS1 Total Ion Current - CV%", color="Group", color_discrete_sequence=color_list)
+        update_figure(ms1tic_bar, 'update_xaxes', tickfont_size=6)
+        update_figure(ms1tic_bar, 'update_layout', title={'font': {'size': 9}})
+        update_figure(ms1tic_bar, 'add_hline', y=tic_cv_threshold, line_dash="dot", annotation_text=f"TIC CV Threshold = {tic_cv_threshold}")
+        update_figure(ms1tic_bar, 'update_layout', margin=dict(l=20, r=20, t=20, b=20))
 
-        ms1_tic = plotly.io.to_html(ms1tic_bar, include_plotlyjs=False, full_html=False, default_width='900px', default_height='450px')
+        ms1_tic = ms1tic_bar
         tic_report_params['tic_ms1_cv_plot'] = ms1_tic
 
         if list(set(tic_cv[f'MS1 TIC CV% Threshold = {int(tic_cv_threshold)}'].tolist())) == ['PASS']:
@@ -467,15 +502,13 @@ def tic_plots(mzml_df, tic_cv, ms1_tic_threshold, ms2_tic_threshold, tic_cv_thre
             failed_ms1_groups = ", ".join(tic_cv[tic_cv[f'MS1 TIC CV% Threshold = {int(tic_cv_threshold)}'] == 'FAIL']['Group'].tolist())
             tic_report_params['tic_ms1_cv_description'] = f'CV% for MS1 TIC was calculated using TIC values from each sample within a provided group. The following groups have not met the CV Threshold: {failed_ms1_groups}. This represents an inconsistent TIC pattern, please check the samples within the failed groups.'
 
-        ms2tic_bar = px.bar(tic_cv, x='Group', y="Log MS2 TIC CV%", title="MS2 Total Ion Current - CV%", color="Group", color_discrete_sequence=color_list)
-        ms2tic_bar.update_xaxes(tickfont_size=6)
-        ms2tic_bar.update_layout(title={'font': {'size': 9}})
-        ms2tic_bar.add_hline(y=tic_cv_threshold, line_dash="dot", annotation_text=f"TIC CV Threshold = {tic_cv_threshold}")
-        ms2tic_bar.update_layout(
-            margin=dict(l=20, r=20, t=20, b=20),
-        )
+        ms2tic_bar = figure_spec('bar', tic_cv, x='Group', y="Log MS2 TIC CV%", title="MS2 Total Ion Current - CV%", color="Group", color_discrete_sequence=color_list)
+        update_figure(ms2tic_bar, 'update_xaxes', tickfont_size=6)
+        update_figure(ms2tic_bar, 'update_layout', title={'font': {'size': 9}})
+        update_figure(ms2tic_bar, 'add_hline', y=tic_cv_threshold, line_dash="dot", annotation_text=f"TIC CV Threshold = {tic_cv_threshold}")
+        update_figure(ms2tic_bar, 'update_layout', margin=dict(l=20, r=20, t=20, b=20))
 
-        ms2_tic = plotly.io.to_html(ms2tic_bar, include_plotlyjs=False, full_html=False, default_width='900px', default_height='450px')
+        ms2_tic = ms2tic_bar
         tic_report_params['tic_ms2_cv_plot'] = ms2_tic
 
         if list(set(tic_cv[f'MS2 TIC CV% Threshold = {int(tic_cv_threshold)}'].tolist())) == ['PASS']:
@@ -486,18 +519,16 @@ def tic_plots(mzml_df, tic_cv, ms1_tic_threshold, ms2_tic_threshold, tic_cv_thre
 
     return tic_report_params
 
-def spectral_plot(mzml_df, iqr_ranges):
+def spectral_plot(mzml_df, iqr_ranges, scale_threshold=large_cohort_samples):
 
     df = mzml_df[['Filename','MS2/MS1 Spectra', 'MS2/MS1 Spectra Outliers']]
 
-    count_line = px.line(df, x='Filename', y="MS2/MS1 Spectra", title="MS2/MS1 Spectral Ratio", line_shape="spline", markers=True)
-    count_line.update_xaxes(tickfont_size=6)
-    count_line.update_layout(title={'font': {'size': 9}})
-    count_line.update_layout(
-        margin=dict(l=20, r=20, t=20, b=20),
-    )
+    count_line = figure_spec('line', df, x='Filename', y="MS2/MS1 Spectra", title="MS2/MS1 Spectral Ratio", line_shape="spline", markers=True)
+    update_figure(count_line, 'update_xaxes', tickfont_size=6)
+    update_figure(count_line, 'update_layout', title={'font': {'size': 9}})
+    update_figure(count_line, 'update_layout', margin=dict(l=20, r=20, t=20, b=20))
 
-    spectral_count = plotly.io.to_html(count_line, include_plotlyjs=False, full_html=False, default_width='900px', default_height='450px')
+    spectral_count = scale_figure_spec(count_line, scale_threshold)
     spectra_report_params = {'ms2_ms1_spectral_ratio': True,
                             'ms2_ms1_spectral_ratio_plot': spectral_count,
                             'ms2_ms1_spectral_ratio_description': 'MS2/MS1 Spectral Count Ratio extracted from given mzML files'}
@@ -507,41 +538,37 @@ def spectral_plot(mzml_df, iqr_ranges):
         spectra_outliers_filenames = ", ".join(spectra_outliers)
         spectra_report_params['ms2_ms1_spectral_ratio_outlier_description'] = f"{mzml_df['MS2/MS1 Spectra Outliers'].tolist().count(1)} outliers were found. The following files have been detected as outliers: {spectra_outliers_filenames}"
 
-        ms2_ms1_spectral_ratio_outlier = px.scatter(mzml_df, x='Filename', y='MS2/MS1 Spectra', title="MS2/MS1 Spectra Outliers", color='MS2/MS1 Spectra Outliers')
-        ms2_ms1_spectral_ratio_outlier.update_xaxes(tickfont_size=6)
-        ms2_ms1_spectral_ratio_outlier.add_hline(y=iqr_ranges['MS2/MS1 Spectra'][1], line_width=1.5, line_dash='dash', line_color="red")
-        ms2_ms1_spectral_ratio_outlier.add_hline(y=iqr_ranges['MS2/MS1 Spectra'][0], line_width=1.5, line_dash='dash', line_color="red")
-        ms2_ms1_spectral_ratio_outlier.update_layout(title={'font': {'size': 9}})
-        ms2_ms1_spectral_ratio_outlier.update_layout(
-                margin=dict(l=20, r=20, t=20, b=20)
-        )
-        ms2_ms1_spectral_ratio_outlier.update_traces(marker=dict(line=dict(color='black', width=1)))
+        ms2_ms1_spectral_ratio_outlier = figure_spec('scatter', mzml_df, x='Filename', y='MS2/MS1 Spectra', title="MS2/MS1 Spectra Outliers", color='MS2/MS1 Spectra Outliers')
+        update_figure(ms2_ms1_spectral_ratio_outlier, 'update_xaxes', tickfont_size=6)
+        update_figure(ms2_ms1_spectral_ratio_outlier, 'add_hline', y=iqr_ranges['MS2/MS1 Spectra'][1], line_width=1.5, line_dash='dash', line_color="red")
+        update_figure(ms2_ms1_spectral_ratio_outlier, 'add_hline', y=iqr_ranges['MS2/MS1 Spectra'][0], line_width=1.5, line_dash='dash', line_color="red")
+        update_figure(ms2_ms1_spectral_ratio_outlier, 'update_layout', title={'font': {'size': 9}})
+        update_figure(ms2_ms1_spectral_ratio_outlier, 'update_layout', margin=dict(l=20, r=20, t=20, b=20))
+        update_figure(ms2_ms1_spectral_ratio_outlier, 'update_traces', marker=dict(line=dict(color='black', width=1)))
 
-        ms2_ms1_spectral_ratio_plot = plotly.io.to_html(ms2_ms1_spectral_ratio_outlier, include_plotlyjs=False, full_html=False, default_width='900px', default_height='450px')
+        ms2_ms1_spectral_ratio_plot = scale_figure_spec(ms2_ms1_spectral_ratio_outlier, scale_threshold)
 
         spectra_report_params['ms2_ms1_spectral_ratio_outlier_plot'] = ms2_ms1_spectral_ratio_plot
 
     return spectra_report_params
 
-def basepeak_graph(mzml_df, max_basepeak_intensity_threshold, groups, groupwise_comparison, color_list, iqr_ranges):
+def basepeak_graph(mzml_df, max_basepeak_intensity_threshold, groups, groupwise_comparison, color_list, iqr_ranges, scale_threshold=large_cohort_samples):
 
     if groupwise_comparison:
         mzml_df['Group'] = mzml_df['Filename'].apply(groupname, args=[groups,])
         mzml_df = mzml_df.sort_values('Group')
-        bp_bar = px.bar(mzml_df, x='Filename', y="Log Max Basepeak Intensity", title="Log Max Base Peak Intensity", color="Group", color_discrete_sequence=color_list)
+        bp_bar = figure_spec('bar', mzml_df, x='Filename', y="Log Max Basepeak Intensity", title="Log Max Base Peak Intensity", color="Group", color_discrete_sequence=color_list)
     else:
-        bp_bar = px.bar(mzml_df, x='Filename', y="Log Max Basepeak Intensity", title="Log Max Base Peak Intensity")
+        bp_bar = figure_spec('bar', mzml_df, x='Filename', y="Log Max Basepeak Intensity", title="Log Max Base Peak Intensity")
 
-    bp_bar.update_layout(title={'font': {'size': 9}})
-    bp_bar.update_xaxes(tickfont_size=6)
-    bp_bar.update_layout(
-        margin=dict(l=20, r=20, t=20, b=20),
-    )
+    update_figure(bp_bar, 'update_layout', title={'font': {'size': 9}})
+    update_figure(bp_bar, 'update_xaxes', tickfont_size=6)
+    update_figure(bp_bar, 'update_layout', margin=dict(l=20, r=20, t=20, b=20))
 
     if max_basepeak_intensity_threshold:
-        bp_bar.add_hline(y=max_basepeak_intensity_threshold, line_dash="dot", annotation_text=f"Max Base Peak Intensity Threshold = {max_basepeak_intensity_threshold}")
+        update_figure(bp_bar, 'add_hline', y=max_basepeak_intensity_threshold, line_dash="dot", annotation_text=f"Max Base Peak Intensity Threshold = {max_basepeak_intensity_threshold}")
 
-    bp_plot = plotly.io.to_html(bp_bar, include_plotlyjs=False, full_html=False, default_width='900px', default_height='450px')
+    bp_plot = scale_figure_spec(bp_bar, scale_threshold)
 
     basepeak_report_params = {'max_basepeak_intensity' : True,
                               'max_basepeak_intensity_plot': bp_plot}
@@ -551,37 +578,35 @@ def basepeak_graph(mzml_df, max_basepeak_intensity_threshold, groups, groupwise_
         bp_outliers_filenames = ", ".join(bp_outliers)
         basepeak_report_params['max_basepeak_intensity_outlier_description'] = f"{mzml_df['Log Max Basepeak Intensity Outliers'].tolist().count(1)} outliers were found. The following files have been detected as outliers: {bp_outliers_filenames}"
 
-        max_basepeak_intensity_outlier = px.scatter(mzml_df, x='Filename', y='Log Max Basepeak Intensity', title="Log Max Base Peak Intensity Outliers", color='Log Max Basepeak Intensity Outliers')
-        max_basepeak_intensity_outlier.update_layout(title={'font': {'size': 9}})
-        max_basepeak_intensity_outlier.add_hline(y=iqr_ranges['Log Max Basepeak Intensity'][1], line_width=1.5, line_dash='dash', line_color="red")
-        max_basepeak_intensity_outlier.add_hline(y=iqr_ranges['Log Max Basepeak Intensity'][0], line_width=1.5, line_dash='dash', line_color="red")
-        max_basepeak_intensity_outlier.update_xaxes(tickfont_size=6)
-        max_basepeak_intensity_outlier.update_layout(
-                margin=dict(l=20, r=20, t=20, b=20)
-        )
-        max_basepeak_intensity_outlier.update_traces(marker=dict(line=dict(color='black', width=1)))
+        max_basepeak_intensity_outlier = figure_spec('scatter', mzml_df, x='Filename', y='Log Max Basepeak Intensity', title="Log Max Base Peak Intensity Outliers", color='Log Max Basepeak Intensity Outliers')
+        update_figure(max_basepeak_intensity_outlier, 'update_layout', title={'font': {'size': 9}})
+        update_figure(max_basepeak_intensity_outlier, 'add_hline', y=iqr_ranges['Log Max Basepeak Intensity'][1], line_width=1.5, line_dash='dash', line_color="red")
+        update_figure(max_basepeak_intensity_outlier, 'add_hline', y=iqr_ranges['Log Max Basepeak Intensity'][0], line_width=1.5, line_dash='dash', line_color="red")
+        update_figure(max_basepeak_intensity_outlier, 'update_xaxes', tickfont_size=6)
+        update_figure(max_basepeak_intensity_outlier, 'update_layout', margin=dict(l=20, r=20, t=20, b=20))
+        update_figure(max_basepeak_intensity_outlier, 'update_traces', marker=dict(line=dict(color='black', width=1)))
 
-        max_basepeak_intensity_outlier_plot = plotly.io.to_html(max_basepeak_intensity_outlier, include_plotlyjs=False, full_html=False, default_width='900px', default_height='450px')
+        max_basepeak_intensity_outlier_plot = scale_figure_spec(max_basepeak_intensity_outlier, scale_threshold)
 
         basepeak_report_params['max_basepeak_intensity_outlier_plot'] = max_basepeak_intensity_outlier_plot
 
     return basepeak_report_params
 
-def create_graphs(mzml_df, tic_cv, groupwise_comparison, groups, mzml_threshold_dict, iqr_ranges):
+def create_graphs(mzml_df, tic_cv, groupwise_comparison, groups, mzml_threshold_dict, iqr_ranges, scale_threshold=large_cohort_samples):
 
     if 'Log MS1 TIC' and 'Log MS2 TIC' in mzml_df.columns.tolist():
-        tic_report_params = tic_plots(mzml_df, tic_cv, mzml_threshold_dict['MS1 TIC Threshold'], mzml_threshold_dict['MS2 TIC Threshold'], mzml_threshold_dict['TIC CV Threshold'], groupwise_comparison, color_list, iqr_ranges)
+        tic_report_params = tic_plots(mzml_df, tic_cv, mzml_threshold_dict['MS1 TIC Threshold'], mzml_threshold_dict['MS2 TIC Threshold'], mzml_threshold_dict['TIC CV Threshold'], groupwise_comparison, color_list, iqr_ranges, scale_threshold)
     else:
         logging.info("No TIC information was extracted from provided mzML files, no plots for TIC will be generated")
         tic_report_params = {}
 
     if 'Log Max Basepeak Intensity' in mzml_df.columns.tolist():
-        basepeak_report_params = basepeak_graph(mzml_df, mzml_threshold_dict['Max Basepeak Intensity Threshold'], groups, groupwise_comparison, color_list, iqr_ranges)
+        basepeak_report_params = basepeak_graph(mzml_df, mzml_threshold_dict['Max Basepeak Intensity Threshold'], groups, groupwise_comparison, color_list, iqr_ranges, scale_threshold)
     else:
         logging.info("No Basepeak Intensity information was extracted from provided mzML files, no plots for Max Basepeak Intensity will be generated")
         basepeak_report_params = {}
 
-    spectra_report_params = spectral_plot(mzml_df, iqr_ranges)
+    spectra_report_params = spectral_plot(mzml_df, iqr_ranges, scale_threshold)
 
     idfree_report_parameters = dict(tuple(tic_report_params.items()) + tuple(spectra_report_params.items()) + tuple(basepeak_report_params.items()))
 
@@ -589,27 +614,61 @@ def create_graphs(mzml_df, tic_cv, groupwise_comparison, groups, mzml_threshold_
 
 #---------------------------------------------------------------------- MAIN FUNCTION CALL -------------------------------------------------------------------------
 
-def calculate_idfree_metrics(out_dir, reportname, mzml_dir, groupwise_comparison, groups, mzml_threshold_dict):
+def calculate_idfree_metrics(out_dir, reportname, mzml_dir, groupwise_comparison, groups, mzml_threshold_dict, scale_threshold=large_cohort_samples, baseline_file=False, instrument=False,
+                             stream_verdicts=False, stop_after_failures=False, metrics_bundle=False, rethreshold=False):
 
-    #getting list of mzML files
-    mzml_list = get_mzml_list(mzml_dir)
+    if rethreshold:
+        #the extracted metrics and instruments of the files are read from the metrics bundle instead of the mzML files
+        idfree_bundle = load_bundle_part(metrics_bundle, "ID-Free")
+        mzml_df = idfree_bundle['Extracted Metrics']
+        instruments = idfree_bundle['Instruments']
+    else:
+        #getting list of mzML files
+        mzml_list = get_mzml_list(mzml_dir)
+
+        if baseline_file or metrics_bundle:
+            from mod.baseline import get_file_instrument
+            instruments = {os.path.split(mzml_path)[1]: get_file_instrument(mzml_path, instrument) for mzml_path in mzml_list}
+        else:
+            instruments = False
 
-    if len(mzml_list) > 30:
-        mzml_list_chunks = [mzml_list[x:x+30] for x in range(0, len(mzml_list), 30)]
+    #outliers are detected against the baseline of earlier runs where it covers the instruments of the run
+    if baseline_file:
+        from mod.baseline import load_baseline, get_baseline_ranges
+        baseline_ranges = get_baseline_ranges(load_baseline(baseline_file), instruments, mzml_threshold_dict['IQR Sensitivity'])
     else:
-        mzml_list_chunks = [mzml_list]
+        baseline_ranges = False
+
+    #provisional verdicts are written as each file is extracted and reconciled once the whole batch is judged
+    if stream_verdicts:
+        from mod.verdict_stream import open_verdict_stream, close_verdict_stream, stream_mzml_extraction, reconcile_verdicts
+        verdict_stream = open_verdict_stream(stream_verdicts)
+        try:
+            mzml_df, provisional = stream_mzml_extraction(mzml_list, mzml_threshold_dict, verdict_stream, baseline_ranges, instruments, stop_after_failures)
+        except BaseException:
+            close_verdict_stream(verdict_stream)
+            raise
+    elif not rethreshold:
+        if len(mzml_list) > 30:
+            mzml_list_chunks = [mzml_list[x:x+30] for x in range(0, len(mzml_list), 30)]
+        else:
+            mzml_list_chunks = [mzml_list]
+
+        mzml_df = pd.DataFrame()
 
-    mzml_df = pd.DataFrame()
+        for lt in mzml_list_chunks:
+            #extracting data from mzml files
+            extracted_df = get_mzml_info_dataframe(lt)
+            mzml_df = pd.concat([mzml_df, extracted_df], ignore_index=True)
+            time.sleep(100)
 
-    for lt in mzml_list_chunks:
-        #extracting data from mzml files
-        extracted_df = get_mzml_info_dataframe(lt)
-        mzml_df = pd.concat([mzml_df, extracted_df], ignore_index=True)
-        time.sleep(100)
+    #extracted metrics before any threshold is applied, saved so other thresholds can be applied without extracting the files again
+    if metrics_bundle and not rethreshold:
+        save_bundle_part(metrics_bundle, "ID-Free", {'Extracted Metrics': mzml_df, 'Instruments': instruments})
 
     #applying thresholds + outlier detection
     mzml_df = apply_idfree_thresholds(mzml_df, mzml_threshold_dict)
-    mzml_df, iqr_ranges = outlier_detection(mzml_df, mzml_threshold_dict['IQR Sensitivity'])
+    mzml_df, iqr_ranges = outlier_detection(mzml_df, mzml_threshold_dict['IQR Sensitivity'], baseline_ranges, instruments)
 
     if groupwise_comparison:
         mzml_df['Group'] = mzml_df['Filename'].apply(groupname, args=[groups, ])
@@ -627,9 +686,15 @@ def calculate_idfree_metrics(out_dir, reportname, mzml_dir, groupwise_comparison
         tic_cv.to_excel(writer, index=False, sheet_name='Group TIC CV')
     writer.close()
 
-    idfree_report_parameters = create_graphs(mzml_df, tic_cv, groupwise_comparison, groups, mzml_threshold_dict, iqr_ranges)
+    idfree_report_parameters = create_graphs(mzml_df, tic_cv, groupwise_comparison, groups, mzml_threshold_dict, iqr_ranges, scale_threshold)
+    #metrics embedded in the report, so other thresholds can be tried in the browser
+    idfree_report_parameters['idfree_tuning'] = get_idfree_tuning(mzml_df, mzml_threshold_dict, baseline_ranges, instruments)
 
     mzml_sample_df = get_sample_qc(mzml_df, mzml_threshold_dict, groupwise_comparison, groups)
+    if stream_verdicts:
+        reconcile_verdicts(verdict_stream, provisional, mzml_sample_df)
+        close_verdict_stream(verdict_stream)
+
     if groupwise_comparison:
         idfree_grouped_df = get_idfree_grouped_df(mzml_sample_df, tic_cv, mzml_threshold_dict['TIC CV Threshold'], groups)
     else:
@@ -0,0 +1,386 @@
+"""
+Functions to calculate PCA of protein, peptide and precursor level intensities, for in-memory and streamed intensity files
+"""
+
+import pandas as pd
+import numpy as np
+import os
+import hashlib
+import logging
+
+#-------------------------------------------------------------------------- VARIABLES --------------------------------------------------------------------------
+
+#missing value handling - fill with 0, fill with the feature mean or minimum, or only use features found in all samples
+pca_missing_value_methods = ['zero', 'mean', 'min', 'drop']
+
+#full and randomized SVD on the whole matrix, or incremental PCA on batches of samples
+pca_solver_methods = ['auto', 'full', 'randomized', 'incremental']
+
+#smallest number of samples and features for which the auto solver uses randomized SVD, smaller matrices get the exact full SVD
+randomized_min_size = 1000
+
+#PCA results of each matrix seen so far - {key: results dict}
+pca_cache = {}
+
+#-------------------------------------------------------------------------- FUNCTIONS ---------------------------------------------------------------------------
+
+def get_pca_options(input_dict):
+    """
+    Collects the PCA options from the input dictionary, using defaults that match a zero-filled full PCA.
+
+    Args:
+    input_dict (dict): Dictionary containing the input files and options.
+
+    Returns:
+    dict: PCA options - 'Missing Values', 'Completeness', 'Top Variance', 'Solver', 'Components' and 'Cache Directory'.
+    """
+
+    pca_options = {'Missing Values': input_dict.get('PCA Missing Values') or 'zero',
+                   'Completeness': input_dict.get('PCA Completeness') or 0,
+                   'Top Variance': input_dict.get('PCA Top Variance') or 0,
+                   'Solver': input_dict.get('PCA Solver') or 'auto',
+                   'Components': 3,
+                   'Cache Directory': input_dict.get('Cache Directory')}
+
+    return pca_options
+
+def feature_stats(values):
+    """
+    Calculates per-feature statistics of a block of samples, which can be merged across blocks.
+
+    Args:
+    values (ndarray): Intensity matrix (samples x features) with NaN for missing values.
+
+    Returns:
+    dict: Number of values ('Count'), sum ('Sum'), sum of squares ('Sum Squares') and minimum ('Min') of each feature.
+    """
+
+    present = ~np.isnan(values)
+    filled = np.where(present, values, 0).astype(np.float64)
+
+    stats = {'Count': present.sum(axis=0),
+             'Sum': filled.sum(axis=0),
+             'Sum Squares': (filled**2).sum(axis=0),
+             'Min': np.where(present, values, np.inf).min(axis=0)}
+
+    return stats
+
+def merge_feature_stats(stats, block_stats):
+    """
+    Merges the per-feature statistics of two blocks of samples.
+
+    Args:
+    stats (dict): Statistics of the samples seen so far, or None.
+    block_stats (dict): Statistics of the next block of samples.
+
+    Returns:
+    dict: Statistics of all samples.
+    """
+
+    if stats is None:
+        return block_stats
+
+    return {'Count': stats['Count'] + block_stats['Count'],
+            'Sum': stats['Sum'] + block_stats['Sum'],
+            'Sum Squares': stats['Sum Squares'] + block_stats['Sum Squares'],
+            'Min': np.minimum(stats['Min'], block_stats['Min'])}
+
+def get_scaling(stats, num_samples, pca_options):
+    """
+    Selects the features used for PCA and calculates the values used to fill, center and scale them.
+
+    Args:
+    stats (dict): Per-feature statistics of all samples, from feature_stats.
+    num_samples (int): Number of samples.
+    pca_options (dict): PCA options, from get_pca_options.
+
+    Returns:
+    dict: Indices of the selected features ('Features') with their fill value ('Fill'), mean ('Mean') and standard deviation ('Scale') after filling.
+
+    Note:
+    Means and standard deviations are those of the filled matrix, matching StandardScaler on the filled intensities.
+    Features with no variance are removed since they do not change the components.
+    """
+
+    count = stats['Count'].astype(np.float64)
+    missing = num_samples - count
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        if pca_options['Missing Values'] == 'mean':
+            fill = stats['Sum']/count
+        elif pca_options['Missing Values'] == 'min':
+            fill = np.where(np.isinf(stats['Min']), np.nan, stats['Min'])
+        else:
+            fill = np.zeros(len(count))
+
+        total = stats['Sum'] + missing*fill
+        total_squares = stats['Sum Squares'] + missing*fill**2
+        mean = total/num_samples
+        variance = np.maximum(total_squares/num_samples - mean**2, 0)
+
+    keep = (count > 0) & (variance > 0) & ~np.isnan(variance)
+    if pca_options['Missing Values'] == 'drop':
+        keep &= count == num_samples
+    if pca_options['Completeness']:
+        keep &= (count/num_samples)*100 >= pca_options['Completeness']
+
+    features = np.flatnonzero(keep)
+    if pca_options['Top Variance'] and len(features) > pca_options['Top Variance']:
+        #scaled intensities all have unit variance, so the most variable features are picked on the coefficient of variation
+        dispersion = np.sqrt(variance[features])/np.abs(mean[features])
+        features = np.sort(features[np.argsort(dispersion)[::-1][:pca_options['Top Variance']]])
+
+    scaling = {'Features': features,
+               'Fill': fill[features].astype(np.float32),
+               'Mean': mean[features].astype(np.float32),
+               'Scale': np.sqrt(variance[features]).astype(np.float32)}
+
+    return scaling
+
+def scale_block(values, scaling):
+    """
+    Fills the missing values of a block of samples and standardizes the selected features.
+
+    Args:
+    values (ndarray): Intensity matrix (samples x features) with NaN for missing values.
+    scaling (dict): Selected features and scaling values, from get_scaling.
+
+    Returns:
+    ndarray: Standardized float32 matrix (samples x selected features).
+    """
+
+    block = values[:, scaling['Features']].astype(np.float32)
+    block = np.where(np.isnan(block), scaling['Fill'], block)
+    block -= scaling['Mean']
+    block /= scaling['Scale']
+
+    return block
+
+def get_batches(num_samples, batch_size, n_components):
+    """
+    Splits the samples into batches for incremental PCA, each with at least as many samples as components.
+
+    Args:
+    num_samples (int): Number of samples.
+    batch_size (int): Maximum number of samples in a batch.
+    n_components (int): Number of principal components.
+
+    Returns:
+    list: Arrays of sample indices.
+    """
+
+    batch_size = max(int(batch_size), n_components)
+    num_batches = max(min(int(np.ceil(num_samples/batch_size)), num_samples//n_components), 1)
+
+    return np.array_split(np.arange(num_samples), num_batches)
+
+def get_svd_solver(solver, num_samples, num_features):
+    """
+    Resolves the auto PCA solver from the size of the intensity matrix.
+
+    Args:
+    solver (str): PCA solver from pca_solver_methods.
+    num_samples (int): Number of samples.
+    num_features (int): Number of features.
+
+    Returns:
+    str: The solver, with auto replaced by 'full', or by 'randomized' if both dimensions are at least randomized_min_size.
+    """
+
+    if solver != 'auto':
+        return solver
+
+    return 'randomized' if min(num_samples, num_features) >= randomized_min_size else 'full'
+
+def fit_pca(scaled, pca_options, batch_size=500):
+    """
+    Fits PCA on a standardized matrix.
+
+    Args:
+    scaled (ndarray): Standardized float32 matrix (samples x features), can be a memory-mapped array.
+    pca_options (dict): PCA options, from get_pca_options.
+    batch_size (int): [Optional] Number of samples in each batch for the incremental solver.
+
+    Returns:
+    dict: PCA 'Scores' (samples x components), 'Components' (components x features) and 'Explained Variance Ratio'.
+    """
+
+    #scikit-learn is only imported when pca is calculated, it takes a while to import
+    from sklearn.decomposition import PCA, IncrementalPCA
+
+    n_components = min(pca_options['Components'], *scaled.shape)
+
+    if pca_options['Solver'] == 'incremental':
+        pca = IncrementalPCA(n_components=n_components)
+        batches = get_batches(scaled.shape[0], batch_size, n_components)
+        for batch in batches:
+            pca.partial_fit(scaled[batch])
+        scores = np.vstack([pca.transform(scaled[batch]) for batch in batches])
+    else:
+        pca = PCA(n_components=n_components, svd_solver=pca_options['Solver'], random_state=0)
+        scores = pca.fit_transform(scaled)
+
+    pca_results = {'Scores': scores.astype(np.float32),
+                   'Components': pca.components_.astype(np.float32),
+                   'Explained Variance Ratio': pca.explained_variance_ratio_}
+
+    return pca_results
+
+def get_cache_key(level, sample_names, pca_options, content):
+    """
+    Creates the key of a PCA result from the level, samples, options and the hashed input content.
+
+    Args:
+    level (str): The analysis level ('Protein', 'Peptide' or 'Precursor').
+    sample_names (list): Sample names, in the row order of the PCA scores.
+    pca_options (dict): PCA options, from get_pca_options.
+    content (bytes): Intensities, or a description of the input file, that the result is calculated from.
+
+    Returns:
+    str: Hex digest identifying the PCA result.
+    """
+
+    key = hashlib.sha1()
+    key.update(level.encode())
+    key.update("\t".join(sample_names).encode())
+    key.update(str(sorted((option, str(value)) for option, value in pca_options.items() if option != 'Cache Directory')).encode())
+    key.update(content)
+
+    return key.hexdigest()
+
+def load_cached_pca(key, cache_dir):
+    """
+    Gets a cached PCA result from memory, or from the cache directory.
+
+    Args:
+    key (str): Key of the PCA result, from get_cache_key.
+    cache_dir (str): Directory where PCA results are saved, or False.
+
+    Returns:
+    dict: The cached PCA result, or None if it was not calculated before.
+    """
+
+    if key in pca_cache:
+        return pca_cache[key]
+
+    cache_file = f"{cache_dir}/pca_{key}.npz" if cache_dir else ""
+    if cache_file and os.path.exists(cache_file):
+        with np.load(cache_file) as cached:
+            pca_cache[key] = {'Scores': cached['scores'],
+                              'Components': cached['components'],
+                              'Explained Variance Ratio': cached['explained_variance_ratio']}
+        logging.info(f"Loaded PCA components and explained variance from {cache_file}")
+        return pca_cache[key]
+
+    return None
+
+def save_cached_pca(key, pca_results, cache_dir):
+    """
+    Keeps a PCA result in memory and saves it to the cache directory.
+
+    Args:
+    key (str): Key of the PCA result, from get_cache_key.
+    pca_results (dict): PCA result, from fit_pca.
+    cache_dir (str): Directory where PCA results are saved, or False.
+
+    Returns:
+    None
+    """
+
+    pca_cache[key] = pca_results
+
+    if cache_dir:
+        #renamed into place once complete, so load_cached_pca never reads a partial npz file
+        cache_file = f"{cache_dir}/pca_{key}.npz"
+        tmp_file = f"{cache_file}.{os.getpid()}.tmp"
+        with open(tmp_file, 'wb') as f:
+            np.savez(f, scores=pca_results['Scores'], components=pca_results['Components'],
+                     explained_variance_ratio=pca_results['Explained Variance Ratio'])
+        os.replace(tmp_file, cache_file)
+
+    return None
+
+def level_pca(df_level, filenames, level, pca_options):
+    """
+    Calculates PCA of the samples from an intensity DataFrame.
+
+    Args:
+    df_level (DataFrame): DataFrame with one row per feature and one column per sample.
+    filenames (list): Samples to be analyzed, in the row order of the scores.
+    level (str): The analysis level ('Protein', 'Peptide' or 'Precursor').
+    pca_options (dict): PCA options, from get_pca_options.
+
+    Returns:
+    dict: PCA 'Scores', 'Components' and 'Explained Variance Ratio'.
+    """
+
+    values = np.ascontiguousarray(df_level[filenames].to_numpy(dtype=np.float32).T)
+    pca_options = dict(pca_options, Solver=get_svd_solver(pca_options['Solver'], *values.shape))
+
+    key = get_cache_key(level, filenames, pca_options, values.tobytes())
+    pca_results = load_cached_pca(key, pca_options['Cache Directory'])
+    if pca_results is not None:
+        return pca_results
+
+    scaling = get_scaling(feature_stats(values), len(filenames), pca_options)
+    logging.info(f"{len(scaling['Features'])} {level}s are used for PCA ({pca_options['Solver']} solver, '{pca_options['Missing Values']}' missing value handling)")
+
+    pca_results = fit_pca(scale_block(values, scaling), pca_options)
+    save_cached_pca(key, pca_results, pca_options['Cache Directory'])
+
+    return pca_results
+
+def streamed_level_pca(level_file, filenames, level, pca_options, batch_size):
+    """
+    Calculates PCA of the samples from an intensity file without loading the whole file, by reading batches of sample columns.
+
+    Args:
+    level_file (str): Path to the tab delimited intensity file.
+    filenames (list): Samples to be analyzed, in the row order of the scores.
+    level (str): The analysis level ('Protein', 'Peptide' or 'Precursor').
+    pca_options (dict): PCA options, from get_pca_options.
+    batch_size (int): Number of sample columns read at once.
+
+    Returns:
+    dict: PCA 'Scores', 'Components' and 'Explained Variance Ratio'.
+
+    Note:
+    The file is read once to get the feature statistics, once to fit incremental PCA and once to get the scores.
+    """
+
+    file_stat = os.stat(level_file)
+    key = get_cache_key(level, filenames, pca_options, f"{os.path.abspath(level_file)}:{file_stat.st_size}:{file_stat.st_mtime_ns}".encode())
+    pca_results = load_cached_pca(key, pca_options['Cache Directory'])
+    if pca_results is not None:
+        return pca_results
+
+    n_components = min(pca_options['Components'], len(filenames))
+    batches = get_batches(len(filenames), batch_size, n_components)
+
+    def read_batch(batch):
+        batch_files = [filenames[i] for i in batch]
+        block = pd.read_csv(level_file, sep="\t", usecols=batch_files, dtype=np.float32)
+        block = block.replace(0, np.nan)
+        return np.ascontiguousarray(block[batch_files].to_numpy().T)
+
+    stats = None
+    for batch in batches:
+        stats = merge_feature_stats(stats, feature_stats(read_batch(batch)))
+
+    scaling = get_scaling(stats, len(filenames), pca_options)
+    logging.info(f"{len(scaling['Features'])} {level}s are used for incremental PCA of {len(batches)} sample batches")
+
+    from sklearn.decomposition import IncrementalPCA
+
+    pca = IncrementalPCA(n_components=n_components)
+    for batch in batches:
+        pca.partial_fit(scale_block(read_batch(batch), scaling))
+
+    scores = np.vstack([pca.transform(scale_block(read_batch(batch), scaling)) for batch in batches])
+
+    pca_results = {'Scores': scores.astype(np.float32),
+                   'Components': pca.components_.astype(np.float32),
+                   'Explained Variance Ratio': pca.explained_variance_ratio_}
+    save_cached_pca(key, pca_results, pca_options['Cache Directory'])
+
+    return pca_results
@@ -0,0 +1,285 @@
+"""
+Pipeline of QC stages - stages declare their dependencies, independent stages run concurrently and unchanged stages are restored from a cache
+"""
+
+import os
+import glob
+import json
+import time
+import pickle
+import shutil
+import hashlib
+import logging
+from concurrent.futures import wait, FIRST_COMPLETED
+
+#-------------------------------------------------------------------------- VARIABLES --------------------------------------------------------------------------
+
+#source files of the stage functions, part of every cache key so changed code is not answered from the cache
+code_dir = os.path.dirname(os.path.abspath(__file__))
+
+#-------------------------------------------------------------------------- FUNCTIONS ---------------------------------------------------------------------------
+
+def stage_spec(function, depends=[], inputs=[], outputs=[], ignore=[], cache=False, process=False, **kwargs):
+    """
+    Creates the specification of a pipeline stage.
+
+    Args:
+    function (function): Function of the stage, called with the results of the stages it depends on followed by the keyword arguments.
+    depends (list): [Optional] Names of the stages whose results the stage takes, in argument order.
+    inputs (list): [Optional] Paths of the files and directories the stage reads, part of the cache key by content. False entries are left out.
+    outputs (list): [Optional] Glob patterns of the files the stage writes, saved and restored along with a cached result.
+    ignore (list): [Optional] Names of keyword arguments left out of the cache key, e.g. the output directory or values read from an input file.
+    cache (bool): [Optional] Whether the result is cached, for stages worth skipping when their inputs and parameters are unchanged.
+    process (bool): [Optional] Whether the stage runs in the stage pool, so it runs concurrently with other stages.
+    **kwargs: Keyword arguments of the function.
+
+    Returns:
+    dict: Stage specification.
+    """
+
+    return {'Function': function, 'Depends': list(depends), 'Inputs': [path for path in inputs if path], 'Outputs': list(outputs),
+            'Ignore': list(ignore), 'Cache': cache, 'Process': process, 'Arguments': kwargs}
+
+def check_pipeline(stages):
+    """
+    Checks that all dependencies of the stages exist and do not form a cycle.
+
+    Args:
+    stages (dict): Stage specifications by name, in the order ready stages are started.
+
+    Returns:
+    list: Stage names in dependency order.
+
+    Raises:
+    ValueError: If a dependency is missing or the dependencies form a cycle.
+    """
+
+    order = []
+
+    while len(order) < len(stages):
+        ready = [name for name, stage in stages.items() if name not in order and all(depend in order for depend in stage['Depends'])]
+        if not ready:
+            missing = {name: [depend for depend in stage['Depends'] if depend not in stages] for name, stage in stages.items() if name not in order}
+            raise ValueError(f"Pipeline stages with missing or circular dependencies: {missing}")
+        order.extend(ready)
+
+    return order
+
+def get_input_fingerprint(path):
+    """
+    Describes a stage input by its content - files by the hash of their contents, directories (e.g. mzML directories) by their
+    file names, sizes and modification times.
+
+    Args:
+    path (str): Path to the file or directory.
+
+    Returns:
+    dict: JSON-serialisable description of the input.
+    """
+
+    if os.path.isdir(path):
+        entries = sorted(os.scandir(path), key=lambda entry: entry.name)
+        return {'Directory': [(entry.name, entry.stat().st_size, entry.stat().st_mtime_ns) for entry in entries if entry.is_file()]}
+
+    file_hash = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            file_hash.update(block)
+
+    return {'File': os.path.basename(path), 'Hash': file_hash.hexdigest()}
+
+def get_code_fingerprint():
+    """
+    Hashes the source files of the pipeline stages.
+
+    Args:
+    None
+
+    Returns:
+    str: Hex digest of the mod package sources.
+    """
+
+    code_hash = hashlib.sha1()
+    for path in sorted(glob.glob(f"{code_dir}/*.py")):
+        with open(path, 'rb') as f:
+            code_hash.update(f.read())
+
+    return code_hash.hexdigest()
+
+def get_stage_key(name, stage, dependency_keys, code_fingerprint):
+    """
+    Calculates the cache key of a stage from its function, arguments, input contents, code and the keys of the stages it depends on.
+
+    Args:
+    name (str): Stage name.
+    stage (dict): Stage specification.
+    dependency_keys (list): Cache keys of the stages it depends on.
+    code_fingerprint (str): Hash of the stage sources from get_code_fingerprint.
+
+    Returns:
+    str: Hex digest identifying the stage result.
+    """
+
+    description = {'Stage': name, 'Function': f"{stage['Function'].__module__}.{stage['Function'].__qualname__}", 'Code': code_fingerprint,
+                   'Arguments': {argument: value for argument, value in stage['Arguments'].items() if argument not in stage['Ignore']},
+                   'Inputs': [get_input_fingerprint(path) for path in stage['Inputs']], 'Depends': dependency_keys,
+                   'Outputs': [os.path.basename(pattern) for pattern in stage['Outputs']]}
+
+    return hashlib.sha1(json.dumps(description, sort_keys=True, default=str).encode()).hexdigest()
+
+def load_cached_stage(stage, key, cache_dir):
+    """
+    Loads a cached stage result and restores the files the stage wrote.
+
+    Args:
+    stage (dict): Stage specification.
+    key (str): Cache key from get_stage_key.
+    cache_dir (str): Directory where stage results are cached.
+
+    Returns:
+    tuple: (True, result) for a cached stage, (False, None) otherwise.
+    """
+
+    result_file = f"{cache_dir}/stage_{key}.pkl"
+    if not os.path.exists(result_file):
+        return False, None
+
+    with open(result_file, 'rb') as f:
+        result, output_files = pickle.load(f)
+
+    for pattern, filenames in zip(stage['Outputs'], output_files):
+        for filename in filenames:
+            shutil.copy2(f"{cache_dir}/stage_{key}/{filename}", os.path.join(os.path.dirname(pattern), filename))
+
+    return True, result
+
+def save_cached_stage(stage, key, result, cache_dir):
+    """
+    Caches a stage result along with the files the stage wrote.
+
+    Args:
+    stage (dict): Stage specification.
+    key (str): Cache key from get_stage_key.
+    result: Stage result.
+    cache_dir (str): Directory where stage results are cached.
+
+    Returns:
+    None
+    """
+
+    output_files = []
+    os.makedirs(f"{cache_dir}/stage_{key}", exist_ok=True)
+
+    for pattern in stage['Outputs']:
+        paths = sorted(glob.glob(pattern))
+        for path in paths:
+            shutil.copy2(path, f"{cache_dir}/stage_{key}/{os.path.basename(path)}")
+        output_files.append([os.path.basename(path) for path in paths])
+
+    #written to a temporary file first, so an interrupted run does not leave a partial result
+    with open(f"{cache_dir}/stage_{key}.pkl.tmp", 'wb') as f:
+        pickle.dump((result, output_files), f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(f"{cache_dir}/stage_{key}.pkl.tmp", f"{cache_dir}/stage_{key}.pkl")
+
+    return None
+
+def call_stage(function, dependency_results, arguments):
+    """
+    Calls the function of a stage, in this process or a worker process.
+
+    Args:
+    function (function): Function of the stage.
+    dependency_results (list): Results of the stages it depends on.
+    arguments (dict): Keyword arguments of the function.
+
+    Returns:
+    Result of the function.
+    """
+
+    return function(*dependency_results, **arguments)
+
+def run_pipeline(stages, executor=None, cache_dir=False):
+    """
+    Runs the stages of a pipeline as soon as the stages they depend on are done.
+
+    Args:
+    stages (dict): Stage specifications by name, in the order ready stages are started.
+    executor (ProcessPoolExecutor): [Optional] Stage pool - stages with process=True run there, concurrently with the other stages.
+    cache_dir (str): [Optional] Directory where results of stages with cache=True are saved, and reused while their inputs,
+                     parameters and code are unchanged.
+
+    Returns:
+    dict: Stage results by name.
+    dict: Stage timings by name, with the keys 'Status' (Ran or Cached), 'Start' and 'Time' in seconds from the start of the pipeline.
+
+    Note:
+    Stages without process=True (or without a pool) run one at a time in this process, in the order they become ready.
+    """
+
+    check_pipeline(stages)
+
+    start_time = time.time()
+    code_fingerprint = get_code_fingerprint() if cache_dir else ""
+    results = {}
+    timings = {}
+    keys = {}
+    running = {}
+    pending = list(stages)
+
+    def finish(name, result, status, stage_start):
+        results[name] = result
+        timings[name] = {'Status': status, 'Start': stage_start - start_time, 'Time': time.time() - stage_start}
+        if status == 'Ran' and cache_dir and stages[name]['Cache']:
+            save_cached_stage(stages[name], keys[name], result, cache_dir)
+        logging.info(f"Pipeline stage {name}: {status.lower()} in {timings[name]['Time']:.2f} seconds")
+
+    while pending or running:
+        ready = [name for name in pending if all(depend in results for depend in stages[name]['Depends'])]
+
+        if ready:
+            name = ready[0]
+            pending.remove(name)
+            stage = stages[name]
+            stage_start = time.time()
+            dependency_results = [results[depend] for depend in stage['Depends']]
+
+            if cache_dir and stage['Cache']:
+                keys[name] = get_stage_key(name, stage, [keys.get(depend, "") for depend in stage['Depends']], code_fingerprint)
+                cached, result = load_cached_stage(stage, keys[name], cache_dir)
+                if cached:
+                    finish(name, result, 'Cached', stage_start)
+                    continue
+
+            if stage['Process'] and executor is not None:
+                running[executor.submit(call_stage, stage['Function'], dependency_results, stage['Arguments'])] = (name, stage_start)
+            else:
+                finish(name, call_stage(stage['Function'], dependency_results, stage['Arguments']), 'Ran', stage_start)
+            continue
+
+        done, _ = wait(running, return_when=FIRST_COMPLETED)
+        for future in done:
+            name, stage_start = running.pop(future)
+            finish(name, future.result(), 'Ran', stage_start)
+
+    return results, timings
+
+def format_pipeline(stages, timings):
+    """
+    Formats the stages of a pipeline, their dependencies and timings as a table.
+
+    Args:
+    stages (dict): Stage specifications by name.
+    timings (dict): Stage timings from run_pipeline.
+
+    Returns:
+    str: Table with one line per stage, in dependency order.
+    """
+
+    lines = [f"{'Stage':<22}{'Depends On':<42}{'Status':<9}{'Start (s)':>10}{'Time (s)':>10}"]
+
+    for name in check_pipeline(stages):
+        depends = ", ".join(stages[name]['Depends']) or "-"
+        timing = timings.get(name, {'Status': '-', 'Start': 0, 'Time': 0})
+        lines.append(f"{name:<22}{depends:<42}{timing['Status']:<9}{timing['Start']:>10.2f}{timing['Time']:>10.2f}")
+
+    return "\n".join(lines)
@@ -0,0 +1,444 @@
+"""
+Service mode - local HTTP API over a SQLite job queue, running QC jobs on a pool of warm worker processes
+"""
+
+import os
+import re
+import json
+import time
+import sqlite3
+import logging
+import signal
+import mimetypes
+import threading
+from urllib.parse import unquote
+from functools import partial
+from concurrent.futures import ProcessPoolExecutor
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from mod.batch_runner import warm_imports, run_project
+from mod.metrics_bundle import bundle_input_options, bundle_threshold_options
+
+#-------------------------------------------------------------------------- VARIABLES --------------------------------------------------------------------------
+
+#the service only listens on the local machine
+service_host = "127.0.0.1"
+
+#host names requests may be addressed to, so pages of other sites cannot reach the service through DNS rebinding
+service_host_names = ["127.0.0.1", "localhost"]
+
+#options a job may set - its inputs and thresholds. Output, cache and bundle paths are set by the service
+job_options = bundle_input_options + bundle_threshold_options
+
+#seconds between checks of the job queue for jobs to start
+dispatch_interval = 0.5
+
+#api routes
+job_route = re.compile(r"^/jobs/(\d+)$")
+job_files_route = re.compile(r"^/jobs/(\d+)/files$")
+job_file_route = re.compile(r"^/jobs/(\d+)/files/(.+)$")
+
+#-------------------------------------------------------------------------- FUNCTIONS ---------------------------------------------------------------------------
+
+def open_job_queue(queue_file):
+    """
+    Opens the SQLite job queue, creating it if needed.
+
+    Args:
+    queue_file (str): Path to the SQLite database.
+
+    Returns:
+    Connection: Database connection, to be closed by the caller.
+    """
+
+    connection = sqlite3.connect(queue_file, timeout=30)
+    connection.row_factory = sqlite3.Row
+    connection.execute("CREATE TABLE IF NOT EXISTS jobs (id INTEGER PRIMARY KEY AUTOINCREMENT, status TEXT NOT NULL, config TEXT NOT NULL, "
+                       "submitted REAL NOT NULL, started REAL, finished REAL, result TEXT)")
+    connection.execute("CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, id)")
+
+    return connection
+
+def job_record(row):
+    """
+    Converts a job queue row to the job dictionary returned by the API.
+
+    Args:
+    row (Row): Row of the jobs table.
+
+    Returns:
+    dict: Job with the keys 'Job', 'Status' (Queued, Running, Completed or Failed), 'Submitted', 'Started', 'Finished',
+          'Config' and 'Result' (project status from batch_runner.run_project, once finished).
+    """
+
+    return {'Job': row['id'], 'Status': row['status'], 'Submitted': row['submitted'], 'Started': row['started'], 'Finished': row['finished'],
+            'Config': json.loads(row['config']), 'Result': json.loads(row['result']) if row['result'] else None}
+
+def submit_job(queue_file, config, defaults, jobs_dir):
+    """
+    Adds a QC job to the queue.
+
+    Args:
+    queue_file (str): Path to the SQLite job queue.
+    config (dict): run_qc options of the job.
+    defaults (dict): Options used for the options the job does not set.
+    jobs_dir (str): Directory of the job output directories.
+
+    Returns:
+    dict: Queued job.
+
+    Note:
+    The job writes to {jobs_dir}/job{id} with the report name job{id}, config should only have job_options.
+    """
+
+    with open_job_queue(queue_file) as connection:
+        job_id = connection.execute("INSERT INTO jobs (status, config, submitted) VALUES ('Queued', '{}', ?)", (time.time(),)).lastrowid
+
+        job_config = dict(defaults)
+        job_config.update(config)
+        job_config['outdirectory'] = f"{jobs_dir}/job{job_id}"
+        job_config['reportname'] = f"job{job_id}"
+        os.makedirs(job_config['outdirectory'], exist_ok=True)
+
+        connection.execute("UPDATE jobs SET config = ? WHERE id = ?", (json.dumps(job_config), job_id))
+        row = connection.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+    connection.close()
+
+    return job_record(row)
+
+def get_jobs(queue_file, job_id=None):
+    """
+    Reads jobs from the queue.
+
+    Args:
+    queue_file (str): Path to the SQLite job queue.
+    job_id (int): [Optional] Job to read, all jobs by default.
+
+    Returns:
+    list: Jobs, in submission order.
+    """
+
+    connection = open_job_queue(queue_file)
+    if job_id is None:
+        rows = connection.execute("SELECT * FROM jobs ORDER BY id").fetchall()
+    else:
+        rows = connection.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchall()
+    connection.close()
+
+    return [job_record(row) for row in rows]
+
+def claim_next_job(queue_file):
+    """
+    Marks the oldest queued job as running.
+
+    Args:
+    queue_file (str): Path to the SQLite job queue.
+
+    Returns:
+    dict or None: Claimed job, None if no job is queued.
+    """
+
+    connection = open_job_queue(queue_file)
+    connection.isolation_level = None
+    connection.execute("BEGIN IMMEDIATE")
+    row = connection.execute("SELECT * FROM jobs WHERE status = 'Queued' ORDER BY id LIMIT 1").fetchone()
+    if row is not None:
+        connection.execute("UPDATE jobs SET status = 'Running', started = ? WHERE id = ?", (time.time(), row['id']))
+        row = connection.execute("SELECT * FROM jobs WHERE id = ?", (row['id'],)).fetchone()
+    connection.execute("COMMIT")
+    connection.close()
+
+    return job_record(row) if row is not None else None
+
+def finish_job(queue_file, job_id, future):
+    """
+    Records the result of a finished job, used as the done callback of the job future.
+
+    Args:
+    queue_file (str): Path to the SQLite job queue.
+    job_id (int): Finished job.
+    future (Future): Future of batch_runner.run_project.
+
+    Returns:
+    None
+    """
+
+    try:
+        result = future.result()
+    except BaseException as e:
+        result = {'Status': 'Failed', 'Error': f"{type(e).__name__}: {e}"}
+
+    with open_job_queue(queue_file) as connection:
+        connection.execute("UPDATE jobs SET status = ?, finished = ?, result = ? WHERE id = ?", (result['Status'], time.time(), json.dumps(result), job_id))
+    connection.close()
+
+    logging.info(f"Job {job_id}: {result['Status']} {result['Error']}")
+
+    return None
+
+def requeue_running_jobs(queue_file):
+    """
+    Queues the jobs left running by a previous service again, e.g. after a restart.
+
+    Args:
+    queue_file (str): Path to the SQLite job queue.
+
+    Returns:
+    int: Number of queued jobs.
+    """
+
+    with open_job_queue(queue_file) as connection:
+        requeued = connection.execute("UPDATE jobs SET status = 'Queued', started = NULL WHERE status = 'Running'").rowcount
+    connection.close()
+
+    return requeued
+
+def start_service_worker():
+    """
+    Initializes a worker process of the service - imports the dependencies and leaves Ctrl+C to the service, which lets running jobs finish.
+
+    Args:
+    None
+
+    Returns:
+    None
+    """
+
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    warm_imports()
+
+    return None
+
+def dispatch_jobs(queue_file, run_qc, executor, workers, stop_event):
+    """
+    Starts queued jobs on the worker pool, keeping at most one running job per worker so queued jobs stay in the queue.
+
+    Args:
+    queue_file (str): Path to the SQLite job queue.
+    run_qc (function): QC run function (main.run_qc).
+    executor (ProcessPoolExecutor): Pool of warm worker processes.
+    workers (int): Number of workers of the pool.
+    stop_event (Event): Set to stop dispatching.
+
+    Returns:
+    None
+    """
+
+    running = set()
+
+    while not stop_event.is_set():
+        running = {future for future in running if not future.done()}
+
+        while len(running) < workers:
+            job = claim_next_job(queue_file)
+            if job is None:
+                break
+            logging.info(f"Starting job {job['Job']}")
+            future = executor.submit(run_project, run_qc, job['Config'], job['Config']['outdirectory'])
+            future.add_done_callback(partial(finish_job, queue_file, job['Job']))
+            running.add(future)
+
+        stop_event.wait(dispatch_interval)
+
+    return None
+
+def get_job_files(job):
+    """
+    Lists the output files of a job - the files in its output directory starting with its report name.
+
+    Args:
+    job (dict): Job from get_jobs.
+
+    Returns:
+    list: Paths relative to the output directory, e.g. job1.html or job1_figures/plotly.min.js.
+    """
+
+    out_dir = job['Config']['outdirectory']
+    reportname = job['Config']['reportname']
+    job_files = []
+
+    if not os.path.isdir(out_dir):
+        return job_files
+
+    for root, dirs, files in os.walk(out_dir):
+        for filename in files:
+            path = os.path.relpath(os.path.join(root, filename), out_dir).replace(os.sep, "/")
+            if path.startswith(reportname):
+                job_files.append(path)
+
+    return sorted(job_files)
+
+class QCServiceHandler(BaseHTTPRequestHandler):
+    """
+    Request handler of the QC service API:
+
+    POST /jobs                      submit a job, the JSON body takes the long command line parameter names of job_options
+    GET  /jobs                      list jobs
+    GET  /jobs/{id}                 job status and result
+    GET  /jobs/{id}/files           list output files of a job
+    GET  /jobs/{id}/files/{path}    download an output file
+    """
+
+    def send_json(self, data, status=200):
+        body = json.dumps(data, indent=2).encode('utf-8')
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def check_request(self):
+        """
+        Rejects requests addressed to another host name, sending the error response.
+
+        Returns:
+        bool: True if the request may be handled.
+        """
+
+        host = self.headers.get("Host", "").rsplit(":", 1)[0]
+        if host not in service_host_names:
+            self.send_json({'Error': f"Requests should be addressed to {' or '.join(service_host_names)}"}, 403)
+            return False
+
+        return True
+
+    def find_job(self, job_id):
+        jobs = get_jobs(self.server.queue_file, int(job_id))
+        if not jobs:
+            self.send_json({'Error': f"Job {job_id} does not exist"}, 404)
+            return None
+        return jobs[0]
+
+    def do_POST(self):
+        if not self.check_request():
+            return
+
+        if self.path.rstrip("/") != "/jobs":
+            return self.send_json({'Error': "Not found"}, 404)
+
+        #a JSON content type cannot be sent cross-site without a preflight request
+        if self.headers.get_content_type() != "application/json":
+            return self.send_json({'Error': "Job parameters should be sent as application/json"}, 415)
+
+        try:
+            config = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        except ValueError as e:
+            return self.send_json({'Error': f"Job parameters should be a JSON object: {e}"}, 400)
+
+        if not isinstance(config, dict):
+            return self.send_json({'Error': "Job parameters should be a JSON object"}, 400)
+
+        #rejected before the job is queued, as run_qc would reject it once a worker picks it up
+        unknown_options = self.server.get_unknown_options(config)
+        if unknown_options:
+            return self.send_json({'Error': f"Unknown options {', '.join(unknown_options)}. Please use the long parameter names, e.g. precursor_level"}, 400)
+
+        fixed_options = [option for option in config if option not in job_options]
+        if fixed_options:
+            return self.send_json({'Error': f"{', '.join(fixed_options)} cannot be set by a job, jobs can only set their inputs and thresholds: {', '.join(job_options)}"}, 400)
+
+        job = submit_job(self.server.queue_file, config, self.server.defaults, self.server.jobs_dir)
+        logging.info(f"Queued job {job['Job']}")
+        self.send_json(job, 201)
+
+    def do_GET(self):
+        if not self.check_request():
+            return
+
+        path = self.path.split("?")[0].rstrip("/")
+
+        if path == "/jobs":
+            return self.send_json(get_jobs(self.server.queue_file))
+
+        match = job_route.match(path)
+        if match:
+            job = self.find_job(match.group(1))
+            if job:
+                self.send_json(job)
+            return
+
+        match = job_files_route.match(path)
+        if match:
+            job = self.find_job(match.group(1))
+            if job:
+                self.send_json(get_job_files(job))
+            return
+
+        match = job_file_route.match(path)
+        if match:
+            job = self.find_job(match.group(1))
+            if job is None:
+                return
+            #only listed output files are served, so paths cannot leave the output directory
+            job_file = unquote(match.group(2))
+            if job_file not in get_job_files(job):
+                return self.send_json({'Error': f"Job {job['Job']} has no output file {job_file}"}, 404)
+
+            with open(os.path.join(job['Config']['outdirectory'], job_file), 'rb') as f:
+                body = f.read()
+            self.send_response(200)
+            self.send_header("Content-Type", mimetypes.guess_type(job_file)[0] or "application/octet-stream")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+            return
+
+        self.send_json({'Error': "Not found"}, 404)
+
+    def log_message(self, format, *args):
+        logging.info(f"{self.address_string()} - {format % args}")
+
+def run_service(run_qc, get_unknown_options, defaults, out_dir, reportname, port, workers=1):
+    """
+    Runs the QC service until it is interrupted (Ctrl+C).
+
+    Args:
+    run_qc (function): QC run function (main.run_qc).
+    get_unknown_options (function): Finds the options of a job that run_qc does not have (main.get_unknown_options).
+    defaults (dict): run_qc options used for the options a job does not set.
+    out_dir (str): Directory of the job queue ({reportname}_jobs.sqlite) and job outputs ({reportname}_jobs).
+    reportname (str): Name of the service.
+    port (int): Port on 127.0.0.1, 0 for any free port.
+    workers (int): [Optional] Number of worker processes, i.e. jobs run at the same time.
+
+    Returns:
+    None
+
+    Note:
+    Workers import the dependencies once and keep grouping files in memory, and jobs share the cache directory of the defaults.
+    Queued jobs are kept in the database, so jobs submitted before a restart are run by the next service.
+    """
+
+    queue_file = f"{out_dir}/{reportname}_jobs.sqlite"
+    jobs_dir = f"{out_dir}/{reportname}_jobs"
+    os.makedirs(jobs_dir, exist_ok=True)
+
+    requeued = requeue_running_jobs(queue_file)
+    if requeued:
+        logging.info(f"Queued {requeued} jobs left running by the previous service again")
+
+    server = ThreadingHTTPServer((service_host, port), QCServiceHandler)
+    server.queue_file = queue_file
+    server.jobs_dir = jobs_dir
+    server.defaults = defaults
+    server.get_unknown_options = get_unknown_options
+
+    executor = ProcessPoolExecutor(max_workers=workers, initializer=start_service_worker)
+    stop_event = threading.Event()
+    dispatcher = threading.Thread(target=dispatch_jobs, args=(queue_file, run_qc, executor, workers, stop_event), daemon=True)
+    dispatcher.start()
+
+    print(f"QCeltis service listening on http://{service_host}:{server.server_address[1]} with {workers} workers, job queue {queue_file}", flush=True)
+    logging.info(f"QCeltis service listening on http://{service_host}:{server.server_address[1]} with {workers} workers, job queue {queue_file}")
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("Stopping QCeltis service, waiting for running jobs to finish", flush=True)
+        logging.info("Stopping QCeltis service, waiting for running jobs to finish")
+    finally:
+        stop_event.set()
+        dispatcher.join()
+        server.server_close()
+        executor.shutdown(wait=True, cancel_futures=True)
+
+    return None
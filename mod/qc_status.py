@@ -0,0 +1,174 @@
+"""
+QC status rules - the checks behind the samplewise, groupwise and overall QC statuses, evaluated on whole columns of samples or groups at once
+"""
+
+import numpy as np
+import pandas as pd
+
+from mod.general_functions import get_group_codes
+
+#-------------------------------------------------------------------------- VARIABLES --------------------------------------------------------------------------
+
+#checks a QC status can fail, giving the FAIL mask of an array of values - NaN values never fail a threshold
+status_checks = {'Below Threshold': lambda values, threshold: threshold > values,
+                 'Above Threshold': lambda values, threshold: values > threshold,
+                 'Outlier': lambda values, threshold: values == 1,
+                 'Failed': lambda values, threshold: values == 'FAIL',
+                 'Not Passed': lambda values, threshold: values != 'PASS'}
+
+#checks comparing numeric values with a threshold
+threshold_checks = ['Below Threshold', 'Above Threshold']
+
+#-------------------------------------------------------------------------- FUNCTIONS ---------------------------------------------------------------------------
+
+def get_fail_mask(values, check, threshold=None):
+    """
+    Evaluates a check on an array of values.
+
+    Args:
+    values (array-like): Values of the samples or groups.
+    check (str): Check from status_checks.
+    threshold (int/float): [Optional] Threshold of 'Below Threshold' and 'Above Threshold' checks.
+
+    Returns:
+    ndarray: True for each value failing the check.
+    """
+
+    values = np.asarray(values, dtype=float) if check in threshold_checks else np.asarray(values)
+
+    return np.asarray(status_checks[check](values, threshold), dtype=bool)
+
+def get_status(fail_mask):
+    """
+    Converts a FAIL mask to QC statuses.
+
+    Args:
+    fail_mask (ndarray): True for each sample or group that failed.
+
+    Returns:
+    ndarray: "FAIL" or "PASS" for each sample or group.
+    """
+
+    return np.where(fail_mask, "FAIL", "PASS").astype(object)
+
+def check_status(values, check, threshold=None):
+    """
+    Gets the QC status of each value for a single check.
+
+    Args:
+    values (array-like): Values of the samples or groups.
+    check (str): Check from status_checks.
+    threshold (int/float): [Optional] Threshold of 'Below Threshold' and 'Above Threshold' checks.
+
+    Returns:
+    ndarray: "FAIL" for each value failing the check, otherwise "PASS".
+    """
+
+    return get_status(get_fail_mask(values, check, threshold))
+
+def get_rule_status(df, checks):
+    """
+    Gets the QC status of each row for a rule - a row fails the rule if it fails any of its checks.
+
+    Args:
+    df (DataFrame): Samples or groups with the columns of the checks.
+    checks (list): (check, column, threshold) of each check of the rule, the threshold is None for status and outlier checks.
+
+    Returns:
+    ndarray: "FAIL" or "PASS" for each row.
+    """
+
+    fail_mask = np.zeros(len(df), dtype=bool)
+    for check, column, threshold in checks:
+        fail_mask |= get_fail_mask(df[column].to_numpy(), check, threshold)
+
+    return get_status(fail_mask)
+
+def get_sample_groups(filenames, groups):
+    """
+    Gets the group of each filename, as with groupname.
+
+    Args:
+    filenames (list): List of filenames.
+    groups (dict): Dictionary mapping groups to filenames.
+
+    Returns:
+    ndarray: Group name of each filename, None if the file is not in a group.
+    """
+
+    group_codes, group_names = get_group_codes(filenames, groups)
+
+    return np.array(group_names + [None], dtype=object)[group_codes]
+
+def get_group_status(df, status_cols, groups, filename_col='Filename'):
+    """
+    Gets the groupwise QC statuses - a group passes a status only if all of its samples pass it.
+
+    Args:
+    df (DataFrame): Samplewise QC statuses.
+    status_cols (list): Status columns to group.
+    groups (dict): Dictionary mapping groups to filenames.
+    filename_col (str): [Optional] Column with the filename of each sample.
+
+    Returns:
+    DataFrame: 'Group' and the status columns, one row per group with samples in df, sorted by group.
+
+    Note:
+    Samples that are not in a group are left out.
+    """
+
+    group_codes, group_names = get_group_codes(df[filename_col].tolist(), groups)
+    grouped = group_codes >= 0
+    codes = group_codes[grouped]
+
+    present = np.bincount(codes, minlength=len(group_names)) > 0
+    group_df = pd.DataFrame({'Group': np.array(group_names, dtype=object)[present]})
+
+    for column in status_cols:
+        fail_counts = np.bincount(codes, weights=get_fail_mask(df[column].to_numpy()[grouped], 'Not Passed'), minlength=len(group_names))
+        group_df[column] = get_status(fail_counts[present] > 0)
+
+    return group_df
+
+def get_group_values(df, value_col, groups, filename_col='Filename'):
+    """
+    Splits the values of a column by group, keeping the sample order of df.
+
+    Args:
+    df (DataFrame): Samplewise values.
+    value_col (str): Column to split.
+    groups (dict): Dictionary mapping groups to filenames.
+    filename_col (str): [Optional] Column with the filename of each sample.
+
+    Returns:
+    dict: Array of the values of each group with samples in df, in group name order. Samples that are not in a group are left out.
+    """
+
+    group_codes, group_names = get_group_codes(df[filename_col].tolist(), groups)
+    order = np.argsort(group_codes, kind='stable')
+    sorted_codes = group_codes[order]
+    values = df[value_col].to_numpy()[order]
+
+    bounds = np.searchsorted(sorted_codes, np.arange(len(group_names) + 1))
+
+    return {group: values[bounds[code]:bounds[code + 1]] for code, group in enumerate(group_names) if bounds[code + 1] > bounds[code]}
+
+def get_overall_status(df, status_cols):
+    """
+    Gets the overall QC status of each row from its status columns.
+
+    Args:
+    df (DataFrame): Samples or groups with their QC statuses.
+    status_cols (list): Status columns counted towards the overall status.
+
+    Returns:
+    ndarray: "PASS" if all statuses pass, otherwise "FAIL".
+    ndarray: QC fail score - the number of failed statuses out of the number of status columns.
+    """
+
+    statuses = df[status_cols].to_numpy(dtype=object)
+    failed = (statuses == 'FAIL').sum(axis=1)
+    overall = get_status((statuses != 'PASS').any(axis=1))
+    scores = np.array([f'{count} out of {len(status_cols)} metrics' for count in failed.tolist()], dtype=object)
+
+    return (overall, scores)
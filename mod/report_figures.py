@@ -0,0 +1,452 @@
+"""
+Rendering of plotly figures for the HTML report - figure specifications built in parallel and streamed into the report, a single plotly.js bundle, figure data encoded as base64 typed arrays, scale-aware per-sample plots and lazily loaded figure sidecars
+"""
+
+import numpy as np
+import os
+import re
+import gzip
+import uuid
+import shutil
+import base64
+import tempfile
+from concurrent.futures import Future
+from markupsafe import Markup
+
+#-------------------------------------------------------------------------- VARIABLES --------------------------------------------------------------------------
+
+#typed array dtypes understood by plotly.js, int64 and uint64 are not supported and are narrowed or converted to float64
+typed_array_dtypes = {'int8': 'i1', 'uint8': 'u1', 'int16': 'i2', 'uint16': 'u2', 'int32': 'i4', 'uint32': 'u4', 'float32': 'f4', 'float64': 'f8'}
+
+#number of samples above which per-sample plots are drawn with webgl traces, run-order ticks and decimated lines
+large_cohort_samples = 1000
+
+#maximum number of points kept in each line trace of a large cohort plot
+max_line_points = 1500
+
+#html report modes - one self-contained file, or figures loaded from compressed sidecars when they are scrolled into view
+report_modes = ['single', 'lazy']
+
+#figure data embedded by figure_html, moved to a sidecar in the lazy report mode
+figure_data_pattern = re.compile(r'<script type="application/json" id="(figure-[0-9a-f-]+)-data">(.*?)</script>', re.S)
+
+#-------------------------------------------------------------------------- FUNCTIONS ---------------------------------------------------------------------------
+
+def get_plotlyjs():
+    """
+    Gets the plotly.js bundle shipped with the installed plotly package, to be inlined once in the HTML report.
+
+    Args:
+    None
+
+    Returns:
+    str: The minified plotly.js source.
+
+    Note:
+    The bundle is pinned to the plotly.js version of the installed plotly package, so the report opens offline and
+    always matches the version the figures were generated with.
+    """
+
+    import plotly.offline as offline
+
+    return offline.get_plotlyjs()
+
+def encode_typed_array(values):
+    """
+    Encodes a numeric array as a plotly.js typed array specification.
+
+    Args:
+    values (ndarray): 1D or 2D numeric array.
+
+    Returns:
+    dict: Typed array specification with the keys 'dtype', 'bdata' (base64 encoded bytes) and 'shape' for 2D arrays,
+    or the array unchanged if it can not be encoded.
+    """
+
+    if values.dtype.kind not in 'iuf' or values.ndim not in (1, 2) or values.size == 0:
+        return values
+
+    if values.dtype.kind in 'iu' and values.dtype.itemsize == 8:
+        if values.min() >= np.iinfo(np.int32).min and values.max() <= np.iinfo(np.int32).max:
+            values = values.astype(np.int32)
+        else:
+            values = values.astype(np.float64)
+    elif values.dtype.name == 'float16':
+        values = values.astype(np.float32)
+
+    typed_array = {'dtype': typed_array_dtypes[values.dtype.name],
+                   'bdata': base64.b64encode(np.ascontiguousarray(values).tobytes()).decode('ascii')}
+    if values.ndim == 2:
+        typed_array['shape'] = f"{values.shape[0]}, {values.shape[1]}"
+
+    return typed_array
+
+def encode_trace_arrays(obj):
+    """
+    Replaces the numeric arrays of a trace (x, y, marker colors, customdata, ...) with typed array specifications.
+
+    Args:
+    obj (dict, list or ndarray): Trace, or a nested attribute of a trace.
+
+    Returns:
+    dict, list or ndarray: The same structure with numeric arrays encoded.
+    """
+
+    if isinstance(obj, np.ndarray):
+        return encode_typed_array(obj)
+    if isinstance(obj, dict):
+        return {key: encode_trace_arrays(value) for key, value in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return [encode_trace_arrays(value) for value in obj]
+
+    return obj
+
+def figure_html(fig):
+    """
+    Renders a plotly figure as a div for the HTML report, without the plotly.js bundle.
+
+    Args:
+    fig (Figure): Plotly figure.
+
+    Returns:
+    str: HTML div and the figure data as an embedded JSON script, drawn by the report when the div is scrolled into view.
+
+    Note:
+    Numeric trace arrays are written as base64 typed arrays instead of JSON lists. Layout attributes are left as they are.
+    """
+
+    import plotly.io
+
+    fig_dict = fig.to_plotly_json()
+    figure = {'data': [encode_trace_arrays(trace) for trace in fig_dict['data']],
+              'layout': fig_dict.get('layout', {}),
+              'config': {'responsive': True}}
+
+    figure_id = f"figure-{uuid.uuid4()}"
+    #escaping closing tags so the json can not end the script element
+    figure_json = plotly.io.to_json(figure, validate=False).replace('</', '<\\/')
+
+    return (f'<div id="{figure_id}" class="plotly-graph-div qceltis-figure" style="height:450px; width:900px;"></div>\n'
+            f'<script type="application/json" id="{figure_id}-data">{figure_json}</script>')
+
+def prepare_figure_dir(figure_dir):
+    """
+    Creates an empty directory for the figure sidecars of the lazy report mode, with the plotly.js bundle.
+
+    Args:
+    figure_dir (str): Directory where the sidecars and the plotly.js bundle are saved, next to the HTML report.
+
+    Returns:
+    None
+    """
+
+    if os.path.isdir(figure_dir):
+        shutil.rmtree(figure_dir)
+    os.makedirs(figure_dir)
+
+    with open(f"{figure_dir}/plotly.min.js", 'w', encoding='utf-8') as f:
+        f.write(get_plotlyjs())
+
+    return None
+
+def save_figure_sidecar(html, figure_dir):
+    """
+    Moves the figure data of a rendered figure into a compressed sidecar, for the lazy report mode.
+
+    Args:
+    html (str): Figure rendered by figure_html.
+    figure_dir (str): Directory prepared with prepare_figure_dir.
+
+    Returns:
+    str: The figure div without its data.
+
+    Note:
+    Each figure is saved as a script calling qceltisFigureLoaded with its gzip compressed, base64 encoded JSON. Sidecars are
+    loaded with script elements rather than fetched, so the report also works when opened from the local file system.
+    """
+
+    def save_sidecar(match):
+        payload = base64.b64encode(gzip.compress(match.group(2).encode('utf-8'))).decode('ascii')
+        with open(f"{figure_dir}/{match.group(1)}.js", 'w') as f:
+            f.write(f'qceltisFigureLoaded("{match.group(1)}", "{payload}");\n')
+        return ''
+
+    return figure_data_pattern.sub(save_sidecar, html)
+
+def lttb_indices(x, y, max_points):
+    """
+    Selects the points of a line that preserve its shape, using largest-triangle-three-buckets decimation.
+
+    Args:
+    x (ndarray): x values, in plotting order.
+    y (ndarray): y values, NaN for missing values.
+    max_points (int): Maximum number of points to keep.
+
+    Returns:
+    ndarray: Positions of the points to keep, always including the first and last point.
+
+    Note:
+    The points between the first and last are split into max_points - 2 buckets. From each bucket the point forming the
+    largest triangle with the previously kept point and the average of the next bucket is kept, so peaks and dips
+    (e.g. outlier samples) survive the decimation.
+    """
+
+    num_points = len(x)
+    if max_points < 3 or num_points <= max_points:
+        return np.arange(num_points)
+
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+
+    edges = np.linspace(1, num_points - 1, max_points - 1).astype(int)
+    keep = np.empty(max_points, dtype=np.int64)
+    keep[0] = 0
+    keep[-1] = num_points - 1
+
+    for bucket in range(max_points - 2):
+        start, end = edges[bucket], edges[bucket + 1]
+        next_start, next_end = end, (edges[bucket + 2] if bucket + 2 < len(edges) else num_points)
+
+        next_x = x[next_start:next_end].mean()
+        next_y = np.nanmean(y[next_start:next_end]) if not np.isnan(y[next_start:next_end]).all() else y[keep[bucket]]
+        prev_x, prev_y = x[keep[bucket]], y[keep[bucket]]
+
+        area = np.abs((prev_x - next_x) * (y[start:end] - prev_y) - (prev_x - x[start:end]) * (next_y - prev_y))
+        area = np.where(np.isnan(area), -1, area)
+        keep[bucket + 1] = start + int(np.argmax(area))
+
+    return keep
+
+def scale_figure(fig, scale_threshold=large_cohort_samples, max_points=max_line_points):
+    """
+    Switches a per-sample plot (one x category per filename) to a scale-aware mode when the number of samples is large.
+
+    Args:
+    fig (Figure): Plotly figure with filenames on the x axis.
+    scale_threshold (int): [Optional] Number of samples above which the plot is scaled, 0 to never scale it.
+    max_points (int): [Optional] Maximum number of points kept in each line trace.
+
+    Returns:
+    Figure: The figure unchanged, or a figure with run-order indices on the x axis and filenames in the hover text.
+
+    Note:
+    Scatter and line traces are replaced by WebGL traces, spline smoothing is dropped and line traces are decimated with
+    lttb_indices. Bar traces stay bars, with one bar per run index.
+    """
+
+    import plotly.graph_objects as go
+
+    sample_order = {}
+    for trace in fig.data:
+        if trace.x is not None and len(trace.x) and isinstance(trace.x[0], str):
+            for filename in trace.x:
+                sample_order.setdefault(filename, len(sample_order) + 1)
+
+    if not scale_threshold or len(sample_order) <= scale_threshold:
+        return fig
+
+    traces = []
+    for trace in fig.data:
+        if trace.x is None or not len(trace.x) or not isinstance(trace.x[0], str):
+            traces.append(trace)
+            continue
+
+        filenames = np.asarray(trace.x, dtype=object)
+        run_index = np.array([sample_order[filename] for filename in filenames], dtype=np.int32)
+        props = trace.to_plotly_json()
+        props.pop('type')
+
+        if props.get('hovertemplate'):
+            props['hovertemplate'] = props['hovertemplate'].replace('%{x}', '%{hovertext} (run %{x})')
+
+        if trace.type == 'scatter':
+            keep = np.arange(len(run_index))
+            if 'lines' in (trace.mode or 'lines'):
+                keep = lttb_indices(run_index, np.asarray(trace.y, dtype=np.float64), max_points)
+            props.get('line', {}).pop('shape', None)
+            for key, values in [('customdata', props.get('customdata')), ('text', props.get('text'))]:
+                if isinstance(values, np.ndarray) and len(values) == len(filenames):
+                    props[key] = values[keep]
+            if isinstance(props.get('marker', {}).get('color'), np.ndarray):
+                props['marker']['color'] = props['marker']['color'][keep]
+            props.update({'x': run_index[keep], 'y': np.asarray(trace.y)[keep], 'hovertext': filenames[keep]})
+            traces.append(go.Scattergl(props, skip_invalid=True))
+        else:
+            props.update({'x': run_index, 'hovertext': filenames})
+            traces.append(type(trace)(props, skip_invalid=True))
+
+    scaled_fig = go.Figure(data=traces, layout=fig.layout)
+    scaled_fig.update_xaxes(type='linear', title_text='Run Order', categoryorder=None)
+
+    return scaled_fig
+
+def figure_spec(plot_type, data_frame=None, **kwargs):
+    """
+    Specifies a plotly express figure without building it, so figures can be built and rendered later in worker processes.
+
+    Args:
+    plot_type (str): Plotly express function, e.g. 'bar', 'line', 'scatter' or 'scatter_3d'.
+    data_frame (DataFrame): [Optional] Data of the figure.
+    **kwargs: Arguments of the plotly express function.
+
+    Returns:
+    dict: Figure specification with the keys 'Plot Type', 'Data', 'Arguments', 'Updates' and 'Scale Threshold'.
+    """
+
+    return {'Plot Type': plot_type,
+            'Data': data_frame,
+            'Arguments': kwargs,
+            'Updates': [],
+            'Scale Threshold': 0}
+
+def update_figure(spec, method, **kwargs):
+    """
+    Adds a figure method call (e.g. update_layout, update_xaxes, add_hline) to a figure specification.
+
+    Args:
+    spec (dict): Figure specification from figure_spec.
+    method (str): Name of the plotly figure method.
+    **kwargs: Arguments of the method.
+
+    Returns:
+    None
+    """
+
+    spec['Updates'].append((method, kwargs))
+
+def scale_figure_spec(spec, scale_threshold):
+    """
+    Marks a per-sample figure specification to be scaled with scale_figure when it is built.
+
+    Args:
+    spec (dict): Figure specification from figure_spec.
+    scale_threshold (int): Number of samples above which the figure is scaled, 0 to never scale it.
+
+    Returns:
+    dict: The figure specification.
+    """
+
+    spec['Scale Threshold'] = scale_threshold
+
+    return spec
+
+def is_figure_spec(value):
+    """
+    Checks if a report parameter is a figure specification still to be rendered.
+
+    Args:
+    value: Report parameter.
+
+    Returns:
+    bool: True for figure specifications.
+    """
+
+    return isinstance(value, dict) and 'Plot Type' in value
+
+def render_figure(spec):
+    """
+    Builds a figure from its specification and renders it with figure_html.
+
+    Args:
+    spec (dict): Figure specification from figure_spec.
+
+    Returns:
+    str: HTML div and figure data for the report.
+    """
+
+    #plotly is only imported when figures are built, so importing the metric modules stays fast
+    import plotly.express as px
+
+    fig = getattr(px, spec['Plot Type'])(spec['Data'], **spec['Arguments'])
+    for method, kwargs in spec['Updates']:
+        getattr(fig, method)(**kwargs)
+
+    if spec['Scale Threshold']:
+        fig = scale_figure(fig, spec['Scale Threshold'])
+
+    return figure_html(fig)
+
+def save_rendered_figure(spec, share_dir):
+    """
+    Renders a figure specification in a worker process and saves the HTML to a file, so rendered figures are not held
+    in memory until the report template reaches them.
+
+    Args:
+    spec (dict): Figure specification from figure_spec.
+    share_dir (str): Directory where the rendered figure is saved, e.g. the output directory.
+
+    Returns:
+    str: Path to the rendered figure, removed by report_figure once it is written to the report.
+    """
+
+    handle, path = tempfile.mkstemp(prefix="qceltis_", suffix=".html", dir=share_dir)
+    with os.fdopen(handle, 'w', encoding='utf-8') as f:
+        f.write(render_figure(spec))
+
+    return path
+
+def submit_figures(report_params, executor=None, share_dir=None):
+    """
+    Starts rendering the figure specifications of the report parameters in a process pool, while the caller carries on
+    (e.g. writing Excel reports).
+
+    Args:
+    report_params (dict): Report parameters, with figure specifications for the figures.
+    executor (ProcessPoolExecutor): [Optional] Pool the figures are rendered in. Without a pool, figures are rendered by report_figure.
+    share_dir (str): [Optional] Directory where the rendered figures are saved until the report is written.
+
+    Returns:
+    dict: Report parameters with the same keys, with futures of the rendered figures in place of their specifications.
+    """
+
+    if executor is None:
+        return report_params
+
+    return {key: executor.submit(save_rendered_figure, value, share_dir) if is_figure_spec(value) else value
+            for key, value in report_params.items()}
+
+def report_figure(value, figure_dir=False):
+    """
+    Jinja filter producing the HTML of a figure when the report template reaches it, so only one rendered figure is held in memory at a time.
+
+    Args:
+    value (dict, Future or str): Figure specification, future from submit_figures or rendered figure.
+    figure_dir (str): [Optional] Directory prepared with prepare_figure_dir, the figure data is saved there as a sidecar in the lazy report mode.
+
+    Returns:
+    Markup: HTML of the figure.
+    """
+
+    if is_figure_spec(value):
+        html = render_figure(value)
+    elif isinstance(value, Future):
+        path = value.result()
+        with open(path, encoding='utf-8') as f:
+            html = f.read()
+        os.remove(path)
+    else:
+        html = value
+
+    if figure_dir:
+        html = save_figure_sidecar(html, figure_dir)
+
+    return Markup(html)
+
+def discard_figures(report_params):
+    """
+    Removes rendered figures that were not written to the report (e.g. sections left out by the template).
+
+    Args:
+    report_params (dict): Report parameters, with futures from submit_figures.
+
+    Returns:
+    None
+    """
+
+    for value in report_params.values():
+        if isinstance(value, Future):
+            path = value.result()
+            if os.path.exists(path):
+                os.remove(path)
+
+    return None
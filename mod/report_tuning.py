@@ -0,0 +1,296 @@
+"""
+Interactive threshold tuning in the HTML report - compact per-sample metrics and per-feature CV histograms embedded in the report, along with the QC status rules of its tables, so the report can apply other thresholds in the browser
+"""
+
+import re
+import json
+import numpy as np
+import pandas as pd
+
+from mod.general_functions import get_group_codes
+
+#-------------------------------------------------------------------------- VARIABLES --------------------------------------------------------------------------
+
+#id-free metrics embedded for each sample
+idfree_tuning_metrics = ['Log MS1 TIC', 'Log MS2 TIC', 'MS1 Spectra', 'MS2 Spectra', 'MS2/MS1 Spectra', 'Log Max Basepeak Intensity']
+
+#thresholds each part of the run is judged with
+idfree_tuning_thresholds = ['MS1 TIC Threshold', 'MS2 TIC Threshold', 'MS1 Spectra Threshold', 'MS2 Spectra Threshold', 'Max Basepeak Intensity Threshold',
+                            'TIC CV Threshold', 'IQR Sensitivity']
+level_tuning_thresholds = ['CV Percent Threshold', 'Data Percent Threshold', 'TIC CV Threshold', 'Miscleavage Threshold']
+
+#report parameters holding the tuning data of each part of the run
+tuning_report_params = {'ID-Free': 'idfree_tuning', 'Protein': 'protein_tuning', 'Peptide': 'peptide_tuning', 'Precursor': 'precursor_tuning'}
+
+#whole CV% bins of the per-feature CV histograms - CV thresholds are whole percentages between 0 and 100, larger CVs share the last bin
+cv_histogram_bins = 102
+
+#sample status columns of the id-free metrics - FAIL if the sample is an outlier for the 'Outlier' metric or its 'Metric' is below the 'Threshold'
+idfree_sample_rules = {'MS1 TIC Sample QC Status': {'Part': 'ID-Free', 'Metric': 'Log MS1 TIC', 'Outlier': 'Log MS1 TIC', 'Threshold': 'MS1 TIC Threshold'},
+                       'MS2 TIC Sample QC Status': {'Part': 'ID-Free', 'Metric': 'Log MS2 TIC', 'Outlier': 'Log MS2 TIC', 'Threshold': 'MS2 TIC Threshold'},
+                       'MS1 Spectra QC Status': {'Part': 'ID-Free', 'Metric': 'MS1 Spectra', 'Outlier': 'MS2/MS1 Spectra', 'Threshold': 'MS1 Spectra Threshold'},
+                       'MS2 Spectra QC Status': {'Part': 'ID-Free', 'Metric': 'MS2 Spectra', 'Outlier': 'MS2/MS1 Spectra', 'Threshold': 'MS2 Spectra Threshold'},
+                       'Max Basepeak Intensity QC Status': {'Part': 'ID-Free', 'Metric': 'Log Max Basepeak Intensity', 'Outlier': 'Log Max Basepeak Intensity',
+                                                            'Threshold': 'Max Basepeak Intensity Threshold'}}
+
+#group status columns of the id-free metrics - FAIL if a sample of the group failed the 'Sample' status or the CV% of the 'CV' metric within the group is above the 'CV Threshold'
+idfree_group_rules = {'MS1 TIC Group QC Status': {'Part': 'ID-Free', 'Sample': 'MS1 TIC Sample QC Status', 'CV': 'Log MS1 TIC', 'CV Threshold': 'TIC CV Threshold'},
+                      'MS2 TIC Group QC Status': {'Part': 'ID-Free', 'Sample': 'MS2 TIC Sample QC Status', 'CV': 'Log MS2 TIC', 'CV Threshold': 'TIC CV Threshold'},
+                      'MS1 Spectra QC Status': {'Part': 'ID-Free', 'Sample': 'MS1 Spectra QC Status'},
+                      'MS2 Spectra QC Status': {'Part': 'ID-Free', 'Sample': 'MS2 Spectra QC Status'},
+                      'Max Basepeak Intensity QC Status': {'Part': 'ID-Free', 'Sample': 'Max Basepeak Intensity QC Status'}}
+
+level_threshold_pattern = re.compile(r'^(Protein|Peptide|Precursor) Threshold( = .*)?$')
+level_cv_pattern = re.compile(r'^.*% (Protein|Peptide|Precursor)s <= .*% CV$')
+common_tic_pattern = re.compile(r'^Common (Peptide|Precursor) TIC QC Status$')
+
+#-------------------------------------------------------------------------- FUNCTIONS ---------------------------------------------------------------------------
+
+def tuning_values(values):
+    """
+    Converts metric values for the embedded tuning data.
+
+    Args:
+    values (iterable): Numeric values.
+
+    Returns:
+    list: Values as floats, None for missing values.
+    """
+
+    values = np.asarray(values, dtype=np.float64)
+
+    return [None if np.isnan(value) else float(value) for value in values]
+
+def get_idfree_tuning(mzml_df, mzml_threshold_dict, baseline_ranges=False, instruments=False):
+    """
+    Gets the tuning data of the ID-free metrics - the extracted metrics of each sample and the baseline quartiles outliers were detected with.
+
+    Args:
+    mzml_df (DataFrame): DataFrame containing mzML data.
+    mzml_threshold_dict (dict): Dictionary containing QC thresholds.
+    baseline_ranges (dict): [Optional] Baseline outlier detection ranges by metric and instrument (see baseline.get_baseline_ranges).
+    instruments (dict): [Optional] Instrument of each filename, required with baseline_ranges.
+
+    Returns:
+    dict: Tuning data of the ID-free metrics, for get_report_tuning.
+    """
+
+    filenames = mzml_df['Filename'].tolist()
+    metrics = {metric: tuning_values(mzml_df[metric]) for metric in idfree_tuning_metrics if metric in mzml_df.columns.tolist()}
+
+    #quartiles of the baseline, recovered from the ranges so the report can apply other IQR sensitivities
+    baseline_quartiles = {}
+    if baseline_ranges:
+        iqr_sensitivity = mzml_threshold_dict['IQR Sensitivity']
+        for metric, metric_ranges in baseline_ranges.items():
+            ranges = np.array([metric_ranges[instruments[filename]] for filename in filenames], dtype=np.float64).reshape(-1, 2)
+            IQR = (ranges[:, 1] - ranges[:, 0])/(1 + 2*iqr_sensitivity)
+            baseline_quartiles[metric] = [tuning_values(ranges[:, 0] + iqr_sensitivity*IQR), tuning_values(ranges[:, 1] - iqr_sensitivity*IQR)]
+
+    idfree_tuning = {'Filenames': filenames,
+                     'Metrics': metrics,
+                     'Baseline Quartiles': baseline_quartiles,
+                     'Thresholds': {key: mzml_threshold_dict[key] for key in idfree_tuning_thresholds}}
+
+    return idfree_tuning
+
+def get_level_tuning(level, quant, level_cv, grouped_cv, threshold_dict, df_tic=None, dig_df=None):
+    """
+    Gets the tuning data of a level - the number of features in each sample and, for each group, a histogram of the lowest CV% of each unique feature.
+
+    Args:
+    level (str): The analysis level ('Protein', 'Peptide' or 'Precursor').
+    quant (DataFrame): Quant DataFrame from get_quant.
+    level_cv (DataFrame): Level CV DataFrame from intensity_cvs.
+    grouped_cv (DataFrame): Group-wise CV DataFrame from intensity_cvs, "" without group CVs.
+    threshold_dict (dict): Dictionary containing threshold values.
+    df_tic (DataFrame): [Optional] Common TIC DataFrame from common_tic.
+    dig_df (DataFrame): [Optional] Miscleavage DataFrame from miscleavage.
+
+    Returns:
+    dict: Tuning data of the level, for get_report_tuning.
+
+    Note:
+    Unique features with their lowest CV% in bin b have a CV% above b-1 and at most b, so the features under a whole CV% threshold
+    are the sum of the bins up to the threshold.
+    """
+
+    quant = quant.sort_values('Filename')
+    filenames = quant['Filename'].tolist()
+
+    metrics = {'Counts': tuning_values(quant[f'{level} Number'])}
+    if df_tic is not None:
+        metrics['Common TIC'] = tuning_values(df_tic.set_index('Filename')['TIC'].reindex(filenames))
+    if dig_df is not None:
+        metrics['Miscleavage %'] = tuning_values(dig_df.set_index('Filename')['0 missed cleavage percentage'].reindex(filenames))
+
+    level_tuning = {'Filenames': filenames,
+                    'Metrics': metrics,
+                    'Thresholds': dict({f'{level} Threshold': threshold_dict[f'{level} Threshold']}, **{key: threshold_dict[key] for key in level_tuning_thresholds})}
+
+    if isinstance(grouped_cv, pd.DataFrame):
+        group_totals = grouped_cv.set_index('Group')[f'{level} Number']
+        cv_histograms = {}
+        for group in group_totals.index:
+            min_cvs = level_cv.groupby(level)[f'{group}-CV%'].min().dropna().to_numpy(dtype=np.float64)
+            cv_bins = np.minimum(np.ceil(min_cvs), cv_histogram_bins - 1).astype(np.int64)
+            cv_histograms[group] = np.bincount(cv_bins, minlength=cv_histogram_bins).tolist()
+
+        level_tuning['CV Histograms'] = cv_histograms
+        level_tuning['Group Totals'] = {group: int(total) for group, total in group_totals.items()}
+
+    return level_tuning
+
+def get_sample_rule(column, parts):
+    """
+    Gets the QC status rule of a samplewise status column.
+
+    Args:
+    column (str): Status column, or the name of a sample rule.
+    parts (dict): Tuning data of each part of the run.
+
+    Returns:
+    dict: Sample rule, False if the column can not be recalculated from the tuning data.
+    """
+
+    level_match = level_threshold_pattern.match(column)
+
+    if column in idfree_sample_rules:
+        rule = dict(idfree_sample_rules[column], Name=column, Label=column)
+    elif level_match:
+        level = level_match.group(1)
+        rule = {'Name': f'{level} Threshold', 'Label': f'{level} Threshold = {{{level} Threshold}}', 'Part': level, 'Metric': 'Counts', 'Threshold': f'{level} Threshold'}
+    elif column == '0 missed cleavage QC Status':
+        miscleavage_parts = [part for part in parts if 'Miscleavage %' in parts[part]['Metrics']]
+        if not miscleavage_parts:
+            return False
+        #percentages are compared with the whole miscleavage threshold
+        rule = {'Name': column, 'Label': column, 'Part': miscleavage_parts[0], 'Metric': 'Miscleavage %', 'Threshold': 'Miscleavage Threshold', 'Whole': True}
+    else:
+        return False
+
+    if rule['Part'] not in parts or rule['Metric'] not in parts[rule['Part']]['Metrics']:
+        return False
+
+    return rule
+
+def get_group_rule(column, parts):
+    """
+    Gets the QC status rule of a groupwise status column.
+
+    Args:
+    column (str): Status column.
+    parts (dict): Tuning data of each part of the run.
+
+    Returns:
+    dict: Group rule, False if the column can not be recalculated from the tuning data.
+    """
+
+    level_match = level_threshold_pattern.match(column.replace(" QC Status", ""))
+    cv_match = level_cv_pattern.match(column)
+    tic_match = common_tic_pattern.match(column)
+
+    if column in idfree_group_rules:
+        rule = dict(idfree_group_rules[column], Label=column)
+    elif level_match:
+        rule = {'Label': column, 'Part': level_match.group(1), 'Sample': f'{level_match.group(1)} Threshold'}
+    elif column == '0 Miscleaved Peptides QC Status':
+        rule = {'Label': column, 'Sample': '0 missed cleavage QC Status'}
+    elif cv_match:
+        level = cv_match.group(1)
+        if level not in parts or 'CV Histograms' not in parts[level]:
+            return False
+        rule = {'Label': f'{{Data Percent Threshold}}% {level}s <= {{CV Percent Threshold}}% CV', 'Part': level, 'Histogram': True}
+    elif tic_match:
+        rule = {'Label': column, 'Part': tic_match.group(1), 'CV': 'Common TIC', 'CV Threshold': 'TIC CV Threshold'}
+    else:
+        return False
+
+    if 'Part' in rule and (rule['Part'] not in parts or ('CV' in rule and rule['CV'] not in parts[rule['Part']]['Metrics'])):
+        return False
+
+    return rule
+
+def get_report_tuning(metric_results, groupwise_comparison, groups):
+    """
+    Gets the threshold tuning data of the HTML report - the tuning data of each part of the run and the QC status rules of the samplewise
+    and groupwise status columns.
+
+    Args:
+    metric_results (tuple): Samplewise QC metrics, groupwise QC metrics and report parameters of each metrics stage.
+    groupwise_comparison (bool): Whether a grouping file was provided.
+    groups (dict): Groups and their filenames.
+
+    Returns:
+    str: Tuning data as JSON to embed in the report, False if the run has no QC status columns.
+
+    Note:
+    Status columns that can not be recalculated from the tuning data keep the statuses of the run.
+    """
+
+    parts = {}
+    for _, _, report_parameters in metric_results:
+        parts.update({part: dict(report_parameters[key]) for part, key in tuning_report_params.items() if key in report_parameters})
+
+    group_names = sorted(groups) if groupwise_comparison else []
+    for part in parts.values():
+        part['Groups'] = get_group_codes(part['Filenames'], groups)[0].tolist() if groupwise_comparison else []
+
+    sample_rules = []
+    group_rules = []
+    filenames = False
+    group_rows = False
+
+    for sample_df, group_df, _ in metric_results:
+        if isinstance(sample_df, pd.DataFrame):
+            #samples and groups of all metrics stages, as merged by get_qc_status
+            merged = set(filenames) if filenames is not False else False
+            filenames = [filename for filename in sample_df['Filename'].tolist() if merged is False or filename in merged]
+            for column in [col for col in sample_df.columns.tolist() if col not in ['Filename', 'Group']]:
+                rule = get_sample_rule(column, parts) or {'Name': column, 'Label': column, 'Fixed': dict(zip(sample_df['Filename'], sample_df[column]))}
+                sample_rules.append(dict(rule, Shown=True))
+
+        if groupwise_comparison and isinstance(group_df, pd.DataFrame):
+            group_rows = [group for group in group_df['Group'].tolist() if group_rows is False or group in group_rows]
+            for column in [col for col in group_df.columns.tolist() if col not in ['Group', 'Overall QC Status', 'QC Fail Score']]:
+                rule = get_group_rule(column, parts) or {'Label': column, 'Fixed': dict(zip(group_df['Group'], group_df[column]))}
+                group_rules.append(rule)
+
+    if not sample_rules and not group_rules:
+        return False
+
+    #sample statuses the group statuses depend on are calculated even when they are not shown
+    sample_names = [rule['Name'] for rule in sample_rules]
+    for group_rule in group_rules:
+        if 'Sample' in group_rule and group_rule['Sample'] not in sample_names:
+            sample_rule = get_sample_rule(group_rule['Sample'], parts)
+            if sample_rule:
+                sample_rules.append(dict(sample_rule, Shown=False))
+                sample_names.append(group_rule['Sample'])
+            else:
+                group_rule.pop('Sample')
+
+    rules = sample_rules + group_rules
+    threshold_keys = [rule[key] for rule in rules for key in ['Threshold', 'CV Threshold'] if key in rule]
+    if any(rule.get('Histogram') for rule in rules):
+        threshold_keys += ['CV Percent Threshold', 'Data Percent Threshold']
+    if any('Outlier' in rule for rule in rules):
+        threshold_keys.append('IQR Sensitivity')
+
+    thresholds = {}
+    for part in parts.values():
+        #thresholds that were not given are left empty, the outlier range is calculated with any sensitivity
+        thresholds.update({key: value if value or key == 'IQR Sensitivity' else None for key, value in part.pop('Thresholds').items() if key in threshold_keys})
+
+    tuning = {'Group Names': group_names,
+              'Filenames': filenames or [],
+              'Group Rows': group_rows or [],
+              'Parts': parts,
+              'Thresholds': {key: thresholds[key] for key in sorted(set(threshold_keys), key=threshold_keys.index) if key in thresholds},
+              #thresholds written with a decimal point in the status columns, e.g. 70.0% Proteins <= 30.0% CV
+              'Decimal Thresholds': [key for key, value in thresholds.items() if isinstance(value, float)],
+              'Sample Rules': sample_rules,
+              'Group Rules': group_rules}
+
+    #escaping closing tags so the json can not end the script element
+    return json.dumps(tuning, separators=(',', ':'), default=str).replace('</', '<\\/')
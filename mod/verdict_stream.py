@@ -0,0 +1,247 @@
+"""
+Streaming ID-free QC verdicts - provisional PASS/FAIL records for each mzML file as soon as it is extracted, reconciled with the final verdicts of the batch
+"""
+
+import pandas as pd
+import os
+import sys
+import json
+import logging
+from datetime import datetime, timezone
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from mod.mzml_extract import idfree_metrics, mzml_extract, apply_idfree_thresholds, get_sample_qc
+from mod.baseline import create_digest, merge_digests, digest_quantile
+
+#-------------------------------------------------------------------------- VARIABLES --------------------------------------------------------------------------
+
+#files extracted at a time, as in the chunks of calculate_idfree_metrics
+stream_workers = 30
+
+#outliers are only judged within the batch once this many files are extracted
+min_running_samples = 5
+
+#metric whose outliers each sample QC status depends on
+status_metrics = {'MS1 TIC Sample QC Status': 'Log MS1 TIC', 'MS2 TIC Sample QC Status': 'Log MS2 TIC', 'MS1 Spectra QC Status': 'MS2/MS1 Spectra',
+                  'MS2 Spectra QC Status': 'MS2/MS1 Spectra', 'Max Basepeak Intensity QC Status': 'Log Max Basepeak Intensity'}
+
+#-------------------------------------------------------------------------- FUNCTIONS ---------------------------------------------------------------------------
+
+def open_verdict_stream(stream_file):
+    """
+    Opens the verdict stream.
+
+    Args:
+    stream_file (str): Path to the JSON lines file verdicts are appended to, or '-' for the standard output.
+
+    Returns:
+    file: Stream to write verdict records to, to be closed with close_verdict_stream.
+    """
+
+    if stream_file == '-':
+        return sys.stdout
+
+    return open(stream_file, 'a', encoding='utf-8')
+
+def close_verdict_stream(stream):
+    """
+    Closes the verdict stream, unless it is the standard output.
+
+    Args:
+    stream (file): Stream from open_verdict_stream.
+
+    Returns:
+    None
+    """
+
+    if stream is not sys.stdout:
+        stream.close()
+
+    return None
+
+def write_verdict_event(stream, event, **fields):
+    """
+    Writes a verdict record as one JSON line, flushed at once so it can be followed while the batch is running.
+
+    Args:
+    stream (file): Stream from open_verdict_stream.
+    event (str): Record type - Provisional, Stopped, Final or Summary.
+    **fields: Fields of the record.
+
+    Returns:
+    dict: Record written.
+    """
+
+    record = dict({'Event': event, 'Time': datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")}, **fields)
+    stream.write(json.dumps(record, default=float) + "\n")
+    stream.flush()
+
+    return record
+
+def get_running_ranges(digests, iqr_sensitivity):
+    """
+    Calculates the outlier detection ranges of the ID-free metrics from the quartiles of the files extracted so far.
+
+    Args:
+    digests (dict): t-digest sketch of each metric over the files extracted so far.
+    iqr_sensitivity (float): Sensitivity value for determining IQR decision range for outlier detection.
+
+    Returns:
+    dict: (lower, upper) range of each metric with at least min_running_samples values.
+    """
+
+    running_ranges = {}
+
+    for metric, digest in digests.items():
+        if digest['Count'] >= min_running_samples:
+            q1, q3 = digest_quantile(digest, [0.25, 0.75])
+            IQR = q3 - q1
+            running_ranges[metric] = (q1 - (iqr_sensitivity * IQR), q3 + (iqr_sensitivity * IQR))
+
+    return running_ranges
+
+def get_provisional_verdict(file_data, mzml_threshold_dict, outlier_ranges):
+    """
+    Calculates the provisional QC verdict of one file, applying the absolute thresholds and the outlier ranges known so far.
+
+    Args:
+    file_data (dict): Extracted ID-free metrics of the file (see mzml_extract.mzml_extract).
+    mzml_threshold_dict (dict): Dictionary containing QC thresholds.
+    outlier_ranges (dict): (lower, upper) outlier detection range of each metric known so far.
+
+    Returns:
+    str: Verdict - FAIL if any check failed, PENDING if no check failed but outliers of some metrics cannot be judged yet, PASS otherwise.
+    list: Failed checks.
+    list: Pending checks.
+    """
+
+    file_df = apply_idfree_thresholds(pd.DataFrame([file_data]), mzml_threshold_dict)
+
+    for metric in [metric for metric in idfree_metrics if metric in file_df.columns.tolist()]:
+        if metric in outlier_ranges:
+            file_df[f"{metric} Outliers"] = int(not outlier_ranges[metric][0] <= file_df[metric].iloc[0] <= outlier_ranges[metric][1])
+        else:
+            file_df[f"{metric} Outliers"] = 0
+
+    statuses = get_sample_qc(file_df, mzml_threshold_dict, False, "").iloc[0].drop('Filename')
+
+    failed = [check for check, status in statuses.items() if status == 'FAIL']
+    pending = [check for check, status in statuses.items() if status != 'FAIL' and status_metrics[check] not in outlier_ranges]
+
+    if failed:
+        verdict = 'FAIL'
+    elif pending:
+        verdict = 'PENDING'
+    else:
+        verdict = 'PASS'
+
+    return verdict, failed, pending
+
+def stream_mzml_extraction(mzml_list, mzml_threshold_dict, stream, baseline_ranges=False, instruments=False, stop_after_failures=False):
+    """
+    Extracts mzML files and writes a provisional verdict for each file as soon as it is extracted.
+
+    Args:
+    mzml_list (list): Paths to the mzML files.
+    mzml_threshold_dict (dict): Dictionary containing QC thresholds.
+    stream (file): Stream from open_verdict_stream.
+    baseline_ranges (dict): [Optional] Baseline outlier detection ranges by metric and instrument (see baseline.get_baseline_ranges),
+                            used instead of the running quartiles of the batch.
+    instruments (dict): [Optional] Instrument of each filename, required with baseline_ranges.
+    stop_after_failures (int): [Optional] Stop the run once this many files have a provisional FAIL verdict, without extracting the remaining files.
+
+    Returns:
+    DataFrame: Extracted ID-free metrics of each file, as from mzml_extract.get_mzml_info_dataframe.
+    dict: Provisional verdict of each filename.
+
+    Raises:
+    SystemExit: If the run is stopped after stop_after_failures files with a provisional FAIL verdict.
+
+    Note:
+    Running quartiles are estimated from t-digest sketches of the files extracted so far, outliers are judged once
+    min_running_samples files are extracted.
+    """
+
+    mzml_data = []
+    provisional = {}
+    digests = {}
+    failed_files = []
+
+    executor = ThreadPoolExecutor(max_workers=stream_workers)
+    futures = {executor.submit(mzml_extract, mzml_path, []): mzml_path for mzml_path in mzml_list}
+
+    try:
+        for future in as_completed(futures):
+            if future.cancelled():
+                continue
+
+            file_data = future.result()[0]
+            mzml_data.append(file_data)
+
+            for metric in [metric for metric in idfree_metrics if metric in file_data]:
+                digest = create_digest([file_data[metric]])
+                digests[metric] = merge_digests([digests[metric], digest]) if metric in digests else digest
+
+            outlier_ranges = get_running_ranges(digests, mzml_threshold_dict['IQR Sensitivity'])
+            if baseline_ranges:
+                outlier_ranges.update({metric: metric_ranges[instruments[file_data['Filename']]] for metric, metric_ranges in baseline_ranges.items()})
+
+            verdict, failed, pending = get_provisional_verdict(file_data, mzml_threshold_dict, outlier_ranges)
+            provisional[file_data['Filename']] = verdict
+
+            write_verdict_event(stream, 'Provisional', Filename=file_data['Filename'], **{'Files Done': len(mzml_data), 'Files Total': len(mzml_list),
+                                'Verdict': verdict, 'Failed Checks': failed, 'Pending Checks': pending,
+                                'Metrics': {metric: file_data[metric] for metric in idfree_metrics if metric in file_data}})
+
+            if verdict == 'FAIL':
+                failed_files.append(file_data['Filename'])
+                logging.warning(f"WARNING: {file_data['Filename']} has a provisional FAIL verdict: {', '.join(failed)}")
+
+                if stop_after_failures and len(failed_files) >= stop_after_failures:
+                    skipped = sorted([os.path.split(path)[1] for future, path in futures.items() if future.cancel()])
+                    write_verdict_event(stream, 'Stopped', **{'Failed Files': failed_files, 'Skipped Files': skipped})
+                    print(f"ERROR: Stopped after {len(failed_files)} files with a provisional FAIL verdict: {', '.join(failed_files)}")
+                    logging.error(f"ERROR: Stopped after {len(failed_files)} files with a provisional FAIL verdict: {', '.join(failed_files)}. {len(skipped)} files were not extracted")
+                    sys.exit(1)
+    finally:
+        executor.shutdown(cancel_futures=True)
+
+    mzml_dataframe = pd.DataFrame(mzml_data)
+    mzml_dataframe = mzml_dataframe.sort_values("Filename")
+
+    return mzml_dataframe, provisional
+
+def reconcile_verdicts(stream, provisional, mzml_sample_df):
+    """
+    Writes the final verdict of each file once the whole batch is judged, noting verdicts that changed from the provisional verdict.
+
+    Args:
+    stream (file): Stream from open_verdict_stream.
+    provisional (dict): Provisional verdict of each filename from stream_mzml_extraction.
+    mzml_sample_df (DataFrame): Final sample QC statuses from mzml_extract.get_sample_qc.
+
+    Returns:
+    list: Filenames whose final verdict differs from the provisional verdict, other than PENDING files that passed.
+    """
+
+    status_cols = [col for col in mzml_sample_df.columns.tolist() if col in status_metrics]
+    changed = []
+
+    for _, row in mzml_sample_df.iterrows():
+        failed = [check for check in status_cols if row[check] == 'FAIL']
+        verdict = 'FAIL' if failed else 'PASS'
+        #pending verdicts that passed are confirmed rather than changed
+        verdict_changed = verdict != provisional[row['Filename']] and not (verdict == 'PASS' and provisional[row['Filename']] == 'PENDING')
+        if verdict_changed:
+            changed.append(row['Filename'])
+
+        write_verdict_event(stream, 'Final', Filename=row['Filename'], **{'Verdict': verdict, 'Failed Checks': failed,
+                            'Provisional Verdict': provisional[row['Filename']], 'Changed': verdict_changed})
+
+    failed_files = int((mzml_sample_df[status_cols] == 'FAIL').any(axis=1).sum())
+    write_verdict_event(stream, 'Summary', **{'Files': len(mzml_sample_df), 'Failed Files': failed_files, 'Changed Files': changed})
+
+    if changed:
+        logging.info(f"Final ID-free verdicts differ from the provisional verdicts for {', '.join(changed)}")
+
+    return changed
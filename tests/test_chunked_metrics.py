@@ -0,0 +1,93 @@
+"""
+Regression check that streaming the intensity files in chunks gives the same ID-based metrics as reading them into memory
+"""
+
+import os
+import sys
+import logging
+
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from main import run_qc
+from mod.idbased_metrics import get_chunksize
+
+#-------------------------------------------------------------------------- VARIABLES --------------------------------------------------------------------------
+
+example_dir = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "example-dataset")
+
+#rows of the example intensity files kept in the fixture
+fixture_rows = {'protein_level.txt': 800, 'precursor_level.txt': 2000}
+
+#smallest memory budget in MB, giving several chunks of the fixture
+chunk_memory = 1
+
+#-------------------------------------------------------------------------- FUNCTIONS ---------------------------------------------------------------------------
+
+def write_fixture(tmp_path):
+    """
+    Writes the first rows of the example protein and precursor intensity files.
+    """
+
+    for filename, num_rows in fixture_rows.items():
+        with open(os.path.join(example_dir, filename)) as example_file, open(tmp_path / filename, "w") as fixture_file:
+            for line_num, line in enumerate(example_file):
+                if line_num > num_rows:
+                    break
+                fixture_file.write(line)
+
+def run_fixture(tmp_path, name, options=None):
+    """
+    Runs QCeltis on the fixture, returning the sample and group statuses and the sheets of the level reports.
+    """
+
+    out_dir = tmp_path / name
+    out_dir.mkdir()
+
+    config = {'outdirectory': str(out_dir), 'reportname': name,
+              'protein_level': str(tmp_path / "protein_level.txt"), 'precursor_level': str(tmp_path / "precursor_level.txt"),
+              'grouping_file': os.path.join(example_dir, "grouping_file.txt"),
+              'protein_threshold': 100, 'precursor_threshold': 500, 'enzyme': "trypsin", 'miscleavage_threshold': 50, 'irtlabel': "Biognosys"}
+    config.update(options or {})
+
+    logging.disable(logging.CRITICAL)
+    try:
+        sample_df, grouped_df, report_params = run_qc(config)
+    finally:
+        logging.disable(logging.NOTSET)
+
+    sheets = {}
+    for level in ["Protein", "Precursor"]:
+        sheets.update(pd.read_excel(out_dir / f"{name}_{level}Level_QC_Report.xlsx", sheet_name=None))
+
+    return (sample_df, grouped_df, sheets)
+
+def test_chunked_matches_in_memory(tmp_path):
+    """
+    Quant, CV, common TIC and missed cleavage results match - the chunked level CV sheets only leave out the intensities and
+    the group averages and standard deviations.
+    """
+
+    write_fixture(tmp_path)
+    for filename, num_rows in fixture_rows.items():
+        assert get_chunksize(str(tmp_path / filename), chunk_memory) < num_rows
+
+    memory_sample_df, memory_grouped_df, memory_sheets = run_fixture(tmp_path, "memory")
+    chunked_sample_df, chunked_grouped_df, chunked_sheets = run_fixture(tmp_path, "chunked", {'chunk_memory': chunk_memory})
+
+    pd.testing.assert_frame_equal(chunked_sample_df, memory_sample_df)
+    pd.testing.assert_frame_equal(chunked_grouped_df, memory_grouped_df)
+
+    assert list(chunked_sheets) == list(memory_sheets)
+    for sheet in ["Protein Quant Summary", "Precursor Quant Summary", "Protein CV Group Summary", "Precursor CV Group Summary",
+                  "Common Precursor TIC", "Common Precursor TIC Group CV", "Miscleavage Threshold"]:
+        pd.testing.assert_frame_equal(chunked_sheets[sheet], memory_sheets[sheet])
+
+    for sheet in ["Protein Level CV", "Precursor Level CV"]:
+        memory_cv, chunked_cv = memory_sheets[sheet], chunked_sheets[sheet]
+        dropped = [col for col in memory_cv.columns if col not in chunked_cv.columns]
+
+        assert set(chunked_cv.columns) <= set(memory_cv.columns)
+        assert all(col.endswith(".mzML") or col.endswith("-Average") or col.endswith("-Standard Deviation") for col in dropped)
+        pd.testing.assert_frame_equal(chunked_cv, memory_cv[chunked_cv.columns.tolist()])
@@ -0,0 +1,61 @@
+"""
+Regression check that cached intensity files load the same as a fresh parse
+"""
+
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from mod.idbased_metrics import read_level_file
+
+#-------------------------------------------------------------------------- FUNCTIONS ---------------------------------------------------------------------------
+
+def test_cached_level_matches_fresh_parse(tmp_path):
+    """
+    Identifiers read as missing values ("NA", "NULL", "nan") or as numbers by read_csv keep those values and dtypes on a cache hit.
+    """
+
+    level_file = tmp_path / "protein_level.txt"
+    level_file.write_text("Protein\tPeptide\tS1\tS2\n"
+                          "NA\t101\t10\t0\n"
+                          "NULL\t102\t20\t30\n"
+                          "nan\t103\t0\t40\n"
+                          "P1\t104\t50\t60\n")
+    cache_dir = tmp_path / "cache"
+    cache_dir.mkdir()
+
+    fresh = read_level_file(str(level_file))
+    first = read_level_file(str(level_file), str(cache_dir))
+    cached = read_level_file(str(level_file), str(cache_dir))
+
+    assert any(path.name.endswith("_ids.pkl") for path in cache_dir.iterdir())
+    pd.testing.assert_frame_equal(first, fresh)
+    pd.testing.assert_frame_equal(cached, fresh)
+
+def test_cached_level_is_memory_mapped(tmp_path):
+    """
+    Intensities of a cache hit are read from the memory-mapped matrix, and no temporary files are left in the cache.
+    """
+
+    level_file = tmp_path / "precursor_level.txt"
+    level_file.write_text("Protein\tPrecursor\tS1\tS2\n"
+                          "P1\tAAK2\t10\t0\n"
+                          "P2\tCCR2\t20\t30\n")
+    cache_dir = tmp_path / "cache"
+    cache_dir.mkdir()
+
+    fresh = read_level_file(str(level_file), str(cache_dir))
+    cached = read_level_file(str(level_file), str(cache_dir))
+
+    assert not [path.name for path in cache_dir.iterdir() if path.name.endswith(".tmp")]
+    assert cached.columns.tolist() == fresh.columns.tolist()
+
+    #the intensities are a view of the memory map
+    values = cached['S1'].to_numpy()
+    while values is not None and not isinstance(values, np.memmap):
+        values = values.base
+    assert isinstance(values, np.memmap)
@@ -0,0 +1,41 @@
+"""
+Regression run of the ID-based metrics with the peptide and precursor levels together, using the example dataset
+"""
+
+import os
+import sys
+import logging
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from main import run_qc
+
+#-------------------------------------------------------------------------- VARIABLES --------------------------------------------------------------------------
+
+example_dir = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "example-dataset")
+
+#-------------------------------------------------------------------------- FUNCTIONS ---------------------------------------------------------------------------
+
+def test_precursor_level_rollup(tmp_path):
+    """
+    Peptide and protein levels derived from the precursor level run all three levels, with the precursor level reported
+    alongside the peptide level.
+    """
+
+    logging.disable(logging.CRITICAL)
+    try:
+        sample_df, grouped_df, report_params = run_qc({'outdirectory': str(tmp_path), 'reportname': "rollup",
+                                                       'precursor_level': os.path.join(example_dir, "precursor_level.txt"),
+                                                       'grouping_file': os.path.join(example_dir, "grouping_file.txt"),
+                                                       'level_rollup': "top3", 'protein_threshold': 300, 'peptide_threshold': 900,
+                                                       'precursor_threshold': 500, 'enzyme': "trypsin", 'miscleavage_threshold': 50})
+    finally:
+        logging.disable(logging.NOTSET)
+
+    for level in ["Protein", "Peptide", "Precursor"]:
+        assert os.path.exists(tmp_path / f"rollup_{level}Level_QC_Report.xlsx")
+        assert f"{level} Threshold QC Status" in grouped_df.columns.tolist()
+
+    #miscleavage is reported once, for the peptide level
+    assert grouped_df.columns.tolist().count("0 Miscleaved Peptides QC Status") == 1
+    assert os.path.exists(tmp_path / "rollup.html")
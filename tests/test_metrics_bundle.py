@@ -0,0 +1,55 @@
+"""
+Checks that metrics bundles are only saved when asked for, and that thresholds reapplied to a bundle match a full run
+"""
+
+import os
+import sys
+import logging
+
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from main import run_qc
+
+#-------------------------------------------------------------------------- VARIABLES --------------------------------------------------------------------------
+
+example_dir = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "example-dataset")
+
+#-------------------------------------------------------------------------- FUNCTIONS ---------------------------------------------------------------------------
+
+def run_protein_level(tmp_path, name, options):
+    """
+    Runs QCeltis on the example protein level, returning the output directory and the sample and group statuses.
+    """
+
+    out_dir = tmp_path / name
+    out_dir.mkdir()
+
+    config = {'outdirectory': str(out_dir), 'reportname': name}
+    config.update(options)
+
+    logging.disable(logging.CRITICAL)
+    try:
+        sample_df, grouped_df, report_params = run_qc(config)
+    finally:
+        logging.disable(logging.NOTSET)
+
+    return (out_dir, sample_df, grouped_df)
+
+def test_bundle_saved_on_request(tmp_path):
+    inputs = {'protein_level': os.path.join(example_dir, "protein_level.txt"), 'grouping_file': os.path.join(example_dir, "grouping_file.txt")}
+
+    out_dir, _, _ = run_protein_level(tmp_path, "plain", dict(inputs, protein_threshold=300))
+    assert not os.path.exists(out_dir / "plain_Metrics_Bundle")
+
+    out_dir, _, _ = run_protein_level(tmp_path, "bundled", dict(inputs, protein_threshold=300, save_bundle=True))
+    assert os.path.exists(out_dir / "bundled_Metrics_Bundle" / "Protein.pkl")
+
+    #thresholds reapplied to the bundle give the statuses of a full run with the same thresholds
+    _, strict_sample_df, strict_grouped_df = run_protein_level(tmp_path, "strict", dict(inputs, protein_threshold=3000, cv_percent_threshold=20))
+    _, rethreshold_sample_df, rethreshold_grouped_df = run_protein_level(tmp_path, "rethreshold", {'rethreshold': str(out_dir / "bundled_Metrics_Bundle"),
+                                                                                                  'protein_threshold': 3000, 'cv_percent_threshold': 20})
+
+    pd.testing.assert_frame_equal(rethreshold_sample_df, strict_sample_df)
+    pd.testing.assert_frame_equal(rethreshold_grouped_df, strict_grouped_df)
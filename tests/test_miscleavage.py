@@ -0,0 +1,60 @@
+"""
+Checks that the vectorized missed cleavage scores match the per-peptide calc_miscleavage scores
+"""
+
+import os
+import sys
+import random
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from mod.idbased_metrics import enzyme_info, calc_miscleavage, score_peptides, get_miscleavage_scores, miscleavage_cache
+
+#-------------------------------------------------------------------------- VARIABLES --------------------------------------------------------------------------
+
+amino_acids = "ACDEFGHIKLMNPQRSTVWY"
+
+#modifications removed before scoring
+modifications = ["[+57.021]", "(UniMod:35)", "{Acetyl}"]
+
+#-------------------------------------------------------------------------- FUNCTIONS ---------------------------------------------------------------------------
+
+def random_peptides(count, seed):
+    """
+    Random peptide sequences of 1 to 40 residues, some with modifications, enriched in cleavage sites and exception pairs.
+    """
+
+    rng = random.Random(seed)
+    peptides = set()
+
+    while len(peptides) < count:
+        residues = [rng.choice(amino_acids + "KRDEP" * 2) for _ in range(rng.randint(1, 40))]
+        if rng.random() < 0.3:
+            position = rng.randint(1, len(residues))
+            residues.insert(position, rng.choice(modifications))
+        peptides.add("".join(residues))
+
+    return sorted(peptides)
+
+@pytest.mark.parametrize("enzyme", sorted(enzyme_info))
+def test_score_peptides_matches_calc_miscleavage(enzyme):
+    peptides = random_peptides(5000, enzyme)
+
+    scores = score_peptides(peptides, enzyme)
+
+    assert scores.index.tolist() == peptides
+    assert scores.tolist() == [calc_miscleavage(peptide, enzyme) for peptide in peptides]
+
+def test_cached_scores_match(tmp_path):
+    peptides = random_peptides(500, "cache")
+    miscleavage_cache.pop("trypsin", None)
+
+    scores = get_miscleavage_scores(peptides, "Trypsin", str(tmp_path))
+    miscleavage_cache.pop("trypsin", None)
+    cached = get_miscleavage_scores(peptides, "Trypsin", str(tmp_path))
+    miscleavage_cache.pop("trypsin", None)
+
+    assert scores.tolist() == cached.tolist() == [calc_miscleavage(peptide, "trypsin") for peptide in peptides]
+    assert [path.name for path in tmp_path.iterdir()] == ["miscleavage_scores_trypsin.tsv"]
@@ -0,0 +1,54 @@
+"""
+Regression check that PCA with the default options reproduces the zero-filled StandardScaler and PCA of the earlier pca_plot
+"""
+
+import os
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from mod.idbased_metrics import read_level_file
+from mod.pca_analysis import get_pca_options, level_pca
+
+#-------------------------------------------------------------------------- VARIABLES --------------------------------------------------------------------------
+
+example_dir = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "example-dataset")
+
+#float32 tolerance of the scores, relative to the largest score
+scores_tolerance = 2e-5
+
+#-------------------------------------------------------------------------- FUNCTIONS ---------------------------------------------------------------------------
+
+@pytest.mark.parametrize("level,filename", [("Protein", "protein_level.txt"), ("Precursor", "precursor_level.txt")])
+def test_default_pca_matches_baseline(tmp_path, level, filename):
+    """
+    Scores and explained variance match an exact zero-filled PCA of the standardized intensities, up to the sign of each
+    component, and the result cached to disk is loaded unchanged.
+    """
+
+    from sklearn.preprocessing import StandardScaler
+    from sklearn.decomposition import PCA
+
+    df_level = read_level_file(os.path.join(example_dir, filename))
+    filenames = [col for col in df_level.columns if col not in ['Protein', 'Peptide', 'Precursor']]
+
+    pca = PCA(n_components=3, svd_solver='full')
+    reference = pca.fit_transform(StandardScaler().fit_transform(df_level[filenames].fillna(0).T.to_numpy()))
+
+    pca_options = get_pca_options({'Cache Directory': str(tmp_path)})
+    pca_results = level_pca(df_level, filenames, level, pca_options)
+
+    scores = pca_results['Scores'].astype(np.float64)
+    scores *= np.sign((scores * reference).sum(axis=0))
+
+    np.testing.assert_allclose(scores, reference, rtol=0, atol=scores_tolerance * np.abs(reference).max())
+    np.testing.assert_allclose(pca_results['Explained Variance Ratio'], pca.explained_variance_ratio_, rtol=1e-5)
+
+    cache_files = os.listdir(tmp_path)
+    assert len(cache_files) == 1 and cache_files[0].endswith(".npz")
+
+    with np.load(tmp_path / cache_files[0]) as cached:
+        np.testing.assert_array_equal(cached['scores'], pca_results['Scores'])
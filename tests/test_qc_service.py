@@ -0,0 +1,102 @@
+"""
+Checks of the job requests the QC service rejects
+"""
+
+import os
+import sys
+import json
+import threading
+import http.client
+from http.server import ThreadingHTTPServer
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from main import get_unknown_options
+from mod.qc_service import QCServiceHandler, service_host, get_jobs
+
+#-------------------------------------------------------------------------- FUNCTIONS ---------------------------------------------------------------------------
+
+@pytest.fixture
+def service(tmp_path):
+    """
+    QC service API without workers, so submitted jobs stay queued.
+    """
+
+    server = ThreadingHTTPServer((service_host, 0), QCServiceHandler)
+    server.queue_file = str(tmp_path / "service_jobs.sqlite")
+    server.jobs_dir = str(tmp_path / "service_jobs")
+    server.defaults = {'cache_dir': str(tmp_path / "cache")}
+    server.get_unknown_options = get_unknown_options
+
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+def send_request(server, method, path, body=None, headers=None):
+    """
+    Sends a request to the service, returning the status and the decoded JSON response.
+    """
+
+    request_headers = {'Host': f"127.0.0.1:{server.server_address[1]}", 'Content-Type': "application/json"}
+    request_headers.update(headers or {})
+
+    connection = http.client.HTTPConnection(service_host, server.server_address[1], timeout=10)
+    connection.putrequest(method, path, skip_host=True)
+    for header, value in request_headers.items():
+        connection.putheader(header, value)
+    data = json.dumps(body).encode('utf-8') if body is not None else b""
+    connection.putheader('Content-Length', str(len(data)))
+    connection.endheaders(data)
+
+    response = connection.getresponse()
+    result = (response.status, json.loads(response.read() or b"null"))
+    connection.close()
+
+    return result
+
+def test_job_writes_to_job_directory(service):
+    status, job = send_request(service, "POST", "/jobs", {'precursor_level': "precursor_level.txt", 'precursor_threshold': 500})
+
+    assert status == 201
+    assert job['Config']['outdirectory'] == f"{service.jobs_dir}/job{job['Job']}"
+    assert job['Config']['reportname'] == f"job{job['Job']}"
+    assert job['Config']['cache_dir'] == service.defaults['cache_dir']
+
+@pytest.mark.parametrize("option", ["outdirectory", "reportname", "cache_dir", "rethreshold", "metric_store", "update_baseline", "stream_verdicts"])
+def test_job_output_options_rejected(service, option):
+    status, error = send_request(service, "POST", "/jobs", {option: "/tmp/elsewhere", 'precursor_threshold': 500})
+
+    assert status == 400
+    assert option in error['Error']
+    assert get_jobs(service.queue_file) == []
+
+def test_unknown_option_rejected(service):
+    status, error = send_request(service, "POST", "/jobs", {'nope': 1})
+
+    assert status == 400
+    assert "nope" in error['Error']
+    assert get_jobs(service.queue_file) == []
+
+@pytest.mark.parametrize("content_type", ["text/plain", "application/x-www-form-urlencoded", "multipart/form-data"])
+def test_content_type_rejected(service, content_type):
+    status, _ = send_request(service, "POST", "/jobs", {'precursor_threshold': 500}, {'Content-Type': content_type})
+
+    assert status == 415
+    assert get_jobs(service.queue_file) == []
+
+@pytest.mark.parametrize("method,path", [("POST", "/jobs"), ("GET", "/jobs"), ("GET", "/jobs/1/files")])
+def test_other_host_rejected(service, method, path):
+    status, _ = send_request(service, method, path, {'precursor_threshold': 500} if method == "POST" else None, {'Host': "attacker.example:8765"})
+
+    assert status == 403
+    assert get_jobs(service.queue_file) == []
+
+def test_localhost_accepted(service):
+    status, jobs = send_request(service, "GET", "/jobs", headers={'Host': f"localhost:{service.server_address[1]}"})
+
+    assert status == 200
+    assert jobs == []
@@ -0,0 +1,87 @@
+"""
+Checks of the QC status rules against the row-by-row status helpers they replaced
+"""
+
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from mod.general_functions import groupname, get_group_codes
+from mod.qc_status import check_status, get_rule_status, get_sample_groups, get_group_status, get_group_values, get_overall_status
+
+#-------------------------------------------------------------------------- VARIABLES --------------------------------------------------------------------------
+
+groups = {'B': ["s3", "s4"], 'A': ["s1", "s2", "s3"]}
+
+#-------------------------------------------------------------------------- FUNCTIONS ---------------------------------------------------------------------------
+
+def check_threshold(row, threshold):
+    """
+    Row-by-row threshold check the rule engine replaced.
+    """
+    if threshold > float(row):
+        return "FAIL"
+    else:
+        return "PASS"
+
+def perc_qc(row, perc_thres):
+    """
+    Row-by-row percentage check the rule engine replaced.
+    """
+    if float(row) < perc_thres:
+        return "FAIL"
+    else:
+        return "PASS"
+
+@pytest.mark.parametrize("reference", [check_threshold, perc_qc])
+def test_below_threshold_matches_row_checks(reference):
+    values = [0, 49.9, 50, 50.1, 300, -1, 1e9]
+
+    assert check_status(values, 'Below Threshold', 50).tolist() == [reference(value, 50) for value in values]
+
+def test_missing_values_pass():
+    values = [np.nan, 10, np.nan, 90]
+
+    assert check_status(values, 'Below Threshold', 50).tolist() == ["PASS", "FAIL", "PASS", "PASS"]
+    assert check_status(values, 'Above Threshold', 50).tolist() == ["PASS", "PASS", "PASS", "FAIL"]
+
+def test_rule_fails_on_any_check():
+    df = pd.DataFrame({'Count': [10, 600, 600, np.nan], 'Outlier': [0, 1, 0, 0], 'CV': ["PASS", "PASS", "FAIL", "PASS"]})
+    checks = [('Below Threshold', 'Count', 500), ('Outlier', 'Outlier', None), ('Failed', 'CV', None)]
+
+    assert get_rule_status(df, checks).tolist() == ["FAIL", "FAIL", "FAIL", "PASS"]
+
+def test_group_codes_match_groupname():
+    filenames = ["s1", "s2", "s3", "s4", "s5"]
+    group_codes, group_names = get_group_codes(filenames, groups)
+
+    assert group_names == ["A", "B"]
+    assert [group_names[code] if code >= 0 else None for code in group_codes] == [groupname(filename, groups) for filename in filenames]
+    assert get_sample_groups(filenames, groups).tolist() == [groupname(filename, groups) for filename in filenames]
+
+def test_ungrouped_samples_left_out():
+    df = pd.DataFrame({'Filename': ["s1", "s2", "s4", "s5"],
+                       'Count Status': ["PASS", "PASS", "PASS", "FAIL"],
+                       'CV Status': ["PASS", "FAIL", "PASS", "FAIL"],
+                       'Count': [1, 2, 3, 4]})
+
+    group_df = get_group_status(df, ['Count Status', 'CV Status'], groups)
+    assert group_df.to_dict('list') == {'Group': ["A", "B"], 'Count Status': ["PASS", "PASS"], 'CV Status': ["FAIL", "PASS"]}
+
+    group_values = get_group_values(df, 'Count', groups)
+    assert list(group_values) == ["A", "B"]
+    assert group_values['A'].tolist() == [1, 2]
+    assert group_values['B'].tolist() == [3]
+
+def test_overall_status():
+    df = pd.DataFrame({'First': ["PASS", "FAIL", "FAIL"], 'Second': ["PASS", "PASS", "FAIL"]})
+
+    overall, scores = get_overall_status(df, ['First', 'Second'])
+
+    assert overall.tolist() == ["PASS", "FAIL", "FAIL"]
+    assert scores.tolist() == ["0 out of 2 metrics", "1 out of 2 metrics", "2 out of 2 metrics"]